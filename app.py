@@ -1,7 +1,7 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from datetime import datetime, timedelta
+from datetime import datetime
 import secrets
 import logging
 from logging.handlers import RotatingFileHandler
@@ -11,12 +11,14 @@ from werkzeug.exceptions import HTTPException
 from flask import Flask, g, session, request, jsonify
 from flask_mail import Mail
 from config import Config
-from models import db, ActiveSession, Perfil
-from sqlalchemy import func
+from models import db
 from rotas import register_blueprints
+from services.chave_norm import ensure_chave_norm_schema
+from services.dotacao_ledger import ensure_ledger_schema
+from services.relatorio_consulta import ensure_relatorio_indices
+from services.session_cache import contar_sessoes_ativas, resolver_perfil, validar_sessao
 
 mail = Mail()
-SESSION_TIMEOUT = timedelta(hours=2)
 
 
 def _setup_logging(app: Flask) -> None:
@@ -44,6 +46,26 @@ def create_app():
     # Garante que as tabelas existam quando subir sem migrações
     with app.app_context():
         db.create_all()
+        try:
+            alteradas = ensure_chave_norm_schema()
+            if alteradas:
+                app.logger.info("Colunas chave_norm criadas/preenchidas em: %s", ", ".join(alteradas))
+        except Exception:
+            db.session.rollback()
+            app.logger.warning("Nao foi possivel garantir as colunas chave_norm.", exc_info=True)
+        try:
+            criados = ensure_relatorio_indices()
+            if criados:
+                app.logger.info("Indices dos relatorios criados: %s", ", ".join(criados))
+        except Exception:
+            app.logger.warning("Nao foi possivel criar os indices dos relatorios.", exc_info=True)
+        try:
+            criados = ensure_ledger_schema()
+            if criados:
+                app.logger.info("Ledger de dotacao: %s", ", ".join(criados))
+        except Exception:
+            db.session.rollback()
+            app.logger.warning("Nao foi possivel garantir a trava e o indice do ledger.", exc_info=True)
 
 
     @app.errorhandler(Exception)
@@ -62,60 +84,35 @@ def create_app():
     @app.before_request
     def load_current_user():
         g.user = None
-        g.active_sessions_count = 0
         g.user_perfil_id = None
         g.user_nivel = None
+        # Arquivos estaticos nao dependem do usuario.
+        if request.endpoint == "static" or request.path.startswith("/static/"):
+            return
         user = session.get("user")
         token = session.get("session_token")
         if not user or not token:
             session.clear()
             return
 
-        now = datetime.utcnow()
-        cutoff = now - SESSION_TIMEOUT
-        active = ActiveSession.query.filter_by(email=user.get("email")).first()
-
-        if not active or active.session_token != token:
+        if not validar_sessao(user.get("email"), token, datetime.utcnow(), app):
             session.clear()
             return
 
-        last_activity = active.last_activity
-        if isinstance(last_activity, str):
-            try:
-                last_activity = datetime.fromisoformat(last_activity)
-            except ValueError:
-                last_activity = None
-
-        if last_activity and last_activity < cutoff:
-            db.session.delete(active)
-            db.session.commit()
-            session.clear()
-            return
-
-        active.last_activity = now
-        db.session.commit()
         g.user = user
-        perfil_row = None
         perfil_id = user.get("perfil_id")
-        if perfil_id:
-            perfil_row = db.session.get(Perfil, perfil_id)
-        if not perfil_row:
-            perfil_nome = (user.get("perfil") or "").strip()
-            if perfil_nome:
-                normalized = func.lower(func.ltrim(func.rtrim(Perfil.nome)))
-                perfil_row = Perfil.query.filter(normalized == perfil_nome.lower()).first()
-                if not perfil_row:
-                    perfil_row = Perfil.query.filter(Perfil.nome.ilike(perfil_nome)).first()
-        if perfil_row and not perfil_id:
+        resolved_id, nivel = resolver_perfil(perfil_id, user.get("perfil"))
+        if resolved_id and not perfil_id:
             # atualiza sessao com id resolvido
-            user["perfil_id"] = perfil_row.id
+            user["perfil_id"] = resolved_id
             session["user"] = user
-        if perfil_row:
-            g.user_perfil_id = perfil_row.id
-            g.user_nivel = perfil_row.nivel
-        g.active_sessions_count = ActiveSession.query.filter(
-            ActiveSession.last_activity >= cutoff
-        ).count()
+        if resolved_id:
+            g.user_perfil_id = resolved_id
+            g.user_nivel = nivel
+
+    @app.context_processor
+    def inject_active_sessions_count():
+        return {"active_sessions_count": contar_sessoes_ativas}
 
     register_blueprints(app)
     return app
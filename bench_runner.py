@@ -0,0 +1,144 @@
+"""
+Pico de memoria (RSS) de um runner de verdade numa planilha representativa:
+leitura, tratamentos, iter_frame_chunks -> compactar -> insert no banco.
+
+Roda o job duas vezes, cada uma num processo novo: antes (RUNNER_COMPACTAR=0,
+frames em object e tratamento no frame inteiro) e depois (compactado, em
+pedacos). Grava de verdade no banco do .env, entao use o de homologacao; no
+fim de cada execucao as linhas inseridas sao apagadas e o conjunto que estava
+ativo e reativado (rollback_upload). A planilha de saida vai para uma pasta
+temporaria.
+
+Uso: python bench_runner.py {fip613,ped,est_emp} caminho/arquivo.xlsx
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+RUNNERS = ("fip613", "ped", "est_emp")
+MODOS = (("antes (sem compactar)", "0"), ("depois (compactado)", "1"))
+
+
+def _pico_rss_mb() -> float:
+    """Pico de RSS do proprio processo."""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class _Contadores(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        contadores = _Contadores()
+        contadores.cb = ctypes.sizeof(contadores)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(contadores), contadores.cb
+        )
+        return contadores.PeakWorkingSetSize / (1024 * 1024)
+    import resource
+
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux devolve KB; macOS, bytes.
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+
+def _runner(kind: str):
+    """(modulo, funcao run_*, tabela) do runner."""
+    if kind == "fip613":
+        from services import fip613_runner
+
+        return fip613_runner, fip613_runner.run_fip613, "fip613"
+    if kind == "ped":
+        from services import ped_runner
+
+        return ped_runner, ped_runner.run_ped, "ped"
+    from services import est_emp_runner
+
+    return est_emp_runner, est_emp_runner.run_est_emp, "est_emp"
+
+
+def _executar(kind: str, arquivo: Path) -> dict:
+    """Uma execucao do job completo neste processo; desfeita no fim."""
+    from sqlalchemy import text
+
+    from app import create_app
+    from models import db
+    from services.ingest_checkpoint import STAGE_DEACTIVATED, rollback_upload, save_checkpoint
+
+    modulo, run, tabela = _runner(kind)
+    app = create_app()
+    # Id fora da faixa dos uploads reais.
+    upload_id = -os.getpid()
+    with app.app_context(), tempfile.TemporaryDirectory() as pasta:
+        anteriores = [
+            row[0] for row in db.session.execute(text(f"SELECT DISTINCT upload_id FROM {tabela} WHERE ativo = 1"))
+        ]
+        db.session.rollback()
+        modulo.OUTPUT_DIR = Path(pasta)
+        inicio = time.perf_counter()
+        try:
+            resultado = run(arquivo, datetime.now(), "bench_runner", upload_id)
+        finally:
+            save_checkpoint(kind, upload_id, STAGE_DEACTIVATED, previous_upload_ids=anteriores)
+            rollback_upload(kind, upload_id, tabela)
+        segundos = time.perf_counter() - inicio
+    return {"linhas": resultado[0], "segundos": round(segundos, 2), "pico_rss_mb": round(_pico_rss_mb(), 1)}
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pico de RSS de um runner antes/depois da compactacao.")
+    parser.add_argument("kind", choices=RUNNERS)
+    parser.add_argument("arquivo", type=Path)
+    parser.add_argument("--filho", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = _parse_args()
+    if args.filho:
+        # O runner escreve progresso no stdout; o resultado vai na ultima linha.
+        print(json.dumps(_executar(args.kind, args.arquivo)))
+        return 0
+
+    if not args.arquivo.exists():
+        print(f"Arquivo nao encontrado: {args.arquivo}", file=sys.stderr)
+        return 2
+    for rotulo, compactar in MODOS:
+        proc = subprocess.run(
+            [sys.executable, str(Path(__file__).resolve()), args.kind, str(args.arquivo.resolve()), "--filho"],
+            env={**os.environ, "RUNNER_COMPACTAR": compactar},
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{rotulo}: falhou\n{proc.stderr}", file=sys.stderr)
+            return 1
+        dados = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(
+            f"{rotulo}: pico RSS={dados['pico_rss_mb']:.1f} MB, "
+            f"linhas={dados['linhas']}, tempo={dados['segundos']:.2f}s"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
+from .chaves import normalize_chave, normalize_dotacao_key
 from .db import db
 from .user import (
     Usuario,
@@ -20,4 +21,9 @@ from .user import (
     Plan21Nger,
     Adj,
     Dotacao,
+    DotacaoMovimento,
+    TravaProcesso,
+    SaldoDotacao,
+    CHAVE_NORM_SOURCES,
+    chave_norm_values,
 )
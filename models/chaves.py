@@ -0,0 +1,19 @@
+import re
+import unicodedata
+
+
+def normalize_dotacao_key(value) -> str:
+    """Chave de dotacao comparavel: sem espacos, sem '*' final, maiuscula."""
+    if not value:
+        return ""
+    cleaned = re.sub(r"\s+", "", str(value).strip())
+    return cleaned.rstrip("*").upper()
+
+
+def normalize_chave(value) -> str:
+    """Chave de planejamento comparavel: sem acentos, so alfanumericos e '*'."""
+    if not value:
+        return ""
+    value = unicodedata.normalize("NFKD", str(value))
+    value = "".join(ch for ch in value if not unicodedata.combining(ch))
+    return "".join(ch for ch in value if ch.isalnum() or ch == "*").upper()
@@ -1,3 +1,4 @@
+from .chaves import normalize_chave, normalize_dotacao_key
 from .db import db
 
 
@@ -154,6 +155,10 @@ class PedUpload(db.Model):
 
 class PedRegistro(db.Model):
     __tablename__ = "ped"
+    __table_args__ = (
+        db.Index("idx_ped_ativo_chave_norm", "ativo", "chave_norm"),
+        db.Index("idx_ped_ativo_chave_planejamento_norm", "ativo", "chave_planejamento_norm"),
+    )
 
     id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
     upload_id = db.Column(db.BigInteger, nullable=True)
@@ -223,6 +228,8 @@ class PedRegistro(db.Model):
     credor = db.Column(db.String(255))
     nome_credor = db.Column(db.String(255))
     chave_planejamento = db.Column(db.String(255))
+    chave_norm = db.Column(db.String(255))
+    chave_planejamento_norm = db.Column(db.String(255))
     data_atualizacao = db.Column(db.DateTime)
     data_arquivo = db.Column(db.DateTime)
     user_email = db.Column(db.String(255))
@@ -244,11 +251,17 @@ class EmpUpload(db.Model):
 
 class EmpRegistro(db.Model):
     __tablename__ = "emp"
+    __table_args__ = (
+        db.Index("idx_emp_ativo_chave_norm", "ativo", "chave_norm"),
+        db.Index("idx_emp_ativo_chave_planejamento_norm", "ativo", "chave_planejamento_norm"),
+    )
 
     id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
     upload_id = db.Column(db.BigInteger, nullable=True)
     chave = db.Column(db.String(255))
     chave_planejamento = db.Column(db.String(255))
+    chave_norm = db.Column(db.String(255))
+    chave_planejamento_norm = db.Column(db.String(255))
     regiao = db.Column(db.String(255))
     subfuncao_ug = db.Column(db.String(255))
     adj = db.Column(db.String(255))
@@ -438,6 +451,10 @@ class Adj(db.Model):
 
 class Dotacao(db.Model):
     __tablename__ = "dotacao"
+    __table_args__ = (
+        db.Index("idx_dotacao_ativo_chave_norm", "ativo", "chave_norm"),
+        db.Index("idx_dotacao_ativo_chave_planejamento_norm", "ativo", "chave_planejamento_norm"),
+    )
 
     id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
     plan21_nger_id = db.Column(db.BigInteger)
@@ -468,9 +485,113 @@ class Dotacao(db.Model):
     data_aprovacao = db.Column(db.DateTime)
     motivo_rejeicao = db.Column(db.Text)
     chave_dotacao = db.Column(db.String(255))
+    chave_norm = db.Column(db.String(255))
+    chave_planejamento_norm = db.Column(db.String(255))
     justificativa_historico = db.Column(db.Text)
     usuarios_id = db.Column(db.BigInteger)
     criado_em = db.Column(db.DateTime, server_default=db.func.now())
     alterado_em = db.Column(db.DateTime)
     excluido_em = db.Column(db.DateTime)
     ativo = db.Column(db.Boolean, nullable=False, default=True, server_default=db.text("1"))
+
+
+class DotacaoMovimento(db.Model):
+    """
+    Movimento que compoe o saldo de uma dotacao: soma de PED/EMP de um upload
+    (ref_id = upload) ou um estorno (ref_id = est_dotacao.id). Nunca e apagado;
+    ao ser substituido vira ativo = 0. O indice unico do movimento ativo
+    (origem, ref_id, chave_norm) e criado por ensure_ledger_schema, pois
+    depende do banco (filtrado no SQL Server, coluna gerada no MySQL).
+    """
+
+    __tablename__ = "dotacao_movimento"
+    __table_args__ = (
+        db.Index("idx_dotacao_movimento_chave", "chave_norm", "ativo"),
+        db.Index("idx_dotacao_movimento_origem", "origem", "ativo", "ref_id"),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    chave_norm = db.Column(db.String(255), nullable=False)
+    origem = db.Column(db.String(20), nullable=False)
+    ref_id = db.Column(db.BigInteger, nullable=False)
+    valor = db.Column(db.Numeric(18, 2), nullable=False)
+    quantidade = db.Column(db.Integer)
+    ativo = db.Column(db.Boolean, nullable=False, default=True, server_default=db.text("1"))
+    criado_em = db.Column(db.DateTime)
+    retirado_em = db.Column(db.DateTime)
+
+
+class TravaProcesso(db.Model):
+    """
+    Linha de trava entre processos: quem precisa rodar sozinho (web e worker)
+    seleciona a linha do nome com FOR UPDATE ate o commit.
+    """
+
+    __tablename__ = "trava_processo"
+
+    nome = db.Column(db.String(50), primary_key=True)
+
+
+class SaldoDotacao(db.Model):
+    """
+    Saldo materializado de uma combinacao do formulario de dotacao: exercicio,
+    chave de planejamento e os filtros (JSON), achada pela assinatura (hash).
+    Vale enquanto geracao_saldo == geracao e versao_base bate com as versoes
+    de PED/EMP/plan21 (services/saldo_dotacao.py); escritas de dotacao e
+    estorno incrementam geracao das linhas da chave.
+    """
+
+    __tablename__ = "saldo_dotacao"
+    __table_args__ = (
+        db.UniqueConstraint("assinatura", name="uq_saldo_dotacao_assinatura"),
+        db.Index("idx_saldo_dotacao_chave", "exercicio", "chave_planejamento_norm"),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    assinatura = db.Column(db.String(40), nullable=False)
+    exercicio = db.Column(db.String(50), nullable=False)
+    chave_planejamento = db.Column(db.String(255), nullable=False)
+    chave_planejamento_norm = db.Column(db.String(255), nullable=False)
+    filtros = db.Column(db.Text, nullable=False)
+    saldo = db.Column(db.Numeric(18, 2))
+    valor_atual = db.Column(db.Numeric(18, 2))
+    valor_dotacao = db.Column(db.Numeric(18, 2))
+    valor_ped = db.Column(db.Numeric(18, 2))
+    valor_emp_liquido = db.Column(db.Numeric(18, 2))
+    plan21_count = db.Column(db.Integer)
+    dotacao_count = db.Column(db.Integer)
+    ped_count = db.Column(db.Integer)
+    emp_count = db.Column(db.Integer)
+    geracao = db.Column(db.Integer, nullable=False, default=0, server_default=db.text("0"))
+    geracao_saldo = db.Column(db.Integer)
+    versao_base = db.Column(db.String(40))
+    atualizado_em = db.Column(db.DateTime)
+    consultado_em = db.Column(db.DateTime)
+
+
+# Colunas *_norm: chaves normalizadas gravadas junto com a linha, para busca
+# indexada em vez de normalizar a tabela inteira em Python.
+CHAVE_NORM_SOURCES = {
+    "ped": ("chave", "chave_planejamento"),
+    "emp": ("chave", "chave_planejamento"),
+    "dotacao": ("chave_dotacao", "chave_planejamento"),
+    "est_dotacao": ("chave_dotacao", "chave_planejamento"),
+}
+
+
+def chave_norm_values(chave, chave_planejamento) -> dict:
+    return {
+        "chave_norm": normalize_dotacao_key(chave) if chave is not None else None,
+        "chave_planejamento_norm": normalize_chave(chave_planejamento) if chave_planejamento is not None else None,
+    }
+
+
+def _fill_chave_norm(mapper, connection, target) -> None:
+    chave_col, plan_col = CHAVE_NORM_SOURCES[mapper.local_table.name]
+    for col, value in chave_norm_values(getattr(target, chave_col), getattr(target, plan_col)).items():
+        setattr(target, col, value)
+
+
+for _model in (PedRegistro, EmpRegistro, Dotacao):
+    db.event.listen(_model, "before_insert", _fill_chave_norm)
+    db.event.listen(_model, "before_update", _fill_chave_norm)
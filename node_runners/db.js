@@ -95,7 +95,15 @@ function buildMssqlConfig() {
   };
 }
 
-async function connect() {
+// No runner persistente (serve.js) o pool fica aberto entre jobs.
+let reusePool = false;
+let sharedDb = null;
+
+function setPoolReuse(flag) {
+  reusePool = Boolean(flag);
+}
+
+async function openDb() {
   loadEnv();
   const engine = resolveEngine();
 
@@ -110,6 +118,32 @@ async function connect() {
   return { kind: "mysql", pool };
 }
 
+async function connect() {
+  if (!reusePool) return openDb();
+  if (!sharedDb) sharedDb = await openDb();
+  return sharedDb;
+}
+
+async function closeDb(db) {
+  if (!db || db === sharedDb) return;
+  if (db.kind === "mssql") {
+    await db.pool.close();
+  } else {
+    await db.pool.end();
+  }
+}
+
+async function closeSharedDb() {
+  const db = sharedDb;
+  sharedDb = null;
+  if (!db) return;
+  if (db.kind === "mssql") {
+    await db.pool.close();
+  } else {
+    await db.pool.end();
+  }
+}
+
 function mapSqlType(column) {
   const type = String(column.data_type || "").toLowerCase();
   const charLen = column.character_maximum_length;
@@ -259,5 +293,8 @@ async function bulkInsert(db, tableName, columns, rows) {
 
 module.exports = {
   connect,
+  closeDb,
+  closeSharedDb,
+  setPoolReuse,
   bulkInsert,
 };
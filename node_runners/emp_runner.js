@@ -1,7 +1,7 @@
 ﻿
 const path = require("path");
 const ExcelJS = require("exceljs");
-const { connect, bulkInsert } = require("./db");
+const { connect, closeDb, bulkInsert } = require("./db");
 const {
   ensureDir,
   readJsonWithBom,
@@ -18,6 +18,7 @@ const {
   formatDatePtBr,
   formatDateIso,
   updateStatusFields,
+  reportWarning,
   readCancelFlag,
 } = require("./util");
 
@@ -325,6 +326,8 @@ const INSERT_COLS = [
   "upload_id",
   "chave",
   "chave_planejamento",
+  "chave_norm",
+  "chave_planejamento_norm",
   "regiao",
   "subfuncao_ug",
   "adj",
@@ -1096,6 +1099,16 @@ function normalizeDotacaoKey(value) {
   return cleaned.toUpperCase();
 }
 
+// Mesmo criterio de models/chaves.py:normalize_chave.
+function normalizeChave(value) {
+  if (!value) return "";
+  return String(value)
+    .normalize("NFKD")
+    .replace(/\p{M}/gu, "")
+    .replace(/[^\p{L}\p{N}*]/gu, "")
+    .toUpperCase();
+}
+
 function ajustarChavesPorFormato(dataset, keyColName, partesPlanejamento) {
   if (!dataset.columns.includes("Chave")) {
     dataset.columns = ["Chave", ...dataset.columns];
@@ -1174,84 +1187,19 @@ async function carregarDotacoes(db) {
   return rows || [];
 }
 
-async function carregarPedSums(db) {
-  if (db.kind === "mssql") {
-    const result = await db.pool
-      .request()
-      .query(
-        "SELECT chave, SUM(valor_ped) AS total FROM ped WHERE ativo = 1 AND chave IS NOT NULL GROUP BY chave"
-      );
-    return result.recordset || [];
-  }
-  const [rows] = await db.pool.query(
-    "SELECT chave, SUM(valor_ped) AS total FROM ped WHERE ativo = 1 AND chave IS NOT NULL GROUP BY chave"
-  );
-  return rows || [];
-}
-
-function toNumber(value) {
-  if (value === null || value === undefined) return 0;
-  const num = Number(value);
-  if (Number.isFinite(num)) return num;
-  return parseValorDb(value) || 0;
-}
-
-async function atualizarDotacaoComEmp(db, empSums) {
+// O saldo das dotacoes (valor_ped_emp/valor_atual) e mantido pelo ledger de
+// movimentos no refresh pos-ingestao; aqui so sai o aviso de chaves sem dotacao.
+async function dotacoesFaltantes(db, empSums) {
   const dotacoes = await carregarDotacoes(db);
-  const pedRows = await carregarPedSums(db);
-  const pedSums = new Map();
-  for (const row of pedRows) {
-    const key = normalizeDotacaoKey(row.chave);
-    if (!key) continue;
-    const total = toNumber(row.total);
-    pedSums.set(key, (pedSums.get(key) || 0) + total);
-  }
   const dotKeys = new Set();
   for (const dot of dotacoes) {
     const key = normalizeDotacaoKey(dot.chave_dotacao);
     if (key) dotKeys.add(key);
   }
-
   const missing = [];
   for (const key of empSums.keys()) {
     if (!dotKeys.has(key)) missing.push(key);
   }
-
-  if (db.kind === "mssql") {
-    for (const dot of dotacoes) {
-      const key = normalizeDotacaoKey(dot.chave_dotacao);
-      const somaEmp = empSums.get(key) || 0;
-      const somaPed = pedSums.get(key) || 0;
-      const soma = somaPed + somaEmp;
-      const valorDot = Number.isFinite(Number(dot.valor_dotacao))
-        ? Number(dot.valor_dotacao)
-        : parseValorDb(dot.valor_dotacao) || 0;
-      const valorAtual = valorDot - soma;
-      const req = db.pool.request();
-      req.input("valor_ped_emp", soma);
-      req.input("valor_atual", valorAtual);
-      req.input("chave_dotacao", dot.chave_dotacao);
-      await req.query(
-        "UPDATE dotacao SET valor_ped_emp = @valor_ped_emp, valor_atual = @valor_atual WHERE chave_dotacao = @chave_dotacao"
-      );
-    }
-  } else {
-    for (const dot of dotacoes) {
-      const key = normalizeDotacaoKey(dot.chave_dotacao);
-      const somaEmp = empSums.get(key) || 0;
-      const somaPed = pedSums.get(key) || 0;
-      const soma = somaPed + somaEmp;
-      const valorDot = Number.isFinite(Number(dot.valor_dotacao))
-        ? Number(dot.valor_dotacao)
-        : parseValorDb(dot.valor_dotacao) || 0;
-      const valorAtual = valorDot - soma;
-      await db.pool.query(
-        "UPDATE dotacao SET valor_ped_emp = ?, valor_atual = ? WHERE chave_dotacao = ?",
-        [soma, valorAtual, dot.chave_dotacao]
-      );
-    }
-  }
-
   return missing.sort();
 }
 
@@ -1289,6 +1237,10 @@ function montarRegistrosParaDb(dataset, dataArquivo, userEmail, uploadId) {
       }
     }
 
+    payload.chave_norm = payload.chave == null ? null : normalizeDotacaoKey(payload.chave);
+    payload.chave_planejamento_norm =
+      payload.chave_planejamento == null ? null : normalizeChave(payload.chave_planejamento);
+
     for (const col of ["valor_emp", "devolucao_gcv", "valor_emp_devolucao_gcv"]) {
       if (col in payload) payload[col] = parseValorDb(payload[col]);
     }
@@ -1421,9 +1373,7 @@ async function processEmp(filePath, dataArquivo, userEmail, uploadId) {
       missingPlanejamentoLines.push(i + 2); // header na linha 1, dados a partir da linha 2
     }
   }
-  updateStatusFields("emp", uploadId, {
-    planejamento_missing_lines: missingPlanejamentoLines,
-  });
+  reportWarning("emp", uploadId, "planejamento_missing_lines", missingPlanejamentoLines);
 
   df.columns = moverColunas(
     df.columns,
@@ -1508,16 +1458,10 @@ async function processEmp(filePath, dataArquivo, userEmail, uploadId) {
     });
   }
 
-  const missingDotacaoKeys = await atualizarDotacaoComEmp(db, empDotSums);
-  updateStatusFields("emp", uploadId, {
-    dotacao_missing_keys: missingDotacaoKeys,
-  });
+  const missingDotacaoKeys = await dotacoesFaltantes(db, empDotSums);
+  reportWarning("emp", uploadId, "dotacao_missing_keys", missingDotacaoKeys);
 
-  if (db.kind === "mssql") {
-    await db.pool.close();
-  } else {
-    await db.pool.end();
-  }
+  await closeDb(db);
 
   return { total, outputPath: outputFile };
 }
@@ -0,0 +1,48 @@
+﻿const path = require("path");
+const { processEmp } = require("./emp_runner");
+const { processNob } = require("./nob_runner");
+const { writeStatus } = require("./util");
+
+function parseDataArquivo(raw) {
+  const parsedDate = raw ? new Date(raw) : null;
+  return parsedDate && !Number.isNaN(parsedDate.getTime()) ? parsedDate : null;
+}
+
+// Executa um job EMP/NOB; usado pelo run.js (um processo por job) e pelo serve.js (persistente).
+async function runJob({ kind, file, uploadId, userEmail, dataArquivo }) {
+  const id = Number(uploadId || 0);
+  if (!kind || !file || !id) {
+    throw new Error("Parametros obrigatorios ausentes.");
+  }
+
+  writeStatus(kind, id, {
+    state: "em processamento",
+    message: "Processamento iniciado (node).",
+    progress: 0,
+    pid: process.pid,
+  });
+
+  const email = userEmail || "desconhecido";
+  const data = parseDataArquivo(dataArquivo);
+  if (kind === "emp") {
+    return await processEmp(file, data, email, id);
+  }
+  if (kind === "nob") {
+    return await processNob(file, data, email, id);
+  }
+  throw new Error(`Tipo nao suportado: ${kind}`);
+}
+
+function resultPayload(result) {
+  return {
+    ok: true,
+    total: result.total,
+    output_filename: path.basename(result.outputPath),
+    output_path: result.outputPath,
+  };
+}
+
+module.exports = {
+  runJob,
+  resultPayload,
+};
@@ -1,7 +1,7 @@
 ﻿const path = require("path");
 const fs = require("fs");
 const ExcelJS = require("exceljs");
-const { connect, bulkInsert } = require("./db");
+const { connect, closeDb, bulkInsert } = require("./db");
 const {
   ensureDir,
   cleanHistorico,
@@ -793,11 +793,7 @@ async function processNob(filePath, dataArquivo, userEmail, uploadId) {
   }
 
   await workbook.commit();
-  if (db.kind === "mssql") {
-    await db.pool.close();
-  } else {
-    await db.pool.end();
-  }
+  await closeDb(db);
 
   return { total: totalInserted, outputPath: outputFile };
 }
@@ -1,7 +1,5 @@
-﻿const path = require("path");
-const { processEmp } = require("./emp_runner");
-const { processNob } = require("./nob_runner");
-const { writeStatus } = require("./util");
+﻿const { runJob, resultPayload } = require("./jobs");
+const { emitEvent, setProtocol } = require("./util");
 
 function parseArgs(argv) {
   const args = {};
@@ -15,48 +13,31 @@ function parseArgs(argv) {
   return args;
 }
 
-async function main() {
-  const args = parseArgs(process.argv);
-  const kind = args.kind;
-  const filePath = args.file;
-  const uploadId = Number(args["upload-id"] || 0);
-  const userEmail = args["user-email"] || "desconhecido";
-  const dataArquivoRaw = args["data-arquivo"] || "";
-  const parsedDate = dataArquivoRaw ? new Date(dataArquivoRaw) : null;
-  const dataArquivo = parsedDate && !Number.isNaN(parsedDate.getTime()) ? parsedDate : null;
+const args = parseArgs(process.argv);
+const ndjson = args.protocol === "ndjson";
+setProtocol(args.protocol);
 
-  if (!kind || !filePath || !uploadId) {
-    throw new Error("Parametros obrigatorios ausentes.");
-  }
-
-  writeStatus(kind, uploadId, {
-    state: "em processamento",
-    message: "Processamento iniciado (node).",
-    progress: 0,
-    pid: process.pid,
-  });
-
-  if (kind === "emp") {
-    return await processEmp(filePath, dataArquivo, userEmail, uploadId);
-  }
-  if (kind === "nob") {
-    return await processNob(filePath, dataArquivo, userEmail, uploadId);
-  }
-  throw new Error(`Tipo nao suportado: ${kind}`);
-}
-
-main()
+runJob({
+  kind: args.kind,
+  file: args.file,
+  uploadId: args["upload-id"],
+  userEmail: args["user-email"],
+  dataArquivo: args["data-arquivo"],
+})
   .then((result) => {
-    const payload = {
-      ok: true,
-      total: result.total,
-      output_filename: path.basename(result.outputPath),
-      output_path: result.outputPath,
-    };
-    process.stdout.write(JSON.stringify(payload));
+    const payload = resultPayload(result);
+    if (ndjson) {
+      emitEvent("result", payload);
+    } else {
+      process.stdout.write(JSON.stringify(payload));
+    }
   })
   .catch((err) => {
     const payload = { ok: false, error: err.message || String(err) };
-    process.stderr.write(JSON.stringify(payload));
-    process.exit(1);
+    if (ndjson) {
+      emitEvent("result", payload);
+    } else {
+      process.stderr.write(JSON.stringify(payload));
+    }
+    process.exitCode = 1;
   });
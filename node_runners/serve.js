@@ -0,0 +1,47 @@
+﻿const readline = require("readline");
+const { runJob, resultPayload } = require("./jobs");
+const { closeSharedDb, setPoolReuse } = require("./db");
+const { emitEvent, setProtocol } = require("./util");
+
+// Runner persistente: le um job JSON por linha no stdin e responde no
+// protocolo NDJSON do run.js. Modulos e pool do banco ficam quentes entre jobs.
+setProtocol("ndjson");
+setPoolReuse(true);
+
+function rssBytes() {
+  return process.memoryUsage().rss;
+}
+
+async function main() {
+  const rl = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+  emitEvent("ready", { pid: process.pid, rss: rssBytes() });
+  for await (const line of rl) {
+    const text = line.trim();
+    if (!text) continue;
+    let job;
+    try {
+      job = JSON.parse(text);
+    } catch {
+      emitEvent("result", { ok: false, error: "Pedido invalido.", rss: rssBytes() });
+      continue;
+    }
+    try {
+      const result = await runJob({
+        kind: job.kind,
+        file: job.file,
+        uploadId: job.upload_id,
+        userEmail: job.user_email,
+        dataArquivo: job.data_arquivo,
+      });
+      emitEvent("result", { ...resultPayload(result), rss: rssBytes() });
+    } catch (err) {
+      emitEvent("result", { ok: false, error: err.message || String(err), rss: rssBytes() });
+    }
+  }
+  await closeSharedDb();
+}
+
+main().catch((err) => {
+  console.error(err && err.stack ? err.stack : String(err));
+  process.exitCode = 1;
+});
@@ -179,7 +179,30 @@ function cancelPath(kind, uploadId) {
   return path.join(statusDir(), `${safeKind}_${uploadId}.cancel`);
 }
 
+// Com --protocol ndjson o status vai pelo stdout (uma linha JSON por evento)
+// e o worker Python repassa ao status store; sem ele, grava o arquivo JSON.
+let protocolo = "file";
+
+function setProtocol(value) {
+  protocolo = value === "ndjson" ? "ndjson" : "file";
+}
+
+function emitEvent(event, fields) {
+  process.stdout.write(`${JSON.stringify({ event, ...fields })}\n`);
+}
+
+// Escreve em arquivo temporario e renomeia: o Python nunca le JSON pela metade.
+function writeJsonAtomic(filePath, data) {
+  const tmpPath = `${filePath}.${process.pid}.tmp`;
+  fs.writeFileSync(tmpPath, JSON.stringify(data), "utf8");
+  fs.renameSync(tmpPath, filePath);
+}
+
 function writeStatus(kind, uploadId, payload) {
+  if (protocolo === "ndjson") {
+    emitEvent("progress", payload);
+    return;
+  }
   ensureDir(statusDir());
   const now = new Date().toISOString();
   const data = {
@@ -188,10 +211,14 @@ function writeStatus(kind, uploadId, payload) {
     updated_at: now,
     ...payload,
   };
-  fs.writeFileSync(statusPath(kind, uploadId), JSON.stringify(data), "utf8");
+  writeJsonAtomic(statusPath(kind, uploadId), data);
 }
 
 function updateStatusFields(kind, uploadId, fields) {
+  if (protocolo === "ndjson") {
+    emitEvent("progress", fields);
+    return;
+  }
   ensureDir(statusDir());
   const pathStatus = statusPath(kind, uploadId);
   let current = {};
@@ -210,7 +237,15 @@ function updateStatusFields(kind, uploadId, fields) {
     ...fields,
     updated_at: now,
   };
-  fs.writeFileSync(pathStatus, JSON.stringify(data), "utf8");
+  writeJsonAtomic(pathStatus, data);
+}
+
+function reportWarning(kind, uploadId, code, value) {
+  if (protocolo === "ndjson") {
+    emitEvent("warning", { code, value });
+    return;
+  }
+  updateStatusFields(kind, uploadId, { [code]: value });
 }
 
 function readCancelFlag(kind, uploadId) {
@@ -233,7 +268,10 @@ module.exports = {
   parseBrNumber,
   formatDatePtBr,
   formatDateIso,
+  setProtocol,
+  emitEvent,
   writeStatus,
   updateStatusFields,
+  reportWarning,
   readCancelFlag,
 };
@@ -8,6 +8,7 @@ from werkzeug.security import check_password_hash
 from models import db, Usuario, LogLogin, ActiveSession
 from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
+from services.session_cache import esquecer_sessao
 
 
 auth_bp = Blueprint("auth", __name__)
@@ -45,6 +46,7 @@ def _set_active_session(email: str) -> None:
             active.session_token = token
             active.last_activity = now
         db.session.commit()
+        esquecer_sessao(email)
         session["session_token"] = token
     except SQLAlchemyError as exc:
         db.session.rollback()
@@ -57,6 +59,7 @@ def _clear_active_session(email: str) -> None:
     if active:
         db.session.delete(active)
         db.session.commit()
+    esquecer_sessao(email)
 
 
 @auth_bp.route("/login", methods=["GET", "POST"])
@@ -1,15 +1,16 @@
-from flask import Blueprint, jsonify, render_template, request, abort, g, session, send_file, current_app
+from flask import Blueprint, jsonify, render_template, request, abort, g, session, send_file, current_app, Response
+from flask import stream_with_context
 from functools import wraps
 import re
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 import os
-from io import BytesIO
 import json
 import unicodedata
 import subprocess
 import sys
 import threading
+import time
 import pytz
 import pandas as pd
 from models import (
@@ -18,7 +19,6 @@ from models import (
     PerfilPermissao,
     NivelPermissao,
     Fip613Upload,
-    Fip613Registro,
     Plan20Upload,
     PedUpload,
     PedRegistro,
@@ -32,11 +32,15 @@ from models import (
     Adj,
     Dotacao,
     ActiveSession,
+    chave_norm_values,
     db,
+    normalize_chave,
+    normalize_dotacao_key,
 )
 from sqlalchemy.exc import ProgrammingError, IntegrityError
 from services.auth import login_required, role_required, current_user
 from services.features import FEATURES, flatten_features, build_parent_map
+from services.permissoes_cache import bump_permissoes_version, permissoes, tem_permissao
 from services.fip613_runner import run_fip613, UPLOAD_DIR
 from services.plan20_runner import run_plan20
 from services.ped_runner import (
@@ -51,9 +55,63 @@ from services.est_emp_runner import (
     OUTPUT_DIR as EST_EMP_OUTPUT_DIR,
     move_existing_to_tmp as move_est_emp_existing_to_tmp,
 )
-from services.job_status import read_status, set_cancel_flag, update_status_fields, write_status
+from services.ingest_checkpoint import pode_retomar
+from services.job_control import JobCancelado, JobProgress
+from services.node_runner import run_node
+from services.dotacao_ledger import (
+    ORIGEM_ESTORNO,
+    estorno_rows,
+    invalidar_saldos,
+    saldo_ledger,
+    saldos_ledger,
+    sync_ledger,
+)
+from services.plan21_index import FACET_FIELDS, SEARCH_FIELDS, get_plan21_index
+from services.saldo_dotacao import SALDO_CAMPOS, atualizar_saldos, saldo_zerado, saldos
+from services.excel_export import FORMATO_AZUL_VERMELHO, FORMATO_MOEDA, ColunaExcel, colunas_excel, resposta_excel
+from services.relatorio_cache import cache_relatorio, resposta_cacheada
+from services.relatorio_consulta import (
+    RELATORIO_EMP,
+    RELATORIO_EST_EMP,
+    RELATORIO_FIP613,
+    RELATORIO_NOB,
+    RELATORIO_PED,
+    RELATORIO_PLAN20,
+    RELATORIO_STREAM_LOTE,
+    CodificadorColunar,
+    agregar,
+    colunas_pedidas,
+    consultar,
+    data_hora_br,
+    formato_pedido,
+    json_stream,
+    linhas_completo,
+    para_colunar,
+    para_float,
+    parse_agregacao,
+    parse_consulta,
+)
+from services.post_ingest import (
+    bump_dataset_version,
+    read_derived,
+    schedule_refresh,
+)
+from services.diretorio import bump_diretorio_version, get_diretorio
+from services.user_state import get_user_state, put_user_state
+from services.worker_service import submit_job
+from services.job_status import (
+    FINAL_STATES,
+    esperar_mudanca,
+    geracao_status,
+    latest_upload_id,
+    read_status,
+    set_cancel_flag,
+    status_version,
+    update_status_fields,
+    write_status,
+)
 from pathlib import Path
-from sqlalchemy import text, func, or_
+from sqlalchemy import bindparam, text, func, or_
 
 home_bp = Blueprint("home", __name__)
 
@@ -61,8 +119,17 @@ EMP_UPLOAD_DIR = Path("upload/emp")
 EMP_OUTPUT_DIR = Path("outputs/td_emp")
 NOB_UPLOAD_DIR = Path("upload/nob")
 NOB_OUTPUT_DIR = Path("outputs/td_nob")
-NODE_RUNNER = Path(__file__).resolve().parents[1] / "node_runners" / "run.js"
-NODE_EXE = os.getenv("NODE_EXE", "node")
+STATUS_STREAM_KEEPALIVE = 15.0
+# Vida maxima de uma conexao SSE; ao fechar, o EventSource reconecta apos STATUS_STREAM_RETRY_MS.
+STATUS_STREAM_MAX_SECONDS = int(os.getenv("STATUS_STREAM_MAX_SECONDS", "300"))
+STATUS_STREAM_RETRY_MS = 5000
+# Desliga o SSE (IIS/wfastcgi segura a resposta inteira): o stream responde 204 e a tela fica no polling.
+STATUS_STREAM_ATIVO = os.getenv("STATUS_STREAM", "1") != "0"
+# Limite de combinacoes por chamada de /api/dotacao/saldo/lote e tamanho do IN por consulta.
+SALDO_LOTE_MAX = int(os.getenv("SALDO_LOTE_MAX", "2000"))
+SALDO_LOTE_CHUNK = 500
+# Limite de itens por chamada dos endpoints de lote de dotacao/estorno.
+DOTACAO_LOTE_MAX = int(os.getenv("DOTACAO_LOTE_MAX", "500"))
 
 
 def _find_upload_path(base_dir: Path, stored_filename: str) -> Path | None:
@@ -79,38 +146,6 @@ def _find_upload_path(base_dir: Path, stored_filename: str) -> Path | None:
     return matches[0] if matches else None
 
 
-def _run_node(kind: str, file_path: Path, user_email: str, data_arquivo, upload_id: int) -> dict:
-    args = [
-        NODE_EXE,
-        str(NODE_RUNNER),
-        "--kind",
-        kind,
-        "--file",
-        str(file_path),
-        "--upload-id",
-        str(upload_id),
-        "--user-email",
-        user_email or "desconhecido",
-    ]
-    if data_arquivo:
-        try:
-            args.extend(["--data-arquivo", data_arquivo.isoformat()])
-        except Exception:
-            args.extend(["--data-arquivo", str(data_arquivo)])
-    proc = subprocess.run(args, capture_output=True, text=True, cwd=str(NODE_RUNNER.parent))
-    if proc.returncode != 0:
-        err = (proc.stderr or proc.stdout or "").strip()
-        raise RuntimeError(f"Node runner falhou: {err or 'erro desconhecido'}")
-    raw = (proc.stdout or "").strip()
-    try:
-        payload = json.loads(raw) if raw else {}
-    except json.JSONDecodeError as exc:
-        raise RuntimeError(f"Resposta invalida do Node: {exc}") from exc
-    if not payload.get("ok"):
-        raise RuntimeError(f"Node runner falhou: {payload.get('error')}")
-    return payload
-
-
 def _move_existing_to_tmp(base_dir: Path) -> None:
     tmp = base_dir / "tmp"
     tmp.mkdir(parents=True, exist_ok=True)
@@ -122,22 +157,47 @@ def _move_existing_to_tmp(base_dir: Path) -> None:
             pass
 
 
-def _send_excel_bytes(buffer: BytesIO, filename: str):
-    buffer.seek(0)
-    resp = current_app.response_class(
-        buffer.getvalue(),
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
-    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
-    resp.headers["Cache-Control"] = "no-store"
+def _excel_download(colunas, gerar_lotes, prefixo: str, aba: str = "Sheet1"):
+    """
+    Download xlsx dos relatorios pelo motor de services/excel_export.py:
+    linhas lidas em lotes do banco direto para a planilha e arquivo enviado
+    em pedacos. gerar_lotes roda aqui dentro, para erro de banco virar 500.
+    """
+    filename = f"{prefixo}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    try:
+        resp = resposta_excel(colunas, gerar_lotes(), filename, aba)
+    except Exception as exc:
+        return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
+    finally:
+        db.session.close()
+    if resp is None:
+        return jsonify({"error": "Nenhum dado para exportar."}), 404
     return resp
 
 
+def _chave_display(row) -> str:
+    """Chave a partir de 2026, chave de planejamento antes (ou a que existir)."""
+    try:
+        ex = int(str(row.get("exercicio") or 0)[:4])
+    except Exception:
+        ex = 0
+    chave = row.get("chave") or ""
+    chave_plan = row.get("chave_planejamento") or ""
+    if ex >= 2026 and chave:
+        return chave
+    return chave_plan or chave
+
+
 def _next_pk(model) -> int:
     max_id = db.session.query(func.max(model.id)).scalar() or 0
     return int(max_id) + 1
 
 
+def _schedule_post_ingest(kind: str) -> None:
+    """Refresh dos dados derivados do tipo (saldo, pendencias, versao de relatorio)."""
+    schedule_refresh(kind, current_app._get_current_object())
+
+
 def _process_emp_upload(upload_id: int) -> None:
     registro = db.session.get(EmpUpload, upload_id)
     if not registro:
@@ -145,7 +205,7 @@ def _process_emp_upload(upload_id: int) -> None:
     file_path = _find_upload_path(EMP_UPLOAD_DIR, registro.stored_filename)
     if not file_path:
         raise RuntimeError(f"Arquivo EMP nao encontrado: {EMP_UPLOAD_DIR / registro.stored_filename}")
-    payload = _run_node("emp", file_path, registro.user_email, registro.data_arquivo, registro.id)
+    payload = run_node("emp", file_path, registro.user_email, registro.data_arquivo, registro.id)
     registro.output_filename = str(payload.get("output_filename") or "")
     db.session.commit()
     write_status(
@@ -156,6 +216,7 @@ def _process_emp_upload(upload_id: int) -> None:
         payload.get("output_filename"),
         progress=100,
     )
+    _schedule_post_ingest("emp")
 
 
 def _process_nob_upload(upload_id: int) -> None:
@@ -165,7 +226,7 @@ def _process_nob_upload(upload_id: int) -> None:
     file_path = _find_upload_path(NOB_UPLOAD_DIR, registro.stored_filename)
     if not file_path:
         raise RuntimeError(f"Arquivo NOB nao encontrado: {NOB_UPLOAD_DIR / registro.stored_filename}")
-    payload = _run_node("nob", file_path, registro.user_email, registro.data_arquivo, registro.id)
+    payload = run_node("nob", file_path, registro.user_email, registro.data_arquivo, registro.id)
     registro.output_filename = str(payload.get("output_filename") or "")
     db.session.commit()
     write_status(
@@ -176,6 +237,7 @@ def _process_nob_upload(upload_id: int) -> None:
         payload.get("output_filename"),
         progress=100,
     )
+    _schedule_post_ingest("nob")
 
 
 def _start_thread(kind: str, upload_id: int) -> None:
@@ -191,6 +253,7 @@ def _start_thread(kind: str, upload_id: int) -> None:
                     "Processamento iniciado (thread).",
                     progress=0,
                 )
+                bump_dataset_version(kind)
                 if kind == "emp":
                     _process_emp_upload(upload_id)
                 else:
@@ -201,6 +264,7 @@ def _start_thread(kind: str, upload_id: int) -> None:
                     write_status(kind, upload_id, "processamento cancelado", "Cancelado pelo usuario.")
                 else:
                     write_status(kind, upload_id, "falha no processamento", msg)
+                bump_dataset_version(kind)
             finally:
                 db.session.remove()
 
@@ -209,6 +273,10 @@ def _start_thread(kind: str, upload_id: int) -> None:
 
 
 def _start_worker(kind: str, upload_id: int) -> None:
+    # Worker persistente (worker.py --serve) evita subir Python e Node a cada job.
+    if submit_job(kind, upload_id):
+        update_status_fields(kind, upload_id, message="Job enviado ao worker persistente.")
+        return
     worker_path = Path(__file__).resolve().parents[1] / "worker.py"
     creationflags = 0
     if sys.platform.startswith("win"):
@@ -270,36 +338,42 @@ def partial_dashboard():
             .order_by(ActiveSession.last_activity.desc())
             .all()
         )
-        emails = [s.email for s in sessions]
-        usuarios = {u.email: u.nome for u in Usuario.query.filter(Usuario.email.in_(emails)).all()}
+        diretorio = get_diretorio()
         for s in sessions:
+            usuario = diretorio.usuario_por_email(s.email)
             active_sessions.append(
                 {
                     "email": s.email,
-                    "nome": usuarios.get(s.email, s.email),
+                    "nome": usuario.nome if usuario else s.email,
                     "last_activity": s.last_activity,
                 }
             )
-    ped_dotacao_missing = session.get("ped_dotacao_missing", [])
-    if not ped_dotacao_missing:
+    # Cookies de versoes antigas ainda trazem a lista inteira.
+    session.pop("ped_dotacao_missing", None)
+    ped_dotacao_missing: list[str] = []
+    derivado = read_derived("ped_dotacao_missing")
+    do_upload = get_user_state((g.user or {}).get("email"), "ped_dotacao_missing")
+    if do_upload and (derivado is None or _derived_ts(derivado) < do_upload[1]):
+        # upload do usuario mais novo que o ultimo refresh pos-ingestao
+        ped_dotacao_missing = list(do_upload[0].get("keys") or [])
+    elif derivado is not None:
+        ped_dotacao_missing = list(derivado.get("keys") or [])
+    else:
         ped_keys = (
-            PedRegistro.query.with_entities(PedRegistro.chave)
-            .filter(PedRegistro.ativo == True)  # noqa: E712
+            PedRegistro.query.with_entities(PedRegistro.chave_norm)
+            .filter(PedRegistro.ativo == True, PedRegistro.chave_norm.like("DOT.%"))  # noqa: E712
+            .distinct()
             .all()
         )
-        ped_keys = [
-            _normalize_dotacao_key(k[0])
-            for k in ped_keys
-            if k and k[0] and str(k[0]).strip().upper().startswith("DOT.")
-        ]
-        ped_keys = {k for k in ped_keys if k}
+        ped_keys = {k[0] for k in ped_keys if k and k[0]}
         if ped_keys:
             dotacao_keys = (
-                Dotacao.query.with_entities(Dotacao.chave_dotacao)
-                .filter(Dotacao.chave_dotacao.isnot(None))
+                Dotacao.query.with_entities(Dotacao.chave_norm)
+                .filter(Dotacao.chave_norm.isnot(None))
+                .distinct()
                 .all()
             )
-            dotacao_keys = {_normalize_dotacao_key(k[0]) for k in dotacao_keys if k and k[0]}
+            dotacao_keys = {k[0] for k in dotacao_keys if k and k[0]}
             missing = sorted([k for k in ped_keys if k not in dotacao_keys])
             ped_dotacao_missing = missing
     emp_planejamento_missing_lines: list[int] = []
@@ -357,11 +431,7 @@ def partial_dashboard():
         ).fetchall()
     except Exception:
         est_raw = []
-    est_adj_ids = [r[5] for r in est_raw if len(r) > 5 and r[5]]
-    est_adj_map = {}
-    if est_adj_ids:
-        perfis = Perfil.query.filter(Perfil.id.in_(est_adj_ids)).all()
-        est_adj_map = {p.id: p.nome for p in perfis if p and p.nome}
+    est_adj_map = get_diretorio().perfil_nomes
     for row in est_raw:
         chave = row[1] if len(row) > 1 else ""
         valor_est = row[2] if len(row) > 2 else None
@@ -391,6 +461,14 @@ def partial_dashboard():
     )
 
 
+def _derived_ts(derivado: dict) -> float:
+    """updated_at (UTC) de um resultado em outputs/derived, em epoch."""
+    try:
+        return datetime.fromisoformat(str(derivado.get("updated_at"))).replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return 0.0
+
+
 def ensure_admin_nivel1():
     nivel = getattr(g, "user_nivel", None)
     if nivel != 1:
@@ -403,28 +481,7 @@ def has_permission(feature: str) -> bool:
     nivel = getattr(g, "user_nivel", None)
     if not perfil_id and nivel is None:
         return False
-    try:
-        if perfil_id:
-            exists = (
-                db.session.query(PerfilPermissao.id)
-                .filter(PerfilPermissao.perfil_id == perfil_id, PerfilPermissao.feature == feature)
-                .first()
-            )
-            if exists:
-                return True
-    except ProgrammingError:
-        db.session.rollback()
-    try:
-        if nivel is not None:
-            exists = (
-                db.session.query(NivelPermissao.id)
-                .filter(NivelPermissao.nivel == nivel, NivelPermissao.feature == feature)
-                .first()
-            )
-            return bool(exists)
-    except ProgrammingError:
-        db.session.rollback()
-    return False
+    return tem_permissao(perfil_id, nivel, feature)
 
 
 def _load_permissoes_perfil(perfil_id: int | None):
@@ -504,16 +561,7 @@ def _load_permissoes_por_nivel_perfis(nivel: int):
 
 
 def _permissoes_with_parents(perfil_id: int | None, nivel: int | None = None):
-    locked = [f["id"] for f in FEATURES if f.get("locked")]
-    parent_map = build_parent_map()
-    feats = _load_permissoes_perfil(perfil_id) + _load_permissoes_nivel(nivel)
-    # include parents of children
-    feats = _add_parent_features(feats)
-    # add locked always
-    for l in locked:
-        if l not in feats:
-            feats.append(l)
-    return feats
+    return permissoes(perfil_id, nivel)
 
 
 def require_feature(feature_id):
@@ -534,13 +582,7 @@ def require_feature(feature_id):
 def _perfil_by_nome(nome: str | None):
     if not nome:
         return None
-    nome_strip = nome.strip()
-    return (
-        Perfil.query.filter(
-            func.lower(func.ltrim(func.rtrim(Perfil.nome))) == nome_strip.lower()
-        ).first()
-        or Perfil.query.filter(Perfil.nome.ilike(nome_strip)).first()
-    )
+    return get_diretorio().perfil_por_nome(nome)
 
 
 def _is_nivel1(perfil_nome: str | None) -> bool:
@@ -675,8 +717,9 @@ def partial_cadastrar_dotacao():
     user_email = (user_session.get("email") or "").strip()
     user_nome = ""
     user_id = ""
+    diretorio = get_diretorio()
     if user_email:
-        usuario_row = Usuario.query.filter_by(email=user_email).first()
+        usuario_row = diretorio.usuario_por_email(user_email)
         if usuario_row:
             user_nome = (usuario_row.nome or "").strip()
             user_id = str(usuario_row.id or "")
@@ -691,61 +734,19 @@ def partial_cadastrar_dotacao():
         .order_by(Dotacao.id.desc())
         .all()
     )
-    adj_ids = [dot.adj_id for dot in rows if getattr(dot, "adj_id", None)]
-    adj_map = {}
-    if adj_ids:
-        perfis = Perfil.query.filter(Perfil.id.in_(adj_ids)).all()
-        adj_map = {p.id: p.nome for p in perfis if p and p.nome}
-    usuarios_ids = [dot.usuarios_id for dot in rows if getattr(dot, "usuarios_id", None)]
-    usuarios_map = {}
-    usuarios_perfil_map = {}
-    if usuarios_ids:
-        usuarios = Usuario.query.filter(Usuario.id.in_(usuarios_ids)).all()
-        usuarios_map = {u.id: u.nome for u in usuarios}
-        usuarios_perfil_map = {u.id: u.perfil for u in usuarios if getattr(u, "perfil", None)}
+    adj_map = diretorio.perfil_nomes
 
     dotacoes = []
-    atualizar_ids: list[int] = []
-    atualizar_ped_emp: list[Decimal] = []
-    atualizar_estorno: list[Decimal] = []
-    atualizar_situacao: list[str] = []
-    atualizar_atual: list[Decimal] = []
-    est_map, situacao_map = _build_estorno_maps()
-    aprovado_ids: set[int] = set()
-    for dot in rows:
-        if getattr(dot, "aprovado_por", None):
-            try:
-                aprovado_ids.add(int(dot.aprovado_por))
-            except Exception:
-                pass
-    aprovado_map = {}
-    aprovado_perfil_map = {}
-    if aprovado_ids:
-        usuarios_aprov = Usuario.query.filter(Usuario.id.in_(aprovado_ids)).all()
-        aprovado_map = {u.id: u.nome for u in usuarios_aprov}
-        aprovado_perfil_map = {u.id: u.perfil for u in usuarios_aprov if getattr(u, "perfil", None)}
-
     for dot in rows:
         adj_nome = (adj_map.get(dot.adj_id) or "").strip()
-        ped_sum = _calc_ped_sum_for_dotacao(dot.chave_dotacao)
-        emp_sum = _calc_emp_sum_for_dotacao(dot.chave_dotacao)
-        key_norm = _normalize_dotacao_key(dot.chave_dotacao)
-        est_sum = est_map.get(key_norm, Decimal("0"))
-        est_situacao = situacao_map.get(key_norm, "")
-        ped_emp_sum = _dec_or_zero(ped_sum) + _dec_or_zero(emp_sum)
-        valor_dot = _dec_or_zero(dot.valor_dotacao)
-        valor_atual = valor_dot - _dec_or_zero(est_sum) - ped_emp_sum
-        if (
-            _dec_or_zero(dot.valor_ped_emp) != ped_emp_sum
-            or _dec_or_zero(dot.valor_estorno) != _dec_or_zero(est_sum)
-            or _dec_or_zero(dot.valor_atual) != valor_atual
-            or (est_situacao and (dot.situacao or "").strip() != est_situacao)
-        ):
-            atualizar_ids.append(dot.id)
-            atualizar_ped_emp.append(ped_emp_sum)
-            atualizar_estorno.append(_dec_or_zero(est_sum))
-            atualizar_situacao.append(est_situacao)
-            atualizar_atual.append(valor_atual)
+        criador = diretorio.usuario(dot.usuarios_id)
+        aprovador = diretorio.usuario(getattr(dot, "aprovado_por", None))
+        # Saldo mantido pelo ledger de movimentos (services/dotacao_ledger.py).
+        valor_atual = dot.valor_atual
+        if valor_atual is None:
+            valor_atual = (
+                _dec_or_zero(dot.valor_dotacao) - _dec_or_zero(dot.valor_estorno) - _dec_or_zero(dot.valor_ped_emp)
+            )
         dotacoes.append(
             {
                 "id": dot.id,
@@ -757,8 +758,8 @@ def partial_cadastrar_dotacao():
                 "adj_concedente": getattr(dot, "adj_concedente", "") or "",
                 "status_aprovacao": getattr(dot, "status_aprovacao", "") or "",
                 "aprovado_por": getattr(dot, "aprovado_por", "") or "",
-                "aprovado_por_nome": aprovado_map.get(getattr(dot, "aprovado_por", None), ""),
-                "aprovado_por_perfil": aprovado_perfil_map.get(getattr(dot, "aprovado_por", None), ""),
+                "aprovado_por_nome": aprovador.nome if aprovador else "",
+                "aprovado_por_perfil": aprovador.perfil if aprovador else "",
                 "data_aprovacao": dot.data_aprovacao.isoformat() if getattr(dot, "data_aprovacao", None) else "",
                 "motivo_rejeicao": getattr(dot, "motivo_rejeicao", "") or "",
                 "uo": dot.uo,
@@ -777,29 +778,12 @@ def partial_cadastrar_dotacao():
                 "valor_dotacao": dot.valor_dotacao,
                 "valor_atual": valor_atual,
                 "justificativa_historico": dot.justificativa_historico,
-                "usuario_nome": usuarios_map.get(dot.usuarios_id, ""),
-                "usuario_perfil": usuarios_perfil_map.get(dot.usuarios_id, ""),
+                "usuario_nome": criador.nome if criador else "",
+                "usuario_perfil": criador.perfil if criador else "",
                 "criado_em": dot.criado_em.isoformat() if dot.criado_em else "",
                 "alterado_em": dot.alterado_em.isoformat() if dot.alterado_em else "",
             }
         )
-    if atualizar_ids:
-        try:
-            for idx, dot_id in enumerate(atualizar_ids):
-                db.session.execute(
-                    Dotacao.__table__.update()
-                    .where(Dotacao.id == dot_id)
-                    .values(
-                        valor_ped_emp=atualizar_ped_emp[idx],
-                        valor_estorno=atualizar_estorno[idx],
-                        situacao=atualizar_situacao[idx],
-                        valor_atual=atualizar_atual[idx],
-                        alterado_em=_now_local(),
-                    )
-                )
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
     return render_template(
         "partials/cadastrar_dotacao.html",
         dotacoes=dotacoes,
@@ -818,8 +802,9 @@ def partial_cadastrar_est_dotacao():
     user_email = (user_session.get("email") or "").strip()
     user_nome = ""
     user_id = ""
+    diretorio = get_diretorio()
     if user_email:
-        usuario_row = Usuario.query.filter_by(email=user_email).first()
+        usuario_row = diretorio.usuario_por_email(user_email)
         if usuario_row:
             user_nome = (usuario_row.nome or "").strip()
             user_id = str(usuario_row.id or "")
@@ -830,11 +815,7 @@ def partial_cadastrar_est_dotacao():
         .order_by(Dotacao.id.desc())
         .all()
     )
-    adj_ids = [dot.adj_id for dot in rows if getattr(dot, "adj_id", None)]
-    adj_map = {}
-    if adj_ids:
-        perfis = Perfil.query.filter(Perfil.id.in_(adj_ids)).all()
-        adj_map = {p.id: p.nome for p in perfis if p and p.nome}
+    adj_map = diretorio.perfil_nomes
 
     dotacoes = []
     for dot in rows:
@@ -872,11 +853,7 @@ def partial_cadastrar_est_dotacao():
         raw = db.session.execute(text("SELECT * FROM est_dotacao WHERE ativo = 1")).mappings().all()
     except Exception:
         raw = []
-    est_adj_ids = {r.get("adj_id") for r in raw if r.get("adj_id")}
-    est_adj_map = {}
-    if est_adj_ids:
-        est_perfis = Perfil.query.filter(Perfil.id.in_(est_adj_ids)).all()
-        est_adj_map = {p.id: p.nome for p in est_perfis if p and p.nome}
+    est_adj_map = diretorio.perfil_nomes
     for r in raw:
         def pick(*keys):
             for k in keys:
@@ -1075,6 +1052,7 @@ def api_permissoes(perfil_id):
     except ProgrammingError:
         db.session.rollback()
         return jsonify({"error": "Tabela perfil_permissoes inexistente. Crie a tabela antes de salvar."}), 500
+    bump_permissoes_version()
     return jsonify({"ok": True, "message": "Permissoes atualizadas."})
 
 
@@ -1120,6 +1098,7 @@ def api_permissoes_nivel(nivel):
     except ProgrammingError:
         db.session.rollback()
         return jsonify({"error": "Tabela nivel_permissoes inexistente. Crie a tabela antes de salvar."}), 500
+    bump_permissoes_version()
     return jsonify({"ok": True, "message": "Permissoes atualizadas."})
 
 
@@ -1190,14 +1169,15 @@ def _dotacao_payload(registro: Dotacao, adj_label: str) -> dict:
             aprovado_id = int(aprovado_id)
         except Exception:
             aprovado_id = None
+    diretorio = get_diretorio()
     if aprovado_id:
-        usuario_aprov = Usuario.query.filter_by(id=aprovado_id).first()
+        usuario_aprov = diretorio.usuario(aprovado_id)
         aprovado_nome = (usuario_aprov.nome or "").strip() if usuario_aprov else ""
         aprovado_perfil = (usuario_aprov.perfil or "").strip() if usuario_aprov else ""
     usuario_perfil = ""
     usuarios_id = getattr(registro, "usuarios_id", None)
     if usuarios_id:
-        usuario_row = Usuario.query.filter_by(id=usuarios_id).first()
+        usuario_row = diretorio.usuario(usuarios_id)
         usuario_perfil = (usuario_row.perfil or "").strip() if usuario_row else ""
     return {
         "id": registro.id,
@@ -1239,8 +1219,8 @@ def _resolve_usuario_id():
     email = (user.get("email") or "").strip()
     if not email:
         return None
-    usuario = Usuario.query.filter_by(email=email).first()
-    return getattr(usuario, "id", None) if usuario else None
+    usuario = get_diretorio().usuario_por_email(email)
+    return usuario.id if usuario else None
 
 
 def _now_local():
@@ -1253,8 +1233,8 @@ def _attach_usuario_nome(registro: Dotacao) -> Dotacao:
     if not usuarios_id:
         registro.usuario_nome = ""
         return registro
-    usuario = Usuario.query.filter_by(id=usuarios_id).first()
-    registro.usuario_nome = (getattr(usuario, "nome", "") or getattr(usuario, "email", "") or "").strip() if usuario else ""
+    usuario = get_diretorio().usuario(usuarios_id)
+    registro.usuario_nome = (usuario.nome or usuario.email or "").strip() if usuario else ""
     return registro
 
 
@@ -1305,54 +1285,8 @@ def _iduso_variants(value: str) -> list[str]:
     return sorted(variants)
 
 
-def _normalize_chave(value: str) -> str:
-    if not value:
-        return ""
-    value = str(value)
-    value = unicodedata.normalize("NFKD", value)
-    value = "".join(ch for ch in value if not unicodedata.combining(ch))
-    return "".join(ch for ch in value if ch.isalnum() or ch == "*").upper()
-
-
-def _normalize_dotacao_key(value: str) -> str:
-    if not value:
-        return ""
-    cleaned = str(value).strip()
-    cleaned = re.sub(r"\s+", "", cleaned)
-    cleaned = cleaned.rstrip("*")
-    return cleaned.upper()
-
-
-def _calc_ped_sum_for_dotacao(chave_dotacao: str) -> Decimal:
-    key_norm = _normalize_dotacao_key(chave_dotacao)
-    if not key_norm:
-        return Decimal("0")
-    rows = (
-        PedRegistro.query.with_entities(PedRegistro.valor_ped, PedRegistro.chave)
-        .filter(PedRegistro.ativo == True)  # noqa: E712
-        .all()
-    )
-    total = Decimal("0")
-    for row in rows:
-        if _normalize_dotacao_key(row.chave) == key_norm:
-            total += _dec_or_zero(row.valor_ped)
-    return total
-
-
-def _calc_emp_sum_for_dotacao(chave_dotacao: str) -> Decimal:
-    key_norm = _normalize_dotacao_key(chave_dotacao)
-    if not key_norm:
-        return Decimal("0")
-    rows = (
-        EmpRegistro.query.with_entities(EmpRegistro.valor_emp_devolucao_gcv, EmpRegistro.chave)
-        .filter(EmpRegistro.ativo == True)  # noqa: E712
-        .all()
-    )
-    total = Decimal("0")
-    for row in rows:
-        if _normalize_dotacao_key(row.chave) == key_norm:
-            total += _dec_or_zero(row.valor_emp_devolucao_gcv)
-    return total
+_normalize_chave = normalize_chave
+_normalize_dotacao_key = normalize_dotacao_key
 
 
 def _parse_decimal_value(value) -> Decimal:
@@ -1366,144 +1300,31 @@ def _parse_decimal_value(value) -> Decimal:
         return Decimal("0")
 
 
-def _fetch_estorno_rows() -> list[tuple[str, Decimal]]:
-    try:
-        rows = db.session.execute(
-            text("SELECT chave_dotacao, valor_a_ser_est FROM est_dotacao WHERE ativo = 1")
-        ).fetchall()
-        return [(r[0], _parse_decimal_value(r[1])) for r in rows]
-    except Exception:
-        try:
-            rows = db.session.execute(
-                text("SELECT chave_dotacao, valor_estorno FROM est_dotacao WHERE ativo = 1")
-            ).fetchall()
-            return [(r[0], _parse_decimal_value(r[1])) for r in rows]
-        except Exception:
-            try:
-                rows = db.session.execute(
-                    text("SELECT chave, valor_a_ser_est FROM est_dotacao WHERE ativo = 1")
-                ).fetchall()
-                return [(r[0], _parse_decimal_value(r[1])) for r in rows]
-            except Exception:
-                try:
-                    rows = db.session.execute(
-                        text("SELECT chave, valor_estorno FROM est_dotacao WHERE ativo = 1")
-                    ).fetchall()
-                    return [(r[0], _parse_decimal_value(r[1])) for r in rows]
-                except Exception:
-                    return []
-
-
-def _fetch_estorno_rows_full() -> list[tuple[str, Decimal, str]]:
-    try:
-        rows = db.session.execute(
-            text(
-                "SELECT chave_dotacao, valor_a_ser_est, situacao FROM est_dotacao WHERE ativo = 1"
-            )
-        ).fetchall()
-        return [(r[0], _parse_decimal_value(r[1]), r[2] if len(r) > 2 else "") for r in rows]
-    except Exception:
-        try:
-            rows = db.session.execute(
-                text("SELECT chave_dotacao, valor_estorno, situacao FROM est_dotacao WHERE ativo = 1")
-            ).fetchall()
-            return [(r[0], _parse_decimal_value(r[1]), r[2] if len(r) > 2 else "") for r in rows]
-        except Exception:
-            try:
-                rows = db.session.execute(
-                    text("SELECT chave, valor_a_ser_est, situacao FROM est_dotacao WHERE ativo = 1")
-                ).fetchall()
-                return [(r[0], _parse_decimal_value(r[1]), r[2] if len(r) > 2 else "") for r in rows]
-            except Exception:
-                try:
-                    rows = db.session.execute(
-                        text("SELECT chave, valor_estorno, situacao FROM est_dotacao WHERE ativo = 1")
-                    ).fetchall()
-                    return [(r[0], _parse_decimal_value(r[1]), r[2] if len(r) > 2 else "") for r in rows]
-                except Exception:
-                    return []
-
-
-def _calc_estorno_sum_for_dotacao(chave_dotacao: str) -> Decimal:
-    key_norm = _normalize_dotacao_key(chave_dotacao)
-    if not key_norm:
-        return Decimal("0")
-    total = Decimal("0")
-    for chave, valor in _fetch_estorno_rows():
-        if _normalize_dotacao_key(chave) == key_norm:
-            total += _dec_or_zero(valor)
-    return total
-
-
 def _build_estorno_maps() -> tuple[dict[str, Decimal], dict[str, str]]:
     est_map: dict[str, Decimal] = {}
     situacao_map: dict[str, str] = {}
-    for chave, valor, situacao in _fetch_estorno_rows_full():
+    for _, chave, valor, situacao in estorno_rows():
         key_norm = _normalize_dotacao_key(chave)
         if not key_norm:
             continue
-        est_map[key_norm] = _dec_or_zero(est_map.get(key_norm)) + _dec_or_zero(valor)
+        est_map[key_norm] = _dec_or_zero(est_map.get(key_norm)) + _parse_decimal_value(valor)
         if situacao:
             situacao_map[key_norm] = str(situacao).strip()
     return est_map, situacao_map
 
 
-def _build_estorno_map() -> dict[str, Decimal]:
-    est_map, _ = _build_estorno_maps()
-    return est_map
-
-
-def _calc_ped_sum_for_dotacao_keys(keys: set[str]) -> tuple[Decimal, int]:
-    if not keys:
-        return Decimal("0"), 0
-    rows = (
-        PedRegistro.query.with_entities(PedRegistro.valor_ped, PedRegistro.chave)
-        .filter(PedRegistro.ativo == True)  # noqa: E712
-        .all()
-    )
-    total = Decimal("0")
-    count = 0
-    for row in rows:
-        if _normalize_dotacao_key(row.chave) in keys:
-            total += _dec_or_zero(row.valor_ped)
-            count += 1
-    return total, count
-
-
+# As consultas por chave usam a coluna chave_norm (indice ativo + chave_norm),
+# preenchida na gravacao com o mesmo _normalize_dotacao_key; so as linhas da
+# chave saem do banco.
 def _collect_ped_rows_for_dotacao_keys(keys: set[str]) -> dict[int, Decimal]:
     if not keys:
         return {}
     rows = (
-        PedRegistro.query.with_entities(PedRegistro.id, PedRegistro.valor_ped, PedRegistro.chave)
-        .filter(PedRegistro.ativo == True)  # noqa: E712
-        .all()
-    )
-    matched: dict[int, Decimal] = {}
-    for row in rows:
-        if _normalize_dotacao_key(row.chave) in keys:
-            matched[row.id] = _dec_or_zero(row.valor_ped)
-    return matched
-
-
-def _calc_emp_sum_for_dotacao_keys(keys: set[str]) -> tuple[Decimal, int]:
-    if not keys:
-        return Decimal("0"), 0
-    rows = (
-        EmpRegistro.query.with_entities(
-            EmpRegistro.numero_emp, EmpRegistro.valor_emp_devolucao_gcv, EmpRegistro.chave
-        )
-        .filter(EmpRegistro.ativo == True)  # noqa: E712
+        PedRegistro.query.with_entities(PedRegistro.id, PedRegistro.valor_ped)
+        .filter(PedRegistro.ativo == True, PedRegistro.chave_norm.in_(keys))  # noqa: E712
         .all()
     )
-    total = Decimal("0")
-    emp_nums = []
-    for row in rows:
-        if _normalize_dotacao_key(row.chave) in keys:
-            total += _dec_or_zero(row.valor_emp_devolucao_gcv)
-            if row.numero_emp:
-                emp_nums.append(row.numero_emp)
-    emp_nums = list(dict.fromkeys(emp_nums))
-    return total, len(emp_nums)
+    return {row.id: _dec_or_zero(row.valor_ped) for row in rows}
 
 
 def _collect_emp_rows_for_dotacao_keys(keys: set[str]) -> dict[int, tuple[Decimal, str]]:
@@ -1514,16 +1335,11 @@ def _collect_emp_rows_for_dotacao_keys(keys: set[str]) -> dict[int, tuple[Decima
             EmpRegistro.id,
             EmpRegistro.numero_emp,
             EmpRegistro.valor_emp_devolucao_gcv,
-            EmpRegistro.chave,
         )
-        .filter(EmpRegistro.ativo == True)  # noqa: E712
+        .filter(EmpRegistro.ativo == True, EmpRegistro.chave_norm.in_(keys))  # noqa: E712
         .all()
     )
-    matched: dict[int, tuple[Decimal, str]] = {}
-    for row in rows:
-        if _normalize_dotacao_key(row.chave) in keys:
-            matched[row.id] = (_dec_or_zero(row.valor_emp_devolucao_gcv), row.numero_emp or "")
-    return matched
+    return {row.id: (_dec_or_zero(row.valor_emp_devolucao_gcv), row.numero_emp or "") for row in rows}
 
 
 @home_bp.route("/api/dotacao/options", methods=["GET"])
@@ -1531,62 +1347,29 @@ def _collect_emp_rows_for_dotacao_keys(keys: set[str]) -> dict[int, tuple[Decima
 @require_feature("cadastrar/dotacao")
 def api_dotacao_options():
     current_year = str(_now_local().year)
-    fields = {
-        "exercicio": Plan21Nger.exercicio,
-        "chave_planejamento": Plan21Nger.chave_planejamento,
-        "uo": Plan21Nger.uo,
-        "programa": Plan21Nger.programa,
-        "acao_paoe": Plan21Nger.acao_paoe,
-        "produto": Plan21Nger.produto,
-        "ug": Plan21Nger.ug,
-        "regiao": Plan21Nger.regiao_etapa,
-        "subacao_entrega": Plan21Nger.subacao_entrega,
-        "etapa": Plan21Nger.etapa,
-        "natureza_despesa": Plan21Nger.natureza,
-        "elemento": Plan21Nger.elemento,
-        "subelemento": Plan21Nger.subelemento,
-        "fonte": Plan21Nger.fonte,
-        "iduso": Plan21Nger.idu,
-    }
     selected = {}
-    for key in fields:
+    for key in FACET_FIELDS:
         val = (request.args.get(key) or "").strip()
         if val:
             selected[key] = val
     if "exercicio" not in selected:
         selected["exercicio"] = current_year
+    prefixos = {}
+    for key in SEARCH_FIELDS:
+        val = (request.args.get(f"{key}_prefixo") or "").strip()
+        if val:
+            prefixos[key] = val
 
     options = {}
-    for key, col in fields.items():
-        query = db.session.query(col).distinct().filter(Plan21Nger.ativo == True)  # noqa: E712
-        for s_key, s_val in selected.items():
-            if s_key == key:
-                continue
-            if s_key == "natureza_despesa":
-                query = query.filter(fields[s_key].like(f"{s_val}%"))
-            else:
-                query = query.filter(fields[s_key] == s_val)
-        rows = query.all()
-        values = []
-        for (val,) in rows:
-            if val is None:
-                continue
-            s = str(val).strip()
-            if s == "":
-                continue
-            if key == "natureza_despesa":
-                s = _natureza_prefix(s)
-            values.append(s)
+    for key, values in get_plan21_index().options(selected, prefixos).items():
         if key == "exercicio":
             options[key] = [current_year]
-        else:
-            options[key] = sorted(set(values), key=lambda v: v.lower())
+            continue
+        if key == "natureza_despesa":
+            values = {_natureza_prefix(v) for v in values}
+        options[key] = sorted(values, key=lambda v: v.lower())
 
-    perfis_raw = (
-        Perfil.query.filter(Perfil.ativo == True)  # noqa: E712
-        .order_by(Perfil.nome)
-        .all()
-    )
+    perfis_raw = sorted((p for p in get_diretorio().perfis if p.ativo), key=lambda p: p.nome)
     adj_options = []
     for p in perfis_raw:
         nome = (p.nome or "").strip()
@@ -1654,7 +1437,7 @@ def api_dotacao_create():
         adj_id = int(adj_raw)
     except ValueError:
         return jsonify({"error": "Adjunta Responsavel invalida."}), 400
-    adj_row = db.session.get(Perfil, adj_id)
+    adj_row = get_diretorio().perfil(adj_id)
     if not adj_row or (adj_row.nome or "").strip().lower() in {"admin", "consultor"}:
         return jsonify({"error": "Adjunta Responsavel nao encontrada."}), 400
 
@@ -1663,12 +1446,8 @@ def api_dotacao_create():
     if emprestada:
         if not adj_concedente_raw:
             return jsonify({"error": "Adjunta Concedente obrigatoria para dotacao emprestada."}), 400
-        perfil = (
-            Perfil.query.filter(Perfil.ativo == True)  # noqa: E712
-            .filter(Perfil.nome == adj_concedente_raw)
-            .first()
-        )
-        if not perfil or adj_concedente_raw.lower() in {"admin", "consultor"}:
+        perfil = get_diretorio().perfil_por_nome(adj_concedente_raw)
+        if not perfil or not perfil.ativo or adj_concedente_raw.lower() in {"admin", "consultor"}:
             return jsonify({"error": "Adjunta Concedente invalida."}), 400
         adj_concedente = adj_concedente_raw
     else:
@@ -1683,23 +1462,7 @@ def api_dotacao_create():
     if valor_dotacao is None:
         return jsonify({"error": "Valor da dotacao invalido."}), 400
 
-    saldo_info = _calc_dotacao_saldo(
-        exercicio,
-        programa,
-        acao_paoe,
-        produto,
-        ug,
-        uo,
-        regiao,
-        subacao_entrega,
-        etapa,
-        natureza_despesa,
-        elemento_raw,
-        subelemento,
-        fonte,
-        iduso,
-        chave_planejamento,
-    )
+    saldo_info = _saldos_dotacao([_saldo_params(data)], gravar=False)[0]
     saldo_disponivel = saldo_info["saldo"]
     saldo_disponivel = _dec_or_zero(saldo_disponivel).quantize(Decimal("0.01"))
     valor_dotacao = _dec_or_zero(valor_dotacao).quantize(Decimal("0.01"))
@@ -1773,18 +1536,16 @@ def api_dotacao_create():
         adj_label = (adj_row.nome or str(adj_id)).strip()
         chave_dotacao = f"DOT.{exercicio}.{adj_label}.{registro.id}*"
         justificativa_full = f"{chave_dotacao} {justificativa}".strip()
-        ped_sum = _calc_ped_sum_for_dotacao(chave_dotacao)
-        emp_sum = _calc_emp_sum_for_dotacao(chave_dotacao)
-        est_sum = _calc_estorno_sum_for_dotacao(chave_dotacao)
+        ped_emp_sum, est_sum = saldo_ledger(chave_dotacao)
         _, situacao_map = _build_estorno_maps()
         est_situacao = situacao_map.get(_normalize_dotacao_key(chave_dotacao), "")
-        ped_emp_sum = _dec_or_zero(ped_sum) + _dec_or_zero(emp_sum)
         valor_atual = _dec_or_zero(valor_dotacao) - _dec_or_zero(est_sum) - ped_emp_sum
         db.session.execute(
             Dotacao.__table__.update()
             .where(Dotacao.id == registro.id)
             .values(
                 chave_dotacao=chave_dotacao,
+                chave_norm=_normalize_dotacao_key(chave_dotacao),
                 justificativa_historico=justificativa_full,
                 valor_ped_emp=ped_emp_sum,
                 valor_estorno=_dec_or_zero(est_sum),
@@ -1793,11 +1554,13 @@ def api_dotacao_create():
                 alterado_em=None,
             )
         )
+        invalidar_saldos(chaves_planejamento=[(exercicio, chave_planejamento)])
         db.session.commit()
         db.session.refresh(registro)
     except Exception as exc:
         db.session.rollback()
         return jsonify({"error": f"Falha ao salvar dotacao: {exc}"}), 500
+    _schedule_post_ingest("dotacao")
 
     return (
         jsonify(
@@ -1818,7 +1581,6 @@ def api_dotacao_update(dotacao_id):
     registro = db.session.get(Dotacao, dotacao_id)
     if not registro:
         return jsonify({"error": "Dotacao nao encontrada."}), 404
-
     user_session = session.get("user") or {}
     perfil_usuario = (user_session.get("perfil") or "").strip()
     adj_concedente = (getattr(registro, "adj_concedente", "") or "").strip()
@@ -1881,7 +1643,7 @@ def api_dotacao_update(dotacao_id):
         adj_id = int(adj_raw)
     except ValueError:
         return jsonify({"error": "Adjunta Responsavel invalida."}), 400
-    adj_row = db.session.get(Perfil, adj_id)
+    adj_row = get_diretorio().perfil(adj_id)
     if not adj_row or (adj_row.nome or "").strip().lower() in {"admin", "consultor"}:
         return jsonify({"error": "Adjunta Responsavel nao encontrada."}), 400
 
@@ -1890,12 +1652,8 @@ def api_dotacao_update(dotacao_id):
     if emprestada:
         if not adj_concedente_raw:
             return jsonify({"error": "Adjunta Concedente obrigatoria para dotacao emprestada."}), 400
-        perfil = (
-            Perfil.query.filter(Perfil.ativo == True)  # noqa: E712
-            .filter(Perfil.nome == adj_concedente_raw)
-            .first()
-        )
-        if not perfil or adj_concedente_raw.lower() in {"admin", "consultor"}:
+        perfil = get_diretorio().perfil_por_nome(adj_concedente_raw)
+        if not perfil or not perfil.ativo or adj_concedente_raw.lower() in {"admin", "consultor"}:
             return jsonify({"error": "Adjunta Concedente invalida."}), 400
         adj_concedente = adj_concedente_raw
     else:
@@ -1910,23 +1668,7 @@ def api_dotacao_update(dotacao_id):
     if valor_dotacao is None:
         return jsonify({"error": "Valor da dotacao invalido."}), 400
 
-    saldo_info = _calc_dotacao_saldo(
-        exercicio,
-        programa,
-        acao_paoe,
-        produto,
-        ug,
-        uo,
-        regiao,
-        subacao_entrega,
-        etapa,
-        natureza_despesa,
-        elemento_raw,
-        subelemento,
-        fonte,
-        iduso,
-        chave_planejamento,
-    )
+    saldo_info = _saldos_dotacao([_saldo_params(data)], gravar=False)[0]
     saldo_disponivel = saldo_info["saldo"]
     saldo_disponivel = _dec_or_zero(saldo_disponivel).quantize(Decimal("0.01"))
     valor_dotacao = _dec_or_zero(valor_dotacao).quantize(Decimal("0.01"))
@@ -1965,6 +1707,7 @@ def api_dotacao_update(dotacao_id):
     if usuarios_id is None:
         return jsonify({"error": "Usuario nao encontrado."}), 400
 
+    chave_anterior = (registro.exercicio, registro.chave_planejamento)
     registro.plan21_nger_id = plan.id
     registro.exercicio = exercicio
     registro.adj_id = adj_id
@@ -1992,21 +1735,20 @@ def api_dotacao_update(dotacao_id):
     chave_dotacao = f"DOT.{exercicio}.{adj_label}.{registro.id}*"
     registro.chave_dotacao = chave_dotacao
     registro.justificativa_historico = f"{chave_dotacao} {justificativa}".strip()
-    ped_sum = _calc_ped_sum_for_dotacao(chave_dotacao)
-    emp_sum = _calc_emp_sum_for_dotacao(chave_dotacao)
-    est_sum = _calc_estorno_sum_for_dotacao(chave_dotacao)
+    ped_emp_sum, est_sum = saldo_ledger(chave_dotacao)
     _, situacao_map = _build_estorno_maps()
     est_situacao = situacao_map.get(_normalize_dotacao_key(chave_dotacao), "")
-    ped_emp_sum = _dec_or_zero(ped_sum) + _dec_or_zero(emp_sum)
     registro.valor_ped_emp = ped_emp_sum
     registro.valor_estorno = _dec_or_zero(est_sum)
     registro.situacao = est_situacao
     registro.valor_atual = _dec_or_zero(valor_dotacao) - _dec_or_zero(est_sum) - ped_emp_sum
     try:
+        invalidar_saldos(chaves_planejamento=[chave_anterior, (exercicio, chave_planejamento)])
         db.session.commit()
     except Exception as exc:
         db.session.rollback()
         return jsonify({"error": f"Falha ao salvar dotacao: {exc}"}), 500
+    _schedule_post_ingest("dotacao")
     return jsonify(
         {
             "ok": True,
@@ -2038,10 +1780,12 @@ def api_dotacao_delete(dotacao_id):
     registro.ativo = False
     registro.excluido_em = _now_local()
     try:
+        invalidar_saldos(chaves_planejamento=[(registro.exercicio, registro.chave_planejamento)])
         db.session.commit()
     except Exception as exc:
         db.session.rollback()
         return jsonify({"error": f"Falha ao excluir dotacao: {exc}"}), 500
+    _schedule_post_ingest("dotacao")
 
     return jsonify({"ok": True, "message": "Dotacao excluida."})
 
@@ -2091,14 +1835,18 @@ def api_dotacao_aprovar(dotacao_id):
     registro.alterado_em = _now_local()
 
     try:
+        if not registro.ativo:
+            invalidar_saldos(chaves_planejamento=[(registro.exercicio, registro.chave_planejamento)])
         db.session.commit()
     except Exception as exc:
         db.session.rollback()
         return jsonify({"error": f"Falha ao aprovar dotacao: {exc}"}), 500
+    if not registro.ativo:
+        _schedule_post_ingest("dotacao")
 
     adj_label = ""
     if registro.adj_id:
-        adj_row = db.session.get(Perfil, registro.adj_id)
+        adj_row = get_diretorio().perfil(registro.adj_id)
         adj_label = (adj_row.nome or str(registro.adj_id)).strip() if adj_row else ""
 
     return jsonify(
@@ -2110,6 +1858,403 @@ def api_dotacao_aprovar(dotacao_id):
     )
 
 
+def _itens_lote(data: dict):
+    """Lista de itens do corpo de um endpoint de lote; (itens, None) ou (None, resposta de erro)."""
+    itens = data.get("itens")
+    if not isinstance(itens, list) or not itens or not all(isinstance(item, dict) for item in itens):
+        return None, (jsonify({"error": "Informe itens."}), 400)
+    if len(itens) > DOTACAO_LOTE_MAX:
+        return None, (jsonify({"error": f"Maximo de {DOTACAO_LOTE_MAX} itens por chamada."}), 400)
+    return itens, None
+
+
+def _erro_lote(erros: list[tuple[int, str]]):
+    return (
+        jsonify(
+            {
+                "error": "Nenhum item foi gravado; corrija os itens com erro.",
+                "erros": [{"indice": idx, "error": msg} for idx, msg in erros],
+            }
+        ),
+        400,
+    )
+
+
+_DOTACAO_LOTE_OBRIGATORIOS = (
+    "exercicio",
+    "chave_planejamento",
+    "uo",
+    "programa",
+    "acao_paoe",
+    "produto",
+    "ug",
+    "regiao",
+    "subacao_entrega",
+    "etapa",
+    "natureza_despesa",
+    "elemento",
+    "subelemento",
+    "fonte",
+    "iduso",
+    "adj_id",
+    "valor_dotacao",
+)
+
+
+def _validar_dotacao_lote(item: dict, perfis: dict[int, Perfil]) -> tuple[dict | None, str | None]:
+    """Mesmas regras de api_dotacao_create, com os perfis ja carregados."""
+    campos = {k: str(item.get(k) or "").strip() for k in _DOTACAO_LOTE_OBRIGATORIOS}
+    campos["justificativa"] = _extract_justificativa_text(str(item.get("justificativa_historico") or "").strip())
+    missing = [k for k, v in campos.items() if not v]
+    if missing:
+        nomes = ["justificativa_historico" if k == "justificativa" else k for k in missing]
+        return None, f"Campos obrigatorios ausentes: {', '.join(nomes)}."
+    try:
+        adj_id = int(campos["adj_id"])
+    except ValueError:
+        return None, "Adjunta Responsavel invalida."
+    adj_row = perfis.get(adj_id)
+    if not adj_row or (adj_row.nome or "").strip().lower() in {"admin", "consultor"}:
+        return None, "Adjunta Responsavel nao encontrada."
+    campos["adj_id"] = adj_id
+    campos["adj_label"] = (adj_row.nome or str(adj_id)).strip()
+
+    if str(item.get("dotacao_emprestada") or "").strip().lower() == "sim":
+        concedente = str(item.get("adj_concedente") or "").strip()
+        if not concedente:
+            return None, "Adjunta Concedente obrigatoria para dotacao emprestada."
+        ativos = {(p.nome or "").strip().lower() for p in perfis.values() if p.ativo}
+        if concedente.lower() not in ativos or concedente.lower() in {"admin", "consultor"}:
+            return None, "Adjunta Concedente invalida."
+        campos["adj_concedente"] = concedente
+    else:
+        campos["adj_concedente"] = campos["adj_label"]
+
+    try:
+        campos["elemento_int"] = int(campos["elemento"])
+    except ValueError:
+        return None, "Elemento invalido."
+    valor = _parse_decimal(campos["valor_dotacao"])
+    if valor is None:
+        return None, "Valor da dotacao invalido."
+    campos["valor"] = _dec_or_zero(valor).quantize(Decimal("0.01"))
+    return campos, None
+
+
+def _plan21_atende(plan, campos: dict) -> bool:
+    """Mesmo filtro do plan21_nger em api_dotacao_create (sem distinguir maiusculas, como o banco)."""
+
+    def _igual(valor, esperado) -> bool:
+        return str(valor if valor is not None else "").strip().lower() == esperado.lower()
+
+    obrigatorios = {
+        "exercicio": "exercicio",
+        "chave_planejamento": "chave_planejamento",
+        "uo": "uo",
+        "programa": "programa",
+        "acao_paoe": "acao_paoe",
+        "produto": "produto",
+        "ug": "ug",
+        "regiao_etapa": "regiao",
+        "elemento": "elemento",
+        "fonte": "fonte",
+        "idu": "iduso",
+    }
+    if not all(_igual(getattr(plan, attr), campos[campo]) for attr, campo in obrigatorios.items()):
+        return False
+    for attr in ("subacao_entrega", "etapa", "subelemento"):
+        if campos[attr] and not _igual(getattr(plan, attr), campos[attr]):
+            return False
+    natureza = str(plan.natureza or "").strip().lower()
+    return not campos["natureza_despesa"] or natureza.startswith(campos["natureza_despesa"].lower())
+
+
+@home_bp.route("/api/dotacao/lote", methods=["POST"])
+@login_required
+@require_feature("cadastrar/dotacao")
+def api_dotacao_create_lote():
+    """
+    Cadastro de varias dotacoes numa transacao: tudo e validado antes de
+    gravar (um item com erro cancela o lote). O saldo das combinacoes sai de
+    _calc_saldos_lote e cada item aprovado e descontado de toda combinacao do
+    lote em que ele entraria depois de gravado; as chave_dotacao saem de um
+    unico flush.
+    """
+    itens, erro = _itens_lote(request.get_json(silent=True) or {})
+    if erro:
+        return erro
+    usuarios_id = _resolve_usuario_id()
+    if usuarios_id is None:
+        return jsonify({"error": "Usuario nao encontrado."}), 400
+
+    perfis = get_diretorio().perfis_por_id
+    erros: list[tuple[int, str]] = []
+    validos: list[tuple[int, dict]] = []
+    for idx, item in enumerate(itens):
+        campos, msg = _validar_dotacao_lote(item, perfis)
+        if msg:
+            erros.append((idx, msg))
+        else:
+            validos.append((idx, campos))
+
+    # Saldo de cada combinacao distinta, com as consultas agrupadas do lote.
+    combinacoes = {}
+    for _, campos in validos:
+        exercicio, chave_planejamento, filtros = _saldo_params(campos)
+        chave = (exercicio, chave_planejamento, *filtros.values())
+        combinacoes.setdefault(chave, (exercicio, chave_planejamento, filtros))
+    disponivel = {}
+    if combinacoes:
+        for chave, result in zip(combinacoes, _saldos_dotacao(list(combinacoes.values()), gravar=False)):
+            disponivel[chave] = _dec_or_zero(result["saldo"]).quantize(Decimal("0.01"))
+
+    planos = {}
+    for exercicio in {campos["exercicio"] for _, campos in validos}:
+        chaves = sorted({campos["chave_planejamento"] for _, campos in validos if campos["exercicio"] == exercicio})
+        for i in range(0, len(chaves), SALDO_LOTE_CHUNK):
+            for plan in Plan21Nger.query.filter(
+                Plan21Nger.exercicio == exercicio,
+                Plan21Nger.chave_planejamento.in_(chaves[i : i + SALDO_LOTE_CHUNK]),
+            ).all():
+                planos.setdefault((exercicio, _normalize_chave(plan.chave_planejamento)), []).append(plan)
+
+    # Saldo restante de cada combinacao ja vista no lote. Um item gravado entra
+    # no saldo de toda combinacao cujos filtros ele atende (_dotacao_no_saldo):
+    # natureza "3390" inclui a dotacao "339030", entao as duas disputam o mesmo saldo.
+    agora = _now_local()
+    restante: dict[tuple, Decimal] = {}
+    aprovados: list[tuple[dict, Dotacao]] = []
+    for idx, campos in validos:
+        exercicio, chave_planejamento, filtros = _saldo_params(campos)
+        chave_plan = (exercicio, _normalize_chave(chave_planejamento))
+        chave = (exercicio, chave_planejamento, *filtros.values())
+        if campos["valor"] <= 0:
+            erros.append((idx, "Valor da Dotação deve ser menor ou igual ao Saldo da Dotação"))
+            continue
+        encontrados = [plan for plan in planos.get(chave_plan, []) if _plan21_atende(plan, campos)]
+        if not encontrados:
+            erros.append((idx, "Nenhum registro do plan21_nger encontrado para esta selecao."))
+            continue
+        if len(encontrados) > 1:
+            erros.append((idx, "Selecao ambigua no plan21_nger. Ajuste os filtros."))
+            continue
+        plan = encontrados[0]
+        registro = Dotacao(
+            plan21_nger_id=plan.id,
+            exercicio=campos["exercicio"],
+            adj_id=campos["adj_id"],
+            chave_planejamento=campos["chave_planejamento"],
+            uo=campos["uo"],
+            programa=getattr(plan, "programa", None),
+            acao_paoe=getattr(plan, "acao_paoe", None),
+            produto=getattr(plan, "produto", None),
+            ug=getattr(plan, "ug", None),
+            regiao=campos["regiao"],
+            subacao_entrega=campos["subacao_entrega"],
+            etapa=campos["etapa"],
+            natureza_despesa=campos["natureza_despesa"],
+            elemento=campos["elemento_int"],
+            subelemento=campos["subelemento"],
+            fonte=campos["fonte"],
+            iduso=campos["iduso"],
+            valor_dotacao=campos["valor"],
+            adj_concedente=campos["adj_concedente"],
+            status_aprovacao="Aguardando",
+            aprovado_por=None,
+            data_aprovacao=None,
+            justificativa_historico="",
+            chave_dotacao="",
+            usuarios_id=usuarios_id,
+            criado_em=agora,
+            alterado_em=None,
+            ativo=True,
+        )
+        if chave not in restante:
+            restante[chave] = disponivel[chave] - sum(
+                (c["valor"] for c, r in aprovados if _dotacao_no_saldo(r, *combinacoes[chave])), Decimal("0")
+            )
+        atingidas = [k for k in restante if k == chave or _dotacao_no_saldo(registro, *combinacoes[k])]
+        if any(campos["valor"] > restante[k] for k in atingidas):
+            erros.append((idx, "Valor da Dotação deve ser menor ou igual ao Saldo da Dotação"))
+            continue
+        for k in atingidas:
+            restante[k] -= campos["valor"]
+        aprovados.append((campos, registro))
+    if erros:
+        return _erro_lote(sorted(erros))
+
+    registros = [registro for _, registro in aprovados]
+    db.session.add_all(registros)
+    try:
+        db.session.flush()
+        chaves = [f"DOT.{c['exercicio']}.{c['adj_label']}.{r.id}*" for r, (c, _) in zip(registros, aprovados)]
+        ledger = saldos_ledger(chaves)
+        _, situacao_map = _build_estorno_maps()
+        for registro, (campos, _), chave_dotacao in zip(registros, aprovados, chaves):
+            key_norm = _normalize_dotacao_key(chave_dotacao)
+            ped_emp_sum, est_sum = ledger.get(key_norm, (Decimal("0"), Decimal("0")))
+            registro.chave_dotacao = chave_dotacao
+            registro.chave_norm = key_norm
+            registro.justificativa_historico = f"{chave_dotacao} {campos['justificativa']}".strip()
+            registro.valor_ped_emp = ped_emp_sum
+            registro.valor_estorno = est_sum
+            registro.situacao = situacao_map.get(key_norm, "")
+            registro.valor_atual = campos["valor"] - est_sum - ped_emp_sum
+        invalidar_saldos(chaves_planejamento=[(c["exercicio"], c["chave_planejamento"]) for c, _ in aprovados])
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        return jsonify({"error": f"Falha ao salvar dotacoes: {exc}"}), 500
+    _schedule_post_ingest("dotacao")
+
+    return (
+        jsonify(
+            {
+                "ok": True,
+                "message": f"{len(registros)} dotacoes cadastradas.",
+                "dotacoes": [{"id": r.id, "chave_dotacao": r.chave_dotacao} for r in registros],
+            }
+        ),
+        201,
+    )
+
+
+@home_bp.route("/api/dotacao/aprovar/lote", methods=["POST"])
+@login_required
+@require_feature("cadastrar/dotacao")
+def api_dotacao_aprovar_lote():
+    """
+    Aprovacao/rejeicao de varias dotacoes numa transacao. Cada item traz id,
+    dotacao_aprovada e motivo_rejeicao; as regras sao as de
+    api_dotacao_aprovar e um item com erro cancela o lote.
+    """
+    itens, erro = _itens_lote(request.get_json(silent=True) or {})
+    if erro:
+        return erro
+    user_session = session.get("user") or {}
+    perfil_usuario = (user_session.get("perfil") or "").strip()
+    if not perfil_usuario:
+        return jsonify({"error": "Perfil do usuario nao encontrado."}), 400
+    usuarios_id = _resolve_usuario_id()
+    if usuarios_id is None:
+        return jsonify({"error": "Usuario nao encontrado."}), 400
+
+    ids = set()
+    for item in itens:
+        try:
+            ids.add(int(item.get("id")))
+        except (TypeError, ValueError):
+            pass
+    registros = {r.id: r for r in Dotacao.query.filter(Dotacao.id.in_(ids)).all()} if ids else {}
+    erros: list[tuple[int, str]] = []
+    vistos = set()
+    for idx, item in enumerate(itens):
+        try:
+            registro = registros.get(int(item.get("id")))
+        except (TypeError, ValueError):
+            registro = None
+        if not registro:
+            erros.append((idx, "Dotacao nao encontrada."))
+            continue
+        if registro.id in vistos:
+            erros.append((idx, "Dotacao repetida no lote."))
+            continue
+        vistos.add(registro.id)
+        status_atual = (registro.status_aprovacao or "").strip().lower()
+        if status_atual and status_atual != "aguardando":
+            erros.append((idx, "Dotacao ja foi processada."))
+            continue
+        adj_concedente = (getattr(registro, "adj_concedente", "") or "").strip()
+        if not adj_concedente:
+            erros.append((idx, "Adjunta Concedente nao definida."))
+            continue
+        if perfil_usuario.lower() != adj_concedente.lower():
+            erros.append((idx, "Usuario sem permissao para aprovar a dotacao atual."))
+            continue
+        if not str(item.get("motivo_rejeicao") or "").strip():
+            erros.append((idx, "Justificativa obrigatoria."))
+    if erros:
+        return _erro_lote(erros)
+
+    agora = _now_local()
+    rejeitadas = []
+    for item in itens:
+        registro = registros[int(item.get("id"))]
+        if str(item.get("dotacao_aprovada") or "").strip().lower() == "sim":
+            registro.status_aprovacao = "Aprovado"
+        else:
+            registro.status_aprovacao = "Rejeitado"
+            registro.ativo = False
+            registro.excluido_em = agora
+            rejeitadas.append((registro.exercicio, registro.chave_planejamento))
+        registro.motivo_rejeicao = str(item.get("motivo_rejeicao") or "").strip()
+        registro.aprovado_por = str(usuarios_id)
+        registro.data_aprovacao = agora
+        registro.alterado_em = agora
+    try:
+        invalidar_saldos(chaves_planejamento=rejeitadas)
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        return jsonify({"error": f"Falha ao aprovar dotacoes: {exc}"}), 500
+    if rejeitadas:
+        _schedule_post_ingest("dotacao")
+
+    return jsonify(
+        {
+            "ok": True,
+            "message": f"{len(itens)} dotacoes atualizadas.",
+            "dotacoes": [
+                {"id": int(item.get("id")), "status_aprovacao": registros[int(item.get("id"))].status_aprovacao}
+                for item in itens
+            ],
+        }
+    )
+
+
+def _dotacao_por_chave(chave_dotacao: str):
+    key_norm = _normalize_dotacao_key(chave_dotacao)
+    if not key_norm:
+        return None
+    return Dotacao.query.filter(Dotacao.chave_norm == key_norm).first()
+
+
+def _sync_estornos_dotacao(dotacao_row, situacao) -> None:
+    """
+    Leva o estorno gravado ao ledger (o delta ja ajusta valor_estorno e
+    valor_atual da dotacao) e atualiza a situacao da dotacao.
+    """
+    sync_ledger((ORIGEM_ESTORNO,))
+    if not dotacao_row:
+        return
+    db.session.refresh(dotacao_row)
+    if situacao is not None:
+        dotacao_row.situacao = situacao
+    dotacao_row.alterado_em = _now_local()
+    db.session.commit()
+    _schedule_post_ingest("dotacao")
+
+
+_EST_DOTACAO_INSERT = text(
+    """
+    INSERT INTO est_dotacao (
+        exercicio, adj_id, chave_planejamento, chave_dotacao, uo, programa, acao_paoe, produto,
+        ug, regiao, subacao_entrega, etapa, natureza_despesa, elemento, subelemento, fonte, iduso,
+        valor_dotacao, valor_a_ser_est, saldo_dotacao_apos, justificativa, usuarios_id, ativo,
+        status_aprovacao, situacao, aprovado_por, data_aprovacao, motivo_rejeicao, alterado_em,
+        excluido_em, criado_em, chave_norm, chave_planejamento_norm
+    )
+    VALUES (
+        :exercicio, :adj_id, :chave_planejamento, :chave_dotacao, :uo, :programa, :acao_paoe, :produto,
+        :ug, :regiao, :subacao_entrega, :etapa, :natureza_despesa, :elemento, :subelemento, :fonte, :iduso,
+        :valor_dotacao, :valor_a_ser_est, :saldo_dotacao_apos, :justificativa, :usuarios_id, :ativo,
+        :status_aprovacao, :situacao, :aprovado_por, :data_aprovacao, :motivo_rejeicao, :alterado_em,
+        :excluido_em, :criado_em, :chave_norm, :chave_planejamento_norm
+    )
+    """
+)
+
+
 @home_bp.route("/api/est-dotacao", methods=["POST"])
 @login_required
 @require_feature("cadastrar/est-dotacao")
@@ -2164,7 +2309,7 @@ def api_est_dotacao_create():
     if valor_dotacao is None or valor_est is None or saldo is None:
         return jsonify({"error": "Valores monetários inválidos."}), 400
 
-    adj_row = Perfil.query.filter(Perfil.nome == adjunta).first()
+    adj_row = get_diretorio().perfil_por_nome(adjunta)
     if not adj_row:
         return jsonify({"error": "Adjunta Solicitante não encontrada."}), 400
 
@@ -2175,28 +2320,12 @@ def api_est_dotacao_create():
     now = _now_local()
     try:
         db.session.execute(
-            text(
-                """
-                INSERT INTO est_dotacao (
-                    exercicio, adj_id, chave_planejamento, chave_dotacao, uo, programa, acao_paoe, produto,
-                    ug, regiao, subacao_entrega, etapa, natureza_despesa, elemento, subelemento, fonte, iduso,
-                    valor_dotacao, valor_a_ser_est, saldo_dotacao_apos, justificativa, usuarios_id, ativo,
-                    status_aprovacao, situacao, aprovado_por, data_aprovacao, motivo_rejeicao, alterado_em,
-                    excluido_em, criado_em
-                )
-                VALUES (
-                    :exercicio, :adj_id, :chave_planejamento, :chave_dotacao, :uo, :programa, :acao_paoe, :produto,
-                    :ug, :regiao, :subacao_entrega, :etapa, :natureza_despesa, :elemento, :subelemento, :fonte, :iduso,
-                    :valor_dotacao, :valor_a_ser_est, :saldo_dotacao_apos, :justificativa, :usuarios_id, :ativo,
-                    :status_aprovacao, :situacao, :aprovado_por, :data_aprovacao, :motivo_rejeicao, :alterado_em,
-                    :excluido_em, :criado_em
-                )
-                """
-            ),
+            _EST_DOTACAO_INSERT,
             {
                 "exercicio": exercicio,
                 "adj_id": adj_row.id,
                 "chave_planejamento": chave_planejamento,
+                **chave_norm_values(chave_dotacao, chave_planejamento),
                 "chave_dotacao": chave_dotacao,
                 "uo": uo,
                 "programa": programa,
@@ -2233,31 +2362,8 @@ def api_est_dotacao_create():
         return jsonify({"error": f"Falha ao salvar estorno: {exc}"}), 500
 
     try:
-        dotacao_row = Dotacao.query.filter(Dotacao.chave_dotacao == chave_dotacao).first()
-        if not dotacao_row and chave_dotacao:
-            key_norm = _normalize_dotacao_key(chave_dotacao)
-            dotacao_row = next(
-                (
-                    d
-                    for d in Dotacao.query.filter(Dotacao.chave_dotacao.isnot(None)).all()
-                    if _normalize_dotacao_key(d.chave_dotacao) == key_norm
-                ),
-                None,
-            )
-        if dotacao_row:
-            est_sum = _calc_estorno_sum_for_dotacao(chave_dotacao)
-            ped_sum = _calc_ped_sum_for_dotacao(dotacao_row.chave_dotacao or chave_dotacao)
-            emp_sum = _calc_emp_sum_for_dotacao(dotacao_row.chave_dotacao or chave_dotacao)
-            dotacao_row.valor_estorno = _dec_or_zero(est_sum)
-            dotacao_row.situacao = situacao
-            dotacao_row.valor_atual = (
-                _dec_or_zero(dotacao_row.valor_dotacao)
-                - _dec_or_zero(est_sum)
-                - _dec_or_zero(ped_sum)
-                - _dec_or_zero(emp_sum)
-            )
-            dotacao_row.alterado_em = _now_local()
-            db.session.commit()
+        dotacao_row = _dotacao_por_chave(chave_dotacao)
+        _sync_estornos_dotacao(dotacao_row, situacao)
     except Exception:
         db.session.rollback()
 
@@ -2286,7 +2392,7 @@ def api_est_dotacao_update(est_id):
     adj_id = row.get("adj_id")
     adj_nome = ""
     if adj_id:
-        adj_row = db.session.get(Perfil, adj_id)
+        adj_row = get_diretorio().perfil(adj_id)
         adj_nome = (adj_row.nome or "").strip() if adj_row else ""
     if not adj_nome or not perfil_usuario or perfil_usuario.lower() != adj_nome.lower():
         return jsonify({"error": "Usu\u00e1rio sem permiss\u00e3o para editar o estorno atual."}), 403
@@ -2339,26 +2445,11 @@ def api_est_dotacao_update(est_id):
         db.session.rollback()
         return jsonify({"error": f"Falha ao atualizar estorno: {exc}"}), 500
 
-    chave_dotacao = (row.get("chave_dotacao") or "").strip()
-    if chave_dotacao:
-        try:
-            dotacao_row = Dotacao.query.filter(Dotacao.chave_dotacao == chave_dotacao).first()
-            if dotacao_row:
-                est_sum = _calc_estorno_sum_for_dotacao(chave_dotacao)
-                ped_sum = _calc_ped_sum_for_dotacao(dotacao_row.chave_dotacao or chave_dotacao)
-                emp_sum = _calc_emp_sum_for_dotacao(dotacao_row.chave_dotacao or chave_dotacao)
-                dotacao_row.valor_estorno = _dec_or_zero(est_sum)
-                dotacao_row.situacao = situacao
-                dotacao_row.valor_atual = (
-                    _dec_or_zero(dotacao_row.valor_dotacao)
-                    - _dec_or_zero(est_sum)
-                    - _dec_or_zero(ped_sum)
-                    - _dec_or_zero(emp_sum)
-                )
-                dotacao_row.alterado_em = _now_local()
-                db.session.commit()
-        except Exception:
-            db.session.rollback()
+    try:
+        dotacao_row = _dotacao_por_chave((row.get("chave_dotacao") or "").strip())
+        _sync_estornos_dotacao(dotacao_row, situacao)
+    except Exception:
+        db.session.rollback()
 
     return jsonify({"ok": True, "message": "Estorno atualizado."}), 200
 
@@ -2385,7 +2476,7 @@ def api_est_dotacao_delete(est_id):
     adj_id = row.get("adj_id")
     adj_nome = ""
     if adj_id:
-        adj_row = db.session.get(Perfil, adj_id)
+        adj_row = get_diretorio().perfil(adj_id)
         adj_nome = (adj_row.nome or "").strip() if adj_row else ""
     if not adj_nome or not perfil_usuario or perfil_usuario.lower() != adj_nome.lower():
         return jsonify({"error": "Usu\u00e1rio sem permiss\u00e3o para excluir o estorno atual."}), 403
@@ -2400,25 +2491,11 @@ def api_est_dotacao_delete(est_id):
         db.session.rollback()
         return jsonify({"error": f"Falha ao excluir estorno: {exc}"}), 500
 
-    chave_dotacao = (row.get("chave_dotacao") or "").strip()
-    if chave_dotacao:
-        try:
-            dotacao_row = Dotacao.query.filter(Dotacao.chave_dotacao == chave_dotacao).first()
-            if dotacao_row:
-                est_sum = _calc_estorno_sum_for_dotacao(chave_dotacao)
-                ped_sum = _calc_ped_sum_for_dotacao(dotacao_row.chave_dotacao or chave_dotacao)
-                emp_sum = _calc_emp_sum_for_dotacao(dotacao_row.chave_dotacao or chave_dotacao)
-                dotacao_row.valor_estorno = _dec_or_zero(est_sum)
-                dotacao_row.valor_atual = (
-                    _dec_or_zero(dotacao_row.valor_dotacao)
-                    - _dec_or_zero(est_sum)
-                    - _dec_or_zero(ped_sum)
-                    - _dec_or_zero(emp_sum)
-                )
-                dotacao_row.alterado_em = _now_local()
-                db.session.commit()
-        except Exception:
-            db.session.rollback()
+    try:
+        dotacao_row = _dotacao_por_chave((row.get("chave_dotacao") or "").strip())
+        _sync_estornos_dotacao(dotacao_row, None)
+    except Exception:
+        db.session.rollback()
 
     return jsonify({"ok": True, "message": "Estorno exclu\u00eddo."}), 200
 
@@ -2448,7 +2525,7 @@ def api_est_dotacao_aprovar(est_id):
     adj_id = row.get("adj_id")
     adj_nome = ""
     if adj_id:
-        adj_row = db.session.get(Perfil, adj_id)
+        adj_row = get_diretorio().perfil(adj_id)
         adj_nome = (adj_row.nome or "").strip() if adj_row else ""
     if not adj_nome or perfil_usuario.lower() != adj_nome.lower():
         return jsonify({"error": "Usu\u00e1rio sem permiss\u00e3o para aprovar o estorno atual."}), 403
@@ -2494,6 +2571,260 @@ def api_est_dotacao_aprovar(est_id):
     return jsonify({"ok": True, "message": "Estorno atualizado."}), 200
 
 
+def _sync_estornos_dotacoes(situacoes: dict[str, str | None]) -> None:
+    """_sync_estornos_dotacao para varias chaves DOT. (chave_norm -> situacao) de uma vez."""
+    sync_ledger((ORIGEM_ESTORNO,))
+    if not situacoes:
+        return
+    rows = {}
+    for row in Dotacao.query.filter(Dotacao.chave_norm.in_(list(situacoes))).order_by(Dotacao.id).all():
+        rows.setdefault(row.chave_norm, row)
+    agora = _now_local()
+    for key_norm, row in rows.items():
+        if situacoes[key_norm] is not None:
+            row.situacao = situacoes[key_norm]
+        row.alterado_em = agora
+    db.session.commit()
+    _schedule_post_ingest("dotacao")
+
+
+_EST_DOTACAO_LOTE_OBRIGATORIOS = (
+    "exercicio",
+    "adjunta",
+    "chave_planejamento",
+    "chave_dotacao",
+    "valor_dotacao",
+    "valor_a_ser_est",
+    "saldo_dotacao_apos",
+    "justificativa",
+    "situacao",
+)
+_EST_DOTACAO_LOTE_OPCIONAIS = (
+    "uo",
+    "programa",
+    "acao_paoe",
+    "produto",
+    "ug",
+    "regiao",
+    "subacao_entrega",
+    "etapa",
+    "natureza_despesa",
+    "elemento",
+    "subelemento",
+    "fonte",
+    "iduso",
+)
+
+
+@home_bp.route("/api/est-dotacao/lote", methods=["POST"])
+@login_required
+@require_feature("cadastrar/est-dotacao")
+def api_est_dotacao_create_lote():
+    """
+    Cadastro de varios estornos numa transacao (um INSERT em lote; um item
+    com erro cancela o lote). O ledger e as dotacoes afetadas sao
+    atualizados uma vez no fim.
+    """
+    itens, erro = _itens_lote(request.get_json(silent=True) or {})
+    if erro:
+        return erro
+    user_session = session.get("user") or {}
+    perfil_usuario = (user_session.get("perfil") or "").strip()
+    usuarios_id = _resolve_usuario_id()
+    if usuarios_id is None:
+        return jsonify({"error": "Usuário não encontrado."}), 400
+
+    diretorio = get_diretorio()
+    now = _now_local()
+    erros: list[tuple[int, str]] = []
+    params = []
+    situacoes: dict[str, str] = {}
+    for idx, item in enumerate(itens):
+        campos = {k: str(item.get(k) or "").strip() for k in _EST_DOTACAO_LOTE_OBRIGATORIOS}
+        missing = [k for k, v in campos.items() if not v]
+        if missing:
+            erros.append((idx, f"Campos obrigatórios ausentes: {', '.join(missing)}."))
+            continue
+        if not perfil_usuario or perfil_usuario.lower() != campos["adjunta"].lower():
+            erros.append((idx, "Usuário sem permissão de cadastrar estorno."))
+            continue
+        valor_dotacao = _parse_decimal(campos["valor_dotacao"])
+        valor_est = _parse_decimal(campos["valor_a_ser_est"])
+        saldo = _parse_decimal(campos["saldo_dotacao_apos"])
+        if valor_dotacao is None or valor_est is None or saldo is None:
+            erros.append((idx, "Valores monetários inválidos."))
+            continue
+        adj_row = diretorio.perfil_por_nome(campos["adjunta"])
+        if not adj_row:
+            erros.append((idx, "Adjunta Solicitante não encontrada."))
+            continue
+        campos.update({k: str(item.get(k) or "").strip() for k in _EST_DOTACAO_LOTE_OPCIONAIS})
+        campos.pop("adjunta")
+        campos.update(
+            {
+                "adj_id": adj_row.id,
+                **chave_norm_values(campos["chave_dotacao"], campos["chave_planejamento"]),
+                "valor_dotacao": valor_dotacao,
+                "valor_a_ser_est": valor_est,
+                "saldo_dotacao_apos": saldo,
+                "usuarios_id": usuarios_id,
+                "ativo": True,
+                "status_aprovacao": "Aguardando",
+                "aprovado_por": None,
+                "data_aprovacao": None,
+                "motivo_rejeicao": None,
+                "alterado_em": None,
+                "excluido_em": None,
+                "criado_em": now,
+            }
+        )
+        params.append(campos)
+        if campos["chave_norm"]:
+            situacoes[campos["chave_norm"]] = campos["situacao"]
+    if erros:
+        return _erro_lote(erros)
+
+    try:
+        db.session.execute(_EST_DOTACAO_INSERT, params)
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        return jsonify({"error": f"Falha ao salvar estornos: {exc}"}), 500
+
+    try:
+        _sync_estornos_dotacoes(situacoes)
+    except Exception:
+        db.session.rollback()
+
+    return jsonify({"ok": True, "message": f"{len(params)} estornos cadastrados."}), 201
+
+
+@home_bp.route("/api/est-dotacao/aprovar/lote", methods=["POST"])
+@login_required
+@require_feature("cadastrar/est-dotacao")
+def api_est_dotacao_aprovar_lote():
+    """
+    Aprovacao/rejeicao de varios estornos numa transacao. Cada item traz id,
+    estorno_aprovado e motivo_rejeicao; as regras sao as de
+    api_est_dotacao_aprovar e um item com erro cancela o lote.
+    """
+    itens, erro = _itens_lote(request.get_json(silent=True) or {})
+    if erro:
+        return erro
+    user_session = session.get("user") or {}
+    perfil_usuario = (user_session.get("perfil") or "").strip()
+    if not perfil_usuario:
+        return jsonify({"error": "Perfil do usuário não encontrado."}), 400
+    usuarios_id = _resolve_usuario_id()
+    if usuarios_id is None:
+        return jsonify({"error": "Usuário não encontrado."}), 400
+
+    ids = set()
+    for item in itens:
+        try:
+            ids.add(int(item.get("id")))
+        except (TypeError, ValueError):
+            pass
+    rows = {}
+    if ids:
+        rows = {
+            int(row["id"]): row
+            for row in db.session.execute(
+                text("SELECT id, ativo, status_aprovacao, adj_id FROM est_dotacao WHERE id IN :ids").bindparams(
+                    bindparam("ids", expanding=True)
+                ),
+                {"ids": sorted(ids)},
+            ).mappings()
+        }
+    perfis = get_diretorio().perfil_nomes
+    erros: list[tuple[int, str]] = []
+    params = []
+    vistos = set()
+    agora = _now_local()
+    for idx, item in enumerate(itens):
+        try:
+            row = rows.get(int(item.get("id")))
+        except (TypeError, ValueError):
+            row = None
+        if not row:
+            erros.append((idx, "Estorno não encontrado."))
+            continue
+        if row["id"] in vistos:
+            erros.append((idx, "Estorno repetido no lote."))
+            continue
+        vistos.add(row["id"])
+        if row.get("ativo") is not None and int(row.get("ativo") or 0) != 1:
+            erros.append((idx, "Estorno inativo."))
+            continue
+        status_atual = str(row.get("status_aprovacao") or "").strip().lower()
+        if status_atual and status_atual != "aguardando":
+            erros.append((idx, "Estorno já foi processado."))
+            continue
+        adj_nome = (perfis.get(row.get("adj_id")) or "").strip()
+        if not adj_nome or perfil_usuario.lower() != adj_nome.lower():
+            erros.append((idx, "Usuário sem permissão para aprovar o estorno atual."))
+            continue
+        motivo = str(item.get("motivo_rejeicao") or "").strip()
+        if not motivo:
+            erros.append((idx, "Justificativa obrigatória."))
+            continue
+        aprovado = str(item.get("estorno_aprovado") or "").strip().lower() == "sim"
+        params.append(
+            {
+                "status": "Aprovado" if aprovado else "Rejeitado",
+                "aprovado_por": str(usuarios_id),
+                "data_aprovacao": agora,
+                "motivo": motivo,
+                "alterado_em": agora,
+                "id": row["id"],
+            }
+        )
+    if erros:
+        return _erro_lote(erros)
+
+    try:
+        db.session.execute(
+            text(
+                """
+                UPDATE est_dotacao
+                SET status_aprovacao = :status,
+                    aprovado_por = :aprovado_por,
+                    data_aprovacao = :data_aprovacao,
+                    motivo_rejeicao = :motivo,
+                    alterado_em = :alterado_em
+                WHERE id = :id
+                """
+            ),
+            params,
+        )
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        return jsonify({"error": f"Falha ao aprovar estornos: {exc}"}), 500
+
+    return jsonify({"ok": True, "message": f"{len(params)} estornos atualizados."}), 200
+
+
+def _saldo_chave_field(exercicio, chave_planejamento) -> str:
+    """Coluna de PED/EMP comparada com a chave de planejamento no saldo."""
+
+    def _count_chave_parts(value: str) -> int:
+        if not value:
+            return 0
+        return len([p for p in str(value).split("*") if p.strip()])
+
+    try:
+        exercicio_int = int(str(exercicio).split(".")[0])
+    except ValueError:
+        exercicio_int = None
+    chave_parts = _count_chave_parts(chave_planejamento)
+    if exercicio_int and exercicio_int <= 2025:
+        return "chave_planejamento"
+    if chave_parts >= 8:
+        return "chave_planejamento"
+    return "chave"
+
+
 def _calc_dotacao_saldo(
     exercicio,
     programa,
@@ -2510,6 +2841,7 @@ def _calc_dotacao_saldo(
     fonte,
     iduso,
     chave_planejamento,
+    est_map: dict[str, Decimal] | None = None,
 ):
     if not exercicio or not chave_planejamento:
         return {
@@ -2614,7 +2946,8 @@ def _calc_dotacao_saldo(
         .filter(*dot_filters)
         .all()
     )
-    est_map, _ = _build_estorno_maps()
+    if est_map is None:
+        est_map, _ = _build_estorno_maps()
 
     if subacao_entrega:
         subacao_norm = _normalize_chave(subacao_entrega)
@@ -2635,28 +2968,11 @@ def _calc_dotacao_saldo(
     )
     valor_dotacao = _dec_or_zero(valor_dotacao)
 
-    def _count_chave_parts(value: str) -> int:
-        if not value:
-            return 0
-        return len([p for p in str(value).split("*") if p.strip()])
-
     programa_key = _normalize_codigo_num(programa)
     acao_paoe_key = _normalize_codigo_num(acao_paoe)
     ug_norm = _normalize_ug(ug)
     uo_norm = _normalize_uo(uo)
-    try:
-        exercicio_int = int(str(exercicio).split(".")[0])
-    except ValueError:
-        exercicio_int = None
-    chave_parts = _count_chave_parts(chave_planejamento)
-    if exercicio_int and exercicio_int <= 2025:
-        chave_field = "chave_planejamento"
-    elif chave_parts >= 8:
-        chave_field = "chave_planejamento"
-    elif chave_parts == 4:
-        chave_field = "chave"
-    else:
-        chave_field = "chave"
+    chave_field = _saldo_chave_field(exercicio, chave_planejamento)
     chave_norm = _normalize_chave(chave_planejamento)
 
     ped_base_common = [PedRegistro.ativo == True]  # noqa: E712
@@ -2734,7 +3050,7 @@ def _calc_dotacao_saldo(
             ped_base.append(PedRegistro.chave == chave_planejamento)
     ped_rows = (
         PedRegistro.query.with_entities(
-            PedRegistro.valor_ped, PedRegistro.chave_planejamento, PedRegistro.chave
+            PedRegistro.id, PedRegistro.valor_ped, PedRegistro.chave_planejamento, PedRegistro.chave
         )
         .filter(*ped_base)
         .all()
@@ -2742,7 +3058,7 @@ def _calc_dotacao_saldo(
     if not ped_rows and chave_planejamento:
         ped_rows = (
             PedRegistro.query.with_entities(
-                PedRegistro.valor_ped, PedRegistro.chave_planejamento, PedRegistro.chave
+                PedRegistro.id, PedRegistro.valor_ped, PedRegistro.chave_planejamento, PedRegistro.chave
             )
             .filter(*ped_base_common)
             .all()
@@ -2848,59 +3164,469 @@ def _calc_dotacao_saldo(
     }
 
 
-@home_bp.route("/api/dotacao/saldo", methods=["GET"])
-@login_required
-@require_feature("cadastrar/dotacao")
-def api_dotacao_saldo():
-    exercicio = (request.args.get("exercicio") or "").strip()
-    programa = (request.args.get("programa") or "").strip()
-    acao_paoe = (request.args.get("acao_paoe") or "").strip()
-    produto = (request.args.get("produto") or "").strip()
-    ug = (request.args.get("ug") or "").strip()
-    uo = (request.args.get("uo") or "").strip()
-    regiao = (request.args.get("regiao") or "").strip()
-    subacao_entrega = (request.args.get("subacao_entrega") or "").strip()
-    etapa = (request.args.get("etapa") or "").strip()
-    natureza = (request.args.get("natureza_despesa") or "").strip()
-    elemento = (request.args.get("elemento") or "").strip()
-    subelemento = (request.args.get("subelemento") or "").strip()
-    fonte = (request.args.get("fonte") or "").strip()
-    iduso = (request.args.get("iduso") or "").strip()
-    chave_planejamento = (request.args.get("chave_planejamento") or "").strip()
-
-    result = _calc_dotacao_saldo(
+# Parametro da API -> filtro do saldo (argumentos de _calc_dotacao_saldo).
+_SALDO_PARAMS = {
+    "programa": "programa",
+    "acao_paoe": "acao_paoe",
+    "produto": "produto",
+    "ug": "ug",
+    "uo": "uo",
+    "regiao": "regiao",
+    "subacao_entrega": "subacao_entrega",
+    "etapa": "etapa",
+    "natureza_despesa": "natureza",
+    "elemento": "elemento",
+    "subelemento": "subelemento",
+    "fonte": "fonte",
+    "iduso": "iduso",
+}
+
+
+def _saldo_params(dados) -> tuple[str, str, dict[str, str]]:
+    """(exercicio, chave_planejamento, filtros) a partir dos args ou de um item do lote."""
+    exercicio = str(dados.get("exercicio") or "").strip()
+    chave_planejamento = str(dados.get("chave_planejamento") or "").strip()
+    filtros = {filtro: str(dados.get(param) or "").strip() for param, filtro in _SALDO_PARAMS.items()}
+    return exercicio, chave_planejamento, filtros
+
+
+def _calc_saldo_filtros(exercicio: str, chave_planejamento: str, filtros: dict[str, str], est_map=None):
+    return _calc_dotacao_saldo(
         exercicio,
-        programa,
-        acao_paoe,
-        produto,
-        ug,
-        uo,
-        regiao,
-        subacao_entrega,
-        etapa,
-        natureza,
-        elemento,
-        subelemento,
-        fonte,
-        iduso,
+        filtros["programa"],
+        filtros["acao_paoe"],
+        filtros["produto"],
+        filtros["ug"],
+        filtros["uo"],
+        filtros["regiao"],
+        filtros["subacao_entrega"],
+        filtros["etapa"],
+        filtros["natureza"],
+        filtros["elemento"],
+        filtros["subelemento"],
+        filtros["fonte"],
+        filtros["iduso"],
         chave_planejamento,
+        est_map=est_map,
     )
 
-    return jsonify(
-        {
-            "saldo": float(result["saldo"]),
-            "valor_atual": float(result["valor_atual"]),
-            "valor_dotacao": float(result["valor_dotacao"]),
-            "valor_ped": float(result["valor_ped"]),
-            "valor_emp_liquido": float(result["valor_emp_liquido"]),
-            "plan21_count": result["plan21_count"],
-            "dotacao_count": result["dotacao_count"],
-            "ped_count": result["ped_count"],
-            "emp_count": result["emp_count"],
-        }
+# Filtro do saldo -> coluna do plan21 e da dotacao (mesmas condicoes de _calc_dotacao_saldo).
+_PLAN21_SALDO_FILTROS = {
+    "programa": "programa",
+    "acao_paoe": "acao_paoe",
+    "produto": "produto",
+    "ug": "ug",
+    "uo": "uo",
+    "regiao": "regiao_etapa",
+    "subacao_entrega": "subacao_entrega",
+    "etapa": "etapa",
+    "natureza": "natureza",
+    "elemento": "elemento",
+    "subelemento": "subelemento",
+    "fonte": "fonte",
+    "iduso": "idu",
+}
+_DOTACAO_SALDO_FILTROS = {
+    "programa": "programa",
+    "acao_paoe": "acao_paoe",
+    "produto": "produto",
+    "ug": "ug",
+    "etapa": "etapa",
+    "natureza": "natureza_despesa",
+    "uo": "uo",
+    "regiao": "regiao",
+    "elemento": "elemento",
+    "subelemento": "subelemento",
+    "fonte": "fonte",
+    "iduso": "iduso",
+}
+# Colunas de PED/EMP lidas para o saldo em lote.
+_REGISTRO_SALDO_COLS = (
+    "chave",
+    "chave_planejamento",
+    "chave_norm",
+    "programa_governo",
+    "paoe",
+    "fonte",
+    "iduso",
+    "elemento",
+    "uo",
+    "subfuncao_ug",
+    "regiao",
+)
+
+
+def _sql_igual(valor, filtro) -> bool:
+    """Igualdade como a do banco (collation sem caixa, espacos finais nao contam)."""
+    return valor is not None and str(valor).rstrip().casefold() == str(filtro).rstrip().casefold()
+
+
+def _linha_atende(row, filtros: dict[str, str], colunas: dict[str, str]) -> bool:
+    for filtro, coluna in colunas.items():
+        valor = filtros.get(filtro)
+        if not valor:
+            continue
+        atual = getattr(row, coluna)
+        if filtro == "natureza":
+            if atual is None or not str(atual).casefold().startswith(valor.casefold()):
+                return False
+        elif not _sql_igual(atual, valor):
+            return False
+    return True
+
+
+def _filtros_dotacao(filtros: dict[str, str]) -> dict[str, str]:
+    """Filtros do saldo aplicados a dotacao, onde o elemento e inteiro."""
+    try:
+        elemento = str(int(filtros["elemento"])) if filtros["elemento"] else ""
+    except ValueError:
+        elemento = ""
+    return {**filtros, "elemento": elemento}
+
+
+def _dotacao_contada(row, chave_planejamento: str, filtros_dot: dict[str, str]) -> bool:
+    """Dotacao do exercicio contada no saldo da combinacao (dotacao_count)."""
+    return _sql_igual(row.chave_planejamento, chave_planejamento) and _linha_atende(
+        row, filtros_dot, _DOTACAO_SALDO_FILTROS
+    )
+
+
+def _dotacao_somada(row, filtros: dict[str, str]) -> bool:
+    """Dotacao contada que tambem entra no valor_dotacao: mesma subacao, quando filtrada."""
+    subacao = filtros["subacao_entrega"]
+    return not subacao or _normalize_chave(row.subacao_entrega) == _normalize_chave(subacao)
+
+
+def _dotacao_no_saldo(row, exercicio: str, chave_planejamento: str, filtros: dict[str, str]) -> bool:
+    """Dotacao que _calc_saldos_lote soma no saldo da combinacao."""
+    return (
+        _sql_igual(row.exercicio, exercicio)
+        and _dotacao_contada(row, chave_planejamento, _filtros_dotacao(filtros))
+        and _dotacao_somada(row, filtros)
     )
 
 
+def _filtros_registro(filtros: dict[str, str]) -> dict:
+    """Filtros de PED/EMP ja normalizados como em _calc_dotacao_saldo."""
+    regiao = filtros["regiao"]
+    regiao_key = _normalize_codigo_num(regiao) if regiao else ""
+    return {
+        "programa_governo": _normalize_codigo_num(filtros["programa"]),
+        "paoe": _normalize_codigo_num(filtros["acao_paoe"]),
+        "fonte": filtros["fonte"],
+        "iduso": _iduso_variants(filtros["iduso"]) if filtros["iduso"] else [],
+        "elemento": filtros["elemento"],
+        "uo": _normalize_uo(filtros["uo"]),
+        "ug": _normalize_ug(filtros["ug"]),
+        "regiao": [regiao, regiao_key, f"R{regiao_key}"] if regiao_key else [regiao] if regiao else [],
+    }
+
+
+def _registro_atende(row, reg: dict) -> bool:
+    for coluna in ("programa_governo", "paoe", "fonte", "elemento", "uo"):
+        if reg[coluna] and not _sql_igual(getattr(row, coluna), reg[coluna]):
+            return False
+    for coluna in ("iduso", "regiao"):
+        if reg[coluna] and not any(_sql_igual(getattr(row, coluna), v) for v in reg[coluna]):
+            return False
+    if reg["ug"]:
+        ug = row.subfuncao_ug
+        if ug is None or not str(ug).casefold().endswith(f".{reg['ug']}".casefold()):
+            return False
+    return True
+
+
+def _em_blocos(chaves, consulta) -> list:
+    chaves = sorted(chaves)
+    linhas = []
+    for i in range(0, len(chaves), SALDO_LOTE_CHUNK):
+        linhas.extend(consulta(chaves[i : i + SALDO_LOTE_CHUNK]))
+    return linhas
+
+
+class _SaldoRegistros:
+    """
+    Linhas ativas de PED ou EMP de um lote de saldos: as das chaves do lote,
+    as das chaves DOT. das dotacoes e, so quando algum fallback precisa, o
+    exercicio inteiro (lido uma vez por lote).
+    """
+
+    def __init__(self, model, *valores):
+        self.model = model
+        self.colunas = [model.id, *valores, *(getattr(model, c) for c in _REGISTRO_SALDO_COLS)]
+        self._exercicios: dict[str, list] = {}
+
+    def _consulta(self, *filtros) -> list:
+        return self.model.query.with_entities(*self.colunas).filter(self.model.ativo == True, *filtros).all()  # noqa: E712
+
+    def por_chave(self, exercicio: str, chaves) -> list:
+        # Dois IN de SALDO_LOTE_CHUNK por consulta (MSSQL: no maximo 2100 parametros).
+        linhas = _em_blocos(
+            chaves,
+            lambda bloco: self._consulta(
+                self.model.exercicio == exercicio,
+                or_(self.model.chave.in_(bloco), self.model.chave_planejamento.in_(bloco)),
+            ),
+        )
+        return list({row.id: row for row in linhas}.values())
+
+    def exercicio(self, exercicio: str) -> list:
+        if exercicio not in self._exercicios:
+            self._exercicios[exercicio] = self._consulta(self.model.exercicio == exercicio)
+        return self._exercicios[exercicio]
+
+    def por_dotacao(self, chaves) -> dict[str, dict]:
+        por_chave: dict[str, dict] = {}
+        for row in _em_blocos(chaves, lambda bloco: self._consulta(self.model.chave_norm.in_(bloco))):
+            por_chave.setdefault(row.chave_norm, {})[row.id] = row
+        return por_chave
+
+    def do_plano(self, linhas_chave: list, exercicio: str, chave_planejamento: str, reg: dict) -> list:
+        """Linhas da chave como em _calc_dotacao_saldo: coluna exata ou, sem nenhuma, normalizada."""
+        chave_field = _saldo_chave_field(exercicio, chave_planejamento)
+        chave_norm = _normalize_chave(chave_planejamento)
+        linhas = [
+            row
+            for row in linhas_chave
+            if _sql_igual(getattr(row, chave_field), chave_planejamento) and _registro_atende(row, reg)
+        ]
+        if not linhas:
+            linhas = [row for row in self.exercicio(exercicio) if _registro_atende(row, reg)]
+        return [row for row in linhas if _normalize_chave(getattr(row, chave_field)) == chave_norm]
+
+
+def _calc_saldos_lote(combinacoes: list[tuple[str, str, dict[str, str]]], est_map=None) -> list[dict]:
+    """
+    _calc_dotacao_saldo de varias combinacoes com consultas compartilhadas:
+    plan21 agrupado pelas colunas de filtro e as linhas de dotacao, PED e EMP
+    das chaves do lote lidas uma vez por exercicio (e por bloco de chaves).
+    Cada combinacao e resolvida em memoria com os mesmos filtros e fallbacks;
+    o resultado vem na ordem das combinacoes.
+    """
+    if est_map is None:
+        est_map, _ = _build_estorno_maps()
+    por_exercicio: dict[str, set[str]] = {}
+    for exercicio, chave_planejamento, _ in combinacoes:
+        if exercicio and chave_planejamento:
+            por_exercicio.setdefault(exercicio, set()).add(chave_planejamento)
+
+    plan21_cols = [getattr(Plan21Nger, c) for c in (*_PLAN21_SALDO_FILTROS.values(), "chave_planejamento")]
+    dot_cols = [getattr(Dotacao, c) for c in _DOTACAO_SALDO_FILTROS.values()] + [
+        Dotacao.chave_planejamento,
+        Dotacao.subacao_entrega,
+        Dotacao.chave_dotacao,
+        Dotacao.valor_dotacao,
+        Dotacao.valor_atual,
+        Dotacao.valor_estorno,
+        Dotacao.valor_ped_emp,
+    ]
+    ped = _SaldoRegistros(PedRegistro, PedRegistro.valor_ped)
+    emp = _SaldoRegistros(EmpRegistro, EmpRegistro.numero_emp, EmpRegistro.valor_emp_devolucao_gcv)
+    plan21, dotacoes, ped_chave, emp_chave = {}, {}, {}, {}
+    for exercicio, chaves in por_exercicio.items():
+        plan21[exercicio] = _em_blocos(
+            chaves,
+            lambda bloco: db.session.query(
+                *plan21_cols,
+                func.count(Plan21Nger.id).label("qtd"),
+                func.coalesce(func.sum(Plan21Nger.valor_atual), 0).label("total"),
+            )
+            .filter(
+                Plan21Nger.ativo == True,  # noqa: E712
+                Plan21Nger.exercicio == exercicio,
+                Plan21Nger.chave_planejamento.in_(bloco),
+            )
+            .group_by(*plan21_cols)
+            .all(),
+        )
+        dotacoes[exercicio] = _em_blocos(
+            chaves,
+            lambda bloco: Dotacao.query.with_entities(*dot_cols)
+            .filter(
+                Dotacao.ativo == True,  # noqa: E712
+                Dotacao.exercicio == exercicio,
+                Dotacao.chave_planejamento.in_(bloco),
+            )
+            .all(),
+        )
+        ped_chave[exercicio] = ped.por_chave(exercicio, chaves)
+        emp_chave[exercicio] = emp.por_chave(exercicio, chaves)
+
+    parciais = []
+    for exercicio, chave_planejamento, filtros in combinacoes:
+        if not exercicio or not chave_planejamento:
+            parciais.append(None)
+            continue
+        grupos = [
+            g
+            for g in plan21[exercicio]
+            if _sql_igual(g.chave_planejamento, chave_planejamento) and _linha_atende(g, filtros, _PLAN21_SALDO_FILTROS)
+        ]
+        filtros_dot = _filtros_dotacao(filtros)
+        dots = [r for r in dotacoes[exercicio] if _dotacao_contada(r, chave_planejamento, filtros_dot)]
+        dotacao_count = len(dots)
+        dots = [r for r in dots if _dotacao_somada(r, filtros)]
+        valor_dotacao = sum(
+            (
+                _dec_or_zero(
+                    r.valor_atual
+                    if r.valor_atual is not None
+                    else _dec_or_zero(r.valor_dotacao)
+                    - _dec_or_zero(est_map.get(_normalize_dotacao_key(r.chave_dotacao), r.valor_estorno))
+                    - _dec_or_zero(r.valor_ped_emp)
+                )
+                for r in dots
+            ),
+            Decimal("0"),
+        )
+        dotacao_keys = {
+            _normalize_dotacao_key(r.chave_dotacao) for r in dots if _normalize_dotacao_key(r.chave_dotacao)
+        }
+        parciais.append(
+            {
+                "valor_atual": _dec_or_zero(sum((_dec_or_zero(g.total) for g in grupos), Decimal("0"))),
+                "plan21_count": sum(int(g.qtd or 0) for g in grupos),
+                "valor_dotacao": _dec_or_zero(valor_dotacao),
+                "dotacao_count": dotacao_count,
+                "_keys": dotacao_keys,
+            }
+        )
+
+    todas_keys = set().union(*(p["_keys"] for p in parciais if p)) if parciais else set()
+    ped_dot = ped.por_dotacao(todas_keys)
+    emp_dot = emp.por_dotacao(todas_keys)
+
+    resultados = []
+    for (exercicio, chave_planejamento, filtros), parcial in zip(combinacoes, parciais):
+        if parcial is None:
+            resultados.append(saldo_zerado())
+            continue
+        dotacao_keys = parcial.pop("_keys")
+        reg = _filtros_registro(filtros)
+        chave_norm = _normalize_chave(chave_planejamento)
+
+        merged: dict[int, Decimal] = {}
+        for key in dotacao_keys:
+            merged.update({row_id: _dec_or_zero(row.valor_ped) for row_id, row in ped_dot.get(key, {}).items()})
+        for row in ped.do_plano(ped_chave[exercicio], exercicio, chave_planejamento, reg):
+            merged.setdefault(row.id, _dec_or_zero(row.valor_ped))
+        if not merged:
+            merged = {
+                row.id: _dec_or_zero(row.valor_ped)
+                for row in ped.exercicio(exercicio)
+                if _normalize_chave(row.chave_planejamento) == chave_norm or _normalize_chave(row.chave) == chave_norm
+            }
+
+        merged_emp: dict[int, tuple[Decimal, str]] = {}
+        for key in dotacao_keys:
+            merged_emp.update(
+                {
+                    row_id: (_dec_or_zero(row.valor_emp_devolucao_gcv), row.numero_emp or "")
+                    for row_id, row in emp_dot.get(key, {}).items()
+                }
+            )
+        for row in emp.do_plano(emp_chave[exercicio], exercicio, chave_planejamento, reg):
+            merged_emp.setdefault(row.id, (_dec_or_zero(row.valor_emp_devolucao_gcv), row.numero_emp or ""))
+
+        result = dict(parcial)
+        result["valor_ped"] = sum(merged.values(), Decimal("0"))
+        result["ped_count"] = len(merged)
+        result["valor_emp_liquido"] = sum((v for v, _ in merged_emp.values()), Decimal("0"))
+        result["emp_count"] = len({n for _, n in merged_emp.values() if n})
+        result["saldo"] = (
+            result["valor_atual"] - result["valor_dotacao"] - result["valor_ped"] - result["valor_emp_liquido"]
+        )
+        resultados.append(result)
+    return resultados
+
+
+def _saldo_payload(result: dict) -> dict:
+    payload = {campo: float(result[campo]) for campo in SALDO_CAMPOS if campo.startswith(("saldo", "valor_"))}
+    payload.update({campo: result[campo] for campo in SALDO_CAMPOS if campo.endswith("_count")})
+    return payload
+
+
+def _saldos_dotacao(combinacoes: list[tuple[str, str, dict[str, str]]], gravar: bool = True) -> list[dict]:
+    """Saldos pela tabela saldo_dotacao; so as combinacoes invalidadas passam por _calc_saldos_lote."""
+    return saldos(combinacoes, _calc_saldos_lote, gravar=gravar)
+
+
+def atualizar_saldos_dotacao(todas: bool = False) -> dict:
+    """Passos saldo_dotacao/saldo_dotacao_pendentes do pos-ingestao (services/post_ingest.py)."""
+    return atualizar_saldos(_calc_saldos_lote, todas=todas)
+
+
+def _verificacao_saldo(item: dict, exercicio: str, chave_planejamento: str, filtros: dict[str, str], est_map=None):
+    """Confere o saldo servido com _calc_dotacao_saldo (consulta direta, sem a tabela)."""
+    calculado = _saldo_payload(_calc_saldo_filtros(exercicio, chave_planejamento, filtros, est_map=est_map))
+    divergencias = {
+        campo: {"tabela": item[campo], "calculado": valor}
+        for campo, valor in calculado.items()
+        if round(valor, 2) != round(item[campo], 2)
+    }
+    return {"ok": not divergencias, "divergencias": divergencias}
+
+
+@home_bp.route("/api/dotacao/saldo", methods=["GET"])
+@login_required
+@require_feature("cadastrar/dotacao")
+def api_dotacao_saldo():
+    """Saldo da combinacao pela tabela saldo_dotacao; verificar=1 confere com _calc_dotacao_saldo."""
+    combinacao = _saldo_params(request.args)
+    payload = _saldo_payload(_saldos_dotacao([combinacao])[0])
+    if request.args.get("verificar") == "1":
+        payload["verificacao"] = _verificacao_saldo(payload, *combinacao)
+    return jsonify(payload)
+
+
+def _expandir_filtro_saldo(filtro: dict) -> list[tuple[str, str, dict[str, str]]]:
+    """Uma combinacao por chave do plan21 que atende o filtro parcial (exercicio padrao: ano atual)."""
+    exercicio, _, filtros = _saldo_params(filtro)
+    selected = {campo: str(filtro.get(campo) or "").strip() for campo in FACET_FIELDS}
+    selected["exercicio"] = exercicio or str(_now_local().year)
+    chaves = get_plan21_index().filtrar("chave_planejamento", selected)
+    return [(selected["exercicio"], chave, filtros) for chave in sorted(chaves, key=str.lower)]
+
+
+@home_bp.route("/api/dotacao/saldo/lote", methods=["POST"])
+@login_required
+@require_feature("cadastrar/dotacao")
+def api_dotacao_saldo_lote():
+    """
+    Saldo de varias combinacoes numa chamada. "combinacoes" traz itens com os
+    mesmos campos de /api/dotacao/saldo; "filtro" (parcial) vira uma
+    combinacao por chave do plan21 que o atende. Tudo sai da tabela
+    saldo_dotacao (as invalidadas sao recalculadas juntas por
+    _calc_saldos_lote); "verificar": true confere cada item com
+    _calc_dotacao_saldo.
+    """
+    data = request.get_json(silent=True) or {}
+    combinacoes = [_saldo_params(item) for item in data.get("combinacoes") or [] if isinstance(item, dict)]
+    if isinstance(data.get("filtro"), dict):
+        combinacoes.extend(_expandir_filtro_saldo(data["filtro"]))
+    vistos = {}
+    for combinacao in combinacoes:
+        exercicio, chave_planejamento, filtros = combinacao
+        vistos.setdefault((exercicio, chave_planejamento, tuple(filtros.values())), combinacao)
+    combinacoes = list(vistos.values())
+    if not combinacoes:
+        return jsonify({"error": "Informe combinacoes ou filtro."}), 400
+    if len(combinacoes) > SALDO_LOTE_MAX:
+        return jsonify({"error": f"Maximo de {SALDO_LOTE_MAX} combinacoes por chamada."}), 400
+
+    verificar = data.get("verificar") is True
+    est_map = _build_estorno_maps()[0] if verificar else None
+    itens = []
+    for (exercicio, chave_planejamento, filtros), result in zip(combinacoes, _saldos_dotacao(combinacoes)):
+        item = {"exercicio": exercicio, "chave_planejamento": chave_planejamento}
+        item.update({param: filtros[f] for param, f in _SALDO_PARAMS.items() if filtros[f]})
+        item.update(_saldo_payload(result))
+        if verificar:
+            item["verificacao"] = _verificacao_saldo(item, exercicio, chave_planejamento, filtros, est_map)
+        itens.append(item)
+    return jsonify({"itens": itens, "total": len(itens)})
+
+
 @home_bp.route("/api/fip613/status", methods=["GET"])
 @login_required
 @require_feature("atualizar/fip613")
@@ -2932,6 +3658,7 @@ def api_fip613_status():
                 "data_arquivo": _as_iso(last.data_arquivo),
                 "original_filename": last.original_filename,
                 "output_filename": last.output_filename,
+                **_job_status_fields("fip613", last.id),
             },
         }
     )
@@ -2980,11 +3707,20 @@ def api_fip613_upload():
         )
         db.session.add(registro)
         db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        return jsonify({"error": f"Falha ao processar: {exc}"}), 500
+    return _processar_fip613(registro, save_path)
+
 
-        total, output_path = run_fip613(save_path, data_arquivo, user_email, registro.id)
+def _processar_fip613(registro, file_path: Path):
+    """Roda o job do upload (novo ou retomado) e responde como o upload."""
+    try:
+        total, output_path = run_fip613(file_path, registro.data_arquivo, registro.user_email, registro.id)
 
         registro.output_filename = str(output_path.name)
         db.session.commit()
+        _schedule_post_ingest("fip613")
 
         return jsonify(
             {
@@ -2993,14 +3729,121 @@ def api_fip613_upload():
                 "output": output_path.name,
             }
         )
+    except JobCancelado:
+        db.session.rollback()
+        return jsonify({"error": "Processamento cancelado pelo usuario."}), 409
     except Exception as exc:
         db.session.rollback()
-        return jsonify({"error": f"Falha ao processar: {exc}"}), 500
+        return _falha_upload("fip613", registro.id, exc)
+
+
+@home_bp.route("/api/fip613/retomar", methods=["POST"])
+@login_required
+@require_feature("atualizar/fip613")
+def api_fip613_retomar():
+    """Retoma o job FIP 613 interrompido a partir dos lotes ja confirmados."""
+    registro, file_path, erro = _upload_para_retomar("fip613", Fip613Upload, UPLOAD_DIR)
+    if erro:
+        return erro
+    return _processar_fip613(registro, file_path)
+
+
+@home_bp.route("/api/fip613/cancel", methods=["POST"])
+@login_required
+@require_feature("atualizar/fip613")
+def api_fip613_cancel():
+    return _request_cancel("fip613", Fip613Upload)
+
+
+@home_bp.route("/api/fip613/status/stream", methods=["GET"])
+@login_required
+@require_feature("atualizar/fip613")
+def api_fip613_status_stream():
+    return _status_stream("fip613", None, follow=True)
+
+
+def _relatorio_resposta(spec, meta: dict):
+    """
+    Resposta dos relatorios: pagina por keyset com filtros/ordem/colunas
+    (services/relatorio_consulta.py) ou, com ?completo=1, a tabela inteira
+    em streaming (memoria limitada a um lote de linhas). formato=colunar
+    troca a lista de objetos por colunas + arrays de valores.
+    """
+    completo = (request.args.get("completo") or "").strip().lower() in ("1", "true", "sim")
+    try:
+        formato = formato_pedido(request.args)
+        if completo:
+            colunas = colunas_pedidas(spec, request.args)
+        else:
+            consulta = parse_consulta(spec, request.args)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    if not completo:
+        resultado = consultar(spec, consulta)
+        if formato == "colunar":
+            resultado = para_colunar(spec, resultado)
+        return jsonify({"ok": True, **resultado, **meta})
+
+    lotes = linhas_completo(spec, colunas)
+    cabecalho = {"ok": True, **meta}
+    dumps = current_app.json.dumps
+    if formato == "colunar":
+        codificador = CodificadorColunar(spec, colunas)
+        corpo = json_stream(
+            ([codificador.linha(r) for r in lote] for lote in lotes),
+            {**cabecalho, **codificador.cabecalho()},
+            dumps,
+            chave="linhas",
+            rodape=lambda: {"dicionarios": codificador.dicionarios()},
+        )
+    else:
+        corpo = json_stream(lotes, cabecalho, dumps)
+    return Response(stream_with_context(corpo), mimetype="application/json")
+
+
+# Relatorio na URL -> (spec, feature exigida).
+_RELATORIOS_AGREGADO = {
+    "fip613": (RELATORIO_FIP613, "relatorios/fip613"),
+    "ped": (RELATORIO_PED, "relatorios/ped"),
+    "emp": (RELATORIO_EMP, "relatorios/emp"),
+    "est-emp": (RELATORIO_EST_EMP, "relatorios/est-emp"),
+    "nob": (RELATORIO_NOB, "relatorios/nob"),
+    "plan20-seduc": (RELATORIO_PLAN20, "relatorios/plan20-seduc"),
+}
+
+
+@home_bp.route("/api/relatorios/<relatorio>/agregado", methods=["GET"])
+@login_required
+def api_relatorio_agregado(relatorio):
+    """
+    Totais, grupos (agrupar=uo,fonte) e valores distintos dos filtros
+    (distintos=exercicio,uo) calculados no banco, com os filtros da consulta
+    paginada. Dispensa carregar as linhas so para totalizar.
+    """
+    if relatorio not in _RELATORIOS_AGREGADO:
+        abort(404)
+    spec, feature = _RELATORIOS_AGREGADO[relatorio]
+    if not has_permission(feature):
+        abort(403)
+
+    def _gerar():
+        try:
+            agregacao = parse_agregacao(spec, request.args)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        try:
+            return jsonify({"ok": True, **agregar(spec, agregacao)})
+        except Exception as exc:
+            db.session.rollback()
+            return jsonify({"error": f"Falha ao agregar dados: {exc}"}), 500
+
+    return resposta_cacheada(spec.dataset, _gerar)
 
 
 @home_bp.route("/api/relatorios/fip613", methods=["GET"])
 @login_required
 @require_feature("relatorios/fip613")
+@cache_relatorio("fip613")
 def api_relatorio_fip613():
     def _as_iso(value):
         if not value:
@@ -3015,140 +3858,58 @@ def api_relatorio_fip613():
             return str(value)
 
     try:
-        rows = Fip613Registro.query.filter_by(ativo=True).all()
         last_upload = Fip613Upload.query.order_by(Fip613Upload.uploaded_at.desc()).first()
         data_arquivo = _as_iso(last_upload.data_arquivo) if last_upload else None
         uploaded_at = _as_iso(last_upload.uploaded_at) if last_upload else None
         user_email = last_upload.user_email if last_upload else None
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "uo": r.uo,
-                    "ug": r.ug,
-                    "funcao": r.funcao,
-                    "subfuncao": r.subfuncao,
-                    "programa": r.programa,
-                    "projeto_atividade": r.projeto_atividade,
-                    "regional": r.regional,
-                    "natureza_despesa": str(r.natureza_despesa or ""),
-                    "fonte_recurso": str(r.fonte_recurso or ""),
-                    "iduso": r.iduso,
-                    "tipo_recurso": r.tipo_recurso,
-                    "dotacao_inicial": float(r.dotacao_inicial or 0),
-                    "cred_suplementar": float(r.cred_suplementar or 0),
-                    "cred_especial": float(r.cred_especial or 0),
-                    "cred_extraordinario": float(r.cred_extraordinario or 0),
-                    "reducao": float(r.reducao or 0),
-                    "cred_autorizado": float(r.cred_autorizado or 0),
-                    "bloqueado_conting": float(r.bloqueado_conting or 0),
-                    "reserva_empenho": float(r.reserva_empenho or 0),
-                    "saldo_destaque": float(r.saldo_destaque or 0),
-                    "saldo_dotacao": float(r.saldo_dotacao or 0),
-                    "empenhado": float(r.empenhado or 0),
-                    "liquidado": float(r.liquidado or 0),
-                    "a_liquidar": float(r.a_liquidar or 0),
-                    "valor_pago": float(r.valor_pago or 0),
-                    "valor_a_pagar": float(r.valor_a_pagar or 0),
-                }
-            )
-        return jsonify({"ok": True, "data": data, "data_arquivo": data_arquivo, "uploaded_at": uploaded_at, "user_email": user_email})
+        meta = {"data_arquivo": data_arquivo, "uploaded_at": uploaded_at, "user_email": user_email}
+        return _relatorio_resposta(RELATORIO_FIP613, meta)
     except Exception as exc:
         return jsonify({"error": f"Falha ao buscar dados: {exc}"}), 500
 
 
-@home_bp.route("/api/relatorios/fip613/download", methods=["GET"])
-@login_required
+_EXCEL_FIP613_INVERTIDAS = {"reducao", "bloqueado_conting", "reserva_empenho", "empenhado"}
+_EXCEL_FIP613 = colunas_excel(
+    [
+        ("uo", "UO"),
+        ("ug", "UG"),
+        ("funcao", "Função"),
+        ("subfuncao", "Subfunção"),
+        ("programa", "Programa"),
+        ("projeto_atividade", "Projeto/Atividade"),
+        ("regional", "Regional"),
+        ("natureza_despesa", "Natureza de Despesa"),
+        ("fonte_recurso", "Fonte de Recurso"),
+        ("iduso", "Iduso"),
+        ("tipo_recurso", "Tipo de Recurso"),
+    ]
+) + [
+    ColunaExcel(titulo, chave, FORMATO_AZUL_VERMELHO, inverter=chave in _EXCEL_FIP613_INVERTIDAS)
+    for chave, titulo in [
+        ("dotacao_inicial", "Dotação Inicial"),
+        ("cred_suplementar", "Créd. Suplementar"),
+        ("cred_especial", "Créd. Especial"),
+        ("cred_extraordinario", "Créd. Extraordinário"),
+        ("reducao", "Redução"),
+        ("cred_autorizado", "Créd. Autorizado"),
+        ("bloqueado_conting", "Bloqueado/Conting."),
+        ("reserva_empenho", "Reserva Empenho"),
+        ("saldo_destaque", "Saldo de Destaque"),
+        ("saldo_dotacao", "Saldo Dotação"),
+        ("empenhado", "Empenhado"),
+        ("liquidado", "Liquidado"),
+        ("a_liquidar", "A liquidar"),
+        ("valor_pago", "Valor Pago"),
+        ("valor_a_pagar", "Valor a Pagar"),
+    ]
+]
+
+
+@home_bp.route("/api/relatorios/fip613/download", methods=["GET"])
+@login_required
 @require_feature("relatorios/fip613")
 def api_relatorio_fip613_download():
-    try:
-        rows = Fip613Registro.query.filter_by(ativo=True).all()
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "UO": r.uo,
-                    "UG": r.ug,
-                    "Função": r.funcao,
-                    "Subfunção": r.subfuncao,
-                    "Programa": r.programa,
-                    "Projeto/Atividade": r.projeto_atividade,
-                    "Regional": r.regional,
-                    "Natureza de Despesa": str(r.natureza_despesa or ""),
-                    "Fonte de Recurso": str(r.fonte_recurso or ""),
-                    "Iduso": r.iduso,
-                    "Tipo de Recurso": r.tipo_recurso,
-                    "Dotação Inicial": float(r.dotacao_inicial or 0),
-                    "Créd. Suplementar": float(r.cred_suplementar or 0),
-                    "Créd. Especial": float(r.cred_especial or 0),
-                    "Créd. Extraordinário": float(r.cred_extraordinario or 0),
-                    "Redução": float(r.reducao or 0),
-                    "Créd. Autorizado": float(r.cred_autorizado or 0),
-                    "Bloqueado/Conting.": float(r.bloqueado_conting or 0),
-                    "Reserva Empenho": float(r.reserva_empenho or 0),
-                    "Saldo de Destaque": float(r.saldo_destaque or 0),
-                    "Saldo Dotação": float(r.saldo_dotacao or 0),
-                    "Empenhado": float(r.empenhado or 0),
-                    "Liquidado": float(r.liquidado or 0),
-                    "A liquidar": float(r.a_liquidar or 0),
-                    "Valor Pago": float(r.valor_pago or 0),
-                    "Valor a Pagar": float(r.valor_a_pagar or 0),
-                }
-            )
-        db.session.close()
-        df = None
-        try:
-            import pandas as pd
-            from io import BytesIO
-            from openpyxl import load_workbook
-            from openpyxl.styles import Font
-            import unicodedata
-
-            df = pd.DataFrame(data)
-
-            invert_targets = {"reducao", "bloqueadoconting", "reservaempenho", "empenhado"}
-
-            def _norm_col(name: str) -> str:
-                base = unicodedata.normalize("NFKD", str(name or ""))
-                ascii_only = "".join(ch for ch in base if not unicodedata.combining(ch))
-                return (
-                    ascii_only.lower()
-                    .replace(" ", "")
-                    .replace(".", "")
-                    .replace("/", "")
-                    .replace("_", "")
-                )
-
-            for col in list(df.columns):
-                if _norm_col(col) in invert_targets:
-                    df[col] = df[col].apply(lambda x: -(x or 0))
-            output = BytesIO()
-            df.to_excel(output, index=False)
-            output.seek(0)
-
-            # aplica fonte e formato numérico no Excel
-            wb = load_workbook(output)
-            ws = wb.active
-            font = Font(name="Helvetica", size=8)
-            number_format = "[Blue]#,##0.00;[Red]-#,##0.00;0"
-            # colunas numéricas começam em 12 (1-based) até o final
-            numeric_cols = set(range(12, ws.max_column + 1))
-            for row in ws.iter_rows():
-                for cell in row:
-                    cell.font = font
-                    if cell.col_idx in numeric_cols and isinstance(cell.value, (int, float)):
-                        cell.number_format = number_format
-
-            styled = BytesIO()
-            wb.save(styled)
-            styled.seek(0)
-
-            filename = f"fip613_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            return _send_excel_bytes(styled, filename)
-        except Exception as exc:
-            return jsonify({"error": f"Falha ao preparar planilha: {exc}"}), 500
-    except Exception as exc:
-        return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
+    return _excel_download(_EXCEL_FIP613, lambda: linhas_completo(RELATORIO_FIP613), "fip613")
 
 
 # PED
@@ -3189,6 +3950,7 @@ def api_ped_status():
                 "data_arquivo": _as_iso(last.data_arquivo),
                 "original_filename": last.original_filename,
                 "output_filename": last.output_filename,
+                **_job_status_fields("ped", last.id),
             },
         }
     )
@@ -3231,21 +3993,27 @@ def api_ped_upload():
         )
         db.session.add(registro)
         db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        return jsonify({"error": f"Falha ao processar: {exc}"}), 500
+    return _processar_ped(registro, save_path)
+
 
+def _processar_ped(registro, file_path: Path):
+    """Roda o job do upload (novo ou retomado) e responde como o upload."""
+    try:
         total, output_path, missing_dotacao_keys = run_ped(
-            save_path, data_arquivo, user_email, registro.id
+            file_path, registro.data_arquivo, registro.user_email, registro.id
         )
 
-        if missing_dotacao_keys:
-            session["ped_dotacao_missing"] = missing_dotacao_keys
-            session.modified = True
-        else:
-            if "ped_dotacao_missing" in session:
-                session["ped_dotacao_missing"] = []
-                session.modified = True
+        session.pop("ped_dotacao_missing", None)
+        put_user_state(
+            registro.user_email, "ped_dotacao_missing", {"upload_id": registro.id, "keys": missing_dotacao_keys}
+        )
 
         registro.output_filename = str(output_path.name)
         db.session.commit()
+        _schedule_post_ingest("ped")
 
         return jsonify(
             {
@@ -3254,9 +4022,37 @@ def api_ped_upload():
                 "output": output_path.name,
             }
         )
+    except JobCancelado:
+        db.session.rollback()
+        return jsonify({"error": "Processamento cancelado pelo usuario."}), 409
     except Exception as exc:
         db.session.rollback()
-        return jsonify({"error": f"Falha ao processar: {exc}"}), 500
+        return _falha_upload("ped", registro.id, exc)
+
+
+@home_bp.route("/api/ped/retomar", methods=["POST"])
+@login_required
+@require_feature("atualizar/ped")
+def api_ped_retomar():
+    """Retoma o job PED interrompido a partir dos lotes ja confirmados."""
+    registro, file_path, erro = _upload_para_retomar("ped", PedUpload, PED_UPLOAD_DIR)
+    if erro:
+        return erro
+    return _processar_ped(registro, file_path)
+
+
+@home_bp.route("/api/ped/cancel", methods=["POST"])
+@login_required
+@require_feature("atualizar/ped")
+def api_ped_cancel():
+    return _request_cancel("ped", PedUpload)
+
+
+@home_bp.route("/api/ped/status/stream", methods=["GET"])
+@login_required
+@require_feature("atualizar/ped")
+def api_ped_status_stream():
+    return _status_stream("ped", None, follow=True)
 
 
 # EMP
@@ -3297,6 +4093,7 @@ def api_emp_status():
             {
                 "ok": True,
                 "last": {
+                    "upload_id": last.id,
                     "user_email": last.user_email,
                     "uploaded_at": _as_iso(last.uploaded_at),
                     "data_arquivo": _as_iso(last.data_arquivo),
@@ -3349,6 +4146,7 @@ def api_est_emp_status():
                 "data_arquivo": _as_iso(last.data_arquivo),
                 "original_filename": last.original_filename,
                 "output_filename": last.output_filename,
+                **_job_status_fields("est_emp", last.id),
             },
         }
     )
@@ -3389,6 +4187,7 @@ def api_nob_status():
             {
                 "ok": True,
                 "last": {
+                    "upload_id": last.id,
                     "user_email": last.user_email,
                     "uploaded_at": _as_iso(last.uploaded_at),
                     "data_arquivo": _as_iso(last.data_arquivo),
@@ -3406,6 +4205,137 @@ def api_nob_status():
         return jsonify({"ok": True, "last": None, "status_error": True})
 
 
+def _status_stream(kind: str, upload_id: int | None, follow: bool = False) -> Response:
+    """
+    Server-sent events com o status do job: cada evento leva o payload do
+    store e so sai quando a versao muda; encerra com o evento "done" ao chegar
+    num estado final. A conexao dorme em esperar_mudanca (acordada por
+    escrita ou pelo vigia do processo), sem consultar o store por timer.
+    Com follow, acompanha o job mais novo do tipo (uploads sincronos ainda
+    sem id no cliente) e so encerra depois de ver esse job em andamento.
+
+    O primeiro evento e um "ping" imediato e o keepalive tambem e um evento
+    "ping" (comentarios nao chegam ao JS): se o servidor ou um proxy segurar a
+    resposta, o cliente nao ve o ping e cai no polling de /status. A conexao
+    fecha apos STATUS_STREAM_MAX_SECONDS e o navegador reconecta sozinho, para
+    nao prender um worker por job longo. Com STATUS_STREAM=0 (IIS/wfastcgi,
+    que nao repassa a resposta em pedacos) responde 204 e o cliente fica so
+    no polling.
+    """
+    if not STATUS_STREAM_ATIVO:
+        return Response(status=204)
+    # Na reconexao o navegador manda o id do ultimo evento: o job ja visto em andamento.
+    visto_antes = request.headers.get("Last-Event-ID", "")
+
+    def _eventos():
+        atual = upload_id
+        if atual is None and not follow:
+            yield "event: done\ndata: {}\n\n"
+            return
+        yield f"retry: {STATUS_STREAM_RETRY_MS}\nevent: ping\ndata: {{}}\n\n"
+        ultima_versao = -1
+        visto_em_andamento = not follow
+        inicio = time.monotonic()
+        geracao = geracao_status()
+        while time.monotonic() - inicio < STATUS_STREAM_MAX_SECONDS:
+            if follow:
+                mais_novo = latest_upload_id(kind)
+                if mais_novo is not None and mais_novo != atual:
+                    atual, ultima_versao = mais_novo, -1
+            versao = status_version(kind, atual) if atual is not None else 0
+            if atual is not None and versao != ultima_versao:
+                ultima_versao = versao
+                status_data = read_status(kind, atual) or {}
+                if status_data.get("state") not in FINAL_STATES or visto_antes == str(atual):
+                    visto_em_andamento = True
+                evento_id = f"id: {atual}\n" if visto_em_andamento else ""
+                yield f"{evento_id}data: {json.dumps(status_data, ensure_ascii=True)}\n\n"
+                if status_data.get("state") in FINAL_STATES and visto_em_andamento:
+                    yield "event: done\ndata: {}\n\n"
+                    return
+            nova = esperar_mudanca(geracao, STATUS_STREAM_KEEPALIVE)
+            if nova == geracao:
+                yield "event: ping\ndata: {}\n\n"
+            geracao = nova
+
+    resp = Response(_eventos(), mimetype="text/event-stream", direct_passthrough=True)
+    # no-transform impede compressao (que acumula a resposta); X-Accel-Buffering desliga o buffer do nginx.
+    resp.headers["Cache-Control"] = "no-cache, no-transform"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+def _job_status_fields(kind: str, upload_id: int) -> dict:
+    status_data = read_status(kind, upload_id) or {}
+    return {
+        "upload_id": upload_id,
+        "status": status_data.get("state"),
+        "status_message": status_data.get("message"),
+        "status_updated_at": status_data.get("updated_at"),
+        "status_progress": status_data.get("progress"),
+        "retomavel": pode_retomar(kind, upload_id),
+    }
+
+
+def _upload_para_retomar(kind: str, model_cls, upload_dir: Path):
+    """
+    (registro, arquivo, erro) do upload a retomar: o informado em upload_id
+    ou o mais recente. So vale para job parado com checkpoint (falha de
+    conexao com o banco) e com o arquivo enviado ainda no disco.
+    """
+    payload = request.get_json(silent=True) or {}
+    upload_id = payload.get("upload_id")
+    if upload_id:
+        registro = db.session.get(model_cls, upload_id)
+    else:
+        registro = model_cls.query.order_by(model_cls.uploaded_at.desc()).first()
+    if not registro:
+        return None, None, (jsonify({"error": "Nenhum upload encontrado para retomar."}), 404)
+    status_data = read_status(kind, registro.id) or {}
+    if status_data.get("state") not in FINAL_STATES or not pode_retomar(kind, registro.id):
+        return None, None, (jsonify({"error": "Upload sem processamento interrompido para retomar."}), 409)
+    file_path = _find_upload_path(upload_dir, registro.stored_filename)
+    if not file_path:
+        return None, None, (jsonify({"error": "Arquivo do upload nao encontrado."}), 404)
+    return registro, file_path, None
+
+
+def _falha_upload(kind: str, upload_id: int | None, exc: Exception):
+    """Resposta de falha dos uploads; retomavel indica que /retomar continua o job."""
+    retomavel = upload_id is not None and pode_retomar(kind, upload_id)
+    return jsonify({"error": f"Falha ao processar: {exc}", "retomavel": retomavel, "job_id": upload_id}), 500
+
+
+def _request_cancel(kind: str, model_cls):
+    payload = request.get_json(silent=True) or {}
+    upload_id = payload.get("upload_id")
+    if upload_id:
+        registro = db.session.get(model_cls, upload_id)
+    else:
+        registro = model_cls.query.order_by(model_cls.uploaded_at.desc()).first()
+    if not registro:
+        return jsonify({"error": "Nenhum upload encontrado para cancelar."}), 404
+    set_cancel_flag(kind, registro.id)
+    update_status_fields(kind, registro.id, message="Cancelamento solicitado.")
+    return jsonify({"ok": True, "message": "Cancelamento solicitado.", "job_id": registro.id})
+
+
+@home_bp.route("/api/emp/status/stream", methods=["GET"])
+@login_required
+@require_feature("atualizar/emp")
+def api_emp_status_stream():
+    last = EmpUpload.query.order_by(EmpUpload.uploaded_at.desc()).first()
+    return _status_stream("emp", last.id if last else None)
+
+
+@home_bp.route("/api/nob/status/stream", methods=["GET"])
+@login_required
+@require_feature("atualizar/nob")
+def api_nob_status_stream():
+    last = NobUpload.query.order_by(NobUpload.uploaded_at.desc()).first()
+    return _status_stream("nob", last.id if last else None)
+
+
 @home_bp.route("/api/emp/upload", methods=["POST"])
 @login_required
 @require_feature("atualizar/emp")
@@ -3541,11 +4471,20 @@ def api_est_emp_upload():
         )
         db.session.add(registro)
         db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        return jsonify({"error": f"Falha ao processar: {exc}"}), 500
+    return _processar_est_emp(registro, save_path)
+
 
-        total, output_path = run_est_emp(save_path, data_arquivo, user_email, registro.id)
+def _processar_est_emp(registro, file_path: Path):
+    """Roda o job do upload (novo ou retomado) e responde como o upload."""
+    try:
+        total, output_path = run_est_emp(file_path, registro.data_arquivo, registro.user_email, registro.id)
 
         registro.output_filename = str(output_path.name)
         db.session.commit()
+        _schedule_post_ingest("est_emp")
 
         return jsonify(
             {
@@ -3554,9 +4493,37 @@ def api_est_emp_upload():
                 "output": output_path.name,
             }
         )
+    except JobCancelado:
+        db.session.rollback()
+        return jsonify({"error": "Processamento cancelado pelo usuario."}), 409
     except Exception as exc:
         db.session.rollback()
-        return jsonify({"error": f"Falha ao processar: {exc}"}), 500
+        return _falha_upload("est_emp", registro.id, exc)
+
+
+@home_bp.route("/api/est-emp/retomar", methods=["POST"])
+@login_required
+@require_feature("atualizar/est-emp")
+def api_est_emp_retomar():
+    """Retoma o job EST EMP interrompido a partir dos lotes ja confirmados."""
+    registro, file_path, erro = _upload_para_retomar("est_emp", EstEmpUpload, EST_EMP_UPLOAD_DIR)
+    if erro:
+        return erro
+    return _processar_est_emp(registro, file_path)
+
+
+@home_bp.route("/api/est-emp/cancel", methods=["POST"])
+@login_required
+@require_feature("atualizar/est-emp")
+def api_est_emp_cancel():
+    return _request_cancel("est_emp", EstEmpUpload)
+
+
+@home_bp.route("/api/est-emp/status/stream", methods=["GET"])
+@login_required
+@require_feature("atualizar/est-emp")
+def api_est_emp_status_stream():
+    return _status_stream("est_emp", None, follow=True)
 
 
 @home_bp.route("/api/nob/upload", methods=["POST"])
@@ -3669,6 +4636,7 @@ def api_ped_download(filename):
 @home_bp.route("/api/relatorios/ped", methods=["GET"])
 @login_required
 @require_feature("relatorios/ped")
+@cache_relatorio("ped")
 def api_relatorio_ped():
     def _as_iso(value):
         if value in (None, ""):
@@ -3685,464 +4653,92 @@ def api_relatorio_ped():
         except Exception:
             return str(value)
 
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        chave,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        exercicio,
-                        numero_ped,
-                        numero_ped_estorno,
-                        numero_emp,
-                        numero_cad,
-                        numero_noblist,
-                        numero_os,
-                        convenio,
-                        numero_processo_orcamentario_pagamento,
-                        valor_ped,
-                        valor_estorno,
-                        indicativo_licitacao_exercicios_anteriores,
-                        data_licitacao,
-                        liberado_fisco_estadual,
-                        situacao,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        data_solicitacao,
-                        data_criacao,
-                        tipo_empenho,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        nome_elemento,
-                        fonte,
-                        iduso,
-                        numero_emenda_ep,
-                        autor_emenda_ep,
-                        numero_cac,
-                        licitacao,
-                        usuario_responsavel,
-                        historico,
-                        credor,
-                        nome_credor,
-                        data_autorizacao,
-                        data_hora_cadastro_autorizacao,
-                        tipo_despesa,
-                        numero_abj,
-                        numero_processo_sequestro_judicial,
-                        indicativo_entrega_imediata,
-                        indicativo_contrato,
-                        codigo_uo_extinta,
-                        devolucao_gcv,
-                        mes_competencia_folha_pagamento,
-                        exercicio_competencia_folha,
-                        obrigacao_patronal,
-                        tipo_obrigacao_patronal,
-                        numero_nla
-                    FROM ped
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-
         last_upload = PedUpload.query.order_by(PedUpload.uploaded_at.desc()).first()
         data_arquivo = _as_iso(getattr(last_upload, "data_arquivo", None)) if last_upload else None
         uploaded_at = _as_iso(getattr(last_upload, "uploaded_at", None)) if last_upload else None
         user_email = last_upload.user_email if last_upload else None
-
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "chave": r.get("chave"),
-                    "chave_planejamento": r.get("chave_planejamento"),
-                    "regiao": r.get("regiao"),
-                    "subfuncao_ug": r.get("subfuncao_ug"),
-                    "adj": r.get("adj"),
-                    "macropolitica": r.get("macropolitica"),
-                    "pilar": r.get("pilar"),
-                    "eixo": r.get("eixo"),
-                    "politica_decreto": r.get("politica_decreto"),
-                    "exercicio": r.get("exercicio"),
-                    "numero_ped": r.get("numero_ped"),
-                    "numero_ped_estorno": r.get("numero_ped_estorno"),
-                    "numero_emp": r.get("numero_emp"),
-                    "numero_cad": r.get("numero_cad"),
-                    "numero_noblist": r.get("numero_noblist"),
-                    "numero_os": r.get("numero_os"),
-                    "convenio": r.get("convenio"),
-                    "numero_processo_orcamentario_pagamento": r.get("numero_processo_orcamentario_pagamento"),
-                    "valor_ped": _to_float(r.get("valor_ped")),
-                    "valor_estorno": _to_float(r.get("valor_estorno")),
-                    "indicativo_licitacao_exercicios_anteriores": r.get("indicativo_licitacao_exercicios_anteriores"),
-                    "data_licitacao": r.get("data_licitacao"),
-                    "liberado_fisco_estadual": r.get("liberado_fisco_estadual"),
-                    "situacao": r.get("situacao"),
-                    "uo": r.get("uo"),
-                    "nome_unidade_orcamentaria": r.get("nome_unidade_orcamentaria"),
-                    "ug": r.get("ug"),
-                    "nome_unidade_gestora": r.get("nome_unidade_gestora"),
-                    "data_solicitacao": r.get("data_solicitacao"),
-                    "data_criacao": r.get("data_criacao"),
-                    "tipo_empenho": r.get("tipo_empenho"),
-                    "dotacao_orcamentaria": r.get("dotacao_orcamentaria"),
-                    "funcao": r.get("funcao"),
-                    "subfuncao": r.get("subfuncao"),
-                    "programa_governo": r.get("programa_governo"),
-                    "paoe": r.get("paoe"),
-                    "natureza_despesa": r.get("natureza_despesa"),
-                    "cat_econ": r.get("cat_econ"),
-                    "grupo": r.get("grupo"),
-                    "modalidade": r.get("modalidade"),
-                    "elemento": r.get("elemento"),
-                    "nome_elemento": r.get("nome_elemento"),
-                    "fonte": r.get("fonte"),
-                    "iduso": r.get("iduso"),
-                    "numero_emenda_ep": r.get("numero_emenda_ep"),
-                    "autor_emenda_ep": r.get("autor_emenda_ep"),
-                    "numero_cac": r.get("numero_cac"),
-                    "licitacao": r.get("licitacao"),
-                    "usuario_responsavel": r.get("usuario_responsavel"),
-                    "historico": r.get("historico"),
-                    "credor": r.get("credor"),
-                    "nome_credor": r.get("nome_credor"),
-                    "data_autorizacao": r.get("data_autorizacao"),
-                    "data_hora_cadastro_autorizacao": r.get("data_hora_cadastro_autorizacao"),
-                    "tipo_despesa": r.get("tipo_despesa"),
-                    "numero_abj": r.get("numero_abj"),
-                    "numero_processo_sequestro_judicial": r.get("numero_processo_sequestro_judicial"),
-                    "indicativo_entrega_imediata": r.get("indicativo_entrega_imediata"),
-                    "indicativo_contrato": r.get("indicativo_contrato"),
-                    "codigo_uo_extinta": r.get("codigo_uo_extinta"),
-                    "devolucao_gcv": r.get("devolucao_gcv"),
-                    "mes_competencia_folha_pagamento": r.get("mes_competencia_folha_pagamento"),
-                    "exercicio_competencia_folha": r.get("exercicio_competencia_folha"),
-                    "obrigacao_patronal": r.get("obrigacao_patronal"),
-                    "tipo_obrigacao_patronal": r.get("tipo_obrigacao_patronal"),
-                    "numero_nla": r.get("numero_nla"),
-                }
-            )
-
-        return jsonify(
-            {
-                "ok": True,
-                "data": data,
-                "data_arquivo": data_arquivo,
-                "uploaded_at": uploaded_at,
-                "user_email": user_email,
-            }
-        )
+        meta = {"data_arquivo": data_arquivo, "uploaded_at": uploaded_at, "user_email": user_email}
+        return _relatorio_resposta(RELATORIO_PED, meta)
     except Exception as exc:
         return jsonify({"error": f"Falha ao buscar dados do PED: {exc}"}), 500
 
 
+_EXCEL_PED = [ColunaExcel("Chave / Chave de Planejamento", valor=_chave_display)] + colunas_excel(
+    [
+        ("regiao", "Região"),
+        ("subfuncao_ug", "Subfunção + UG"),
+        ("adj", "ADJ"),
+        ("macropolitica", "Macropolítica"),
+        ("pilar", "Pilar"),
+        ("eixo", "Eixo"),
+        ("politica_decreto", "Política_Decreto"),
+        ("exercicio", "Exercício"),
+        ("numero_ped", "Nº PED"),
+        ("numero_ped_estorno", "Nº PED Estorno/Estornado"),
+        ("numero_emp", "Nº EMP"),
+        ("numero_cad", "Nº CAD"),
+        ("numero_noblist", "Nº NOBLIST"),
+        ("numero_os", "Nº OS"),
+        ("convenio", "Convênio"),
+        ("numero_processo_orcamentario_pagamento", "Nº Processo Orçamentário de Pagamento"),
+        ("valor_ped", "Valor PED"),
+        ("valor_estorno", "Valor do Estorno"),
+        ("indicativo_licitacao_exercicios_anteriores", "Indicativo de Licitação de Exercícios Anteriores"),
+        ("data_licitacao", "Data da Licitação"),
+        ("liberado_fisco_estadual", "Liberado Fisco Estadual"),
+        ("situacao", "Situação"),
+        ("uo", "UO"),
+        ("nome_unidade_orcamentaria", "Nome da Unidade Orçamentária"),
+        ("ug", "UG"),
+        ("nome_unidade_gestora", "Nome da Unidade Gestora"),
+        ("data_solicitacao", "Data Solicitação"),
+        ("data_criacao", "Data Criação"),
+        ("tipo_empenho", "Tipo Empenho"),
+        ("dotacao_orcamentaria", "Dotação Orçamentária"),
+        ("funcao", "Função"),
+        ("subfuncao", "Subfunção"),
+        ("programa_governo", "Programa de Governo"),
+        ("paoe", "PAOE"),
+        ("natureza_despesa", "Natureza de Despesa"),
+        ("cat_econ", "Cat.Econ"),
+        ("grupo", "Grupo"),
+        ("modalidade", "Modalidade"),
+        ("elemento", "Elemento"),
+        ("nome_elemento", "Nome do Elemento"),
+        ("fonte", "Fonte"),
+        ("iduso", "Iduso"),
+        ("numero_emenda_ep", "Nº Emenda (EP)"),
+        ("autor_emenda_ep", "Autor da Emenda (EP)"),
+        ("numero_cac", "Nº CAC"),
+        ("licitacao", "Licitação"),
+        ("usuario_responsavel", "Usuário Responsável"),
+        ("historico", "Histórico"),
+        ("credor", "Credor"),
+        ("nome_credor", "Nome do Credor"),
+        ("data_autorizacao", "Data Autorização"),
+        ("data_hora_cadastro_autorizacao", "Data/Hora Cadastro Autorização"),
+        ("tipo_despesa", "Tipo de Despesa"),
+        ("numero_abj", "Nº ABJ"),
+        ("numero_processo_sequestro_judicial", "Nº Processo do Sequestro Judicial"),
+        ("indicativo_entrega_imediata", "Indicativo de Entrega imediata - § 4º Art. 62 Lei 8.666"),
+        ("indicativo_contrato", "Indicativo de contrato"),
+        ("codigo_uo_extinta", "Código UO Extinta"),
+        ("devolucao_gcv", "Devolução GCV"),
+        ("mes_competencia_folha_pagamento", "Mês de Competência da Folha de Pagamento"),
+        ("exercicio_competencia_folha", "Exercício de Competência da Folha de Pagamento"),
+        ("obrigacao_patronal", "Obrigação Patronal"),
+        ("tipo_obrigacao_patronal", "Tipo de Obrigação Patronal"),
+        ("numero_nla", "Nº NLA"),
+    ]
+)
+
+
 @home_bp.route("/api/relatorios/ped/download", methods=["GET"])
 @login_required
 @require_feature("relatorios/ped")
 def api_relatorio_ped_download():
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        chave,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        exercicio,
-                        numero_ped,
-                        numero_ped_estorno,
-                        numero_emp,
-                        numero_cad,
-                        numero_noblist,
-                        numero_os,
-                        convenio,
-                        numero_processo_orcamentario_pagamento,
-                        valor_ped,
-                        valor_estorno,
-                        indicativo_licitacao_exercicios_anteriores,
-                        data_licitacao,
-                        liberado_fisco_estadual,
-                        situacao,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        data_solicitacao,
-                        data_criacao,
-                        tipo_empenho,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        nome_elemento,
-                        fonte,
-                        iduso,
-                        numero_emenda_ep,
-                        autor_emenda_ep,
-                        numero_cac,
-                        licitacao,
-                        usuario_responsavel,
-                        historico,
-                        credor,
-                        nome_credor,
-                        data_autorizacao,
-                        data_hora_cadastro_autorizacao,
-                        tipo_despesa,
-                        numero_abj,
-                        numero_processo_sequestro_judicial,
-                        indicativo_entrega_imediata,
-                        indicativo_contrato,
-                        codigo_uo_extinta,
-                        devolucao_gcv,
-                        mes_competencia_folha_pagamento,
-                        exercicio_competencia_folha,
-                        obrigacao_patronal,
-                        tipo_obrigacao_patronal,
-                        numero_nla
-                    FROM ped
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-        if not rows:
-            return jsonify({"error": "Nenhum dado para exportar."}), 404
-        db.session.close()
-
-        df = pd.DataFrame(rows)
-
-        def _chave_display(row):
-            try:
-                ex = int(str(row.get("exercicio") or 0)[:4])
-            except Exception:
-                ex = 0
-            chave = row.get("chave") or ""
-            chave_plan = row.get("chave_planejamento") or ""
-            if ex >= 2026 and chave:
-                return chave
-            return chave_plan or chave
-
-        df["Chave / Chave de Planejamento"] = df.apply(_chave_display, axis=1)
-        df.drop(columns=["chave", "chave_planejamento"], inplace=True, errors="ignore")
-        if "valor_ped" in df.columns:
-            df["valor_ped"] = df["valor_ped"].apply(_to_float)
-        if "valor_estorno" in df.columns:
-            df["valor_estorno"] = df["valor_estorno"].apply(_to_float)
-
-        rename_map = {
-            "regiao": "Região",
-            "subfuncao_ug": "Subfunção + UG",
-            "adj": "ADJ",
-            "macropolitica": "Macropolítica",
-            "pilar": "Pilar",
-            "eixo": "Eixo",
-            "politica_decreto": "Política_Decreto",
-            "exercicio": "Exercício",
-            "numero_ped": "Nº PED",
-            "numero_ped_estorno": "Nº PED Estorno/Estornado",
-            "numero_emp": "Nº EMP",
-            "numero_cad": "Nº CAD",
-            "numero_noblist": "Nº NOBLIST",
-            "numero_os": "Nº OS",
-            "convenio": "Convênio",
-            "numero_processo_orcamentario_pagamento": "Nº Processo Orçamentário de Pagamento",
-            "valor_ped": "Valor PED",
-            "valor_estorno": "Valor do Estorno",
-            "indicativo_licitacao_exercicios_anteriores": "Indicativo de Licitação de Exercícios Anteriores",
-            "data_licitacao": "Data da Licitação",
-            "liberado_fisco_estadual": "Liberado Fisco Estadual",
-            "situacao": "Situação",
-            "uo": "UO",
-            "nome_unidade_orcamentaria": "Nome da Unidade Orçamentária",
-            "ug": "UG",
-            "nome_unidade_gestora": "Nome da Unidade Gestora",
-            "data_solicitacao": "Data Solicitação",
-            "data_criacao": "Data Criação",
-            "tipo_empenho": "Tipo Empenho",
-            "dotacao_orcamentaria": "Dotação Orçamentária",
-            "funcao": "Função",
-            "subfuncao": "Subfunção",
-            "programa_governo": "Programa de Governo",
-            "paoe": "PAOE",
-            "natureza_despesa": "Natureza de Despesa",
-            "cat_econ": "Cat.Econ",
-            "grupo": "Grupo",
-            "modalidade": "Modalidade",
-            "elemento": "Elemento",
-            "nome_elemento": "Nome do Elemento",
-            "fonte": "Fonte",
-            "iduso": "Iduso",
-            "numero_emenda_ep": "Nº Emenda (EP)",
-            "autor_emenda_ep": "Autor da Emenda (EP)",
-            "numero_cac": "Nº CAC",
-            "licitacao": "Licitação",
-            "usuario_responsavel": "Usuário Responsável",
-            "historico": "Histórico",
-            "credor": "Credor",
-            "nome_credor": "Nome do Credor",
-            "data_autorizacao": "Data Autorização",
-            "data_hora_cadastro_autorizacao": "Data/Hora Cadastro Autorização",
-            "tipo_despesa": "Tipo de Despesa",
-            "numero_abj": "Nº ABJ",
-            "numero_processo_sequestro_judicial": "Nº Processo do Sequestro Judicial",
-            "indicativo_entrega_imediata": "Indicativo de Entrega imediata - § 4º Art. 62 Lei 8.666",
-            "indicativo_contrato": "Indicativo de contrato",
-            "codigo_uo_extinta": "Código UO Extinta",
-            "devolucao_gcv": "Devolução GCV",
-            "mes_competencia_folha_pagamento": "Mês de Competência da Folha de Pagamento",
-            "exercicio_competencia_folha": "Exercício de Competência da Folha de Pagamento",
-            "obrigacao_patronal": "Obrigação Patronal",
-            "tipo_obrigacao_patronal": "Tipo de Obrigação Patronal",
-            "numero_nla": "Nº NLA",
-        }
-        df.rename(columns=rename_map, inplace=True)
-
-        col_order = [
-            "Chave / Chave de Planejamento",
-            "Região",
-            "Subfunção + UG",
-            "ADJ",
-            "Macropolítica",
-            "Pilar",
-            "Eixo",
-            "Política_Decreto",
-            "Exercício",
-            "Nº PED",
-            "Nº PED Estorno/Estornado",
-            "Nº EMP",
-            "Nº CAD",
-            "Nº NOBLIST",
-            "Nº OS",
-            "Convênio",
-            "Nº Processo Orçamentário de Pagamento",
-            "Valor PED",
-            "Valor do Estorno",
-            "Indicativo de Licitação de Exercícios Anteriores",
-            "Data da Licitação",
-            "Liberado Fisco Estadual",
-            "Situação",
-            "UO",
-            "Nome da Unidade Orçamentária",
-            "UG",
-            "Nome da Unidade Gestora",
-            "Data Solicitação",
-            "Data Criação",
-            "Tipo Empenho",
-            "Dotação Orçamentária",
-            "Função",
-            "Subfunção",
-            "Programa de Governo",
-            "PAOE",
-            "Natureza de Despesa",
-            "Cat.Econ",
-            "Grupo",
-            "Modalidade",
-            "Elemento",
-            "Nome do Elemento",
-            "Fonte",
-            "Iduso",
-            "Nº Emenda (EP)",
-            "Autor da Emenda (EP)",
-            "Nº CAC",
-            "Licitação",
-            "Usuário Responsável",
-            "Histórico",
-            "Credor",
-            "Nome do Credor",
-            "Data Autorização",
-            "Data/Hora Cadastro Autorização",
-            "Tipo de Despesa",
-            "Nº ABJ",
-            "Nº Processo do Sequestro Judicial",
-            "Indicativo de Entrega imediata - § 4º Art. 62 Lei 8.666",
-            "Indicativo de contrato",
-            "Código UO Extinta",
-            "Devolução GCV",
-            "Mês de Competência da Folha de Pagamento",
-            "Exercício de Competência da Folha de Pagamento",
-            "Obrigação Patronal",
-            "Tipo de Obrigação Patronal",
-            "Nº NLA",
-        ]
-        col_order = [c for c in col_order if c in df.columns]
-        if col_order:
-            df = df[col_order]
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="PED", header=False, startrow=1)
-            workbook = writer.book
-            worksheet = writer.sheets["PED"]
-            cell_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            header_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            worksheet.set_default_row(12, cell_fmt)
-            if len(df.columns) > 0:
-                worksheet.set_column(0, len(df.columns) - 1, None, cell_fmt)
-                worksheet.write_row(0, 0, df.columns, header_fmt)
-                worksheet.set_row(0, None, header_fmt)
-        output.seek(0)
-        filename = f"ped_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        return _send_excel_bytes(output, filename)
-    except Exception as exc:
-        return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
+    return _excel_download(_EXCEL_PED, lambda: linhas_completo(RELATORIO_PED), "ped", aba="PED")
 
 
 # Plan20 SEDUC
@@ -4186,6 +4782,7 @@ def api_plan20_status():
         "data_arquivo": _as_iso(registro.data_arquivo),
         "original_filename": registro.original_filename,
         "output_filename": registro.output_filename,
+        **_job_status_fields("plan20", registro.id),
     }
     return jsonify({"ok": True, "last": last})
 
@@ -4253,19 +4850,31 @@ def api_plan20_upload():
         save_path = PLAN20_UPLOAD_DIR / stored_name
         arquivo.save(save_path)
 
-        output_path = run_plan20(save_path, PLAN20_OUTPUT_DIR)
-
+        # O registro nasce antes do processamento para dar id ao job (progresso/cancelamento).
         registro = Plan20Upload(
             user_email=user_email,
             original_filename=arquivo.filename,
             stored_filename=stored_name,
-            output_filename=output_path.name if output_path else None,
             data_arquivo=data_arquivo,
             uploaded_at=datetime.utcnow(),
         )
         db.session.add(registro)
         db.session.commit()
 
+        progress = JobProgress("plan20", registro.id)
+        progress.start("Processando Plan20.")
+        try:
+            output_path = run_plan20(save_path, PLAN20_OUTPUT_DIR, progress)
+        except Exception as exc:
+            progress.fail(exc)
+            db.session.delete(registro)
+            db.session.commit()
+            if isinstance(exc, JobCancelado):
+                return jsonify({"error": "Processamento cancelado pelo usuario."}), 409
+            raise
+        registro.output_filename = output_path.name if output_path else None
+        db.session.commit()
+
         # Insere dados na tabela plan20_seduc a partir do arquivo processado
         try:
             df_out = pd.read_excel(output_path, sheet_name="Plan20_SEDUC")
@@ -4382,6 +4991,7 @@ def api_plan20_upload():
                 else:
                     df_out["ano"] = None
                 # Desativa somente registros do mesmo exercicio+unidade_orcamentaria
+                progress.stage("Gravando no banco.", 80)
                 combos = set()
                 if "unidade_orcamentaria" in df_out.columns and "exercicio" in df_out.columns:
                     for _, uo, ex in df_out[["unidade_orcamentaria", "exercicio"]].dropna().itertuples():
@@ -4399,9 +5009,16 @@ def api_plan20_upload():
                     )
                 db.session.commit()
                 df_out.to_sql("plan20_seduc", db.engine, if_exists="append", index=False)
+        except JobCancelado as exc:
+            db.session.rollback()
+            progress.fail(exc)
+            return jsonify({"error": "Plan20 processado; gravação no banco cancelada pelo usuario."}), 409
         except Exception as exc:
             db.session.rollback()
+            progress.fail(exc)
             return jsonify({"error": f"Plan20 processado, mas falha ao gravar no banco: {exc}"}), 500
+        progress.finish("Plan20 processado com sucesso.", output_path.name)
+        _schedule_post_ingest("plan20")
 
         return jsonify(
             {
@@ -4422,6 +5039,20 @@ def api_plan20_upload():
         return jsonify({"error": f"Falha ao processar: {exc}"}), 500
 
 
+@home_bp.route("/api/plan20/cancel", methods=["POST"])
+@login_required
+@require_feature("atualizar/plan20-seduc")
+def api_plan20_cancel():
+    return _request_cancel("plan20", Plan20Upload)
+
+
+@home_bp.route("/api/plan20/status/stream", methods=["GET"])
+@login_required
+@require_feature("atualizar/plan20-seduc")
+def api_plan20_status_stream():
+    return _status_stream("plan20", None, follow=True)
+
+
 @home_bp.route("/api/plan20/download/<path:filename>", methods=["GET"])
 @login_required
 @require_feature("atualizar/plan20-seduc")
@@ -4435,6 +5066,7 @@ def api_plan20_download(filename):
 @home_bp.route("/api/relatorios/plan20-seduc", methods=["GET"])
 @login_required
 @require_feature("relatorios/plan20-seduc")
+@cache_relatorio("plan20")
 def api_relatorio_plan20():
     def _as_iso(value):
         if value in (None, ""):
@@ -4451,159 +5083,13 @@ def api_relatorio_plan20():
         except Exception:
             return str(value)
 
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        publico_transversal_chave,
-                        programa,
-                        funcao,
-                        unidade_orcamentaria,
-                        acao_paoe,
-                        subfuncao,
-                        objetivo_especifico,
-                        esfera,
-                        responsavel_acao,
-                        produto_acao,
-                        unid_medida_produto,
-                        regiao_produto,
-                        meta_produto,
-                        saldo_meta_produto,
-                        publico_transversal,
-                        subacao_entrega,
-                        responsavel,
-                        prazo,
-                        unid_gestora,
-                        unidade_setorial_planejamento,
-                        produto_subacao,
-                        unidade_medida,
-                        regiao_subacao,
-                        codigo,
-                        municipios_entrega,
-                        meta_subacao,
-                        detalhamento_produto,
-                        etapa,
-                        responsavel_etapa,
-                        prazo_etapa,
-                        regiao_etapa,
-                        natureza,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        subelemento,
-                        fonte,
-                        idu,
-                        descricao_item_despesa,
-                        unid_medida_item,
-                        quantidade,
-                        valor_unitario,
-                        valor_total
-                    FROM plan20_seduc
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-
         last_upload = Plan20Upload.query.order_by(Plan20Upload.uploaded_at.desc()).first()
         data_arquivo = _as_iso(getattr(last_upload, "data_arquivo", None)) if last_upload else None
         uploaded_at = _as_iso(getattr(last_upload, "uploaded_at", None)) if last_upload else None
         user_email = last_upload.user_email if last_upload else None
-
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "exercicio": r.get("exercicio"),
-                    "chave_planejamento": r.get("chave_planejamento"),
-                    "regiao": r.get("regiao"),
-                    "subfuncao_ug": r.get("subfuncao_ug"),
-                    "adj": r.get("adj"),
-                    "macropolitica": r.get("macropolitica"),
-                    "pilar": r.get("pilar"),
-                    "eixo": r.get("eixo"),
-                    "politica_decreto": r.get("politica_decreto"),
-                    "publico_transversal_chave": r.get("publico_transversal_chave"),
-                    "programa": r.get("programa"),
-                    "funcao": r.get("funcao"),
-                    "unidade_orcamentaria": r.get("unidade_orcamentaria"),
-                    "acao_paoe": r.get("acao_paoe"),
-                    "subfuncao": r.get("subfuncao"),
-                    "objetivo_especifico": r.get("objetivo_especifico"),
-                    "esfera": r.get("esfera"),
-                    "responsavel_acao": r.get("responsavel_acao"),
-                    "produto_acao": r.get("produto_acao"),
-                    "unid_medida_produto": r.get("unid_medida_produto"),
-                    "regiao_produto": r.get("regiao_produto"),
-                    "meta_produto": r.get("meta_produto"),
-                    "saldo_meta_produto": r.get("saldo_meta_produto"),
-                    "publico_transversal": r.get("publico_transversal"),
-                    "subacao_entrega": r.get("subacao_entrega"),
-                    "responsavel": r.get("responsavel"),
-                    "prazo": r.get("prazo"),
-                    "unid_gestora": r.get("unid_gestora"),
-                    "unidade_setorial_planejamento": r.get("unidade_setorial_planejamento"),
-                    "produto_subacao": r.get("produto_subacao"),
-                    "unidade_medida": r.get("unidade_medida"),
-                    "regiao_subacao": r.get("regiao_subacao"),
-                    "codigo": r.get("codigo"),
-                    "municipios_entrega": r.get("municipios_entrega"),
-                    "meta_subacao": r.get("meta_subacao"),
-                    "detalhamento_produto": r.get("detalhamento_produto"),
-                    "etapa": r.get("etapa"),
-                    "responsavel_etapa": r.get("responsavel_etapa"),
-                    "prazo_etapa": r.get("prazo_etapa"),
-                    "regiao_etapa": r.get("regiao_etapa"),
-                    "natureza": r.get("natureza"),
-                    "cat_econ": r.get("cat_econ"),
-                    "grupo": r.get("grupo"),
-                    "modalidade": r.get("modalidade"),
-                    "elemento": r.get("elemento"),
-                    "subelemento": r.get("subelemento"),
-                    "fonte": r.get("fonte"),
-                    "idu": r.get("idu"),
-                    "descricao_item_despesa": r.get("descricao_item_despesa"),
-                    "unid_medida_item": r.get("unid_medida_item"),
-                    "quantidade": _to_float(r.get("quantidade")),
-                    "valor_unitario": _to_float(r.get("valor_unitario")),
-                    "valor_total": _to_float(r.get("valor_total")),
-                }
-            )
-
-        return jsonify(
-            {
-                "ok": True,
-                "data": data,
-                "data_arquivo": data_arquivo,
-                "uploaded_at": uploaded_at,
-                "user_email": user_email,
-            }
-        )
+        meta = {"data_arquivo": data_arquivo, "uploaded_at": uploaded_at, "user_email": user_email}
+        return _relatorio_resposta(RELATORIO_PLAN20, meta)
     except Exception as exc:
         return jsonify({"error": f"Falha ao buscar dados: {exc}"}), 500
 
@@ -4611,6 +5097,7 @@ def api_relatorio_plan20():
 @home_bp.route("/api/relatorios/emp", methods=["GET"])
 @login_required
 @require_feature("relatorios/emp")
+@cache_relatorio("emp")
 def api_relatorio_emp():
     def _as_iso(value):
         if value in (None, ""):
@@ -4627,143 +5114,13 @@ def api_relatorio_emp():
         except Exception:
             return str(value)
 
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        chave,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        exercicio,
-                        numero_emp,
-                        numero_ped,
-                        valor_emp,
-                        devolucao_gcv,
-                        valor_emp_devolucao_gcv,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        fonte,
-                        iduso,
-                        historico,
-                        tipo_despesa,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        categoria_credor,
-                        tipo_empenho,
-                        situacao,
-                        data_emissao,
-                        data_criacao,
-                        numero_contrato,
-                        numero_convenio
-                    FROM emp
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
         last_upload = EmpUpload.query.order_by(EmpUpload.uploaded_at.desc()).first()
         data_arquivo = _as_iso(last_upload.data_arquivo) if last_upload else None
         uploaded_at = _as_iso(last_upload.uploaded_at) if last_upload else None
         user_email = last_upload.user_email if last_upload else None
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "chave": r.get("chave"),
-                    "chave_planejamento": r.get("chave_planejamento"),
-                    "regiao": r.get("regiao"),
-                    "subfuncao_ug": r.get("subfuncao_ug"),
-                    "adj": r.get("adj"),
-                    "macropolitica": r.get("macropolitica"),
-                    "pilar": r.get("pilar"),
-                    "eixo": r.get("eixo"),
-                    "politica_decreto": r.get("politica_decreto"),
-                    "exercicio": r.get("exercicio"),
-                    "numero_emp": r.get("numero_emp"),
-                    "numero_ped": r.get("numero_ped"),
-                    "valor_emp": _to_float(r.get("valor_emp")),
-                    "devolucao_gcv": _to_float(r.get("devolucao_gcv")),
-                    "valor_emp_devolucao_gcv": _to_float(r.get("valor_emp_devolucao_gcv")),
-                    "uo": r.get("uo"),
-                    "nome_unidade_orcamentaria": r.get("nome_unidade_orcamentaria"),
-                    "ug": r.get("ug"),
-                    "nome_unidade_gestora": r.get("nome_unidade_gestora"),
-                    "dotacao_orcamentaria": r.get("dotacao_orcamentaria"),
-                    "funcao": r.get("funcao"),
-                    "subfuncao": r.get("subfuncao"),
-                    "programa_governo": r.get("programa_governo"),
-                    "paoe": r.get("paoe"),
-                    "natureza_despesa": r.get("natureza_despesa"),
-                    "cat_econ": r.get("cat_econ"),
-                    "grupo": r.get("grupo"),
-                    "modalidade": r.get("modalidade"),
-                    "elemento": r.get("elemento"),
-                    "fonte": r.get("fonte"),
-                    "iduso": r.get("iduso"),
-                    "historico": r.get("historico"),
-                    "tipo_despesa": r.get("tipo_despesa"),
-                    "credor": r.get("credor"),
-                    "nome_credor": r.get("nome_credor"),
-                    "cpf_cnpj_credor": r.get("cpf_cnpj_credor"),
-                    "categoria_credor": r.get("categoria_credor"),
-                    "tipo_empenho": r.get("tipo_empenho"),
-                    "situacao": r.get("situacao"),
-                    "data_emissao": _format_date(r.get("data_emissao")),
-                    "data_criacao": _format_date(r.get("data_criacao")),
-                    "numero_contrato": r.get("numero_contrato"),
-                    "numero_convenio": r.get("numero_convenio"),
-                }
-            )
-        return jsonify(
-            {
-                "ok": True,
-                "data": data,
-                "data_arquivo": data_arquivo,
-                "uploaded_at": uploaded_at,
-                "user_email": user_email,
-            }
-        )
+        meta = {"data_arquivo": data_arquivo, "uploaded_at": uploaded_at, "user_email": user_email}
+        return _relatorio_resposta(RELATORIO_EMP, meta)
     except Exception as exc:
         return jsonify({"error": f"Falha ao buscar dados do EMP: {exc}"}), 500
 
@@ -4807,35 +5164,16 @@ def api_relatorio_dotacao():
         if not rows:
             return jsonify({"ok": True, "data": []})
 
-        adj_ids = [r.adj_id for r in rows if getattr(r, "adj_id", None)]
-        adj_map = {}
-        if adj_ids:
-            perfis = Perfil.query.filter(Perfil.id.in_(adj_ids)).all()
-            adj_map = {p.id: p.nome for p in perfis if p and p.nome}
-
-        user_ids = [r.usuarios_id for r in rows if getattr(r, "usuarios_id", None)]
-        aprov_ids = []
-        for r in rows:
-            try:
-                if getattr(r, "aprovado_por", None):
-                    aprov_ids.append(int(r.aprovado_por))
-            except Exception:
-                pass
-        user_ids = list({*user_ids, *aprov_ids})
-        user_map = {}
-        if user_ids:
-            usuarios = Usuario.query.filter(Usuario.id.in_(user_ids)).all()
-            user_map = {u.id: (u.nome or "", u.perfil or "") for u in usuarios}
+        diretorio = get_diretorio()
+        adj_map = diretorio.perfil_nomes
 
         data = []
         for r in rows:
             adj_nome = (adj_map.get(r.adj_id) or "").strip()
-            criado_nome, criado_perfil = user_map.get(getattr(r, "usuarios_id", None), ("", ""))
-            aprov_nome, aprov_perfil = ("", "")
-            try:
-                aprov_nome, aprov_perfil = user_map.get(int(r.aprovado_por), ("", ""))
-            except Exception:
-                aprov_nome, aprov_perfil = ("", "")
+            criador = diretorio.usuario(getattr(r, "usuarios_id", None))
+            aprovador = diretorio.usuario(getattr(r, "aprovado_por", None))
+            criado_nome, criado_perfil = (criador.nome, criador.perfil) if criador else ("", "")
+            aprov_nome, aprov_perfil = (aprovador.nome, aprovador.perfil) if aprovador else ("", "")
             usuario_nome_perfil = ""
             if criado_nome:
                 usuario_nome_perfil = f"{criado_nome} - {criado_perfil}".strip(" -")
@@ -4886,6 +5224,7 @@ def api_relatorio_dotacao():
 @home_bp.route("/api/relatorios/est-emp", methods=["GET"])
 @login_required
 @require_feature("relatorios/est-emp")
+@cache_relatorio("est_emp")
 def api_relatorio_est_emp():
     def _as_iso(value):
         if value in (None, ""):
@@ -4902,103 +5241,13 @@ def api_relatorio_est_emp():
         except Exception:
             return str(value)
 
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        numero_est,
-                        numero_emp,
-                        empenho_atual,
-                        empenho_rp,
-                        numero_ped,
-                        valor_emp,
-                        valor_est_emp_sem_aqs,
-                        valor_est_emp_com_aqs,
-                        valor_emp_liquido,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        dotacao_orcamentaria,
-                        historico,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        data_criacao,
-                        data_emissao,
-                        situacao,
-                        rp
-                    FROM est_emp
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
         last_upload = EstEmpUpload.query.order_by(EstEmpUpload.uploaded_at.desc()).first()
         data_arquivo = _as_iso(getattr(last_upload, "data_arquivo", None)) if last_upload else None
         uploaded_at = _as_iso(getattr(last_upload, "uploaded_at", None)) if last_upload else None
         user_email = last_upload.user_email if last_upload else None
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "exercicio": r.get("exercicio"),
-                    "numero_est": r.get("numero_est"),
-                    "numero_emp": r.get("numero_emp"),
-                    "empenho_atual": r.get("empenho_atual"),
-                    "empenho_rp": r.get("empenho_rp"),
-                    "numero_ped": r.get("numero_ped"),
-                    "valor_emp": _to_float(r.get("valor_emp")),
-                    "valor_est_emp_sem_aqs": _to_float(r.get("valor_est_emp_sem_aqs")),
-                    "valor_est_emp_com_aqs": _to_float(r.get("valor_est_emp_com_aqs")),
-                    "valor_emp_liquido": _to_float(r.get("valor_emp_liquido")),
-                    "uo": r.get("uo"),
-                    "nome_unidade_orcamentaria": r.get("nome_unidade_orcamentaria"),
-                    "ug": r.get("ug"),
-                    "nome_unidade_gestora": r.get("nome_unidade_gestora"),
-                    "dotacao_orcamentaria": r.get("dotacao_orcamentaria"),
-                    "historico": r.get("historico"),
-                    "credor": r.get("credor"),
-                    "nome_credor": r.get("nome_credor"),
-                    "cpf_cnpj_credor": r.get("cpf_cnpj_credor"),
-                    "data_criacao": _format_date(r.get("data_criacao")),
-                    "data_emissao": _format_date(r.get("data_emissao")),
-                    "situacao": r.get("situacao"),
-                    "rp": r.get("rp"),
-                }
-            )
-        return jsonify(
-            {
-                "ok": True,
-                "data": data,
-                "data_arquivo": data_arquivo,
-                "uploaded_at": uploaded_at,
-                "user_email": user_email,
-            }
-        )
+        meta = {"data_arquivo": data_arquivo, "uploaded_at": uploaded_at, "user_email": user_email}
+        return _relatorio_resposta(RELATORIO_EST_EMP, meta)
     except Exception as exc:
         return jsonify({"error": f"Falha ao buscar dados do Est EMP: {exc}"}), 500
 
@@ -5006,6 +5255,7 @@ def api_relatorio_est_emp():
 @home_bp.route("/api/relatorios/nob", methods=["GET"])
 @login_required
 @require_feature("relatorios/nob")
+@cache_relatorio("nob")
 def api_relatorio_nob():
     def _as_iso(value):
         if not value:
@@ -5022,1089 +5272,324 @@ def api_relatorio_nob():
         except Exception:
             return str(value)
 
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
-
-    def _format_datetime(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y %H:%M:%S")
-        return str(val)
-
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        numero_nob,
-                        numero_nob_estorno,
-                        numero_liq,
-                        numero_emp,
-                        empenho_atual,
-                        empenho_rp,
-                        numero_ped,
-                        valor_nob,
-                        devolucao_gcv,
-                        valor_nob_gcv,
-                        uo,
-                        ug,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        nome_elemento_despesa,
-                        fonte,
-                        nome_fonte_recurso,
-                        iduso,
-                        historico_liq,
-                        nome_credor_principal,
-                        cpf_cnpj_credor_principal,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        data_nob,
-                        data_cadastro_nob,
-                        data_hora_cadastro_liq
-                    FROM nob
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
         last_upload = NobUpload.query.order_by(NobUpload.uploaded_at.desc()).first()
         data_arquivo = _as_iso(getattr(last_upload, "data_arquivo", None)) if last_upload else None
         uploaded_at = _as_iso(getattr(last_upload, "uploaded_at", None)) if last_upload else None
         user_email = last_upload.user_email if last_upload else None
-        data = []
-        for r in rows:
-            data.append(
-                {
-                    "exercicio": r.get("exercicio"),
-                    "numero_nob": r.get("numero_nob"),
-                    "numero_nob_estorno": r.get("numero_nob_estorno"),
-                    "numero_liq": r.get("numero_liq"),
-                    "numero_emp": r.get("numero_emp"),
-                    "empenho_atual": r.get("empenho_atual"),
-                    "empenho_rp": r.get("empenho_rp"),
-                    "numero_ped": r.get("numero_ped"),
-                    "valor_nob": _to_float(r.get("valor_nob")),
-                    "devolucao_gcv": _to_float(r.get("devolucao_gcv")),
-                    "valor_nob_gcv": _to_float(r.get("valor_nob_gcv")),
-                    "uo": r.get("uo"),
-                    "ug": r.get("ug"),
-                    "dotacao_orcamentaria": r.get("dotacao_orcamentaria"),
-                    "funcao": r.get("funcao"),
-                    "subfuncao": r.get("subfuncao"),
-                    "programa_governo": r.get("programa_governo"),
-                    "paoe": r.get("paoe"),
-                    "natureza_despesa": r.get("natureza_despesa"),
-                    "cat_econ": r.get("cat_econ"),
-                    "grupo": r.get("grupo"),
-                    "modalidade": r.get("modalidade"),
-                    "elemento": r.get("elemento"),
-                    "nome_elemento_despesa": r.get("nome_elemento_despesa"),
-                    "fonte": r.get("fonte"),
-                    "nome_fonte_recurso": r.get("nome_fonte_recurso"),
-                    "iduso": r.get("iduso"),
-                    "historico_liq": r.get("historico_liq"),
-                    "nome_credor_principal": r.get("nome_credor_principal"),
-                    "cpf_cnpj_credor_principal": r.get("cpf_cnpj_credor_principal"),
-                    "credor": r.get("credor"),
-                    "nome_credor": r.get("nome_credor"),
-                    "cpf_cnpj_credor": r.get("cpf_cnpj_credor"),
-                    "data_nob": _format_date(r.get("data_nob")),
-                    "data_cadastro_nob": _format_date(r.get("data_cadastro_nob")),
-                    "data_hora_cadastro_liq": _format_datetime(r.get("data_hora_cadastro_liq")),
-                }
-            )
-        return jsonify(
-            {
-                "ok": True,
-                "data": data,
-                "data_arquivo": data_arquivo,
-                "uploaded_at": uploaded_at,
-                "user_email": user_email,
-            }
-        )
+        meta = {"data_arquivo": data_arquivo, "uploaded_at": uploaded_at, "user_email": user_email}
+        return _relatorio_resposta(RELATORIO_NOB, meta)
     except Exception as exc:
         return jsonify({"error": f"Falha ao buscar dados do NOB: {exc}"}), 500
 
 
+_EXCEL_NOB = colunas_excel(
+    [
+        ("exercicio", "Exercicio"),
+        ("numero_nob", "Nº NOB"),
+        ("numero_nob_estorno", "Nº NOB Estorno/Estornado"),
+        ("numero_liq", "Nº LIQ"),
+        ("numero_emp", "Nº EMP"),
+        ("empenho_atual", "Empenho Atual"),
+        ("empenho_rp", "Empenho RP"),
+        ("numero_ped", "Nº PED"),
+        ("valor_nob", "Valor NOB"),
+        ("devolucao_gcv", "Devolucao GCV"),
+        ("valor_nob_gcv", "Valor NOB - GCV"),
+        ("uo", "UO"),
+        ("ug", "UG"),
+        ("dotacao_orcamentaria", "Dotacao Orcamentaria"),
+        ("funcao", "Funcao"),
+        ("subfuncao", "Subfuncao"),
+        ("programa_governo", "Programa de Governo"),
+        ("paoe", "PAOE"),
+        ("natureza_despesa", "Natureza de Despesa"),
+        ("cat_econ", "Cat.Econ"),
+        ("grupo", "Grupo"),
+        ("modalidade", "Modalidade"),
+        ("elemento", "Elemento"),
+        ("nome_elemento_despesa", "Nome do Elemento da Despesa"),
+        ("fonte", "Fonte"),
+        ("nome_fonte_recurso", "Nome da Fonte de Recurso"),
+        ("iduso", "Iduso"),
+        ("historico_liq", "Historico LIQ"),
+        ("nome_credor_principal", "Nome do Credor Principal"),
+        ("cpf_cnpj_credor_principal", "CPF/CNPJ do Credor Principal"),
+        ("credor", "Credor"),
+        ("nome_credor", "Nome do Credor"),
+        ("cpf_cnpj_credor", "CPF/CNPJ do Credor"),
+        ("data_nob", "Data NOB"),
+        ("data_cadastro_nob", "Data Cadastro NOB"),
+        ("data_hora_cadastro_liq", "Data/Hora de Cadastro da LIQ"),
+    ]
+)
+
+
 @home_bp.route("/api/relatorios/nob/download", methods=["GET"])
 @login_required
 @require_feature("relatorios/nob")
 def api_relatorio_nob_download():
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
-
-    def _format_datetime(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y %H:%M:%S")
-        return str(val)
-
-    try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        numero_nob,
-                        numero_nob_estorno,
-                        numero_liq,
-                        numero_emp,
-                        empenho_atual,
-                        empenho_rp,
-                        numero_ped,
-                        valor_nob,
-                        devolucao_gcv,
-                        valor_nob_gcv,
-                        uo,
-                        ug,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        nome_elemento_despesa,
-                        fonte,
-                        nome_fonte_recurso,
-                        iduso,
-                        historico_liq,
-                        nome_credor_principal,
-                        cpf_cnpj_credor_principal,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        data_nob,
-                        data_cadastro_nob,
-                        data_hora_cadastro_liq
-                    FROM nob
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-        if not rows:
-            return jsonify({"error": "Nenhum dado para exportar."}), 404
-        db.session.close()
-
-        df = pd.DataFrame(rows)
-        for col in ("valor_nob", "devolucao_gcv", "valor_nob_gcv"):
-            if col in df.columns:
-                df[col] = df[col].apply(_to_float)
-        for col in ("data_nob", "data_cadastro_nob"):
-            if col in df.columns:
-                df[col] = df[col].apply(_format_date)
-        if "data_hora_cadastro_liq" in df.columns:
-            df["data_hora_cadastro_liq"] = df["data_hora_cadastro_liq"].apply(_format_datetime)
-
-        rename_map = {
-            "exercicio": "Exercicio",
-            "numero_nob": "Nº NOB",
-            "numero_nob_estorno": "Nº NOB Estorno/Estornado",
-            "numero_liq": "Nº LIQ",
-            "numero_emp": "Nº EMP",
-            "empenho_atual": "Empenho Atual",
-            "empenho_rp": "Empenho RP",
-            "numero_ped": "Nº PED",
-            "valor_nob": "Valor NOB",
-            "devolucao_gcv": "Devolucao GCV",
-            "valor_nob_gcv": "Valor NOB - GCV",
-            "uo": "UO",
-            "ug": "UG",
-            "dotacao_orcamentaria": "Dotacao Orcamentaria",
-            "funcao": "Funcao",
-            "subfuncao": "Subfuncao",
-            "programa_governo": "Programa de Governo",
-            "paoe": "PAOE",
-            "natureza_despesa": "Natureza de Despesa",
-            "cat_econ": "Cat.Econ",
-            "grupo": "Grupo",
-            "modalidade": "Modalidade",
-            "elemento": "Elemento",
-            "nome_elemento_despesa": "Nome do Elemento da Despesa",
-            "fonte": "Fonte",
-            "nome_fonte_recurso": "Nome da Fonte de Recurso",
-            "iduso": "Iduso",
-            "historico_liq": "Historico LIQ",
-            "nome_credor_principal": "Nome do Credor Principal",
-            "cpf_cnpj_credor_principal": "CPF/CNPJ do Credor Principal",
-            "credor": "Credor",
-            "nome_credor": "Nome do Credor",
-            "cpf_cnpj_credor": "CPF/CNPJ do Credor",
-            "data_nob": "Data NOB",
-            "data_cadastro_nob": "Data Cadastro NOB",
-            "data_hora_cadastro_liq": "Data/Hora de Cadastro da LIQ",
-        }
-        df.rename(columns=rename_map, inplace=True)
-
-        col_order = [
-            "Exercicio",
-            "Nº NOB",
-            "Nº NOB Estorno/Estornado",
-            "Nº LIQ",
-            "Nº EMP",
-            "Empenho Atual",
-            "Empenho RP",
-            "Nº PED",
-            "Valor NOB",
-            "Devolucao GCV",
-            "Valor NOB - GCV",
-            "UO",
-            "UG",
-            "Dotacao Orcamentaria",
-            "Funcao",
-            "Subfuncao",
-            "Programa de Governo",
-            "PAOE",
-            "Natureza de Despesa",
-            "Cat.Econ",
-            "Grupo",
-            "Modalidade",
-            "Elemento",
-            "Nome do Elemento da Despesa",
-            "Fonte",
-            "Nome da Fonte de Recurso",
-            "Iduso",
-            "Historico LIQ",
-            "Nome do Credor Principal",
-            "CPF/CNPJ do Credor Principal",
-            "Credor",
-            "Nome do Credor",
-            "CPF/CNPJ do Credor",
-            "Data NOB",
-            "Data Cadastro NOB",
-            "Data/Hora de Cadastro da LIQ",
-        ]
-        col_order = [c for c in col_order if c in df.columns]
-        if col_order:
-            df = df[col_order]
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="NOB", header=False, startrow=1)
-            workbook = writer.book
-            worksheet = writer.sheets["NOB"]
-            cell_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            header_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            worksheet.set_default_row(12, cell_fmt)
-            if len(df.columns) > 0:
-                worksheet.set_column(0, len(df.columns) - 1, None, cell_fmt)
-                worksheet.write_row(0, 0, df.columns, header_fmt)
-                worksheet.set_row(0, None, header_fmt)
-        output.seek(0)
-        filename = f"nob_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        return _send_excel_bytes(output, filename)
-    except Exception as exc:
-        return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
+    return _excel_download(_EXCEL_NOB, lambda: linhas_completo(RELATORIO_NOB), "nob", aba="NOB")
+
+
+_EXCEL_EMP = [ColunaExcel("Chave / Chave de Planejamento", valor=_chave_display)] + colunas_excel(
+    [
+        ("regiao", "Regiao"),
+        ("subfuncao_ug", "Subfuncao + UG"),
+        ("adj", "ADJ"),
+        ("macropolitica", "Macropolitica"),
+        ("pilar", "Pilar"),
+        ("eixo", "Eixo"),
+        ("politica_decreto", "Politica_Decreto"),
+        ("exercicio", "Exercicio"),
+        ("numero_emp", "Nº EMP"),
+        ("numero_ped", "Nº PED"),
+        ("valor_emp", "Valor EMP"),
+        ("devolucao_gcv", "Devolucao GCV"),
+        ("valor_emp_devolucao_gcv", "Valor EMP-Devolucao GCV"),
+        ("uo", "UO"),
+        ("nome_unidade_orcamentaria", "Nome da Unidade Orcamentaria"),
+        ("ug", "UG"),
+        ("nome_unidade_gestora", "Nome da Unidade Gestora"),
+        ("dotacao_orcamentaria", "Dotacao Orcamentaria"),
+        ("funcao", "Funcao"),
+        ("subfuncao", "Subfuncao"),
+        ("programa_governo", "Programa de Governo"),
+        ("paoe", "PAOE"),
+        ("natureza_despesa", "Natureza de Despesa"),
+        ("cat_econ", "Cat.Econ"),
+        ("grupo", "Grupo"),
+        ("modalidade", "Modalidade"),
+        ("elemento", "Elemento"),
+        ("fonte", "Fonte"),
+        ("iduso", "Iduso"),
+        ("historico", "Historico"),
+        ("tipo_despesa", "Tipo de Despesa"),
+        ("credor", "Credor"),
+        ("nome_credor", "Nome do Credor"),
+        ("cpf_cnpj_credor", "CPF/CNPJ do Credor"),
+        ("categoria_credor", "Categoria do Credor"),
+        ("tipo_empenho", "Tipo Empenho"),
+        ("situacao", "Situacao"),
+        ("data_emissao", "Data emissao"),
+        ("data_criacao", "Data criacao"),
+        ("numero_contrato", "Nº Contrato"),
+        ("numero_convenio", "Nº Convênio"),
+    ]
+)
 
 
 @home_bp.route("/api/relatorios/emp/download", methods=["GET"])
 @login_required
 @require_feature("relatorios/emp")
 def api_relatorio_emp_download():
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
+    return _excel_download(_EXCEL_EMP, lambda: linhas_completo(RELATORIO_EMP), "emp", aba="EMP")
+
+
+_EXCEL_DOTACAO = colunas_excel(
+    [
+        ("exercicio", "Exercício"),
+        ("status_aprovacao", "Status"),
+        ("adjunta_solicitante", "Adjunta Solicitante"),
+        ("adj_concedente", "Adjunta Concedente"),
+        ("chave_dotacao", "Controle de Dotação"),
+        ("chave_planejamento", "Chave de Planejamento"),
+        ("valor_dotacao", "Valor da Dotação"),
+        ("valor_estorno", "Valor do Estorno"),
+        ("valor_ped_emp", "Valor do PED/EMP"),
+        ("valor_atual", "Valor da Dotação Atualizada"),
+        ("situacao", "Situação"),
+        ("uo", "UO"),
+        ("programa", "Programa"),
+        ("acao_paoe", "Ação/PAOE"),
+        ("produto", "Produto"),
+        ("ug", "UG"),
+        ("regiao", "Região"),
+        ("subacao_entrega", "Subação/Entrega"),
+        ("etapa", "Etapa"),
+        ("natureza_despesa", "Natureza de Despesa"),
+        ("elemento", "Elemento"),
+        ("subelemento", "Subelemento"),
+        ("fonte", "Fonte"),
+        ("iduso", "Iduso"),
+        ("justificativa_historico", "Justificativa/Histórico"),
+        ("usuario_nome_perfil", "Criado/Alterado por"),
+        ("criado_em", "Criado em"),
+        ("alterado_em", "Alterado em"),
+        ("aprovado_por_nome_perfil", "Aprovado por"),
+        ("data_aprovacao", "Data da Aprovação"),
+        ("motivo_rejeicao", "Justificativa do Estorno"),
+    ]
+)
 
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
 
-    try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        chave,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        exercicio,
-                        numero_emp,
-                        numero_ped,
-                        valor_emp,
-                        devolucao_gcv,
-                        valor_emp_devolucao_gcv,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        dotacao_orcamentaria,
-                        funcao,
-                        subfuncao,
-                        programa_governo,
-                        paoe,
-                        natureza_despesa,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        fonte,
-                        iduso,
-                        historico,
-                        tipo_despesa,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        categoria_credor,
-                        tipo_empenho,
-                        situacao,
-                        data_emissao,
-                        data_criacao,
-                        numero_contrato,
-                        numero_convenio
-                    FROM emp
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-        if not rows:
-            return jsonify({"error": "Nenhum dado para exportar."}), 404
-        db.session.close()
+def _dotacao_excel_lotes():
+    diretorio = get_diretorio()
+    adj_map = diretorio.perfil_nomes
 
-        df = pd.DataFrame(rows)
+    def _nome_perfil(usuario) -> str:
+        if not usuario or not usuario.nome:
+            return ""
+        return f"{usuario.nome} - {usuario.perfil}".strip(" -")
 
-        def _chave_display(row):
-            try:
-                ex = int(str(row.get("exercicio") or 0)[:4])
-            except Exception:
-                ex = 0
-            chave = row.get("chave") or ""
-            chave_plan = row.get("chave_planejamento") or ""
-            if ex >= 2026 and chave:
-                return chave
-            return chave_plan or chave
-
-        df["Chave / Chave de Planejamento"] = df.apply(_chave_display, axis=1)
-        df.drop(columns=["chave", "chave_planejamento"], inplace=True, errors="ignore")
-        for col in ("valor_emp", "devolucao_gcv", "valor_emp_devolucao_gcv"):
-            if col in df.columns:
-                df[col] = df[col].apply(_to_float)
-        for col in ("data_emissao", "data_criacao"):
-            if col in df.columns:
-                df[col] = df[col].apply(_format_date)
-
-        rename_map = {
-            "regiao": "Regiao",
-            "subfuncao_ug": "Subfuncao + UG",
-            "adj": "ADJ",
-            "macropolitica": "Macropolitica",
-            "pilar": "Pilar",
-            "eixo": "Eixo",
-            "politica_decreto": "Politica_Decreto",
-            "exercicio": "Exercicio",
-            "numero_emp": "Nº EMP",
-            "numero_ped": "Nº PED",
-            "valor_emp": "Valor EMP",
-            "devolucao_gcv": "Devolucao GCV",
-            "valor_emp_devolucao_gcv": "Valor EMP-Devolucao GCV",
-            "uo": "UO",
-            "nome_unidade_orcamentaria": "Nome da Unidade Orcamentaria",
-            "ug": "UG",
-            "nome_unidade_gestora": "Nome da Unidade Gestora",
-            "dotacao_orcamentaria": "Dotacao Orcamentaria",
-            "funcao": "Funcao",
-            "subfuncao": "Subfuncao",
-            "programa_governo": "Programa de Governo",
-            "paoe": "PAOE",
-            "natureza_despesa": "Natureza de Despesa",
-            "cat_econ": "Cat.Econ",
-            "grupo": "Grupo",
-            "modalidade": "Modalidade",
-            "elemento": "Elemento",
-            "fonte": "Fonte",
-            "iduso": "Iduso",
-            "historico": "Historico",
-            "tipo_despesa": "Tipo de Despesa",
-            "credor": "Credor",
-            "nome_credor": "Nome do Credor",
-            "cpf_cnpj_credor": "CPF/CNPJ do Credor",
-            "categoria_credor": "Categoria do Credor",
-            "tipo_empenho": "Tipo Empenho",
-            "situacao": "Situacao",
-            "data_emissao": "Data emissao",
-            "data_criacao": "Data criacao",
-            "numero_contrato": "Nº Contrato",
-            "numero_convenio": "Nº Convênio",
+    def _linha(r) -> dict:
+        return {
+            "exercicio": r.exercicio,
+            "status_aprovacao": r.status_aprovacao,
+            "adjunta_solicitante": (adj_map.get(r.adj_id) or "").strip(),
+            "adj_concedente": r.adj_concedente,
+            "chave_dotacao": r.chave_dotacao,
+            "chave_planejamento": r.chave_planejamento,
+            "valor_dotacao": para_float(r.valor_dotacao),
+            "valor_estorno": para_float(r.valor_estorno),
+            "valor_ped_emp": para_float(r.valor_ped_emp),
+            "valor_atual": para_float(r.valor_atual),
+            "situacao": r.situacao,
+            "uo": r.uo,
+            "programa": r.programa,
+            "acao_paoe": r.acao_paoe,
+            "produto": r.produto,
+            "ug": r.ug,
+            "regiao": r.regiao,
+            "subacao_entrega": r.subacao_entrega,
+            "etapa": r.etapa,
+            "natureza_despesa": r.natureza_despesa,
+            "elemento": r.elemento,
+            "subelemento": r.subelemento,
+            "fonte": r.fonte,
+            "iduso": r.iduso,
+            "justificativa_historico": r.justificativa_historico,
+            "usuario_nome_perfil": _nome_perfil(diretorio.usuario(getattr(r, "usuarios_id", None))),
+            "criado_em": data_hora_br(r.criado_em),
+            "alterado_em": data_hora_br(r.alterado_em),
+            "aprovado_por_nome_perfil": _nome_perfil(diretorio.usuario(getattr(r, "aprovado_por", None))),
+            "data_aprovacao": data_hora_br(r.data_aprovacao),
+            "motivo_rejeicao": r.motivo_rejeicao,
         }
-        df.rename(columns=rename_map, inplace=True)
-
-        col_order = [
-            "Chave / Chave de Planejamento",
-            "Regiao",
-            "Subfuncao + UG",
-            "ADJ",
-            "Macropolitica",
-            "Pilar",
-            "Eixo",
-            "Politica_Decreto",
-            "Exercicio",
-            "Nº EMP",
-            "Nº PED",
-            "Valor EMP",
-            "Devolucao GCV",
-            "Valor EMP-Devolucao GCV",
-            "UO",
-            "Nome da Unidade Orcamentaria",
-            "UG",
-            "Nome da Unidade Gestora",
-            "Dotacao Orcamentaria",
-            "Funcao",
-            "Subfuncao",
-            "Programa de Governo",
-            "PAOE",
-            "Natureza de Despesa",
-            "Cat.Econ",
-            "Grupo",
-            "Modalidade",
-            "Elemento",
-            "Fonte",
-            "Iduso",
-            "Historico",
-            "Tipo de Despesa",
-            "Credor",
-            "Nome do Credor",
-            "CPF/CNPJ do Credor",
-            "Categoria do Credor",
-            "Tipo Empenho",
-            "Situacao",
-            "Data emissao",
-            "Data criacao",
-            "Nº Contrato",
-            "Nº Convênio",
-        ]
-        col_order = [c for c in col_order if c in df.columns]
-        if col_order:
-            df = df[col_order]
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="EMP", header=False, startrow=1)
-            workbook = writer.book
-            worksheet = writer.sheets["EMP"]
-            cell_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            header_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            worksheet.set_default_row(12, cell_fmt)
-            if len(df.columns) > 0:
-                worksheet.set_column(0, len(df.columns) - 1, None, cell_fmt)
-                worksheet.write_row(0, 0, df.columns, header_fmt)
-                worksheet.set_row(0, None, header_fmt)
-        output.seek(0)
-        filename = f"emp_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        return _send_excel_bytes(output, filename)
-    except Exception as exc:
-        return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
+
+    query = Dotacao.query.order_by(Dotacao.id.desc()).yield_per(RELATORIO_STREAM_LOTE)
+    return [(_linha(r) for r in query)]
 
 
 @home_bp.route("/api/relatorios/dotacao/download", methods=["GET"])
 @login_required
 @require_feature("relatorios/dotacao")
 def api_relatorio_dotacao_download():
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    def _format_dt(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y %H:%M:%S")
-        return str(val)
-
-    try:
-        rows = Dotacao.query.order_by(Dotacao.id.desc()).all()
-        if not rows:
-            return jsonify({"error": "Nenhum dado para exportar."}), 404
-
-        adj_ids = [r.adj_id for r in rows if getattr(r, "adj_id", None)]
-        adj_map = {}
-        if adj_ids:
-            perfis = Perfil.query.filter(Perfil.id.in_(adj_ids)).all()
-            adj_map = {p.id: p.nome for p in perfis if p and p.nome}
-
-        user_ids = [r.usuarios_id for r in rows if getattr(r, "usuarios_id", None)]
-        aprov_ids = []
-        for r in rows:
-            try:
-                if getattr(r, "aprovado_por", None):
-                    aprov_ids.append(int(r.aprovado_por))
-            except Exception:
-                pass
-        user_ids = list({*user_ids, *aprov_ids})
-        user_map = {}
-        if user_ids:
-            usuarios = Usuario.query.filter(Usuario.id.in_(user_ids)).all()
-            user_map = {u.id: (u.nome or "", u.perfil or "") for u in usuarios}
-
-        data = []
-        for r in rows:
-            adj_nome = (adj_map.get(r.adj_id) or "").strip()
-            criado_nome, criado_perfil = user_map.get(getattr(r, "usuarios_id", None), ("", ""))
-            aprov_nome, aprov_perfil = ("", "")
-            try:
-                aprov_nome, aprov_perfil = user_map.get(int(r.aprovado_por), ("", ""))
-            except Exception:
-                aprov_nome, aprov_perfil = ("", "")
-            usuario_nome_perfil = ""
-            if criado_nome:
-                usuario_nome_perfil = f"{criado_nome} - {criado_perfil}".strip(" -")
-            aprovado_nome_perfil = ""
-            if aprov_nome:
-                aprovado_nome_perfil = f"{aprov_nome} - {aprov_perfil}".strip(" -")
-            data.append(
-                {
-                    "exercicio": r.exercicio,
-                    "status_aprovacao": r.status_aprovacao,
-                    "adjunta_solicitante": adj_nome,
-                    "adj_concedente": r.adj_concedente,
-                    "chave_dotacao": r.chave_dotacao,
-                    "chave_planejamento": r.chave_planejamento,
-                    "valor_dotacao": _to_float(r.valor_dotacao),
-                    "valor_estorno": _to_float(r.valor_estorno),
-                    "valor_ped_emp": _to_float(r.valor_ped_emp),
-                    "valor_atual": _to_float(r.valor_atual),
-                    "situacao": r.situacao,
-                    "uo": r.uo,
-                    "programa": r.programa,
-                    "acao_paoe": r.acao_paoe,
-                    "produto": r.produto,
-                    "ug": r.ug,
-                    "regiao": r.regiao,
-                    "subacao_entrega": r.subacao_entrega,
-                    "etapa": r.etapa,
-                    "natureza_despesa": r.natureza_despesa,
-                    "elemento": r.elemento,
-                    "subelemento": r.subelemento,
-                    "fonte": r.fonte,
-                    "iduso": r.iduso,
-                    "justificativa_historico": r.justificativa_historico,
-                    "usuario_nome_perfil": usuario_nome_perfil,
-                    "criado_em": _format_dt(r.criado_em),
-                    "alterado_em": _format_dt(r.alterado_em),
-                    "aprovado_por_nome_perfil": aprovado_nome_perfil,
-                    "data_aprovacao": _format_dt(r.data_aprovacao),
-                    "motivo_rejeicao": r.motivo_rejeicao,
-                }
-            )
-
-        df = pd.DataFrame(data)
-        rename_map = {
-            "exercicio": "Exercício",
-            "status_aprovacao": "Status",
-            "adjunta_solicitante": "Adjunta Solicitante",
-            "adj_concedente": "Adjunta Concedente",
-            "chave_dotacao": "Controle de Dotação",
-            "chave_planejamento": "Chave de Planejamento",
-            "valor_dotacao": "Valor da Dotação",
-            "valor_estorno": "Valor do Estorno",
-            "valor_ped_emp": "Valor do PED/EMP",
-            "valor_atual": "Valor da Dotação Atualizada",
-            "situacao": "Situação",
-            "uo": "UO",
-            "programa": "Programa",
-            "acao_paoe": "Ação/PAOE",
-            "produto": "Produto",
-            "ug": "UG",
-            "regiao": "Região",
-            "subacao_entrega": "Subação/Entrega",
-            "etapa": "Etapa",
-            "natureza_despesa": "Natureza de Despesa",
-            "elemento": "Elemento",
-            "subelemento": "Subelemento",
-            "fonte": "Fonte",
-            "iduso": "Iduso",
-            "justificativa_historico": "Justificativa/Histórico",
-            "usuario_nome_perfil": "Criado/Alterado por",
-            "criado_em": "Criado em",
-            "alterado_em": "Alterado em",
-            "aprovado_por_nome_perfil": "Aprovado por",
-            "data_aprovacao": "Data da Aprovação",
-            "motivo_rejeicao": "Justificativa do Estorno",
-        }
-        df.rename(columns=rename_map, inplace=True)
-
-        col_order = [
-            "Exercício",
-            "Status",
-            "Adjunta Solicitante",
-            "Adjunta Concedente",
-            "Controle de Dotação",
-            "Chave de Planejamento",
-            "Valor da Dotação",
-            "Valor do Estorno",
-            "Valor do PED/EMP",
-            "Valor da Dotação Atualizada",
-            "Situação",
-            "UO",
-            "Programa",
-            "Ação/PAOE",
-            "Produto",
-            "UG",
-            "Região",
-            "Subação/Entrega",
-            "Etapa",
-            "Natureza de Despesa",
-            "Elemento",
-            "Subelemento",
-            "Fonte",
-            "Iduso",
-            "Justificativa/Histórico",
-            "Criado/Alterado por",
-            "Criado em",
-            "Alterado em",
-            "Aprovado por",
-            "Data da Aprovação",
-            "Justificativa do Estorno",
-        ]
-        col_order = [c for c in col_order if c in df.columns]
-        if col_order:
-            df = df[col_order]
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="Dotacao", header=False, startrow=1)
-            workbook = writer.book
-            worksheet = writer.sheets["Dotacao"]
-            cell_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            header_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            worksheet.set_default_row(12, cell_fmt)
-            if len(df.columns) > 0:
-                worksheet.set_column(0, len(df.columns) - 1, None, cell_fmt)
-                worksheet.write_row(0, 0, df.columns, header_fmt)
-                worksheet.set_row(0, None, header_fmt)
-        output.seek(0)
-        filename = f"dotacao_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        return _send_excel_bytes(output, filename)
-    except Exception as exc:
-        return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
+    return _excel_download(_EXCEL_DOTACAO, _dotacao_excel_lotes, "dotacao", aba="Dotacao")
+
+
+_EXCEL_EST_EMP = colunas_excel(
+    [
+        ("exercicio", "Exercicio"),
+        ("numero_est", "Nº EST"),
+        ("numero_emp", "Nº EMP"),
+        ("empenho_atual", "Empenho Atual"),
+        ("empenho_rp", "Empenho RP"),
+        ("numero_ped", "Nº PED"),
+        ("valor_emp", "Valor EMP"),
+        ("valor_est_emp_sem_aqs", "Valor Est EMP (A LIQ/Em LIQ sem AQS)"),
+        ("valor_est_emp_com_aqs", "Valor Est EMP (Em LIQ com AQS)"),
+        ("valor_emp_liquido", "Valor EMP - (A LIQ/Em LIQ sem AQS) - (Em LIQ com AQS)"),
+        ("uo", "UO"),
+        ("nome_unidade_orcamentaria", "Nome da Unidade Orcamentaria"),
+        ("ug", "UG"),
+        ("nome_unidade_gestora", "Nome da Unidade Gestora"),
+        ("dotacao_orcamentaria", "Dotacao Orcamentaria"),
+        ("historico", "Historico"),
+        ("credor", "Credor"),
+        ("nome_credor", "Nome do Credor"),
+        ("cpf_cnpj_credor", "CPF/CNPJ do Credor"),
+        ("data_criacao", "Data Criacao"),
+        ("data_emissao", "Data Emissao"),
+        ("situacao", "Situacao"),
+        ("rp", "RP"),
+    ]
+)
 
 
 @home_bp.route("/api/relatorios/est-emp/download", methods=["GET"])
 @login_required
 @require_feature("relatorios/est-emp")
 def api_relatorio_est_emp_download():
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
+    return _excel_download(_EXCEL_EST_EMP, lambda: linhas_completo(RELATORIO_EST_EMP), "est_emp", aba="EST_EMP")
 
-    def _format_date(val):
-        if not val:
-            return None
-        if hasattr(val, "strftime"):
-            return val.strftime("%d/%m/%Y")
-        return str(val)
 
+def _exercicio_inteiro(row):
+    val = row.get("exercicio")
+    if not isinstance(val, (int, float, str)):
+        return val
     try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        numero_est,
-                        numero_emp,
-                        empenho_atual,
-                        empenho_rp,
-                        numero_ped,
-                        valor_emp,
-                        valor_est_emp_sem_aqs,
-                        valor_est_emp_com_aqs,
-                        valor_emp_liquido,
-                        uo,
-                        nome_unidade_orcamentaria,
-                        ug,
-                        nome_unidade_gestora,
-                        dotacao_orcamentaria,
-                        historico,
-                        credor,
-                        nome_credor,
-                        cpf_cnpj_credor,
-                        data_criacao,
-                        data_emissao,
-                        situacao,
-                        rp
-                    FROM est_emp
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-        if not rows:
-            return jsonify({"error": "Nenhum dado para exportar."}), 404
-        db.session.close()
-
-        df = pd.DataFrame(rows)
-        for col in (
-            "valor_emp",
-            "valor_est_emp_sem_aqs",
-            "valor_est_emp_com_aqs",
-            "valor_emp_liquido",
-        ):
-            if col in df.columns:
-                df[col] = df[col].apply(_to_float)
-        for col in ("data_criacao", "data_emissao"):
-            if col in df.columns:
-                df[col] = df[col].apply(_format_date)
-
-        rename_map = {
-            "exercicio": "Exercicio",
-            "numero_est": "Nº EST",
-            "numero_emp": "Nº EMP",
-            "empenho_atual": "Empenho Atual",
-            "empenho_rp": "Empenho RP",
-            "numero_ped": "Nº PED",
-            "valor_emp": "Valor EMP",
-            "valor_est_emp_sem_aqs": "Valor Est EMP (A LIQ/Em LIQ sem AQS)",
-            "valor_est_emp_com_aqs": "Valor Est EMP (Em LIQ com AQS)",
-            "valor_emp_liquido": "Valor EMP - (A LIQ/Em LIQ sem AQS) - (Em LIQ com AQS)",
-            "uo": "UO",
-            "nome_unidade_orcamentaria": "Nome da Unidade Orcamentaria",
-            "ug": "UG",
-            "nome_unidade_gestora": "Nome da Unidade Gestora",
-            "dotacao_orcamentaria": "Dotacao Orcamentaria",
-            "historico": "Historico",
-            "credor": "Credor",
-            "nome_credor": "Nome do Credor",
-            "cpf_cnpj_credor": "CPF/CNPJ do Credor",
-            "data_criacao": "Data Criacao",
-            "data_emissao": "Data Emissao",
-            "situacao": "Situacao",
-            "rp": "RP",
-        }
-        df.rename(columns=rename_map, inplace=True)
-
-        col_order = [
-            "Exercicio",
-            "Nº EST",
-            "Nº EMP",
-            "Empenho Atual",
-            "Empenho RP",
-            "Nº PED",
-            "Valor EMP",
-            "Valor Est EMP (A LIQ/Em LIQ sem AQS)",
-            "Valor Est EMP (Em LIQ com AQS)",
-            "Valor EMP - (A LIQ/Em LIQ sem AQS) - (Em LIQ com AQS)",
-            "UO",
-            "Nome da Unidade Orcamentaria",
-            "UG",
-            "Nome da Unidade Gestora",
-            "Dotacao Orcamentaria",
-            "Historico",
-            "Credor",
-            "Nome do Credor",
-            "CPF/CNPJ do Credor",
-            "Data Criacao",
-            "Data Emissao",
-            "Situacao",
-            "RP",
-        ]
-        col_order = [c for c in col_order if c in df.columns]
-        if col_order:
-            df = df[col_order]
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="EST_EMP", header=False, startrow=1)
-            workbook = writer.book
-            worksheet = writer.sheets["EST_EMP"]
-            cell_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            header_fmt = workbook.add_format({"font_name": "Helvetica", "font_size": 8})
-            worksheet.set_default_row(12, cell_fmt)
-            if len(df.columns) > 0:
-                worksheet.set_column(0, len(df.columns) - 1, None, cell_fmt)
-                worksheet.write_row(0, 0, df.columns, header_fmt)
-                worksheet.set_row(0, None, header_fmt)
-        output.seek(0)
-        filename = f"est_emp_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        return _send_excel_bytes(output, filename)
-    except Exception as exc:
-        return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
+        return int(str(val).split(".")[0])
+    except ValueError:
+        return val
+
+
+_EXCEL_PLAN20 = [ColunaExcel("Exercício", formato="0", valor=_exercicio_inteiro)] + colunas_excel(
+    [
+        ("chave_planejamento", "Chave de Planejamento"),
+        ("regiao", "Região"),
+        ("subfuncao_ug", "Subfunção + UG"),
+        ("adj", "ADJ"),
+        ("macropolitica", "Macropolitica"),
+        ("pilar", "Pilar"),
+        ("eixo", "Eixo"),
+        ("politica_decreto", "Politica_Decreto"),
+        ("publico_transversal_chave", "Público Transversal (chave)"),
+        ("programa", "Programa"),
+        ("funcao", "Função"),
+        ("unidade_orcamentaria", "Unidade Orçamentária"),
+        ("acao_paoe", "Ação (P/A/OE)"),
+        ("subfuncao", "Subfunção"),
+        ("objetivo_especifico", "Objetivo Específico"),
+        ("esfera", "Esfera"),
+        ("responsavel_acao", "Responsável pela Ação"),
+        ("produto_acao", "Produto(s) da Ação"),
+        ("unid_medida_produto", "Unidade de Medida do Produto"),
+        ("regiao_produto", "Região do Produto"),
+        ("meta_produto", "Meta do Produto"),
+        ("saldo_meta_produto", "Saldo Meta do Produto"),
+        ("publico_transversal", "Público Transversal"),
+        ("subacao_entrega", "Subação/entrega"),
+        ("responsavel", "Responsável"),
+        ("prazo", "Prazo"),
+        ("unid_gestora", "Unid. Gestora"),
+        ("unidade_setorial_planejamento", "Unidade Setorial de Planejamento"),
+        ("produto_subacao", "Produto da Subação"),
+        ("unidade_medida", "Unidade de Medida"),
+        ("regiao_subacao", "Região da Subação"),
+        ("codigo", "Código"),
+        ("municipios_entrega", "Município(s) da entrega"),
+        ("meta_subacao", "Meta da Subação"),
+        ("detalhamento_produto", "Detalhamento do produto"),
+        ("etapa", "Etapa"),
+        ("responsavel_etapa", "Responsável da Etapa"),
+        ("prazo_etapa", "Prazo da Etapa"),
+        ("regiao_etapa", "Região da Etapa"),
+        ("natureza", "Natureza"),
+        ("cat_econ", "Cat.Econ"),
+        ("grupo", "Grupo"),
+        ("modalidade", "Modalidade"),
+        ("elemento", "Elemento"),
+        ("subelemento", "Subelemento"),
+        ("fonte", "Fonte"),
+        ("idu", "IDU"),
+        ("descricao_item_despesa", "Descrição do Item de Despesa"),
+        ("unid_medida_item", "Unid. Medida"),
+        ("quantidade", "Quantidade"),
+        ("valor_unitario", "Valor Unitário"),
+        ("valor_total", "Valor Total"),
+    ],
+    quantidade=FORMATO_MOEDA,
+    valor_unitario=FORMATO_MOEDA,
+    valor_total=FORMATO_MOEDA,
+)
 
 
 @home_bp.route("/api/relatorios/plan20-seduc/download", methods=["GET"])
 @login_required
 @require_feature("relatorios/plan20-seduc")
 def api_relatorio_plan20_download():
-    def _to_float(val):
-        try:
-            if val in (None, ""):
-                return 0.0
-            if isinstance(val, str):
-                cleaned = val.replace(".", "").replace(",", ".")
-                return float(cleaned)
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
-
-    try:
-        rows = (
-            db.session.execute(
-                text(
-                    """
-                    SELECT
-                        exercicio,
-                        chave_planejamento,
-                        regiao,
-                        subfuncao_ug,
-                        adj,
-                        macropolitica,
-                        pilar,
-                        eixo,
-                        politica_decreto,
-                        publico_transversal_chave,
-                        programa,
-                        funcao,
-                        unidade_orcamentaria,
-                        acao_paoe,
-                        subfuncao,
-                        objetivo_especifico,
-                        esfera,
-                        responsavel_acao,
-                        produto_acao,
-                        unid_medida_produto,
-                        regiao_produto,
-                        meta_produto,
-                        saldo_meta_produto,
-                        publico_transversal,
-                        subacao_entrega,
-                        responsavel,
-                        prazo,
-                        unid_gestora,
-                        unidade_setorial_planejamento,
-                        produto_subacao,
-                        unidade_medida,
-                        regiao_subacao,
-                        codigo,
-                        municipios_entrega,
-                        meta_subacao,
-                        detalhamento_produto,
-                        etapa,
-                        responsavel_etapa,
-                        prazo_etapa,
-                        regiao_etapa,
-                        natureza,
-                        cat_econ,
-                        grupo,
-                        modalidade,
-                        elemento,
-                        subelemento,
-                        fonte,
-                        idu,
-                        descricao_item_despesa,
-                        unid_medida_item,
-                        quantidade,
-                        valor_unitario,
-                        valor_total
-                    FROM plan20_seduc
-                    WHERE ativo = 1
-                    """
-                )
-            )
-            .mappings()
-            .all()
-        )
-        if not rows:
-            return jsonify({"error": "Nenhum dado para exportar."}), 404
-        db.session.close()
-
-        headers = [
-            ("Exercício", "exercicio"),
-            ("Chave de Planejamento", "chave_planejamento"),
-            ("Região", "regiao"),
-            ("Subfunção + UG", "subfuncao_ug"),
-            ("ADJ", "adj"),
-            ("Macropolitica", "macropolitica"),
-            ("Pilar", "pilar"),
-            ("Eixo", "eixo"),
-            ("Politica_Decreto", "politica_decreto"),
-            ("Público Transversal (chave)", "publico_transversal_chave"),
-            ("Programa", "programa"),
-            ("Função", "funcao"),
-            ("Unidade Orçamentária", "unidade_orcamentaria"),
-            ("Ação (P/A/OE)", "acao_paoe"),
-            ("Subfunção", "subfuncao"),
-            ("Objetivo Específico", "objetivo_especifico"),
-            ("Esfera", "esfera"),
-            ("Responsável pela Ação", "responsavel_acao"),
-            ("Produto(s) da Ação", "produto_acao"),
-            ("Unidade de Medida do Produto", "unid_medida_produto"),
-            ("Região do Produto", "regiao_produto"),
-            ("Meta do Produto", "meta_produto"),
-            ("Saldo Meta do Produto", "saldo_meta_produto"),
-            ("Público Transversal", "publico_transversal"),
-            ("Subação/entrega", "subacao_entrega"),
-            ("Responsável", "responsavel"),
-            ("Prazo", "prazo"),
-            ("Unid. Gestora", "unid_gestora"),
-            ("Unidade Setorial de Planejamento", "unidade_setorial_planejamento"),
-            ("Produto da Subação", "produto_subacao"),
-            ("Unidade de Medida", "unidade_medida"),
-            ("Região da Subação", "regiao_subacao"),
-            ("Código", "codigo"),
-            ("Município(s) da entrega", "municipios_entrega"),
-            ("Meta da Subação", "meta_subacao"),
-            ("Detalhamento do produto", "detalhamento_produto"),
-            ("Etapa", "etapa"),
-            ("Responsável da Etapa", "responsavel_etapa"),
-            ("Prazo da Etapa", "prazo_etapa"),
-            ("Região da Etapa", "regiao_etapa"),
-            ("Natureza", "natureza"),
-            ("Cat.Econ", "cat_econ"),
-            ("Grupo", "grupo"),
-            ("Modalidade", "modalidade"),
-            ("Elemento", "elemento"),
-            ("Subelemento", "subelemento"),
-            ("Fonte", "fonte"),
-            ("IDU", "idu"),
-            ("Descrição do Item de Despesa", "descricao_item_despesa"),
-            ("Unid. Medida", "unid_medida_item"),
-            ("Quantidade", "quantidade"),
-            ("Valor Unitário", "valor_unitario"),
-            ("Valor Total", "valor_total"),
-        ]
-
-        data = []
-        for r in rows:
-            row_dict = {}
-            for label, key in headers:
-                val = r.get(key)
-                if key in {"quantidade", "valor_unitario", "valor_total"}:
-                    val = _to_float(val)
-                row_dict[label] = val
-            data.append(row_dict)
-
-        df = None
-        try:
-            import pandas as pd
-            from io import BytesIO
-            from openpyxl import load_workbook
-            from openpyxl.styles import Font
-
-            df = pd.DataFrame(data, columns=[h[0] for h in headers])
-            output = BytesIO()
-            df.to_excel(output, index=False)
-            output.seek(0)
-
-            wb = load_workbook(output)
-            ws = wb.active
-            font = Font(name="Helvetica", size=8)
-            idx_map = {label: i + 1 for i, (label, _) in enumerate(headers)}
-            numeric_cols = {
-                idx_map.get("Quantidade"),
-                idx_map.get("Valor Unitário"),
-                idx_map.get("Valor Total"),
-            }
-            numeric_cols = {c for c in numeric_cols if c}
-            number_format = "#,##0.00"
-            for row in ws.iter_rows():
-                for cell in row:
-                    cell.font = font
-                    if cell.col_idx in numeric_cols and isinstance(cell.value, (int, float)):
-                        cell.number_format = number_format
-                    if cell.col_idx == idx_map.get("Exercício") and isinstance(cell.value, (int, float, str)):
-                        try:
-                            cell.value = int(str(cell.value).split(".")[0])
-                        except Exception:
-                            pass
-                        cell.number_format = "0"
-
-            styled = BytesIO()
-            wb.save(styled)
-            styled.seek(0)
-
-            filename = f"plan20_seduc_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            return _send_excel_bytes(styled, filename)
-        except Exception as exc:
-            return jsonify({"error": f"Falha ao preparar planilha: {exc}"}), 500
-    except Exception as exc:
-        return jsonify({"error": f"Falha ao exportar: {exc}"}), 500
+    return _excel_download(_EXCEL_PLAN20, lambda: linhas_completo(RELATORIO_PLAN20), "plan20_seduc")
 
 
 @home_bp.route("/api/usuarios", methods=["POST"])
@@ -6134,6 +5619,7 @@ def api_criar_usuario():
     usuario.set_password(senha)
     db.session.add(usuario)
     db.session.commit()
+    bump_diretorio_version()
 
     return jsonify({"ok": True, "message": "Usuario criado."}), 201
 
@@ -6168,6 +5654,7 @@ def api_usuario(email):
             return jsonify({"error": "Sem permissao."}), 403
         usuario.ativo = False
         db.session.commit()
+        bump_diretorio_version()
         return jsonify({"ok": True, "message": "Usuario desativado."})
 
     if request.method not in ("PUT", "POST"):
@@ -6191,6 +5678,7 @@ def api_usuario(email):
     except Exception as exc:
         db.session.rollback()
         return jsonify({"error": f"Falha ao atualizar: {exc}"}), 500
+    bump_diretorio_version()
     return jsonify({"ok": True, "message": "Usuario atualizado."})
 
 
@@ -6255,6 +5743,7 @@ def api_perfis():
         except IntegrityError:
             db.session.rollback()
             return jsonify({"error": "Perfil ja existe."}), 400
+        bump_diretorio_version()
         return jsonify({"ok": True, "message": "Perfil ativado.", "id": existing.id}), 200
     try:
         nivel_int = int(nivel)
@@ -6269,6 +5758,7 @@ def api_perfis():
     except IntegrityError:
         db.session.rollback()
         return jsonify({"error": "Perfil ja existe."}), 400
+    bump_diretorio_version()
     return jsonify({"ok": True, "message": "Perfil criado.", "id": perfil.id}), 201
 
 
@@ -6285,6 +5775,8 @@ def api_perfil(perfil_id):
             PerfilPermissao.query.filter_by(perfil_id=perfil_id).delete()
             db.session.delete(perfil)
             db.session.commit()
+            bump_permissoes_version()
+            bump_diretorio_version()
             return jsonify({"ok": True, "message": "Perfil excluido."})
         except IntegrityError:
             db.session.rollback()
@@ -6315,6 +5807,7 @@ def api_perfil(perfil_id):
     except IntegrityError:
         db.session.rollback()
         return jsonify({"error": "Perfil ja existe."}), 400
+    bump_diretorio_version()
     return jsonify({"ok": True, "message": "Perfil atualizado."})
     if chave_field == "chave_planejamento":
         ped_rows = [r for r in ped_rows if r]
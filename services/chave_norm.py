@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import sqlalchemy as sa
+from sqlalchemy import text
+
+from models import CHAVE_NORM_SOURCES, chave_norm_values, db
+
+BACKFILL_BATCH = 2000
+_NORM_COLUMNS = ("chave_norm", "chave_planejamento_norm")
+
+
+def _table(name: str) -> sa.TableClause:
+    chave_col, plan_col = CHAVE_NORM_SOURCES[name]
+    return sa.table(name, sa.column("id"), sa.column(chave_col), sa.column(plan_col), *map(sa.column, _NORM_COLUMNS))
+
+
+def ensure_chave_norm_schema() -> list[str]:
+    """
+    Cria as colunas chave_norm/chave_planejamento_norm e os indices
+    (ativo, *_norm) nas tabelas que ja existiam antes delas (create_all nao
+    altera tabela existente) e preenche as linhas antigas. Devolve as tabelas
+    alteradas.
+    """
+    inspector = sa.inspect(db.engine)
+    alteradas = []
+    for name in CHAVE_NORM_SOURCES:
+        if not inspector.has_table(name):
+            continue
+        colunas = {c["name"] for c in inspector.get_columns(name)}
+        indices = {i["name"] for i in inspector.get_indexes(name)}
+        novas = [col for col in _NORM_COLUMNS if col not in colunas]
+        with db.engine.begin() as conn:
+            for col in novas:
+                conn.execute(text(f"ALTER TABLE {name} ADD {col} VARCHAR(255) NULL"))
+            for col in _NORM_COLUMNS:
+                idx = f"idx_{name}_ativo_{col}"
+                if idx not in indices:
+                    conn.execute(text(f"CREATE INDEX {idx} ON {name} (ativo, {col})"))
+        if novas:
+            backfill_chave_norm(name)
+            alteradas.append(name)
+    return alteradas
+
+
+def backfill_chave_norm(name: str, batch: int = BACKFILL_BATCH) -> int:
+    """Preenche *_norm das linhas que ainda nao tem (chave vazia vira '')."""
+    chave_col, plan_col = CHAVE_NORM_SOURCES[name]
+    tabela = _table(name)
+    c = tabela.c
+    pendente = sa.or_(
+        sa.and_(c.chave_norm.is_(None), c[chave_col].isnot(None)),
+        sa.and_(c.chave_planejamento_norm.is_(None), c[plan_col].isnot(None)),
+    )
+    total = 0
+    ultimo_id = 0
+    while True:
+        rows = db.session.execute(
+            sa.select(c.id, c[chave_col], c[plan_col])
+            .where(pendente, c.id > ultimo_id)
+            .order_by(c.id)
+            .limit(batch)
+        ).all()
+        if not rows:
+            break
+        params = []
+        for row in rows:
+            valores = chave_norm_values(row[1], row[2])
+            params.append(
+                {"row_id": row[0], "v_chave": valores["chave_norm"], "v_plan": valores["chave_planejamento_norm"]}
+            )
+        db.session.execute(
+            sa.update(tabela)
+            .where(c.id == sa.bindparam("row_id"))
+            .values(chave_norm=sa.bindparam("v_chave"), chave_planejamento_norm=sa.bindparam("v_plan")),
+            params,
+        )
+        db.session.commit()
+        ultimo_id = rows[-1][0]
+        total += len(rows)
+    return total
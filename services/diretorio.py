@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from models import db, Perfil, Usuario
+from services.shared_version import SharedVersion
+
+# Releitura de seguranca (s) para alteracoes feitas fora das telas de admin.
+DIRETORIO_TTL = float(os.getenv("DIRETORIO_TTL", "300"))
+_VERSAO = SharedVersion("diretorio_version")
+
+
+@dataclass(frozen=True)
+class UsuarioInfo:
+    id: int | None
+    email: str
+    nome: str
+    perfil: str
+    ativo: bool
+
+
+@dataclass(frozen=True)
+class PerfilInfo:
+    id: int
+    nome: str
+    nivel: int | None
+    ativo: bool
+
+
+def _nome_norm(nome) -> str:
+    return str(nome or "").strip().lower()
+
+
+class Diretorio:
+    """Usuarios e perfis em memoria, por id, email e nome normalizado."""
+
+    def __init__(self, usuarios: list[UsuarioInfo], perfis: list[PerfilInfo], versao, lido_em: float) -> None:
+        self.versao = versao
+        self.lido_em = lido_em
+        self.usuarios_por_id = {u.id: u for u in usuarios if u.id is not None}
+        self.usuarios_por_email = {u.email.strip().lower(): u for u in usuarios}
+        self.perfis = sorted(perfis, key=lambda p: p.id)
+        self.perfis_por_id = {p.id: p for p in self.perfis}
+        self.perfil_nomes = {p.id: p.nome for p in self.perfis if p.nome}
+        self.perfis_por_nome: dict[str, PerfilInfo] = {}
+        for p in self.perfis:
+            self.perfis_por_nome.setdefault(_nome_norm(p.nome), p)
+
+    def usuario(self, usuario_id) -> UsuarioInfo | None:
+        try:
+            return self.usuarios_por_id.get(int(usuario_id))
+        except (TypeError, ValueError):
+            return None
+
+    def usuario_por_email(self, email) -> UsuarioInfo | None:
+        return self.usuarios_por_email.get(str(email or "").strip().lower())
+
+    def perfil(self, perfil_id) -> PerfilInfo | None:
+        try:
+            return self.perfis_por_id.get(int(perfil_id))
+        except (TypeError, ValueError):
+            return None
+
+    def perfil_por_nome(self, nome) -> PerfilInfo | None:
+        return self.perfis_por_nome.get(_nome_norm(nome))
+
+
+_diretorio: Diretorio | None = None
+_lock = threading.Lock()
+
+
+def _carregar(versao) -> Diretorio:
+    usuarios = [
+        UsuarioInfo(
+            id=int(row.id) if row.id is not None else None,
+            email=row.email or "",
+            nome=row.nome or "",
+            perfil=row.perfil or "",
+            ativo=bool(row.ativo),
+        )
+        for row in db.session.query(Usuario.id, Usuario.email, Usuario.nome, Usuario.perfil, Usuario.ativo).all()
+    ]
+    perfis = [
+        PerfilInfo(id=int(row.id), nome=row.nome or "", nivel=row.nivel, ativo=bool(row.ativo))
+        for row in db.session.query(Perfil.id, Perfil.nome, Perfil.nivel, Perfil.ativo).all()
+    ]
+    return Diretorio(usuarios, perfis, versao, time.monotonic())
+
+
+def get_diretorio() -> Diretorio:
+    """Diretorio atual; relido quando a versao muda ou passa DIRETORIO_TTL."""
+    global _diretorio
+    versao = _VERSAO.atual()
+    atual = _diretorio
+    if atual is not None and atual.versao == versao and time.monotonic() - atual.lido_em < DIRETORIO_TTL:
+        return atual
+    with _lock:
+        atual = _diretorio
+        if atual is None or atual.versao != versao or time.monotonic() - atual.lido_em >= DIRETORIO_TTL:
+            atual = _diretorio = _carregar(versao)
+        return atual
+
+
+def bump_diretorio_version() -> None:
+    """Chamar depois do commit de qualquer alteracao de usuario ou perfil."""
+    global _diretorio
+    _VERSAO.bump()
+    _diretorio = None
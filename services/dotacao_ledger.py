@@ -0,0 +1,416 @@
+from __future__ import annotations
+
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any
+
+import pytz
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Dotacao, DotacaoMovimento, TravaProcesso, normalize_chave, normalize_dotacao_key
+from services.valor_sql import decimal_sql
+
+# Origens do ledger: tabela de registros e coluna de valor (ped/emp entram por
+# upload; estorno entra por linha de est_dotacao). valor_ped e texto e passa
+# por decimal_sql.
+LEDGER_ORIGENS = {
+    "ped": ("ped", "valor_ped"),
+    "emp": ("emp", "valor_emp_devolucao_gcv"),
+}
+_VALOR_TEXTO = {"ped"}
+ORIGEM_ESTORNO = "estorno"
+TRAVA_LEDGER = "dotacao_ledger"
+UQ_MOVIMENTO_ATIVO = "uq_dotacao_movimento_ativo"
+# Chaves por IN nas consultas de invalidacao do saldo (MSSQL: ate 2100 parametros).
+INVALIDAR_CHUNK = 500
+
+_est_cols: tuple[str, str] | None = None
+
+
+def _now_local() -> datetime:
+    return datetime.now(pytz.timezone("America/Manaus")).replace(tzinfo=None)
+
+
+def to_decimal(value) -> Decimal:
+    if value is None:
+        return Decimal("0")
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    raw = str(value).strip()
+    if "," in raw:
+        raw = raw.replace(".", "").replace(",", ".")
+    try:
+        return Decimal(raw) if raw else Decimal("0")
+    except InvalidOperation:
+        return Decimal("0")
+
+
+def est_dotacao_columns() -> tuple[str, str]:
+    """(coluna da chave, coluna do valor) de est_dotacao; o schema varia entre bases e e lido uma vez."""
+    global _est_cols
+    if _est_cols is None:
+        colunas = {c["name"] for c in sa.inspect(db.engine).get_columns("est_dotacao")}
+        chave = "chave_dotacao" if "chave_dotacao" in colunas else "chave"
+        valor = "valor_a_ser_est" if "valor_a_ser_est" in colunas else "valor_estorno"
+        _est_cols = (chave, valor)
+    return _est_cols
+
+
+def estorno_rows() -> list[tuple[Any, Any, Any, Any]]:
+    """(id, chave, valor, situacao) dos estornos ativos."""
+    try:
+        chave, valor = est_dotacao_columns()
+        return db.session.execute(
+            text(f"SELECT id, {chave}, {valor}, situacao FROM est_dotacao WHERE ativo = 1")
+        ).all()
+    except Exception:
+        db.session.rollback()
+        return []
+
+
+def _movimento(chave_norm: str, origem: str, ref_id: int, valor: Decimal, quantidade: int, agora) -> None:
+    db.session.add(
+        DotacaoMovimento(
+            chave_norm=chave_norm,
+            origem=origem,
+            ref_id=ref_id,
+            valor=valor,
+            quantidade=quantidade,
+            ativo=True,
+            criado_em=agora,
+        )
+    )
+
+
+def _retirar(movimentos, deltas: dict[str, Decimal], agora) -> None:
+    for mov in movimentos:
+        mov.ativo = False
+        mov.retirado_em = agora
+        deltas[mov.chave_norm] = deltas.get(mov.chave_norm, Decimal("0")) - to_decimal(mov.valor)
+
+
+def _sync_uploads(origem: str, deltas: dict[str, Decimal], agora) -> None:
+    """Grava os movimentos dos uploads ativos ainda sem registro e retira os dos substituidos."""
+    tabela, valor = LEDGER_ORIGENS[origem]
+    if origem in _VALOR_TEXTO:
+        valor = decimal_sql(valor)
+    ativos = {
+        int(row[0])
+        for row in db.session.execute(text(f"SELECT DISTINCT upload_id FROM {tabela} WHERE ativo = 1")).all()
+        if row[0] is not None
+    }
+    registrados = {
+        int(row[0])
+        for row in db.session.query(DotacaoMovimento.ref_id)
+        .filter(DotacaoMovimento.origem == origem, DotacaoMovimento.ativo == True)  # noqa: E712
+        .distinct()
+        .all()
+    }
+    substituidos = registrados - ativos
+    if substituidos:
+        _retirar(
+            DotacaoMovimento.query.filter(
+                DotacaoMovimento.origem == origem,
+                DotacaoMovimento.ativo == True,  # noqa: E712
+                DotacaoMovimento.ref_id.in_(substituidos),
+            ).all(),
+            deltas,
+            agora,
+        )
+    for upload_id in sorted(ativos - registrados):
+        rows = db.session.execute(
+            text(
+                f"SELECT chave_norm, COUNT(*), SUM({valor}) FROM {tabela} "
+                "WHERE ativo = 1 AND upload_id = :upload_id AND chave_norm LIKE 'DOT.%' GROUP BY chave_norm"
+            ),
+            {"upload_id": upload_id},
+        ).all()
+        for chave_norm, qtd, total in rows:
+            total = to_decimal(total)
+            _movimento(chave_norm, origem, upload_id, total, int(qtd or 0), agora)
+            deltas[chave_norm] = deltas.get(chave_norm, Decimal("0")) + total
+
+
+def _sync_estornos(deltas: dict[str, Decimal], situacoes: dict[str, str], agora) -> None:
+    """
+    Um movimento por estorno ativo; estorno editado troca o movimento, excluido
+    retira. Preenche situacoes (chave -> situacao do estorno) para a dotacao.
+    """
+    atuais = {}
+    for est_id, chave, valor, situacao in estorno_rows():
+        key = normalize_dotacao_key(chave)
+        if key:
+            atuais[int(est_id)] = (key, to_decimal(valor))
+            if situacao:
+                situacoes[key] = str(situacao).strip()
+    registrados = DotacaoMovimento.query.filter(
+        DotacaoMovimento.origem == ORIGEM_ESTORNO,
+        DotacaoMovimento.ativo == True,  # noqa: E712
+    ).all()
+    vistos = set()
+    for mov in registrados:
+        atual = atuais.get(int(mov.ref_id))
+        if atual == (mov.chave_norm, to_decimal(mov.valor)):
+            vistos.add(int(mov.ref_id))
+            continue
+        _retirar([mov], deltas, agora)
+    for est_id, (key, valor) in atuais.items():
+        if est_id in vistos:
+            continue
+        _movimento(key, ORIGEM_ESTORNO, est_id, valor, 1, agora)
+        deltas[key] = deltas.get(key, Decimal("0")) + valor
+
+
+def invalidar_saldos(chaves_planejamento=(), chaves_dotacao=()) -> int:
+    """
+    Incrementa geracao das linhas de saldo_dotacao das chaves de planejamento
+    (pares exercicio, chave) e das chaves de planejamento das dotacoes DOT.
+    informadas. Chamar na mesma transacao da escrita, antes do commit: a
+    linha calculada antes dela deixa de valer (services/saldo_dotacao.py).
+    """
+    pares = {(str(exercicio or "").strip(), normalize_chave(chave)) for exercicio, chave in chaves_planejamento}
+    keys = sorted({key for key in map(normalize_dotacao_key, chaves_dotacao) if key})
+    for i in range(0, len(keys), INVALIDAR_CHUNK):
+        pares.update(
+            (str(exercicio or "").strip(), chave or "")
+            for exercicio, chave in db.session.query(Dotacao.exercicio, Dotacao.chave_planejamento_norm)
+            .filter(Dotacao.chave_norm.in_(keys[i : i + INVALIDAR_CHUNK]))
+            .distinct()
+            .all()
+        )
+    params = [{"exercicio": exercicio, "chave": chave} for exercicio, chave in sorted(pares) if exercicio and chave]
+    if params:
+        db.session.execute(
+            text(
+                "UPDATE saldo_dotacao SET geracao = geracao + 1 "
+                "WHERE exercicio = :exercicio AND chave_planejamento_norm = :chave"
+            ),
+            params,
+        )
+    return len(params)
+
+
+def _aplicar(campo: str, deltas: dict[str, Decimal], agora) -> int:
+    """Soma o delta de cada chave em dotacao.<campo> e desconta de valor_atual."""
+    params = [
+        {"delta": delta, "chave": chave, "agora": agora} for chave, delta in deltas.items() if delta
+    ]
+    if params:
+        invalidar_saldos(chaves_dotacao=[p["chave"] for p in params])
+        db.session.execute(
+            text(
+                f"UPDATE dotacao SET {campo} = COALESCE({campo}, 0) + :delta, "
+                "valor_atual = COALESCE(valor_atual, 0) - :delta, alterado_em = :agora "
+                "WHERE ativo = 1 AND chave_norm = :chave"
+            ),
+            params,
+        )
+    return len(params)
+
+
+def _aplicar_situacao(situacoes: dict[str, str], agora) -> int:
+    """Grava na dotacao a situacao dos estornos da chave, so onde mudou."""
+    params = [{"situacao": situacao, "chave": chave, "agora": agora} for chave, situacao in situacoes.items()]
+    if params:
+        db.session.execute(
+            text(
+                "UPDATE dotacao SET situacao = :situacao, alterado_em = :agora "
+                "WHERE ativo = 1 AND chave_norm = :chave AND (situacao IS NULL OR situacao <> :situacao)"
+            ),
+            params,
+        )
+    return len(params)
+
+
+def _travar() -> None:
+    """
+    Trava do ledger no banco ate o commit. Web (estornos) e worker (pos-
+    ingestao) sincronizam em processos diferentes; sem a trava os dois veem os
+    mesmos movimentos faltando e aplicam o delta duas vezes.
+    """
+    # Fecha a transacao anterior: as leituras do sync comecam depois da trava.
+    db.session.commit()
+    consulta = db.session.query(TravaProcesso).filter(TravaProcesso.nome == TRAVA_LEDGER).with_for_update()
+    if consulta.first() is None:
+        try:
+            db.session.add(TravaProcesso(nome=TRAVA_LEDGER))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+        consulta.one()
+
+
+def saldos_ledger(chaves_dotacao) -> dict[str, tuple[Decimal, Decimal]]:
+    """(valor_ped_emp, valor_estorno) pelos movimentos ativos de varias chaves, numa consulta agrupada."""
+    keys = {key for key in map(normalize_dotacao_key, chaves_dotacao) if key}
+    saldos = {key: (Decimal("0"), Decimal("0")) for key in keys}
+    if not keys:
+        return saldos
+    rows = (
+        db.session.query(DotacaoMovimento.chave_norm, DotacaoMovimento.origem, sa.func.sum(DotacaoMovimento.valor))
+        .filter(DotacaoMovimento.chave_norm.in_(keys), DotacaoMovimento.ativo == True)  # noqa: E712
+        .group_by(DotacaoMovimento.chave_norm, DotacaoMovimento.origem)
+        .all()
+    )
+    for key, origem, total in rows:
+        ped_emp, estorno = saldos[key]
+        if origem == ORIGEM_ESTORNO:
+            estorno += to_decimal(total)
+        else:
+            ped_emp += to_decimal(total)
+        saldos[key] = (ped_emp, estorno)
+    return saldos
+
+
+def saldo_ledger(chave_dotacao: str) -> tuple[Decimal, Decimal]:
+    """(valor_ped_emp, valor_estorno) da chave pelos movimentos ativos."""
+    key = normalize_dotacao_key(chave_dotacao)
+    return saldos_ledger([chave_dotacao]).get(key, (Decimal("0"), Decimal("0")))
+
+
+def recalcular_dotacoes() -> int:
+    """Regrava o saldo de todas as dotacoes ativas a partir do ledger (sem commit)."""
+    totais: dict[tuple[str, bool], Decimal] = {}
+    for chave, origem, total in (
+        db.session.query(DotacaoMovimento.chave_norm, DotacaoMovimento.origem, sa.func.sum(DotacaoMovimento.valor))
+        .filter(DotacaoMovimento.ativo == True)  # noqa: E712
+        .group_by(DotacaoMovimento.chave_norm, DotacaoMovimento.origem)
+        .all()
+    ):
+        k = (chave, origem == ORIGEM_ESTORNO)
+        totais[k] = totais.get(k, Decimal("0")) + to_decimal(total)
+    agora = _now_local()
+    alteradas = []
+    for dot in Dotacao.query.filter(Dotacao.ativo == True).all():  # noqa: E712
+        key = normalize_dotacao_key(dot.chave_dotacao)
+        ped_emp = totais.get((key, False), Decimal("0"))
+        estorno = totais.get((key, True), Decimal("0"))
+        atual = to_decimal(dot.valor_dotacao) - estorno - ped_emp
+        if (to_decimal(dot.valor_ped_emp), to_decimal(dot.valor_estorno), to_decimal(dot.valor_atual)) != (
+            ped_emp,
+            estorno,
+            atual,
+        ):
+            dot.valor_ped_emp = ped_emp
+            dot.valor_estorno = estorno
+            dot.valor_atual = atual
+            dot.alterado_em = agora
+            alteradas.append((dot.exercicio, dot.chave_planejamento))
+    invalidar_saldos(chaves_planejamento=alteradas)
+    return len(alteradas)
+
+
+def sync_ledger(origens: tuple[str, ...] = ("ped", "emp", ORIGEM_ESTORNO)) -> dict[str, Any]:
+    """
+    Alinha o ledger com os dados ativos e aplica nas dotacoes so a diferenca
+    (movimentos novos menos retirados), junto com a situacao dos estornos. Na
+    primeira carga o saldo de todas as dotacoes e regravado a partir do ledger.
+    Tudo numa transacao, sob a trava do ledger.
+    """
+    _travar()
+    carga_inicial = db.session.query(DotacaoMovimento.id).first() is None
+    if carga_inicial:
+        origens = (*LEDGER_ORIGENS, ORIGEM_ESTORNO)
+    agora = _now_local()
+    resultado: dict[str, Any] = {}
+    situacoes: dict[str, str] = {}
+    for origem in origens:
+        deltas: dict[str, Decimal] = {}
+        if origem == ORIGEM_ESTORNO:
+            _sync_estornos(deltas, situacoes, agora)
+            campo = "valor_estorno"
+        else:
+            _sync_uploads(origem, deltas, agora)
+            campo = "valor_ped_emp"
+        resultado[origem] = 0 if carga_inicial else _aplicar(campo, deltas, agora)
+    if situacoes:
+        resultado["situacoes"] = _aplicar_situacao(situacoes, agora)
+    if carga_inicial:
+        resultado["recalculadas"] = recalcular_dotacoes()
+    db.session.commit()
+    return resultado
+
+
+def _retirar_duplicados() -> int:
+    """Deixa so o primeiro movimento ativo de cada (origem, ref_id, chave_norm)."""
+    agora = _now_local()
+    extras = []
+    for origem, ref_id, chave_norm, primeiro in (
+        db.session.query(
+            DotacaoMovimento.origem,
+            DotacaoMovimento.ref_id,
+            DotacaoMovimento.chave_norm,
+            sa.func.min(DotacaoMovimento.id),
+        )
+        .filter(DotacaoMovimento.ativo == True)  # noqa: E712
+        .group_by(DotacaoMovimento.origem, DotacaoMovimento.ref_id, DotacaoMovimento.chave_norm)
+        .having(sa.func.count() > 1)
+        .all()
+    ):
+        extras.extend(
+            DotacaoMovimento.query.filter(
+                DotacaoMovimento.origem == origem,
+                DotacaoMovimento.ref_id == ref_id,
+                DotacaoMovimento.chave_norm == chave_norm,
+                DotacaoMovimento.ativo == True,  # noqa: E712
+                DotacaoMovimento.id != primeiro,
+            ).all()
+        )
+    if extras:
+        _retirar(extras, {}, agora)
+        recalcular_dotacoes()
+    return len(extras)
+
+
+def ensure_ledger_schema() -> list[str]:
+    """
+    Cria a linha de trava do ledger e o indice unico do movimento ativo
+    (origem, ref_id, chave_norm). Duplicados deixados por syncs concorrentes
+    sao retirados (e o saldo regravado) antes do indice. Devolve o que criou.
+    """
+    inspector = sa.inspect(db.engine)
+    if not inspector.has_table(DotacaoMovimento.__tablename__):
+        return []
+    criados = []
+    if db.session.get(TravaProcesso, TRAVA_LEDGER) is None:
+        db.session.add(TravaProcesso(nome=TRAVA_LEDGER))
+        criados.append(f"{TravaProcesso.__tablename__}.{TRAVA_LEDGER}")
+    db.session.commit()
+    if UQ_MOVIMENTO_ATIVO in {i["name"] for i in inspector.get_indexes(DotacaoMovimento.__tablename__)}:
+        return criados
+    _travar()
+    retirados = _retirar_duplicados()
+    db.session.commit()
+    if retirados:
+        criados.append(f"{retirados} movimentos duplicados retirados")
+    with db.engine.begin() as conn:
+        if db.engine.dialect.name == "mysql":
+            # MySQL nao tem indice filtrado: a coluna gerada e NULL nos retirados,
+            # que assim nao colidem no indice unico.
+            colunas = {c["name"] for c in inspector.get_columns(DotacaoMovimento.__tablename__)}
+            if "ativo_unico" not in colunas:
+                conn.execute(
+                    text(
+                        "ALTER TABLE dotacao_movimento "
+                        "ADD COLUMN ativo_unico TINYINT AS (IF(ativo = 1, 1, NULL)) VIRTUAL"
+                    )
+                )
+            conn.execute(
+                text(
+                    f"CREATE UNIQUE INDEX {UQ_MOVIMENTO_ATIVO} "
+                    "ON dotacao_movimento (origem, ref_id, chave_norm, ativo_unico)"
+                )
+            )
+        else:
+            conn.execute(
+                text(
+                    f"CREATE UNIQUE INDEX {UQ_MOVIMENTO_ATIVO} "
+                    "ON dotacao_movimento (origem, ref_id, chave_norm) WHERE ativo = 1"
+                )
+            )
+    criados.append(UQ_MOVIMENTO_ATIVO)
+    return criados
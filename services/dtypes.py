@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import os
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from services.pipeline import iter_frame_chunks
+
+try:  # pragma: no cover - depende do ambiente
+    import pyarrow  # noqa: F401
+
+    TEXTO_DTYPE = "string[pyarrow]"
+except ImportError:  # pragma: no cover
+    TEXTO_DTYPE = None
+
+# Coluna vira categoria quando tem poucos valores distintos em relacao ao total.
+CATEGORIA_MAX_RATIO = 0.5
+CATEGORIA_MAX_VALORES = 5000
+# Linhas expandidas por vez nos tratamentos dos runners (tratar_em_partes).
+TRANSFORM_CHUNK = int(os.getenv("RUNNER_TRANSFORM_CHUNK", "20000"))
+# RUNNER_COMPACTAR=0 volta ao caminho sem compactacao (comparacao do bench_runner.py).
+COMPACTAR = os.getenv("RUNNER_COMPACTAR", "1").strip() != "0"
+
+
+def _eh_texto(serie: pd.Series) -> bool:
+    return serie.dtype == object or isinstance(serie.dtype, pd.StringDtype)
+
+
+def _compactar_serie(serie: pd.Series, total: int) -> pd.Series | None:
+    if not _eh_texto(serie):
+        return None
+    distintos = serie.nunique(dropna=True)
+    if distintos <= CATEGORIA_MAX_VALORES and distintos <= total * CATEGORIA_MAX_RATIO:
+        return serie.astype("category")
+    if TEXTO_DTYPE and pd.api.types.infer_dtype(serie, skipna=True) == "string":
+        # So texto puro: colunas mistas (numeros lidos como object) ficam intactas.
+        return serie.astype(TEXTO_DTYPE)
+    return None
+
+
+def compactar_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converte colunas de texto repetitivas (UO, UG, Situacao, Fonte, partes de
+    chave...) em category e o restante do texto em string Arrow, quando o
+    pyarrow esta instalado. Colunas nao textuais ficam como estao.
+    """
+    total = len(df)
+    if not total or not COMPACTAR:
+        return df
+    convertidas = {}
+    for i in range(len(df.columns)):
+        serie = _compactar_serie(df.iloc[:, i], total)
+        if serie is not None:
+            convertidas[i] = serie
+    if not convertidas:
+        return df
+    df = df.copy(deep=False)
+    for i, serie in convertidas.items():
+        df.isetitem(i, serie)
+    return df
+
+
+def _expandir_serie(serie: pd.Series) -> pd.Series:
+    if isinstance(serie.dtype, (pd.CategoricalDtype, pd.StringDtype)):
+        return serie.astype(object).where(serie.notna(), np.nan)
+    return serie
+
+
+def expandir_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Volta category/string para object (NaN nos vazios). Os tratamentos linha a
+    linha dos runners escrevem valores novos nas colunas e filtram por
+    select_dtypes("object"), entao recebem o frame expandido.
+    """
+    df = df.copy()
+    for i in range(len(df.columns)):
+        serie = df.iloc[:, i]
+        if isinstance(serie.dtype, (pd.CategoricalDtype, pd.StringDtype)):
+            df.isetitem(i, _expandir_serie(serie))
+    return df
+
+
+def _juntar_coluna(series: list[pd.Series]) -> pd.Series:
+    if all(isinstance(s.dtype, pd.CategoricalDtype) for s in series):
+        try:
+            return pd.Series(union_categoricals([s.array for s in series], ignore_order=True))
+        except TypeError:
+            pass  # categorias de tipos diferentes: junta expandido
+    elif all(s.dtype == series[0].dtype for s in series):
+        return pd.concat(series, ignore_index=True)
+    junta = pd.concat([_expandir_serie(s) for s in series], ignore_index=True)
+    compacta = _compactar_serie(junta, len(junta))
+    return junta if compacta is None else compacta
+
+
+def concatenar_compactos(partes: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Junta partes ja compactadas sem expandir o frame inteiro: as categorias de
+    cada coluna sao unidas e so a coluna cujo tipo variou entre as partes e
+    expandida (sozinha) para ser compactada de novo. Partes vazias saem quando
+    ha alguma com linhas; as colunas seguem a ordem da primeira aparicao.
+    """
+    partes = [p for p in partes if len(p)] or partes[:1]
+    if len(partes) <= 1:
+        return partes[0] if partes else pd.DataFrame()
+    colunas = list(dict.fromkeys(c for p in partes for c in p.columns))
+    index = partes[0].index.append([p.index for p in partes[1:]])
+    dados = {}
+    for col in colunas:
+        series = [
+            p[col] if col in p.columns else pd.Series(np.nan, index=p.index, dtype=object)
+            for p in partes
+        ]
+        dados[col] = _juntar_coluna(series).array
+    return pd.DataFrame(dados, index=index)
+
+
+def tratar_em_partes(
+    df: pd.DataFrame, tratar: Callable[[pd.DataFrame], pd.DataFrame], tamanho: int | None = None
+) -> pd.DataFrame:
+    """
+    Aplica um tratamento linha a linha de runner ao frame compactado, pedaco a
+    pedaco: so um pedaco fica expandido por vez e cada resultado volta
+    compactado antes do proximo. O tratamento nao pode depender do frame
+    inteiro (decisoes globais sao tomadas antes e passadas a ele).
+    """
+    if not COMPACTAR:
+        # Caminho antigo, frame inteiro expandido: so para a comparacao.
+        return tratar(df)
+    partes = [
+        compactar_dtypes(tratar(expandir_dtypes(parte)))
+        for parte in iter_frame_chunks(df, tamanho or TRANSFORM_CHUNK)
+    ]
+    if not partes:
+        return compactar_dtypes(tratar(expandir_dtypes(df)))
+    return concatenar_compactos(partes)
+
+
+def memoria_mb(df: pd.DataFrame) -> float:
+    return float(df.memory_usage(deep=True).sum()) / (1024 * 1024)
+
@@ -10,14 +10,28 @@ from typing import Any
 
 import pandas as pd
 from sqlalchemy import text, event
-from sqlalchemy.exc import SQLAlchemyError
 
 from models import db
+from services.dtypes import compactar_dtypes, expandir_dtypes, memoria_mb, tratar_em_partes
+from services.ingest_checkpoint import (
+    STAGE_TRANSFORMED,
+    clear_checkpoint,
+    commit_batches,
+    deactivate_once,
+    descartar_pendentes,
+    encerrar_falha,
+    gravar_saida,
+    saida_gravada,
+    save_checkpoint,
+)
+from services.job_control import JobProgress
+from services.pipeline import iter_frame_chunks, prefetch, start_background
 
 BATCH_SIZE = 1000
 INPUT_DIR = Path("upload/est_emp")
 OUTPUT_DIR = Path("outputs/td_est_emp")
 HEADER_INICIO = ["exercicio", "n_est", "n_emp", "n_ped", "historico"]
+COLUNAS_DATA = ["Data Emissão", "Data Criação"]
 
 _FAST_EXEC_ENABLED = False
 
@@ -174,7 +188,7 @@ def tratar_colunas_texto(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def tratar_colunas_numericas(df: pd.DataFrame) -> pd.DataFrame:
+def tratar_colunas_numericas(df: pd.DataFrame, datas: bool = True) -> pd.DataFrame:
     col_monetarias = [
         "Valor EMP",
         "Valor Est EMP (A LIQ/Em LIQ sem AQS)",
@@ -200,8 +214,19 @@ def tratar_colunas_numericas(df: pd.DataFrame) -> pd.DataFrame:
         - valores_numericos.get("Valor Est EMP (Em LIQ com AQS)", 0)
     ).apply(_format_ptbr)
 
-    col_datas = ["Data Emissão", "Data Criação"]
-    for col in col_datas:
+    if datas:
+        df = tratar_colunas_data(df)
+
+    col_numericas = ["Exercício", "UG", "UO"]
+    for col in col_numericas:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna("NÃO INFORMADO").astype(str)
+
+    return df
+
+
+def tratar_colunas_data(df: pd.DataFrame) -> pd.DataFrame:
+    for col in COLUNAS_DATA:
         if col in df.columns:
             serie_str = df[col].astype(str).str.strip()
             if serie_str.str.match(r"\d{4}-\d{2}-\d{2}").all():
@@ -209,12 +234,6 @@ def tratar_colunas_numericas(df: pd.DataFrame) -> pd.DataFrame:
             else:
                 serie_dt = pd.to_datetime(serie_str, errors="coerce", dayfirst=True)
             df[col] = serie_dt.dt.strftime("%d/%m/%Y").fillna("NÃO INFORMADO")
-
-    col_numericas = ["Exercício", "UG", "UO"]
-    for col in col_numericas:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna("NÃO INFORMADO").astype(str)
-
     return df
 
 
@@ -307,16 +326,36 @@ def criar_writer_seguro(output_path: Path) -> tuple[pd.ExcelWriter, Path]:
         return pd.ExcelWriter(fallback, engine="xlsxwriter"), fallback
 
 
-def processar_est_emp(file_path: Path) -> Path:
+def _tratar_linhas_est_emp(df: pd.DataFrame, datas: pd.DataFrame) -> pd.DataFrame:
+    df_tratado = tratar_colunas_texto(remover_colunas(df))
+    df_tratado = tratar_colunas_numericas(df_tratado, datas=False)
+    for col in datas.columns:
+        df_tratado[col] = datas.loc[df_tratado.index, col]
+    df_tratado = adicionar_colunas_empenho(df_tratado)
+    return reorganizar_colunas(df_tratado)
+
+
+def tratar_est_emp(file_path: Path) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Le a aba e devolve (original, tratado), ambos compactados. O tratamento
+    roda em pedacos (tratar_em_partes); as datas, cujo formato o pandas
+    deduz da coluna inteira, sao convertidas antes, de uma vez.
+    """
     xls = pd.ExcelFile(file_path)
-    df_est = extrair_df_est(xls, sheet_name=xls.sheet_names[0])
+    df_est = compactar_dtypes(extrair_df_est(xls, sheet_name=xls.sheet_names[0]))
+
+    colunas_data = [col for col in COLUNAS_DATA if col in df_est.columns]
+    datas = tratar_colunas_data(tratar_colunas_texto(expandir_dtypes(df_est[colunas_data])))
+    df_final = tratar_em_partes(df_est, lambda parte: _tratar_linhas_est_emp(parte, datas))
+    return df_est, df_final
+
+
+def processar_est_emp(file_path: Path) -> Path:
+    df_est, df_final = tratar_est_emp(file_path)
+    return salvar_est_emp(df_est, df_final, file_path)
 
-    df_limpo = remover_colunas(df_est)
-    df_tratado = tratar_colunas_texto(df_limpo)
-    df_tratado = tratar_colunas_numericas(df_tratado)
-    df_tratado = adicionar_colunas_empenho(df_tratado)
-    df_final = reorganizar_colunas(df_tratado)
 
+def salvar_est_emp(df_est: pd.DataFrame, df_final: pd.DataFrame, file_path: Path) -> Path:
     output_dir = OUTPUT_DIR
     output_dir.mkdir(parents=True, exist_ok=True)
     output_file = output_dir / f"{file_path.stem}_tratado.xlsx"
@@ -452,7 +491,11 @@ def _enable_fast_executemany() -> None:
 
 
 def update_database(
-    df: pd.DataFrame, data_arquivo: datetime, user_email: str, upload_id: int
+    df: pd.DataFrame,
+    data_arquivo: datetime,
+    user_email: str,
+    upload_id: int,
+    progress: JobProgress | None = None,
 ) -> int:
     insert_sql = text(
         """
@@ -473,39 +516,83 @@ def update_database(
         """
     )
 
-    try:
-        db.session.execute(text("UPDATE est_emp SET ativo = 0 WHERE ativo = 1"))
-        db.session.commit()
-    except SQLAlchemyError:
-        db.session.rollback()
-        raise
+    deactivate_once("est_emp", upload_id, "est_emp")
 
     _enable_fast_executemany()
-    registros = montar_registros_para_db(df, data_arquivo, user_email, upload_id)
-    total_registros = len(registros)
-    print(f" Gravando {total_registros} registros no banco...")
-    total = 0
-    for start in range(0, len(registros), BATCH_SIZE):
-        chunk = registros[start : start + BATCH_SIZE]
-        try:
-            db.session.execute(insert_sql, chunk)
-            db.session.commit()
-            total += len(chunk)
-            print(f" Inseridos {total}/{total_registros} registros...")
-        except SQLAlchemyError:
-            db.session.rollback()
-            raise
-    return total
+    print(f" Gravando {len(df)} registros no banco...")
+    chunks = prefetch(
+        montar_registros_para_db(expandir_dtypes(parte), data_arquivo, user_email, upload_id)
+        for parte in iter_frame_chunks(df, BATCH_SIZE)
+    )
+    return commit_batches(
+        "est_emp",
+        upload_id,
+        "est_emp",
+        insert_sql,
+        chunks,
+        len(df),
+        on_batch=lambda total, total_registros: _on_batch(total, total_registros, progress),
+    )
+
+
+def _on_batch(total: int, total_registros: int, progress: JobProgress | None) -> None:
+    print(f" Inseridos {total}/{total_registros} registros...")
+    if progress:
+        progress.batch(total, total_registros)
+
+
+def _frame_como_texto(df: pd.DataFrame) -> pd.DataFrame:
+    """Mesmo formato da releitura do xlsx com dtype=str: texto, vazios como NaN."""
+    df = df.copy(deep=False)
+    for col in df.columns:
+        serie = df[col]
+        if isinstance(serie.dtype, pd.StringDtype):
+            continue
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            if pd.api.types.infer_dtype(serie.cat.categories) == "string":
+                continue
+            serie = serie.astype(object)
+        df[col] = serie.where(serie.isna(), serie.astype(str))
+    return df
 
 
 def run_est_emp(
-    file_path: Path, data_arquivo: datetime, user_email: str, upload_id: int
+    file_path: Path,
+    data_arquivo: datetime,
+    user_email: str,
+    upload_id: int,
+    progress: JobProgress | None = None,
 ) -> tuple[int, Path]:
-    ensure_dirs()
-    move_existing_to_tmp(OUTPUT_DIR)
-    output_path = processar_est_emp(file_path)
+    progress = progress or JobProgress("est_emp", upload_id)
+    descartar_pendentes("est_emp", upload_id, "est_emp")
+    progress.start("Lendo a planilha EST EMP.")
+    try:
+        total, output_path = _run_est_emp(file_path, data_arquivo, user_email, upload_id, progress)
+    except Exception as exc:
+        progress.fail(exc, retomavel=encerrar_falha("est_emp", upload_id, "est_emp", exc))
+        raise
+    progress.finish(f"Processado com sucesso. Registros: {total}.", output_path.name)
+    return total, output_path
+
 
-    df_tratado = pd.read_excel(output_path, sheet_name="est_emp_tratado", dtype=str)
+def _run_est_emp(
+    file_path: Path, data_arquivo: datetime, user_email: str, upload_id: int, progress: JobProgress
+) -> tuple[int, Path]:
+    ensure_dirs()
+    # A retomada reaproveita a planilha que a execucao anterior ja gravou.
+    output_path = saida_gravada("est_emp", upload_id, OUTPUT_DIR)
+    if output_path is None:
+        move_existing_to_tmp(OUTPUT_DIR)
+    df_est, df_final = tratar_est_emp(file_path)
+    print(f" Memoria EST EMP: est={memoria_mb(df_est):.1f} MB, tratado={memoria_mb(df_final):.1f} MB")
+    save_checkpoint("est_emp", upload_id, STAGE_TRANSFORMED, rows_parsed=len(df_final))
+    progress.stage(f"Planilha tratada ({len(df_final)} linhas). Gravando planilha e banco.", 40)
+
+    # O xlsx de saida e gravado em paralelo com a insercao no banco.
+    workbook = None
+    if output_path is None:
+        workbook = start_background(gravar_saida, "est_emp", upload_id, salvar_est_emp, df_est, df_final, file_path)
+    df_tratado = _frame_como_texto(df_final)
     colunas_data = {"data_emissao", "data_criacao", "data_atualizacao", "data_arquivo"}
     for col in df_tratado.columns:
         if _normalize_col(col) in colunas_data:
@@ -514,5 +601,9 @@ def run_est_emp(
                 df_tratado[col] = pd.to_datetime(serie_str, errors="coerce", dayfirst=False)
             else:
                 df_tratado[col] = pd.to_datetime(serie_str, errors="coerce", dayfirst=True)
-    total = update_database(df_tratado, data_arquivo, user_email, upload_id)
+    total = update_database(df_tratado, data_arquivo, user_email, upload_id, progress)
+    if workbook is not None:
+        output_path = workbook.result()
+    # Checkpoint so vale para retomar um job interrompido; concluido, descarta.
+    clear_checkpoint("est_emp", upload_id)
     return total, output_path
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import math
+import os
+import tempfile
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Callable, Iterable, Iterator
+
+import xlsxwriter
+from flask import Response
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Pedaco (bytes) de cada leitura do arquivo pronto enviado ao cliente.
+EXCEL_CHUNK = int(os.getenv("EXCEL_CHUNK_KB", "256")) * 1024
+FONTE = {"font_name": "Helvetica", "font_size": 8}
+# Positivo azul, negativo vermelho, zero sem casas.
+FORMATO_AZUL_VERMELHO = "[Blue]#,##0.00;[Red]-#,##0.00;0"
+FORMATO_MOEDA = "#,##0.00"
+# Mesmos formatos que o pandas usava para data/hora sem formato proprio.
+_FORMATO_DATA = "yyyy-mm-dd"
+_FORMATO_DATA_HORA = "yyyy-mm-dd hh:mm:ss"
+
+
+@dataclass(frozen=True)
+class ColunaExcel:
+    """
+    Coluna da planilha: titulo do cabecalho, chave na linha (ou valor(row)
+    calculado), formato numerico e inversao de sinal (valor vazio vira 0).
+    """
+
+    titulo: str
+    chave: str | None = None
+    formato: str | None = None
+    inverter: bool = False
+    valor: Callable[[dict], Any] | None = None
+
+    def extrair(self, row: dict):
+        val = self.valor(row) if self.valor else row.get(self.chave)
+        if self.inverter:
+            return -(val or 0)
+        return val
+
+
+def colunas_excel(titulos: Iterable[tuple[str, str]], **formatos: str) -> list[ColunaExcel]:
+    """[(chave, titulo)] -> colunas; formatos por chave (chave=formato)."""
+    return [ColunaExcel(titulo, chave, formatos.get(chave)) for chave, titulo in titulos]
+
+
+def _escrever(caminho: str, colunas: list[ColunaExcel], lotes: Iterable[Iterable[dict]], aba: str) -> int:
+    wb = xlsxwriter.Workbook(
+        caminho,
+        {
+            # Cada linha vai para o disco assim que a seguinte comeca.
+            "constant_memory": True,
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+            "remove_timezone": True,
+        },
+    )
+    try:
+        ws = wb.add_worksheet(aba)
+        base = wb.add_format(FONTE)
+        formatos = [wb.add_format({**FONTE, "num_format": c.formato}) if c.formato else base for c in colunas]
+        datas: dict[tuple[int, bool], Any] = {}
+        ws.set_default_row(12)
+        if colunas:
+            ws.set_column(0, len(colunas) - 1, None, base)
+        ws.write_row(0, 0, [c.titulo for c in colunas], base)
+        linha = 0
+        for lote in lotes:
+            for row in lote:
+                linha += 1
+                for i, coluna in enumerate(colunas):
+                    val = coluna.extrair(row)
+                    if isinstance(val, float) and not math.isfinite(val):
+                        # xlsxwriter nao aceita NaN/inf; o to_excel antigo deixava em branco.
+                        val = None
+                    fmt = formatos[i]
+                    if isinstance(val, date) and not coluna.formato:
+                        hora = isinstance(val, datetime)
+                        fmt = datas.get((i, hora))
+                        if fmt is None:
+                            fmt = datas[(i, hora)] = wb.add_format(
+                                {**FONTE, "num_format": _FORMATO_DATA_HORA if hora else _FORMATO_DATA}
+                            )
+                    ws.write(linha, i, val, fmt)
+    finally:
+        wb.close()
+    return linha
+
+
+def _ler(caminho: str) -> Iterator[bytes]:
+    try:
+        with open(caminho, "rb") as arq:
+            while True:
+                pedaco = arq.read(EXCEL_CHUNK)
+                if not pedaco:
+                    break
+                yield pedaco
+    finally:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+def resposta_excel(
+    colunas: list[ColunaExcel],
+    lotes: Iterable[Iterable[dict]],
+    filename: str,
+    aba: str = "Sheet1",
+) -> Response | None:
+    """
+    Gera o xlsx em arquivo temporario, linha a linha a partir dos lotes
+    (memoria constante, sem DataFrame nem releitura com openpyxl), e envia o
+    arquivo em pedacos, apagando-o no fim. None se nao houve nenhuma linha.
+    """
+    fd, caminho = tempfile.mkstemp(prefix="export_", suffix=".xlsx")
+    os.close(fd)
+    try:
+        total = _escrever(caminho, colunas, lotes, aba)
+        tamanho = os.path.getsize(caminho)
+    except BaseException:
+        os.remove(caminho)
+        raise
+    if not total:
+        os.remove(caminho)
+        return None
+    resp = Response(_ler(caminho), mimetype=XLSX_MIMETYPE)
+    resp.headers["Content-Length"] = str(tamanho)
+    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
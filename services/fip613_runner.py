@@ -5,8 +5,18 @@ from datetime import datetime
 from pathlib import Path
 import pandas as pd
 from sqlalchemy import text
-from sqlalchemy.exc import SQLAlchemyError
-from models import db
+from services.dtypes import compactar_dtypes, expandir_dtypes, memoria_mb
+from services.ingest_checkpoint import (
+    clear_checkpoint,
+    commit_batches,
+    deactivate_once,
+    descartar_pendentes,
+    encerrar_falha,
+    gravar_saida,
+    saida_gravada,
+)
+from services.job_control import JobProgress
+from services.pipeline import iter_frame_chunks
 from openpyxl import load_workbook
 from openpyxl.styles import Font
 
@@ -67,6 +77,7 @@ def load_clean_data(file_path, sheet_name: str | None = None):
         if "UO" in row.values and "UG" in row.values:
             header_row_index = i
             break
+    del raw_data
     if header_row_index is None:
         return None
 
@@ -167,7 +178,7 @@ def save_clean_data(data, output_dir: Path) -> Path:
     return output_path
 
 
-def update_database(data, ano, data_arquivo, user_email, upload_id):
+def update_database(data, ano, data_arquivo, user_email, upload_id, progress: JobProgress | None = None):
     insert_sql = text(
         """
         INSERT INTO fip613 (
@@ -188,41 +199,66 @@ def update_database(data, ano, data_arquivo, user_email, upload_id):
     )
 
     # desativa versões anteriores
+    deactivate_once("fip613", upload_id, "fip613")
+
+    def _chunks():
+        for parte in iter_frame_chunks(data, BATCH_SIZE):
+            chunk = expandir_dtypes(parte).to_dict(orient="records")
+            for r in chunk:
+                r["data_atualizacao"] = datetime.utcnow()
+                r["ano"] = ano
+                r["data_arquivo"] = data_arquivo
+                r["user_email"] = user_email
+                r["upload_id"] = upload_id
+                r["ativo"] = True
+            yield chunk
+
+    return commit_batches(
+        "fip613",
+        upload_id,
+        "fip613",
+        insert_sql,
+        _chunks(),
+        len(data),
+        on_batch=progress.batch if progress else None,
+    )
+
+
+def run_fip613(
+    file_path: Path,
+    data_arquivo: datetime,
+    user_email: str,
+    upload_id: int,
+    progress: JobProgress | None = None,
+) -> tuple[int, Path]:
+    progress = progress or JobProgress("fip613", upload_id)
+    descartar_pendentes("fip613", upload_id, "fip613")
+    progress.start("Lendo o arquivo FIP 613.")
     try:
-        db.session.execute(text("UPDATE fip613 SET ativo = 0 WHERE ativo = 1"))
-        db.session.commit()
-    except SQLAlchemyError:
-        db.session.rollback()
+        total, output_path = _run_fip613(file_path, data_arquivo, user_email, upload_id, progress)
+    except Exception as exc:
+        progress.fail(exc, retomavel=encerrar_falha("fip613", upload_id, "fip613", exc))
         raise
-
-    rows = data.to_dict(orient="records")
-    total = 0
-    for start in range(0, len(rows), BATCH_SIZE):
-        chunk = rows[start : start + BATCH_SIZE]
-        for r in chunk:
-            r["data_atualizacao"] = datetime.utcnow()
-            r["ano"] = ano
-            r["data_arquivo"] = data_arquivo
-            r["user_email"] = user_email
-            r["upload_id"] = upload_id
-            r["ativo"] = True
-        try:
-            db.session.execute(insert_sql, chunk)
-            db.session.commit()
-            total += len(chunk)
-        except SQLAlchemyError as exc:
-            db.session.rollback()
-            raise exc
-    return total
+    progress.finish(f"Processado com sucesso. Registros: {total}.", output_path.name)
+    return total, output_path
 
 
-def run_fip613(file_path: Path, data_arquivo: datetime, user_email: str, upload_id: int) -> tuple[int, Path]:
+def _run_fip613(file_path: Path, data_arquivo: datetime, user_email: str, upload_id: int, progress: JobProgress):
     ensure_dirs()
     ano = get_year_from_file(file_path)
     data = load_clean_data(file_path)
     if data is None or ano is None:
         raise RuntimeError("Não foi possível ler o arquivo FIP 613 (cabeçalho ou ano ausente).")
+    data = compactar_dtypes(data)
+    print(f" Memoria FIP613: {memoria_mb(data):.1f} MB")
+    progress.stage(f"Arquivo lido ({len(data)} linhas). Gerando planilha.", 30)
 
-    output_path = save_clean_data(data, OUTPUT_DIR)
-    total = update_database(data, ano, data_arquivo, user_email, upload_id)
+    # A retomada reaproveita a planilha que a execucao anterior ja gravou.
+    output_path = saida_gravada("fip613", upload_id, OUTPUT_DIR) or gravar_saida(
+        "fip613", upload_id, save_clean_data, data, OUTPUT_DIR
+    )
+    progress.stage("Planilha gerada. Gravando no banco.", 50)
+    total = update_database(data, ano, data_arquivo, user_email, upload_id, progress)
+    # Checkpoint so vale para retomar um job interrompido; concluido, descarta.
+    clear_checkpoint("fip613", upload_id)
     return total, output_path
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterable, TypeVar
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db
+from services.job_status import checkpoint_upload_ids, read_checkpoint, update_checkpoint
+from services.post_ingest import bump_dataset_version
+
+T = TypeVar("T")
+
+STAGE_PARSED = "parsed"
+STAGE_TRANSFORMED = "transformed"
+STAGE_WORKBOOK = "workbook_written"
+STAGE_DEACTIVATED = "deactivated"
+STAGE_BATCHES = "batches_committed"
+STAGE_DONE = "done"
+
+_STAGE_ORDER = [
+    STAGE_PARSED,
+    STAGE_TRANSFORMED,
+    STAGE_WORKBOOK,
+    STAGE_DEACTIVATED,
+    STAGE_BATCHES,
+    STAGE_DONE,
+]
+
+TRANSIENT_DB_ERRORS = (
+    "MySQL server has gone away",
+    "Packet sequence number wrong",
+    "Lost connection to MySQL server",
+    "Communication link failure",
+)
+
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+
+def is_transient_db_error(exc: BaseException) -> bool:
+    msg = str(exc)
+    return any(token in msg for token in TRANSIENT_DB_ERRORS)
+
+
+def reset_db_connection() -> None:
+    """Descarta a sessao e o pool para que a proxima operacao abra conexao nova."""
+    try:
+        db.session.rollback()
+    except Exception:
+        pass
+    db.session.remove()
+    try:
+        db.engine.dispose()
+    except Exception:
+        pass
+
+
+def with_db_retry(
+    fn: Callable[[], T],
+    attempts: int = RETRY_ATTEMPTS,
+    base_delay: float = RETRY_BASE_DELAY,
+    max_delay: float = RETRY_MAX_DELAY,
+) -> T:
+    """
+    Executa fn; em queda de conexao reconecta e tenta de novo com backoff
+    exponencial limitado. Erros nao transitorios sobem na primeira falha.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except SQLAlchemyError as exc:
+            db.session.rollback()
+            attempt += 1
+            if not is_transient_db_error(exc) or attempt >= attempts:
+                raise
+            reset_db_connection()
+            time.sleep(min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+
+def load_checkpoint(kind: str, upload_id: int) -> dict[str, Any]:
+    return read_checkpoint(kind, upload_id)
+
+
+def save_checkpoint(kind: str, upload_id: int, stage: str, **fields: Any) -> dict[str, Any]:
+    """Grava campos do checkpoint; o estagio so avanca, nunca volta."""
+
+    def _atualizar(checkpoint: dict[str, Any]) -> dict[str, Any]:
+        checkpoint.update(fields)
+        if not stage_reached(checkpoint, stage):
+            checkpoint["stage"] = stage
+        return checkpoint
+
+    return update_checkpoint(kind, upload_id, _atualizar)
+
+
+def clear_checkpoint(kind: str, upload_id: int) -> None:
+    update_checkpoint(kind, upload_id, lambda _: {})
+
+
+def stage_reached(checkpoint: dict[str, Any], stage: str) -> bool:
+    current = checkpoint.get("stage")
+    if current not in _STAGE_ORDER:
+        return False
+    return _STAGE_ORDER.index(current) >= _STAGE_ORDER.index(stage)
+
+
+def deactivate_once(kind: str, upload_id: int, table: str) -> None:
+    """Desativa as linhas anteriores apenas uma vez por job (nao repete ao retomar)."""
+    if stage_reached(load_checkpoint(kind, upload_id), STAGE_DEACTIVATED):
+        return
+
+    def _do() -> list:
+        anteriores = [
+            row[0]
+            for row in db.session.execute(text(f"SELECT DISTINCT upload_id FROM {table} WHERE ativo = 1")).all()
+        ]
+        db.session.execute(text(f"UPDATE {table} SET ativo = 0 WHERE ativo = 1"))
+        db.session.commit()
+        return anteriores
+
+    anteriores = with_db_retry(_do)
+    save_checkpoint(kind, upload_id, STAGE_DEACTIVATED, rows_committed=0, previous_upload_ids=anteriores)
+
+
+def rollback_upload(kind: str, upload_id: int, table: str) -> None:
+    """
+    Desfaz um job interrompido: apaga as linhas ja inseridas por ele e reativa
+    o conjunto que estava ativo antes da desativacao.
+    """
+    checkpoint = load_checkpoint(kind, upload_id)
+    if not stage_reached(checkpoint, STAGE_DEACTIVATED):
+        return
+    anteriores = checkpoint.get("previous_upload_ids") or []
+    ids = [int(v) for v in anteriores if v is not None]
+    inclui_nulos = any(v is None for v in anteriores)
+
+    def _do() -> None:
+        db.session.execute(text(f"DELETE FROM {table} WHERE upload_id = :upload_id"), {"upload_id": upload_id})
+        if ids:
+            params = {f"id{i}": v for i, v in enumerate(ids)}
+            marcadores = ", ".join(f":id{i}" for i in range(len(ids)))
+            db.session.execute(text(f"UPDATE {table} SET ativo = 1 WHERE upload_id IN ({marcadores})"), params)
+        if inclui_nulos:
+            db.session.execute(text(f"UPDATE {table} SET ativo = 1 WHERE upload_id IS NULL"))
+        db.session.commit()
+
+    with_db_retry(_do)
+    clear_checkpoint(kind, upload_id)
+    bump_dataset_version(kind)
+
+
+def pode_retomar(kind: str, upload_id: int) -> bool:
+    """O job parou depois de desativar o conjunto anterior e guarda os lotes ja confirmados."""
+    return stage_reached(load_checkpoint(kind, upload_id), STAGE_DEACTIVATED)
+
+
+def encerrar_falha(kind: str, upload_id: int, table: str, exc: BaseException) -> bool:
+    """
+    Destino de um job que falhou. Queda de conexao com o banco (depois dos
+    retries) deixa o checkpoint para retomar o mesmo upload_id; qualquer
+    outra falha, inclusive o cancelamento, desfaz o job. True = retomavel.
+    """
+    if is_transient_db_error(exc) and pode_retomar(kind, upload_id):
+        return True
+    try:
+        rollback_upload(kind, upload_id, table)
+    finally:
+        clear_checkpoint(kind, upload_id)
+    return False
+
+
+def descartar_pendentes(kind: str, upload_id: int, table: str) -> list[int]:
+    """
+    Desfaz os jobs interrompidos do tipo que nao sao este: um upload novo
+    substitui o retomavel, e a desativacao dele tem de ver o conjunto
+    anterior a ambos.
+    """
+    descartados = []
+    for pendente in checkpoint_upload_ids(kind):
+        if pendente != upload_id:
+            rollback_upload(kind, pendente, table)
+            clear_checkpoint(kind, pendente)
+            descartados.append(pendente)
+    return descartados
+
+
+def saida_gravada(kind: str, upload_id: int, pasta: Path) -> Path | None:
+    """Planilha de saida ja gravada por uma execucao anterior do mesmo job."""
+    nome = load_checkpoint(kind, upload_id).get("output_filename")
+    if nome and (pasta / nome).exists():
+        return pasta / nome
+    return None
+
+
+def gravar_saida(kind: str, upload_id: int, gravar: Callable[..., Path], *args: Any) -> Path:
+    """Grava a planilha de saida e registra no checkpoint (a retomada nao grava de novo)."""
+    output_path = gravar(*args)
+    save_checkpoint(kind, upload_id, STAGE_WORKBOOK, output_filename=output_path.name)
+    return output_path
+
+
+def _count_committed(table: str, upload_id: int) -> int:
+    return int(
+        db.session.execute(
+            text(f"SELECT COUNT(*) FROM {table} WHERE upload_id = :upload_id AND ativo = 1"),
+            {"upload_id": upload_id},
+        ).scalar()
+        or 0
+    )
+
+
+def commit_batches(
+    kind: str,
+    upload_id: int,
+    table: str,
+    insert_sql,
+    chunks: Iterable[list[dict[str, Any]]],
+    total_registros: int,
+    on_batch: Callable[[int, int], None] | None = None,
+) -> int:
+    """
+    Insere os lotes recebidos, gravando no checkpoint quantas linhas ja foram
+    confirmadas. Ao retomar (ou apos reconexao) pula o que ja foi confirmado,
+    conferindo no banco se o commit interrompido chegou a valer.
+    """
+    checkpoint = load_checkpoint(kind, upload_id)
+    total = int(checkpoint.get("rows_committed") or 0) if stage_reached(checkpoint, STAGE_DEACTIVATED) else 0
+    if total:
+        total = min(with_db_retry(lambda: _count_committed(table, upload_id)), total_registros)
+
+    skip = total
+    for chunk in chunks:
+        if skip >= len(chunk):
+            skip -= len(chunk)
+            continue
+        if skip:
+            chunk = chunk[skip:]
+            skip = 0
+        expected = total + len(chunk)
+        state = {"retrying": False}
+
+        def _do() -> None:
+            if state["retrying"] and _count_committed(table, upload_id) >= expected:
+                return
+            state["retrying"] = True
+            db.session.execute(insert_sql, chunk)
+            db.session.commit()
+
+        with_db_retry(_do)
+        total = expected
+        save_checkpoint(kind, upload_id, STAGE_BATCHES, rows_committed=total, rows_total=total_registros)
+        if on_batch:
+            on_batch(total, total_registros)
+    return total
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from typing import Callable
+
+from services.job_status import (
+    clear_cancel_flag,
+    read_cancel_flag,
+    update_status_fields,
+    write_status,
+)
+from services.post_ingest import bump_dataset_version
+
+CANCEL_TOKEN = "PROCESSAMENTO_CANCELADO"
+
+
+class JobCancelado(RuntimeError):
+    """Levantada quando o usuario pede o cancelamento do job."""
+
+    def __init__(self) -> None:
+        super().__init__(CANCEL_TOKEN)
+
+
+class JobProgress:
+    """
+    Progresso por estagio/lote dos runners Python no status store, com checagem
+    do flag .cancel (o mesmo usado pelos runners Node) a cada passo.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        upload_id: int | None,
+        callback: Callable[[str, int | None], None] | None = None,
+    ) -> None:
+        self.kind = kind
+        self.upload_id = upload_id
+        self.callback = callback
+
+    def _ativo(self) -> bool:
+        return self.upload_id is not None
+
+    def start(self, message: str = "Processamento iniciado.") -> None:
+        if not self._ativo():
+            return
+        clear_cancel_flag(self.kind, self.upload_id)
+        write_status(self.kind, self.upload_id, "em processamento", message, progress=0)
+        bump_dataset_version(self.kind)
+
+    def check_cancel(self) -> None:
+        if self._ativo() and read_cancel_flag(self.kind, self.upload_id):
+            raise JobCancelado()
+
+    def stage(self, message: str, progress: int | None = None) -> None:
+        self.check_cancel()
+        if self._ativo():
+            fields = {"message": message}
+            if progress is not None:
+                fields["progress"] = int(progress)
+            update_status_fields(self.kind, self.upload_id, **fields)
+        if self.callback:
+            self.callback(message, progress)
+
+    def batch(self, done: int, total: int, inicio: int = 50, fim: int = 99) -> None:
+        """Lote gravado: distribui o progresso entre inicio e fim (%)."""
+        pct = inicio if not total else inicio + int((fim - inicio) * min(done, total) / total)
+        self.stage(f"Gravando registros no banco ({done}/{total}).", pct)
+
+    def finish(self, message: str, output_filename: str | None = None) -> None:
+        if not self._ativo():
+            return
+        write_status(self.kind, self.upload_id, "processamento finalizado", message, output_filename, progress=100)
+        clear_cancel_flag(self.kind, self.upload_id)
+
+    def fail(self, exc: BaseException, retomavel: bool = False) -> None:
+        """retomavel: o job guardou os lotes confirmados e pode ser retomado pelo mesmo upload_id."""
+        if not self._ativo():
+            return
+        if isinstance(exc, JobCancelado) or CANCEL_TOKEN in str(exc):
+            write_status(self.kind, self.upload_id, "processamento cancelado", "Cancelado pelo usuario.")
+        elif retomavel:
+            write_status(
+                self.kind,
+                self.upload_id,
+                "falha no processamento",
+                f"{type(exc).__name__}: {exc}. Use Retomar para continuar de onde parou.",
+            )
+            update_status_fields(self.kind, self.upload_id, retomavel=True)
+        else:
+            write_status(self.kind, self.upload_id, "falha no processamento", f"{type(exc).__name__}: {exc}")
+        clear_cancel_flag(self.kind, self.upload_id)
+        bump_dataset_version(self.kind)
@@ -1,17 +1,214 @@
 from __future__ import annotations
 
 import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterator
 
 STATUS_DIR = Path("outputs/status")
+STATUS_DB = STATUS_DIR / "job_status.sqlite3"
 _CANCEL_SUFFIX = ".cancel"
 
+FINAL_STATES = {"processamento finalizado", "falha no processamento", "processamento cancelado"}
+# Intervalo (s) do vigia de mudancas de outros processos (worker, runners Node);
+# so roda enquanto ha alguem esperando, e sao so stats de arquivo.
+STATUS_WATCH_INTERVAL = float(os.getenv("STATUS_WATCH_INTERVAL", "1"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_status (
+    kind TEXT NOT NULL,
+    upload_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_ts REAL NOT NULL,
+    PRIMARY KEY (kind, upload_id)
+)
+"""
+# Checkpoint de retomada fora do payload: write_status troca o payload
+# inteiro a cada estado e nao pode apagar o ponto de retomada do job.
+_SCHEMA_CHECKPOINT = """
+CREATE TABLE IF NOT EXISTS job_checkpoint (
+    kind TEXT NOT NULL,
+    upload_id INTEGER NOT NULL,
+    checkpoint TEXT NOT NULL,
+    updated_ts REAL NOT NULL,
+    PRIMARY KEY (kind, upload_id)
+)
+"""
+_schema_ready = False
+
+
+def _safe_kind(kind: str) -> str:
+    return (kind or "").strip().lower()
+
 
 def status_path(kind: str, upload_id: int) -> Path:
-    safe_kind = (kind or "").strip().lower()
-    return STATUS_DIR / f"{safe_kind}_{upload_id}.json"
+    """Arquivo JSON escrito pelos runners Node (lido e importado pelo store)."""
+    return STATUS_DIR / f"{_safe_kind(kind)}_{upload_id}.json"
+
+
+@contextmanager
+def _connect(write: bool = False) -> Iterator[sqlite3.Connection]:
+    """
+    Conexao curta com o SQLite em modo WAL: leitores nao bloqueiam o escritor
+    e cada escrita e um read-modify-write dentro de BEGIN IMMEDIATE, entao
+    processos/threads concorrentes nunca veem status pela metade.
+    """
+    global _schema_ready
+    STATUS_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(STATUS_DB), timeout=10, isolation_level=None)
+    try:
+        if not _schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            conn.execute(_SCHEMA_CHECKPOINT)
+            _schema_ready = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if write:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        else:
+            yield conn
+    finally:
+        conn.close()
+
+
+_mudanca = threading.Condition()
+_geracao = 0
+_esperando = 0
+_vigia: threading.Thread | None = None
+
+
+def _notificar() -> None:
+    global _geracao
+    with _mudanca:
+        _geracao += 1
+        _mudanca.notify_all()
+
+
+def _assinatura() -> tuple:
+    """mtimes do diretorio (rename dos JSON do Node) e do SQLite/WAL (escritas de outros processos)."""
+    marcas = []
+    for path in (STATUS_DIR, STATUS_DB, STATUS_DB.with_name(STATUS_DB.name + "-wal")):
+        try:
+            st = path.stat()
+            marcas.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            marcas.append(None)
+    return tuple(marcas)
+
+
+def _vigiar() -> None:
+    global _vigia
+    anterior = _assinatura()
+    ocioso = 0.0
+    while True:
+        time.sleep(STATUS_WATCH_INTERVAL)
+        with _mudanca:
+            # Sobrevive a folgas curtas entre duas esperas da mesma conexao.
+            ocioso = 0.0 if _esperando else ocioso + STATUS_WATCH_INTERVAL
+            if ocioso >= 30:
+                _vigia = None
+                return
+        atual = _assinatura()
+        if atual != anterior:
+            anterior = atual
+            _notificar()
+
+
+def geracao_status() -> int:
+    """Contador de mudancas do store neste processo (ver esperar_mudanca)."""
+    return _geracao
+
+
+def esperar_mudanca(vista: int, timeout: float) -> int:
+    """
+    Bloqueia ate o store mudar depois da geracao `vista` (escrita deste
+    processo, na hora, ou de outro processo, pelo vigia) ou ate o timeout.
+    Um unico vigia por processo, qualquer que seja o numero de conexoes.
+    """
+    global _esperando, _vigia
+    with _mudanca:
+        _esperando += 1
+        if _vigia is None:
+            _vigia = threading.Thread(target=_vigiar, name="job-status-vigia", daemon=True)
+            _vigia.start()
+        try:
+            _mudanca.wait_for(lambda: _geracao != vista, timeout)
+        finally:
+            _esperando -= 1
+        return _geracao
+
+
+def _select(conn: sqlite3.Connection, kind: str, upload_id: int) -> tuple[dict[str, Any], int, float] | None:
+    row = conn.execute(
+        "SELECT payload, version, updated_ts FROM job_status WHERE kind = ? AND upload_id = ?",
+        (_safe_kind(kind), int(upload_id)),
+    ).fetchone()
+    if not row:
+        return None
+    try:
+        payload = json.loads(row[0]) if row[0] else {}
+    except ValueError:
+        payload = {}
+    return payload, int(row[1]), float(row[2])
+
+
+def _store(
+    conn: sqlite3.Connection, kind: str, upload_id: int, payload: dict[str, Any], version: int, updated_ts: float
+) -> None:
+    payload["version"] = version
+    conn.execute(
+        """
+        INSERT INTO job_status (kind, upload_id, payload, version, updated_ts)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (kind, upload_id) DO UPDATE SET
+            payload = excluded.payload, version = excluded.version, updated_ts = excluded.updated_ts
+        """,
+        (_safe_kind(kind), int(upload_id), json.dumps(payload, ensure_ascii=True), version, updated_ts),
+    )
+
+
+def _merge_node_file(kind: str, upload_id: int) -> None:
+    """
+    Os runners Node gravam o proprio JSON (escrita atomica via rename). Campos
+    mais novos que o ultimo update do store sao incorporados aqui; um write
+    posterior do Python (ex.: "processamento finalizado") nunca e sobrescrito.
+    """
+    path = status_path(kind, upload_id)
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return
+    with _connect() as conn:
+        current = _select(conn, kind, upload_id)
+    if current and current[2] >= mtime:
+        return
+    with _connect(write=True) as conn:
+        current = _select(conn, kind, upload_id)
+        if current and current[2] >= mtime:
+            return
+        try:
+            raw = path.read_text(encoding="utf-8")
+            fields = json.loads(raw) if raw else {}
+        except (OSError, ValueError):
+            return
+        payload, version = (current[0], current[1]) if current else ({}, 0)
+        payload.update(fields)
+        payload["kind"] = _safe_kind(kind)
+        payload["upload_id"] = int(upload_id)
+        _store(conn, kind, upload_id, payload, version + 1, mtime)
+    _notificar()
 
 
 def write_status(
@@ -23,9 +220,8 @@ def write_status(
     progress: int | None = None,
     pid: int | None = None,
 ) -> None:
-    STATUS_DIR.mkdir(parents=True, exist_ok=True)
     payload: dict[str, Any] = {
-        "kind": (kind or "").strip().lower(),
+        "kind": _safe_kind(kind),
         "upload_id": int(upload_id),
         "state": state,
         "message": message or "",
@@ -34,36 +230,110 @@ def write_status(
         "pid": pid,
         "updated_at": datetime.utcnow().isoformat(),
     }
-    status_path(kind, upload_id).write_text(json.dumps(payload, ensure_ascii=True), encoding="utf-8")
+    with _connect(write=True) as conn:
+        current = _select(conn, kind, upload_id)
+        version = current[1] if current else 0
+        _store(conn, kind, upload_id, payload, version + 1, time.time())
+    _notificar()
 
 
 def read_status(kind: str, upload_id: int) -> dict[str, Any] | None:
-    path = status_path(kind, upload_id)
-    if not path.exists():
-        return None
+    _merge_node_file(kind, upload_id)
     try:
-        raw = path.read_text(encoding="utf-8")
-        return json.loads(raw) if raw else None
-    except Exception:
+        with _connect() as conn:
+            current = _select(conn, kind, upload_id)
+    except sqlite3.Error:
         return None
+    return current[0] if current else None
+
+
+def status_version(kind: str, upload_id: int) -> int:
+    _merge_node_file(kind, upload_id)
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT version FROM job_status WHERE kind = ? AND upload_id = ?",
+            (_safe_kind(kind), int(upload_id)),
+        ).fetchone()
+    return int(row[0]) if row else 0
+
+
+def latest_upload_id(kind: str) -> int | None:
+    """Job mais recente do tipo no store (ids de upload sao crescentes)."""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT MAX(upload_id) FROM job_status WHERE kind = ?",
+            (_safe_kind(kind),),
+        ).fetchone()
+    return int(row[0]) if row and row[0] is not None else None
 
 
 def update_status_fields(kind: str, upload_id: int, **fields: Any) -> None:
-    current = read_status(kind, upload_id) or {}
-    if not current:
-        current = {
-            "kind": (kind or "").strip().lower(),
-            "upload_id": int(upload_id),
-        }
-    current.update(fields)
-    current["updated_at"] = datetime.utcnow().isoformat()
-    STATUS_DIR.mkdir(parents=True, exist_ok=True)
-    status_path(kind, upload_id).write_text(json.dumps(current, ensure_ascii=True), encoding="utf-8")
+    with _connect(write=True) as conn:
+        current = _select(conn, kind, upload_id)
+        payload, version = (current[0], current[1]) if current else ({}, 0)
+        if not payload:
+            payload = {"kind": _safe_kind(kind), "upload_id": int(upload_id)}
+        payload.update(fields)
+        payload["updated_at"] = datetime.utcnow().isoformat()
+        _store(conn, kind, upload_id, payload, version + 1, time.time())
+    _notificar()
+
+
+def _select_checkpoint(conn: sqlite3.Connection, kind: str, upload_id: int) -> dict[str, Any]:
+    row = conn.execute(
+        "SELECT checkpoint FROM job_checkpoint WHERE kind = ? AND upload_id = ?",
+        (_safe_kind(kind), int(upload_id)),
+    ).fetchone()
+    try:
+        checkpoint = json.loads(row[0]) if row and row[0] else {}
+    except ValueError:
+        checkpoint = {}
+    return checkpoint if isinstance(checkpoint, dict) else {}
+
+
+def read_checkpoint(kind: str, upload_id: int) -> dict[str, Any]:
+    with _connect() as conn:
+        return _select_checkpoint(conn, kind, upload_id)
+
+
+def update_checkpoint(
+    kind: str, upload_id: int, atualizar: Callable[[dict[str, Any]], dict[str, Any]]
+) -> dict[str, Any]:
+    """
+    Read-modify-write do checkpoint numa transacao (o xlsx de saida grava o
+    seu campo em outra thread, no meio dos lotes). Checkpoint vazio apaga a
+    linha.
+    """
+    with _connect(write=True) as conn:
+        checkpoint = atualizar(_select_checkpoint(conn, kind, upload_id))
+        if checkpoint:
+            conn.execute(
+                """
+                INSERT INTO job_checkpoint (kind, upload_id, checkpoint, updated_ts)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (kind, upload_id) DO UPDATE SET
+                    checkpoint = excluded.checkpoint, updated_ts = excluded.updated_ts
+                """,
+                (_safe_kind(kind), int(upload_id), json.dumps(checkpoint, ensure_ascii=True), time.time()),
+            )
+        else:
+            conn.execute(
+                "DELETE FROM job_checkpoint WHERE kind = ? AND upload_id = ?", (_safe_kind(kind), int(upload_id))
+            )
+    return checkpoint
+
+
+def checkpoint_upload_ids(kind: str) -> list[int]:
+    """Jobs do tipo com checkpoint gravado (interrompidos, ainda nao retomados nem desfeitos)."""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT upload_id FROM job_checkpoint WHERE kind = ? ORDER BY upload_id", (_safe_kind(kind),)
+        ).fetchall()
+    return [int(row[0]) for row in rows]
 
 
 def cancel_path(kind: str, upload_id: int) -> Path:
-    safe_kind = (kind or "").strip().lower()
-    return STATUS_DIR / f"{safe_kind}_{upload_id}{_CANCEL_SUFFIX}"
+    return STATUS_DIR / f"{_safe_kind(kind)}_{upload_id}{_CANCEL_SUFFIX}"
 
 
 def set_cancel_flag(kind: str, upload_id: int) -> None:
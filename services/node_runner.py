@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Any
+
+from services.job_status import update_status_fields
+
+NODE_RUNNER = Path(__file__).resolve().parents[1] / "node_runners" / "run.js"
+NODE_SERVER = NODE_RUNNER.parent / "serve.js"
+NODE_EXE = os.getenv("NODE_EXE", "node")
+# Reciclagem do runner persistente (serve.js).
+NODE_RUNNER_MAX_RSS_MB = int(os.getenv("NODE_RUNNER_MAX_RSS_MB", "1024"))
+NODE_RUNNER_MAX_JOBS = int(os.getenv("NODE_RUNNER_MAX_JOBS", "50"))
+# Tempo maximo (s) de um job no runner persistente; estourou, o processo e
+# morto e o worker segue para o proximo job. 0 desliga.
+NODE_RUNNER_JOB_TIMEOUT = float(os.getenv("NODE_RUNNER_JOB_TIMEOUT", "3600"))
+
+# Protocolo: cada linha do stdout do Node e um objeto JSON com "event":
+#   progress -> campos de status (progress, message, state, pid...)
+#   warning  -> {"code": ..., "value": ...}, gravado no status como code=value
+#   result   -> {"ok": true, "total", "output_filename", ...} ou {"ok": false, "error"}
+#   ready    -> runner persistente pronto (ignorado aqui)
+# O stderr e log livre; so as ultimas linhas ficam em memoria para a mensagem de erro.
+STDERR_TAIL_LINES = 50
+
+
+def node_args(kind: str, file_path: Path, user_email: str, data_arquivo, upload_id: int) -> list[str]:
+    args = [
+        NODE_EXE,
+        str(NODE_RUNNER),
+        "--kind",
+        kind,
+        "--file",
+        str(file_path),
+        "--upload-id",
+        str(upload_id),
+        "--user-email",
+        user_email or "desconhecido",
+        "--protocol",
+        "ndjson",
+    ]
+    if data_arquivo:
+        try:
+            args.extend(["--data-arquivo", data_arquivo.isoformat()])
+        except Exception:
+            args.extend(["--data-arquivo", str(data_arquivo)])
+    return args
+
+
+def _drain_stderr(stream, tail: deque) -> None:
+    for line in stream:
+        line = line.rstrip("\n")
+        if not line:
+            continue
+        tail.append(line)
+        print(line, file=sys.stderr)
+
+
+def handle_event(kind: str, upload_id: int, event: dict[str, Any]) -> dict[str, Any] | None:
+    """Repassa um evento ao status store; devolve o payload quando for o resultado final."""
+    tipo = event.get("event")
+    if tipo == "progress":
+        fields = {k: v for k, v in event.items() if k != "event"}
+        if fields:
+            update_status_fields(kind, upload_id, **fields)
+    elif tipo == "warning":
+        code = event.get("code")
+        if code:
+            update_status_fields(kind, upload_id, **{str(code): event.get("value")})
+    elif tipo == "result":
+        return {k: v for k, v in event.items() if k != "event"}
+    return None
+
+
+def _read_events(stream, kind: str, upload_id: int) -> dict[str, Any] | None:
+    """Le eventos ate o resultado do job; None se o stdout fechar antes."""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            print(line, file=sys.stderr)
+            continue
+        if not isinstance(event, dict):
+            continue
+        resultado = handle_event(kind, upload_id, event)
+        if resultado is not None:
+            return resultado
+    return None
+
+
+def _check_result(payload: dict[str, Any], ok: bool = True) -> dict[str, Any]:
+    if not ok or not payload.get("ok"):
+        raise RuntimeError(f"Node runner falhou: {payload.get('error') or 'erro desconhecido'}")
+    return payload
+
+
+def _start_stderr_drain(proc: subprocess.Popen) -> tuple[threading.Thread, deque]:
+    tail: deque = deque(maxlen=STDERR_TAIL_LINES)
+    thread = threading.Thread(target=_drain_stderr, args=(proc.stderr, tail), daemon=True)
+    thread.start()
+    return thread, tail
+
+
+def run_node(kind: str, file_path: Path, user_email: str, data_arquivo, upload_id: int) -> dict:
+    """
+    Executa o runner Node lendo stdout/stderr linha a linha: o progresso chega
+    ao status store enquanto o processo roda e a memoria nao cresce com o log.
+    """
+    args = node_args(kind, file_path, user_email, data_arquivo, upload_id)
+    proc = subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        bufsize=1,
+        cwd=str(NODE_RUNNER.parent),
+    )
+    stderr_thread, tail = _start_stderr_drain(proc)
+    try:
+        payload = _read_events(proc.stdout, kind, upload_id)
+        proc.stdout.read()
+    finally:
+        returncode = proc.wait()
+        stderr_thread.join(timeout=5)
+
+    if payload is None:
+        err = "\n".join(tail).strip()
+        raise RuntimeError(f"Node runner falhou: {err or f'saida sem resultado (codigo {returncode})'}")
+    return _check_result(payload, returncode == 0)
+
+
+class NodeRunnerSupervisor:
+    """
+    Mantem um serve.js vivo entre jobs (modulos e pool do banco quentes),
+    um job por vez. Reinicia o processo se ele cair e o recicla ao passar do
+    limite de memoria ou de jobs. Job que passa de job_timeout mata o processo.
+    """
+
+    def __init__(
+        self,
+        max_rss_mb: int = NODE_RUNNER_MAX_RSS_MB,
+        max_jobs: int = NODE_RUNNER_MAX_JOBS,
+        job_timeout: float = NODE_RUNNER_JOB_TIMEOUT,
+    ) -> None:
+        self.max_rss_mb = max_rss_mb
+        self.max_jobs = max_jobs
+        self.job_timeout = job_timeout
+        self._lock = threading.Lock()
+        self._proc: subprocess.Popen | None = None
+        self._stderr_thread: threading.Thread | None = None
+        self._tail: deque = deque(maxlen=STDERR_TAIL_LINES)
+        self._jobs = 0
+
+    def _alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _start(self) -> None:
+        self._proc = subprocess.Popen(
+            [NODE_EXE, str(NODE_SERVER)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+            cwd=str(NODE_SERVER.parent),
+        )
+        self._stderr_thread, self._tail = _start_stderr_drain(self._proc)
+        self._jobs = 0
+        print(f"Runner Node persistente iniciado (pid {self._proc.pid}).", file=sys.stderr)
+
+    def _stop(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        if self._stderr_thread:
+            self._stderr_thread.join(timeout=5)
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stop()
+
+    def run(self, kind: str, file_path: Path, user_email: str, data_arquivo, upload_id: int) -> dict:
+        job = {
+            "kind": kind,
+            "file": str(file_path),
+            "upload_id": int(upload_id),
+            "user_email": user_email or "desconhecido",
+            "data_arquivo": data_arquivo.isoformat() if hasattr(data_arquivo, "isoformat") else data_arquivo,
+        }
+        with self._lock:
+            if not self._alive():
+                self._start()
+            proc = self._proc
+            estourou = threading.Event()
+
+            def _matar() -> None:
+                estourou.set()
+                proc.kill()
+
+            timer = threading.Timer(self.job_timeout, _matar) if self.job_timeout > 0 else None
+            if timer:
+                timer.daemon = True
+                timer.start()
+            try:
+                proc.stdin.write(json.dumps(job, ensure_ascii=True) + "\n")
+                proc.stdin.flush()
+                payload = _read_events(proc.stdout, kind, upload_id)
+            except OSError as exc:
+                self._stop()
+                raise RuntimeError(f"Runner Node persistente indisponivel: {exc}") from exc
+            finally:
+                if timer:
+                    timer.cancel()
+            if payload is None:
+                err = "\n".join(self._tail).strip()
+                self._stop()
+                if estourou.is_set():
+                    raise RuntimeError(f"Node runner excedeu o tempo limite do job ({self.job_timeout:.0f}s).")
+                raise RuntimeError(f"Node runner encerrou durante o job: {err or 'sem detalhes'}")
+            self._jobs += 1
+            rss_mb = float(payload.pop("rss", 0) or 0) / (1024 * 1024)
+            if rss_mb >= self.max_rss_mb or self._jobs >= self.max_jobs:
+                print(f"Reciclando runner Node ({rss_mb:.0f} MB, {self._jobs} jobs).", file=sys.stderr)
+                self._stop()
+        return _check_result(payload)
@@ -6,16 +6,30 @@ import time
 import unicodedata
 import warnings
 from datetime import datetime
-from decimal import Decimal
 from pathlib import Path
 from typing import Any
 
 import pandas as pd
+from pandas.tseries.api import guess_datetime_format
 from rapidfuzz import fuzz, process
 from sqlalchemy import text
-from sqlalchemy.exc import SQLAlchemyError
 
-from models import db, Dotacao, EmpRegistro
+from models import chave_norm_values, db, Dotacao
+from services.dtypes import compactar_dtypes, expandir_dtypes, memoria_mb, tratar_em_partes
+from services.ingest_checkpoint import (
+    STAGE_PARSED,
+    STAGE_TRANSFORMED,
+    clear_checkpoint,
+    commit_batches,
+    deactivate_once,
+    descartar_pendentes,
+    encerrar_falha,
+    gravar_saida,
+    saida_gravada,
+    save_checkpoint,
+)
+from services.job_control import JobProgress
+from services.pipeline import iter_frame_chunks, prefetch, start_background
 
 # Evita warnings de downcasting silencioso em replace
 pd.set_option("future.no_silent_downcasting", True)
@@ -141,71 +155,6 @@ def _normalize_dotacao_key(value: str) -> str:
     return cleaned.upper()
 
 
-def _to_decimal(value: Any) -> Decimal:
-    if value is None or (isinstance(value, float) and pd.isna(value)):
-        return Decimal("0")
-    raw = str(value).strip()
-    if not raw:
-        return Decimal("0")
-    cleaned = raw.replace(".", "").replace(",", ".")
-    try:
-        return Decimal(cleaned)
-    except Exception:
-        return Decimal("0")
-
-
-def _find_valor_ped_col(df: pd.DataFrame) -> str | None:
-    for col in df.columns:
-        if not isinstance(col, str):
-            continue
-        base = unicodedata.normalize("NFKD", col)
-        base = "".join(ch for ch in base if not unicodedata.combining(ch))
-        base = re.sub(r"[^A-Z0-9]+", "", base.upper())
-        if base == "VALORPED":
-            return col
-    return None
-
-
-def _update_dotacao_from_ped(df: pd.DataFrame) -> None:
-    if "Chave" not in df.columns:
-        return
-    valor_col = _find_valor_ped_col(df)
-    if not valor_col:
-        return
-    ped_sums: dict[str, Decimal] = {}
-    for _, row in df.iterrows():
-        chave = row.get("Chave")
-        if not isinstance(chave, str):
-            continue
-        if not chave.strip().upper().startswith("DOT."):
-            continue
-        key = _normalize_dotacao_key(chave)
-        ped_sums[key] = ped_sums.get(key, Decimal("0")) + _to_decimal(row.get(valor_col))
-
-    emp_rows = (
-        EmpRegistro.query.with_entities(EmpRegistro.valor_emp_devolucao_gcv, EmpRegistro.chave)
-        .filter(EmpRegistro.ativo == True)  # noqa: E712
-        .all()
-    )
-    emp_sums: dict[str, Decimal] = {}
-    for row in emp_rows:
-        key = _normalize_dotacao_key(row.chave or "")
-        if not key:
-            continue
-        emp_sums[key] = emp_sums.get(key, Decimal("0")) + _to_decimal(row.valor_emp_devolucao_gcv)
-
-    dotacoes = Dotacao.query.filter(Dotacao.ativo == True).all()  # noqa: E712
-    for dot in dotacoes:
-        key = _normalize_dotacao_key(dot.chave_dotacao or "")
-        ped_sum = ped_sums.get(key, Decimal("0"))
-        emp_sum = emp_sums.get(key, Decimal("0"))
-        dot_val = _to_decimal(dot.valor_dotacao)
-        total = ped_sum + emp_sum
-        dot.valor_ped_emp = total
-        dot.valor_atual = dot_val - total
-    db.session.commit()
-
-
 def carregar_chaves_planejamento(json_path: Path) -> list[str]:
     try:
         with open(json_path, "r", encoding="utf-8-sig") as file:
@@ -341,7 +290,28 @@ def forcar_chaves_manualmente(df: pd.DataFrame, substituicoes: dict[str, str]) -
     return df
 
 
-def converter_tipos(df: pd.DataFrame) -> pd.DataFrame:
+# Textos que o pandas pula ao deduzir o formato das datas pelo primeiro valor.
+_NULOS_DATA = {"", "NaT", "nat", "NAT", "nan", "NaN", "NAN", "now", "today"}
+
+
+def _converter_datas(
+    serie_str: pd.Series, dayfirst: bool, formatos: dict[tuple[str, bool], str] | None, col: str
+) -> pd.Series:
+    """
+    pd.to_datetime deduz o formato pelo primeiro valor da serie. Em pedacos,
+    formatos guarda o formato deduzido no primeiro pedaco com valor e o repete
+    nos seguintes ("mixed" quando nao deduziu), como no frame inteiro.
+    """
+    chave = (col, dayfirst)
+    if formatos is not None and chave not in formatos:
+        primeiro = next((v for v in serie_str if v not in _NULOS_DATA), None)
+        if primeiro is not None:
+            formatos[chave] = guess_datetime_format(primeiro, dayfirst=dayfirst) or "mixed"
+    formato = formatos.get(chave) if formatos is not None else None
+    return pd.to_datetime(serie_str, errors="coerce", dayfirst=dayfirst, format=formato)
+
+
+def converter_tipos(df: pd.DataFrame, formatos_data: dict[tuple[str, bool], str] | None = None) -> pd.DataFrame:
     colunas_monetarias = ["Valor PED", "Valor do Estorno"]
     colunas_datas = ["Data da Licitação", "Data Solicitação", "Data Criação", "Data Autorização", "Data/Hora Cadastro Autorização"]
     colunas_numericas = ["Exercício de Competência da Folha de Pagamento"]
@@ -388,9 +358,9 @@ def converter_tipos(df: pd.DataFrame) -> pd.DataFrame:
                 mask_iso = serie_str.str.match(r"\d{4}-\d{2}-\d{2}")
                 parsed = pd.Series(index=serie_str.index, dtype="datetime64[ns]")
                 if mask_iso.any():
-                    parsed.loc[mask_iso] = pd.to_datetime(serie_str[mask_iso], errors="coerce", dayfirst=False)
+                    parsed.loc[mask_iso] = _converter_datas(serie_str[mask_iso], False, formatos_data, col)
                 if (~mask_iso).any():
-                    parsed.loc[~mask_iso] = pd.to_datetime(serie_str[~mask_iso], errors="coerce", dayfirst=True)
+                    parsed.loc[~mask_iso] = _converter_datas(serie_str[~mask_iso], True, formatos_data, col)
                 df[col] = parsed
             df[col] = df[col].apply(formatar_data_br)
 
@@ -726,32 +696,97 @@ def prefiltrar_ped(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+def _identificar_linhas_ped(
+    df: pd.DataFrame,
+    chaves_planejamento: list[str],
+    casos_especificos: dict[str, str],
+    formatos_data: dict[tuple[str, bool], str],
+) -> pd.DataFrame:
+    df = prefiltrar_ped(df)
+    if df.empty:
+        # Pedaco todo filtrado: fica fora da juncao (concatenar_compactos).
+        return df
+
+    hist_col = encontrar_coluna_prefixo(df, "hist")
+    if hist_col:
+        df[hist_col] = df[hist_col].apply(limpar_historico)
+    cols_obj = df.select_dtypes(include=["object"]).columns
+    df[cols_obj] = df[cols_obj].apply(lambda col: col.map(corrigir_caracteres))
+
+    df = converter_tipos(df, formatos_data)
+    return identificar_chave_planejamento(df, chaves_planejamento, casos_especificos)
+
+
+def _finalizar_linhas_ped(
+    df: pd.DataFrame, partes_planejamento: int, precisa_colunas_planejamento: bool, forcar_map: dict[str, str]
+) -> pd.DataFrame:
+    if "Chave" in df.columns:
+        colunas = df.columns.tolist()
+        colunas.insert(0, colunas.pop(colunas.index("Chave")))
+        df = df[colunas]
+
+    if precisa_colunas_planejamento:
+        df = adicionar_novas_colunas(df)
+    df = preencher_novas_colunas(df)
+
+    # Ajusta colunas "Chave" vs "Chave de Planejamento" conforme ano e formato da chave
+    def ajustar_chave_por_formato(row: pd.Series) -> pd.Series:
+        if row.get("_forcar_chave"):
+            return row
+        chave = row.get("Chave", "")
+        partes = contar_partes_chave(chave)
+        if partes == partes_planejamento:
+            row["Chave de Planejamento"] = chave or "-"
+            row["Chave"] = "-"
+        elif partes == 4:
+            row["Chave"] = chave or "-"
+            row["Chave de Planejamento"] = "-"
+        else:
+            row["Chave de Planejamento"] = row.get("Chave de Planejamento") or "-"
+            row["Chave"] = row.get("Chave") or "-"
+        return row
+
+    df = df.apply(ajustar_chave_por_formato, axis=1)
+    df = forcar_chaves_manualmente(df, forcar_map)
+
+    return df.replace(
+        {
+            "NÃO INFORMADO": "-",
+            "NÃO IDENTIFICADO": "-",
+            "NÇŸO INFORMADO": "-",
+            "NÇŸO IDENTIFICADO": "-",
+            "NÇO INFORMADO": "-",
+            "NÇO IDENTIFICADO": "-",
+            "N€YO INFORMADO": "-",
+            "N€YO IDENTIFICADO": "-",
+        },
+        regex=False,
+    )
+
+
 def processar_planilha(
     df: pd.DataFrame, chaves_planejamento: list[str], casos_especificos: dict[str, str], forcar_map: dict[str, str]
 ) -> pd.DataFrame | None:
+    """
+    Trata a aba PED ja compactada (compactar_dtypes) em pedacos: so um
+    pedaco fica expandido por vez. O ano e a necessidade das colunas de
+    planejamento dependem do frame inteiro e sao decididos entre as etapas;
+    o formato das datas segue o do primeiro pedaco (converter_tipos).
+    Devolve o frame tratado compactado.
+    """
     try:
         ano = None
         ex_col = encontrar_coluna_prefixo(df, "exerc")
         if ex_col:
-            anos = df[ex_col].apply(extrair_ano).dropna()
+            anos = df[ex_col].astype(object).apply(extrair_ano).dropna()
             if not anos.empty:
                 ano = int(anos.mode().iloc[0])
 
-        df = prefiltrar_ped(df)
-
-        hist_col = encontrar_coluna_prefixo(df, "hist")
-        if hist_col:
-            df[hist_col] = df[hist_col].apply(limpar_historico)
-        cols_obj = df.select_dtypes(include=["object"]).columns
-        df[cols_obj] = df[cols_obj].apply(lambda col: col.map(corrigir_caracteres))
-
-        df = converter_tipos(df)
-        df = identificar_chave_planejamento(df, chaves_planejamento, casos_especificos)
-
-        if "Chave" in df.columns:
-            colunas = df.columns.tolist()
-            colunas.insert(0, colunas.pop(colunas.index("Chave")))
-            df = df[colunas]
+        formatos_data: dict[tuple[str, bool], str] = {}
+        df = tratar_em_partes(
+            df,
+            lambda parte: _identificar_linhas_ped(parte, chaves_planejamento, casos_especificos, formatos_data),
+        )
 
         partes_planejamento = 7
         if ano and ano >= 2026:
@@ -759,47 +794,15 @@ def processar_planilha(
 
         precisa_colunas_planejamento = False
         if "Chave" in df.columns:
-            partes = df["Chave"].apply(contar_partes_chave)
-            precisa_colunas_planejamento = (partes >= 7).any()
-        if precisa_colunas_planejamento:
-            df = adicionar_novas_colunas(df)
-        df = preencher_novas_colunas(df)
-
-        # Ajusta colunas "Chave" vs "Chave de Planejamento" conforme ano e formato da chave
-        def ajustar_chave_por_formato(row: pd.Series) -> pd.Series:
-            if row.get("_forcar_chave"):
-                return row
-            chave = row.get("Chave", "")
-            partes = contar_partes_chave(chave)
-            if partes == partes_planejamento:
-                row["Chave de Planejamento"] = chave or "-"
-                row["Chave"] = "-"
-            elif partes == 4:
-                row["Chave"] = chave or "-"
-                row["Chave de Planejamento"] = "-"
-            else:
-                row["Chave de Planejamento"] = row.get("Chave de Planejamento") or "-"
-                row["Chave"] = row.get("Chave") or "-"
-            return row
-
-        df = df.apply(ajustar_chave_por_formato, axis=1)
-        df = forcar_chaves_manualmente(df, forcar_map)
-
-        df = df.replace(
-            {
-                "NÃO INFORMADO": "-",
-                "NÃO IDENTIFICADO": "-",
-                "NÇŸO INFORMADO": "-",
-                "NÇŸO IDENTIFICADO": "-",
-                "NÇO INFORMADO": "-",
-                "NÇO IDENTIFICADO": "-",
-                "N€YO INFORMADO": "-",
-                "N€YO IDENTIFICADO": "-",
-            },
-            regex=False,
+            partes = df["Chave"].astype(object).apply(contar_partes_chave)
+            precisa_colunas_planejamento = bool((partes >= 7).any())
+
+        return tratar_em_partes(
+            df,
+            lambda parte: _finalizar_linhas_ped(
+                parte, partes_planejamento, precisa_colunas_planejamento, forcar_map
+            ),
         )
-
-        return df
     except Exception as e:
         print(f"Erro ao processar a planilha: {e}")
         return None
@@ -994,6 +997,7 @@ def montar_registros_para_db(df: pd.DataFrame, data_arquivo: datetime, user_emai
         ):
             if k in payload:
                 payload[k] = _parse_data_db(payload[k])
+        payload.update(chave_norm_values(payload.get("chave"), payload.get("chave_planejamento")))
         payload["upload_id"] = upload_id
         payload["data_atualizacao"] = datetime.utcnow()
         payload["data_arquivo"] = data_arquivo
@@ -1002,7 +1006,13 @@ def montar_registros_para_db(df: pd.DataFrame, data_arquivo: datetime, user_emai
         registros.append(payload)
     return registros
 
-def update_database(df: pd.DataFrame, data_arquivo: datetime, user_email: str, upload_id: int) -> int:
+def update_database(
+    df: pd.DataFrame,
+    data_arquivo: datetime,
+    user_email: str,
+    upload_id: int,
+    progress: JobProgress | None = None,
+) -> int:
     insert_sql = text(
         """
         INSERT INTO ped (
@@ -1017,7 +1027,8 @@ def update_database(df: pd.DataFrame, data_arquivo: datetime, user_email: str, u
             tipo_despesa, numero_abj, numero_processo_sequestro_judicial, indicativo_entrega_imediata,
             indicativo_contrato, codigo_uo_extinta, devolucao_gcv, mes_competencia_folha_pagamento,
             exercicio_competencia_folha, obrigacao_patronal, tipo_obrigacao_patronal, numero_nla, credor,
-            nome_credor, chave_planejamento, data_atualizacao, data_arquivo, user_email, ativo
+            nome_credor, chave_planejamento, chave_norm, chave_planejamento_norm, data_atualizacao, data_arquivo,
+            user_email, ativo
         )
         VALUES (
             :upload_id, :chave, :regiao, :subfuncao_ug, :adj, :macropolitica, :pilar, :eixo, :politica_decreto,
@@ -1031,30 +1042,20 @@ def update_database(df: pd.DataFrame, data_arquivo: datetime, user_email: str, u
             :tipo_despesa, :numero_abj, :numero_processo_sequestro_judicial, :indicativo_entrega_imediata,
             :indicativo_contrato, :codigo_uo_extinta, :devolucao_gcv, :mes_competencia_folha_pagamento,
             :exercicio_competencia_folha, :obrigacao_patronal, :tipo_obrigacao_patronal, :numero_nla, :credor,
-            :nome_credor, :chave_planejamento, :data_atualizacao, :data_arquivo, :user_email, :ativo
+            :nome_credor, :chave_planejamento, :chave_norm, :chave_planejamento_norm, :data_atualizacao, :data_arquivo,
+            :user_email, :ativo
         )
         """
     )
 
-    try:
-        db.session.execute(text("UPDATE ped SET ativo = 0 WHERE ativo = 1"))
-        db.session.commit()
-    except SQLAlchemyError:
-        db.session.rollback()
-        raise
-
-    registros = montar_registros_para_db(df, data_arquivo, user_email, upload_id)
-    total = 0
-    for start in range(0, len(registros), BATCH_SIZE):
-        chunk = registros[start : start + BATCH_SIZE]
-        try:
-            db.session.execute(insert_sql, chunk)
-            db.session.commit()
-            total += len(chunk)
-        except SQLAlchemyError:
-            db.session.rollback()
-            raise
-    return total
+    deactivate_once("ped", upload_id, "ped")
+    chunks = prefetch(
+        montar_registros_para_db(expandir_dtypes(parte), data_arquivo, user_email, upload_id)
+        for parte in iter_frame_chunks(df, BATCH_SIZE)
+    )
+    return commit_batches(
+        "ped", upload_id, "ped", insert_sql, chunks, len(df), on_batch=progress.batch if progress else None
+    )
 
 
 def _normalize_dotacao_key(value: str) -> str:
@@ -1085,7 +1086,26 @@ def _find_missing_dotacao_keys(df: pd.DataFrame) -> list[str]:
 
 
 def run_ped(
-    file_path: Path, data_arquivo: datetime, user_email: str, upload_id: int
+    file_path: Path,
+    data_arquivo: datetime,
+    user_email: str,
+    upload_id: int,
+    progress: JobProgress | None = None,
+) -> tuple[int, Path, list[str]]:
+    progress = progress or JobProgress("ped", upload_id)
+    descartar_pendentes("ped", upload_id, "ped")
+    progress.start("Lendo a planilha PED.")
+    try:
+        resultado = _run_ped(file_path, data_arquivo, user_email, upload_id, progress)
+    except Exception as exc:
+        progress.fail(exc, retomavel=encerrar_falha("ped", upload_id, "ped", exc))
+        raise
+    progress.finish(f"Processado com sucesso. Registros: {resultado[0]}.", resultado[1].name)
+    return resultado
+
+
+def _run_ped(
+    file_path: Path, data_arquivo: datetime, user_email: str, upload_id: int, progress: JobProgress
 ) -> tuple[int, Path, list[str]]:
     ensure_dirs()
     chaves_planejamento = carregar_chaves_planejamento(JSON_CHAVES_PLANEJAMENTO)
@@ -1095,25 +1115,30 @@ def run_ped(
     ped_df = preparar_aba_ped(file_path)
     if ped_df is None:
         raise RuntimeError("Falha ao identificar cabeçalho ou ler a aba ped.")
+    ped_df = compactar_dtypes(ped_df)
+    save_checkpoint("ped", upload_id, STAGE_PARSED, rows_parsed=len(ped_df))
+    progress.stage(f"Planilha lida ({len(ped_df)} linhas). Tratando dados.", 15)
 
-    tratado_df = processar_planilha(ped_df.copy(), chaves_planejamento, casos_especificos, forcar_map)
+    tratado_df = processar_planilha(ped_df, chaves_planejamento, casos_especificos, forcar_map)
     if tratado_df is None:
         raise RuntimeError("Falha ao tratar a planilha PED.")
+    print(f" Memoria PED: ped={memoria_mb(ped_df):.1f} MB, tratado={memoria_mb(tratado_df):.1f} MB")
+    save_checkpoint("ped", upload_id, STAGE_TRANSFORMED)
+    progress.stage("Dados tratados. Gravando planilha e banco.", 45)
 
     missing_dotacao_keys = _find_missing_dotacao_keys(tratado_df)
     tratado_df_export = tratado_df.drop(columns=["_forcar_chave"], errors="ignore")
-    output_path = salvar_planilhas(ped_df, tratado_df_export, file_path)
-    try:
-        total = update_database(tratado_df, data_arquivo, user_email, upload_id)
-    except SQLAlchemyError as exc:
-        if "Packet sequence number wrong" in str(exc):
-            db.session.remove()
-            try:
-                db.engine.dispose()
-            except Exception:
-                pass
-            total = update_database(tratado_df, data_arquivo, user_email, upload_id)
-        else:
-            raise
-    _update_dotacao_from_ped(tratado_df)
+    # O xlsx de saida e gravado em paralelo com a insercao no banco (a
+    # retomada reaproveita o que a execucao anterior ja gravou).
+    output_path = saida_gravada("ped", upload_id, OUTPUT_DIR)
+    workbook = None
+    if output_path is None:
+        workbook = start_background(
+            gravar_saida, "ped", upload_id, salvar_planilhas, ped_df, tratado_df_export, file_path
+        )
+    total = update_database(tratado_df, data_arquivo, user_email, upload_id, progress)
+    if workbook is not None:
+        output_path = workbook.result()
+    # Checkpoint so vale para retomar um job interrompido; concluido, descarta.
+    clear_checkpoint("ped", upload_id)
     return total, output_path, missing_dotacao_keys
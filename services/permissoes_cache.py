@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import threading
+
+from sqlalchemy.exc import ProgrammingError
+
+from models import db, NivelPermissao, PerfilPermissao
+from services.features import FEATURES, build_parent_map
+from services.shared_version import SharedVersion
+
+# Versao das permissoes compartilhada pelos processos; cada gravacao em
+# /api/permissoes troca a versao e os caches locais se descartam.
+_VERSAO = SharedVersion("permissoes_version")
+_PARENT_MAP = build_parent_map()
+_LOCKED = tuple(f["id"] for f in FEATURES if f.get("locked"))
+
+# (versao, perfil, nivel) -> (menu, concedidas): o menu tem os pais e as
+# travadas; concedidas sao so as linhas gravadas, como o has_permission original.
+_cache: dict[tuple, tuple[tuple[str, ...], frozenset[str]]] = {}
+_lock = threading.Lock()
+
+
+def bump_permissoes_version() -> None:
+    """Chamar depois do commit de qualquer alteracao de permissoes."""
+    _VERSAO.bump()
+    with _lock:
+        _cache.clear()
+
+
+def _features(model, filtro) -> list[tuple[str, bool]]:
+    """(feature, ativo) das linhas de permissao."""
+    try:
+        return [
+            (feature, ativo is True or ativo == 1)
+            for feature, ativo in db.session.query(model.feature, model.ativo)
+            .filter(filtro, model.feature.isnot(None))
+            .all()
+            if feature
+        ]
+    except ProgrammingError:
+        db.session.rollback()
+        return []
+
+
+def _carregar(perfil_id: int | None, nivel: int | None) -> tuple[tuple[str, ...], frozenset[str]]:
+    linhas: list[tuple[str, bool]] = []
+    if perfil_id is not None:
+        linhas += _features(PerfilPermissao, PerfilPermissao.perfil_id == perfil_id)
+    if nivel is not None:
+        linhas += _features(NivelPermissao, NivelPermissao.nivel == nivel)
+    feats = [feature for feature, ativo in linhas if ativo]
+    for feat in list(feats):
+        parent = _PARENT_MAP.get(feat)
+        if parent and parent not in feats:
+            feats.append(parent)
+    feats += [f for f in _LOCKED if f not in feats]
+    return tuple(dict.fromkeys(feats)), frozenset(feature for feature, _ in linhas)
+
+
+def _entrada(perfil_id: int | None, nivel: int | None) -> tuple[tuple[str, ...], frozenset[str]]:
+    versao = _VERSAO.atual()
+    chave = (versao, perfil_id, nivel)
+    entrada = _cache.get(chave)
+    if entrada is None:
+        entrada = _carregar(perfil_id, nivel)
+        with _lock:
+            if any(k[0] != versao for k in _cache):
+                _cache.clear()
+            _cache[chave] = entrada
+    return entrada
+
+
+def permissoes(perfil_id: int | None, nivel: int | None) -> list[str]:
+    """
+    Features do menu de (perfil, nivel): as ativas, com os pais e as
+    travadas. O banco so e consultado na primeira vez de cada chave em cada
+    versao. Nao serve para autorizar (ver tem_permissao).
+    """
+    return list(_entrada(perfil_id, nivel)[0])
+
+
+def tem_permissao(perfil_id: int | None, nivel: int | None, feature: str) -> bool:
+    """
+    Concessao exata: a feature tem linha gravada para o perfil ou o nivel.
+    Pai e travada liberam o item no menu, nao o acesso ("usuarios/senha"
+    nao libera "usuarios").
+    """
+    return feature in _entrada(perfil_id, nivel)[1]
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+import pandas as pd
+
+T = TypeVar("T")
+
+PIPELINE_QUEUE_SIZE = 2
+_SENTINEL = object()
+
+
+def start_background(fn: Callable[..., T], *args: Any, **kwargs: Any) -> Future:
+    """
+    Roda fn numa thread propria (ex.: gravar o xlsx de saida) enquanto a
+    thread atual segue com o banco. Nao use para nada que toque db.session.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="runner-io")
+    try:
+        return executor.submit(fn, *args, **kwargs)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def prefetch(items: Iterable[T], maxsize: int = PIPELINE_QUEUE_SIZE) -> Iterator[T]:
+    """
+    Consome items numa thread produtora com fila limitada: o proximo lote e
+    montado enquanto o atual e gravado, e o produtor espera quando a fila
+    enche. Erros do produtor sobem no consumidor.
+    """
+    fila: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def _put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                fila.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce() -> None:
+        try:
+            for item in items:
+                if not _put(item):
+                    return
+        except BaseException as exc:  # noqa: BLE001 - repassado ao consumidor
+            _put(exc)
+            return
+        _put(_SENTINEL)
+
+    producer = threading.Thread(target=_produce, name="runner-prefetch", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = fila.get()
+            if item is _SENTINEL:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_frame_chunks(df: pd.DataFrame, size: int) -> Iterator[pd.DataFrame]:
+    for start in range(0, len(df), size):
+        yield df.iloc[start : start + size]
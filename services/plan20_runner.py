@@ -13,6 +13,9 @@ from typing import Any
 import pandas as pd
 from openpyxl.styles import Font
 
+from services.dtypes import compactar_dtypes, expandir_dtypes, memoria_mb
+from services.job_control import JobProgress
+
 # ----------------------------
 # CONFIG / CONSTANTES
 # ----------------------------
@@ -1487,11 +1490,12 @@ def _explode_natureza(s: Any) -> pd.Series:
     )
 
 
-def run_plan20(input_file: Path, output_dir: Path) -> Path:
+def run_plan20(input_file: Path, output_dir: Path, progress: JobProgress | None = None) -> Path:
     """
     Processa um único arquivo .xlsx do Plan20 com as mesmas regras do script legado,
     gerando as abas Identificadores_Raw, Extrair_dados, Plan20_SEDUC e Debug_Log.
     """
+    progress = progress or JobProgress("plan20", None)
     DEBUG_ROWS.clear()
     output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -1508,10 +1512,12 @@ def run_plan20(input_file: Path, output_dir: Path) -> Path:
         dbg("main", f"Arquivo de entrada: {arquivo}")
         t0 = time.perf_counter()
 
+        progress.stage(f"Lendo identificadores de {arquivo.name}.", 5)
         _, ids_df_raw = processar_arquivo(arquivo, a_contador_inicial=contador_A_global)
         dbg("main", f"processar_arquivo concluído para: {arquivo.name}")
         dbg("main", f"ids_df_raw linhas ({arquivo.name}): {len(ids_df_raw)}")
 
+        progress.stage(f"Extraindo dados ({len(ids_df_raw)} identificadores).", 30)
         extr_df = extrair_dados(ids_df_raw)
         dbg("main", f"Extrair_dados linhas ({arquivo.name}): {len(extr_df)}")
 
@@ -1535,19 +1541,25 @@ def run_plan20(input_file: Path, output_dir: Path) -> Path:
         else pd.DataFrame(columns=EXTR_HEADERS)
     )
 
+    ids_df_all = compactar_dtypes(ids_df_all)
+    extr_df_all = compactar_dtypes(extr_df_all)
+    dbg("main", f"Memória: ids={memoria_mb(ids_df_all):.1f} MB, extr={memoria_mb(extr_df_all):.1f} MB")
+
     # -------- Plan20_SEDUC --------
+    progress.stage("Montando a aba Plan20_SEDUC.", 50)
     if not extr_df_all.empty:
-        df_tmp = extr_df_all.copy()
-        exercicio_num = pd.to_numeric(df_tmp["Exercício"], errors="coerce")
+        # Filtra no frame compactado; so as linhas da SEDUC sao expandidas.
+        exercicio_num = pd.to_numeric(extr_df_all["Exercício"].astype(object), errors="coerce")
 
         mask_uo = (
-            df_tmp["Unidade Orçamentária"]
+            extr_df_all["Unidade Orçamentária"]
+            .astype(object)
             .astype(str)
             .str.strip()
             == "14.101 - SECRETARIA DE ESTADO DE EDUCAÇÃO"
         )
         mask_exercicio = exercicio_num >= 2025
-        plan20_seduc_df = df_tmp[mask_uo & mask_exercicio].copy()
+        plan20_seduc_df = expandir_dtypes(extr_df_all[mask_uo & mask_exercicio])
         dbg("Plan20_SEDUC", f"Linhas filtradas (UO+Exercício): {len(plan20_seduc_df)}")
 
         if not plan20_seduc_df.empty:
@@ -1595,6 +1607,7 @@ def run_plan20(input_file: Path, output_dir: Path) -> Path:
     else:
         plan20_seduc_df = pd.DataFrame(columns=EXTR_HEADERS)
 
+    progress.stage("Gravando a planilha de saída.", 60)
     ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
     out_path = output_dir / f"plan20_seduc_{ts}.xlsx"
 
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Iterable
+
+from sqlalchemy import text
+
+from models import db, Plan21Nger
+from services.post_ingest import dataset_version_name
+from services.shared_version import SharedVersion
+
+# Campo da API -> atributo do Plan21Nger.
+FACET_FIELDS = {
+    "exercicio": "exercicio",
+    "chave_planejamento": "chave_planejamento",
+    "uo": "uo",
+    "programa": "programa",
+    "acao_paoe": "acao_paoe",
+    "produto": "produto",
+    "ug": "ug",
+    "regiao": "regiao_etapa",
+    "subacao_entrega": "subacao_entrega",
+    "etapa": "etapa",
+    "natureza_despesa": "natureza",
+    "elemento": "elemento",
+    "subelemento": "subelemento",
+    "fonte": "fonte",
+    "iduso": "idu",
+}
+# Campos filtrados por prefixo (LIKE 'x%') e campos longos com busca por prefixo.
+PREFIX_FIELDS = ("natureza_despesa",)
+SEARCH_FIELDS = ("subacao_entrega", "etapa")
+# Intervalo minimo (s) entre as verificacoes de mudanca no plan21_nger.
+PLAN21_INDEX_TTL = float(os.getenv("PLAN21_INDEX_TTL", "30"))
+
+
+def _bits_de(indices: list[int]) -> tuple[int, int]:
+    """Bitset deslocado (offset, bits): so ocupa o intervalo entre a primeira e a ultima linha."""
+    offset = indices[0]
+    buf = bytearray(((indices[-1] - offset) >> 3) + 1)
+    for i in indices:
+        pos = i - offset
+        buf[pos >> 3] |= 1 << (pos & 7)
+    return offset, int.from_bytes(buf, "little")
+
+
+class FacetIndex:
+    """
+    Indice facetado das linhas ativas do plan21_nger: um bitset por valor de
+    cada campo (bit i = linha i). As opcoes de um campo saem da intersecao dos
+    bitsets dos outros filtros. As linhas vem ordenadas pela chave, entao os
+    bitsets dos campos de alta cardinalidade ficam curtos.
+    """
+
+    def __init__(self, rows: Iterable[tuple], assinatura: tuple) -> None:
+        self.assinatura = assinatura
+        self.valores: dict[str, list[str | None]] = {campo: [] for campo in FACET_FIELDS}
+        indices: dict[str, dict[str, list[int]]] = {campo: {} for campo in FACET_FIELDS}
+        exibicao: dict[str, dict[str, str]] = {campo: {} for campo in FACET_FIELDS}
+        total = 0
+        for i, row in enumerate(rows):
+            total += 1
+            for campo, raw in zip(FACET_FIELDS, row):
+                texto = str(raw).strip() if raw is not None else ""
+                if not texto:
+                    self.valores[campo].append(None)
+                    continue
+                self.valores[campo].append(texto)
+                chave = texto.lower()
+                indices[campo].setdefault(chave, []).append(i)
+                exibicao[campo].setdefault(chave, texto)
+        self.total = total
+        self.postings = {campo: {k: _bits_de(v) for k, v in por_valor.items()} for campo, por_valor in indices.items()}
+        self.exibicao = exibicao
+        self.ordenados = {campo: sorted(por_valor) for campo, por_valor in indices.items()}
+
+    def _bits(self, campo: str, valor: str, prefixo: bool = False) -> int:
+        chave = valor.strip().lower()
+        postings = self.postings[campo]
+        if not prefixo:
+            offset, bits = postings.get(chave, (0, 0))
+            return bits << offset
+        ordenados = self.ordenados[campo]
+        resultado = 0
+        for k in ordenados[bisect_left(ordenados, chave) :]:
+            if not k.startswith(chave):
+                break
+            offset, bits = postings[k]
+            resultado |= bits << offset
+        return resultado
+
+    def _opcoes(self, campo: str, mask: int | None) -> set[str]:
+        if mask is None:
+            return set(self.exibicao[campo].values())
+        if bin(mask).count("1") <= len(self.postings[campo]):
+            valores = self.valores[campo]
+            encontrados = set()
+            while mask:
+                low = mask & -mask
+                valor = valores[low.bit_length() - 1]
+                if valor is not None:
+                    encontrados.add(valor)
+                mask ^= low
+            return {self.exibicao[campo][v.lower()] for v in encontrados}
+        # Compara so a janela da mascara que o bitset do valor ocupa.
+        mb = mask.to_bytes((self.total >> 3) + 1, "little")
+        encontrados = set()
+        for k, (offset, bits) in self.postings[campo].items():
+            ini = offset >> 3
+            fim = ini + ((bits.bit_length() + (offset & 7)) >> 3) + 1
+            if (int.from_bytes(mb[ini:fim], "little") >> (offset & 7)) & bits:
+                encontrados.add(self.exibicao[campo][k])
+        return encontrados
+
+    def filtrar(self, campo: str, selected: dict[str, str]) -> set[str]:
+        """Valores do campo nas linhas que atendem todos os filtros."""
+        mask = None
+        for outro, valor in selected.items():
+            if outro in FACET_FIELDS and valor:
+                bits = self._bits(outro, valor, prefixo=outro in PREFIX_FIELDS)
+                mask = bits if mask is None else mask & bits
+        return self._opcoes(campo, mask)
+
+    def options(self, selected: dict[str, str], prefixos: dict[str, str] | None = None) -> dict[str, set[str]]:
+        """
+        Valores de cada campo compativeis com os demais filtros (o proprio
+        campo nao se filtra, como no formulario). prefixos restringe os campos
+        longos ao que comeca com o texto digitado.
+        """
+        filtros = {
+            campo: self._bits(campo, valor, prefixo=campo in PREFIX_FIELDS)
+            for campo, valor in selected.items()
+            if campo in FACET_FIELDS and valor
+        }
+        busca = {
+            campo: self._bits(campo, valor, prefixo=True)
+            for campo, valor in (prefixos or {}).items()
+            if campo in SEARCH_FIELDS and valor
+        }
+        resultado = {}
+        for campo in FACET_FIELDS:
+            mask = None
+            for outro, bits in filtros.items():
+                if outro != campo:
+                    mask = bits if mask is None else mask & bits
+            for outro, bits in busca.items():
+                mask = bits if mask is None else mask & bits
+            resultado[campo] = self._opcoes(campo, mask)
+        return resultado
+
+
+_index: FacetIndex | None = None
+_assinatura_atual: tuple | None = None
+_checked = 0.0
+_lock = threading.Lock()
+# Versao trocada pela carga do plan21_nger (worker.py --refresh plan21).
+_versao = SharedVersion(dataset_version_name("plan21"))
+
+# Colunas do conteudo que entra no indice e no saldo (valor_atual).
+_COLUNAS_CHECKSUM = (
+    "id, exercicio, chave_planejamento, unidade_orcamentaria, programa, acao_paoe, produto_acao, "
+    "unid_gestora, regiao_etapa, subacao_entrega, etapa, natureza, elemento, subelemento, fonte, idu, "
+    "valor_atual"
+)
+
+
+def _checksum_sql() -> str:
+    if db.engine.dialect.name == "mssql":
+        return f"CHECKSUM_AGG(BINARY_CHECKSUM({_COLUNAS_CHECKSUM}))"
+    return f"BIT_XOR(CRC32(CONCAT_WS('|', {_COLUNAS_CHECKSUM})))"
+
+
+def _assinatura() -> tuple:
+    """
+    Contagem, ultimo id e checksum do conteudo das linhas ativas, mais a
+    versao da carga: UPDATE que so muda valores (sem inserir linhas) tambem
+    troca a assinatura.
+    """
+    total, ultimo, checksum = db.session.execute(
+        text(f"SELECT COUNT(*), MAX(id), {_checksum_sql()} FROM plan21_nger WHERE ativo = 1")
+    ).one()
+    return int(total or 0), int(ultimo or 0), int(checksum or 0), _versao.atual()
+
+
+def _construir(assinatura: tuple) -> FacetIndex:
+    cols = [getattr(Plan21Nger, attr) for attr in FACET_FIELDS.values()]
+    rows = (
+        db.session.query(*cols)
+        .filter(Plan21Nger.ativo == True)  # noqa: E712
+        .order_by(Plan21Nger.exercicio, Plan21Nger.chave_planejamento, Plan21Nger.id)
+        .yield_per(5000)
+    )
+    return FacetIndex(rows, assinatura)
+
+
+def assinatura_plan21() -> tuple:
+    """
+    Assinatura atual do plan21_nger, relida no maximo uma vez por
+    PLAN21_INDEX_TTL ou logo que a versao da carga muda.
+    """
+    global _assinatura_atual, _checked
+
+    def _vencida(assinatura) -> bool:
+        return (
+            assinatura is None
+            or time.monotonic() - _checked >= PLAN21_INDEX_TTL
+            or assinatura[-1] != _versao.atual()
+        )
+
+    assinatura = _assinatura_atual
+    if not _vencida(assinatura):
+        return assinatura
+    with _lock:
+        if _vencida(_assinatura_atual):
+            _assinatura_atual = _assinatura()
+            _checked = time.monotonic()
+        return _assinatura_atual
+
+
+def get_plan21_index() -> FacetIndex:
+    """Indice atual; so e reconstruido quando o plan21_nger muda (ver _assinatura)."""
+    global _index
+    assinatura = assinatura_plan21()
+    indice = _index
+    if indice is not None and indice.assinatura == assinatura:
+        return indice
+    with _lock:
+        if _index is None or _index.assinatura != assinatura:
+            _index = _construir(assinatura)
+        return _index
@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+from sqlalchemy import text
+
+from models import db
+from services.chave_norm import backfill_chave_norm
+from services.dotacao_ledger import sync_ledger
+
+DERIVED_DIR = Path("outputs/derived")
+# Uploads que chegam dentro desta janela (s) dividem uma unica rodada de refresh.
+POST_INGEST_DEBOUNCE = float(os.getenv("POST_INGEST_DEBOUNCE", "5"))
+RUNS_LOG_SIZE = 50
+
+
+@dataclass(frozen=True)
+class Step:
+    name: str
+    fn: Callable[[], dict[str, Any] | None]
+    after: tuple[str, ...] = ()
+
+
+def _derived_path(name: str) -> Path:
+    return DERIVED_DIR / f"{name}.json"
+
+
+def read_derived(name: str) -> dict[str, Any] | None:
+    try:
+        return json.loads(_derived_path(name).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def write_derived(name: str, data: dict[str, Any]) -> None:
+    DERIVED_DIR.mkdir(parents=True, exist_ok=True)
+    path = _derived_path(name)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=True, default=str), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+# --- passos ---------------------------------------------------------------
+
+
+def refresh_ped_dotacao_missing() -> dict[str, Any]:
+    """Chaves DOT. do PED ativo sem dotacao cadastrada (lista do dashboard)."""
+    ped_keys = {
+        row[0]
+        for row in db.session.execute(
+            text("SELECT DISTINCT chave_norm FROM ped WHERE ativo = 1 AND chave_norm LIKE 'DOT.%'")
+        ).all()
+        if row[0]
+    }
+    dot_keys = {
+        row[0]
+        for row in db.session.execute(
+            text("SELECT DISTINCT chave_norm FROM dotacao WHERE chave_norm IS NOT NULL")
+        ).all()
+    }
+    missing = sorted(k for k in ped_keys if k not in dot_keys)
+    write_derived("ped_dotacao_missing", {"keys": missing, "updated_at": datetime.utcnow().isoformat()})
+    return {"chaves_faltantes": len(missing)}
+
+
+def refresh_chave_norm() -> dict[str, Any]:
+    """Completa chave_norm de linhas gravadas fora dos caminhos que ja a preenchem."""
+    return {name: backfill_chave_norm(name) for name in ("ped", "emp", "dotacao")}
+
+
+def refresh_saldo_dotacao() -> dict[str, Any]:
+    """Recalcula todas as linhas de saldo_dotacao (PED/EMP mudaram por inteiro)."""
+    # import local: o calculo do saldo mora nas rotas, que importam este modulo
+    from rotas.home_routes import atualizar_saldos_dotacao
+
+    return atualizar_saldos_dotacao(todas=True)
+
+
+def refresh_saldo_dotacao_pendentes() -> dict[str, Any]:
+    """Recalcula so as linhas de saldo_dotacao invalidadas por escritas de dotacao/estorno."""
+    from rotas.home_routes import atualizar_saldos_dotacao  # import local, ver refresh_saldo_dotacao
+
+    return atualizar_saldos_dotacao(todas=False)
+
+
+def bump_version_file(nome: str) -> dict[str, Any]:
+    """Incrementa o contador de versao em outputs/derived/<nome>.json (ver services/shared_version.py)."""
+    atual = read_derived(nome) or {}
+    dados = {
+        "version": int(atual.get("version") or 0) + 1,
+        # token distingue duas gravacoes concorrentes com o mesmo numero
+        "token": uuid.uuid4().hex,
+        "updated_at": datetime.utcnow().isoformat(),
+    }
+    write_derived(nome, dados)
+    return dados
+
+
+def dataset_version_name(kind: str) -> str:
+    """Arquivo de versao dos dados de um tipo (ver bump_dataset_version)."""
+    return f"dataset_version_{kind}"
+
+
+def bump_dataset_version(kind: str) -> dict[str, Any]:
+    """
+    Invalida os caches de resposta do tipo. Chamado ao iniciar a ingestao, ao
+    desfazer/cancelar/falhar e ao terminar: resposta montada no meio do job
+    (linhas antigas desativadas, parte dos lotes gravada) nao sobrevive a ele.
+    """
+    return bump_version_file(dataset_version_name(kind))
+
+
+def bump_data_version() -> dict[str, Any]:
+    """Versao dos dados de relatorio; caches de resposta usam como chave."""
+    atual = read_derived("data_version") or {}
+    versao = int(atual.get("version") or 0) + 1
+    write_derived("data_version", {"version": versao, "updated_at": datetime.utcnow().isoformat()})
+    return {"version": versao}
+
+
+STEPS: dict[str, Step] = {
+    step.name: step
+    for step in (
+        Step("chave_norm", refresh_chave_norm),
+        Step("dotacao_ledger", sync_ledger, after=("chave_norm",)),
+        Step("ped_dotacao_missing", refresh_ped_dotacao_missing, after=("chave_norm", "dotacao_ledger")),
+        Step("saldo_dotacao", refresh_saldo_dotacao, after=("chave_norm", "dotacao_ledger")),
+        Step("saldo_dotacao_pendentes", refresh_saldo_dotacao_pendentes, after=("saldo_dotacao",)),
+        Step(
+            "data_version",
+            bump_data_version,
+            after=("dotacao_ledger", "ped_dotacao_missing", "saldo_dotacao", "saldo_dotacao_pendentes"),
+        ),
+    )
+}
+
+# Passos disparados por cada tipo de upload.
+DATASET_STEPS: dict[str, tuple[str, ...]] = {
+    "ped": ("chave_norm", "dotacao_ledger", "ped_dotacao_missing", "saldo_dotacao", "data_version"),
+    "emp": ("chave_norm", "dotacao_ledger", "saldo_dotacao", "data_version"),
+    # Cadastro/edicao de dotacao ou estorno pela tela.
+    "dotacao": ("saldo_dotacao_pendentes", "data_version"),
+    "est_emp": ("data_version",),
+    "nob": ("data_version",),
+    "fip613": ("data_version",),
+    "plan20": ("data_version",),
+    # Carga do plan21_nger, feita fora da aplicacao (worker.py --refresh plan21).
+    "plan21": ("saldo_dotacao", "data_version"),
+}
+
+
+def _ordenar(nomes: Iterable[str]) -> list[str]:
+    """Ordem topologica dos passos pendentes (after so vale entre pendentes)."""
+    pendentes = {n for n in nomes if n in STEPS}
+    ordem: list[str] = []
+    visitados: set[str] = set()
+
+    def _visitar(nome: str) -> None:
+        if nome in visitados:
+            return
+        visitados.add(nome)
+        for dep in STEPS[nome].after:
+            if dep in pendentes:
+                _visitar(dep)
+        ordem.append(nome)
+
+    for nome in sorted(pendentes):
+        _visitar(nome)
+    return ordem
+
+
+_run_lock = threading.Lock()
+
+
+def run_steps(nomes: Iterable[str], origem: Iterable[str] = ()) -> list[dict[str, Any]]:
+    """Executa os passos (dentro de app context) registrando tempo e resultado."""
+    resultados = []
+    with _run_lock:
+        for nome in _ordenar(nomes):
+            inicio = time.perf_counter()
+            registro: dict[str, Any] = {"step": nome, "started_at": datetime.utcnow().isoformat()}
+            try:
+                registro["result"] = STEPS[nome].fn() or {}
+                registro["ok"] = True
+            except Exception as exc:
+                db.session.rollback()
+                traceback.print_exc()
+                registro["ok"] = False
+                registro["error"] = f"{type(exc).__name__}: {exc}"
+            registro["seconds"] = round(time.perf_counter() - inicio, 3)
+            print(f" [post-ingest] {nome}: {registro['seconds']}s {'ok' if registro['ok'] else 'falhou'}")
+            resultados.append(registro)
+        log = read_derived("post_ingest_runs") or {}
+        runs = list(log.get("runs") or [])
+        runs.append({"origem": sorted(set(origem)), "steps": resultados, "finished_at": datetime.utcnow().isoformat()})
+        write_derived("post_ingest_runs", {"runs": runs[-RUNS_LOG_SIZE:]})
+    return resultados
+
+
+def run_refresh_now(kind: str) -> list[dict[str, Any]]:
+    bump_dataset_version(kind)
+    return run_steps(DATASET_STEPS.get(kind, ()), origem=[kind])
+
+
+_pending_lock = threading.Lock()
+_pending: dict[str, set[str]] = {}
+_timer: threading.Timer | None = None
+
+
+def _drain(app) -> None:
+    global _pending, _timer
+    with _pending_lock:
+        pendentes, _pending = _pending, {}
+        _timer = None
+    if not pendentes:
+        return
+    origem = set().union(*pendentes.values())
+    with app.app_context():
+        try:
+            run_steps(pendentes.keys(), origem)
+        finally:
+            db.session.remove()
+
+
+def schedule_refresh(kind: str, app) -> None:
+    """
+    Agenda em background os passos do tipo. Pedidos dentro da janela de
+    debounce sao unidos e cada passo roda uma vez por rodada.
+    """
+    global _timer
+    # Os dados do tipo ja mudaram: invalida os caches de resposta agora, sem
+    # esperar o debounce dos passos.
+    bump_dataset_version(kind)
+    passos = DATASET_STEPS.get(kind, ())
+    if not passos:
+        return
+    with _pending_lock:
+        for nome in passos:
+            _pending.setdefault(nome, set()).add(kind)
+        if _timer is None:
+            _timer = threading.Timer(POST_INGEST_DEBOUNCE, _drain, args=(app,))
+            _timer.daemon = True
+            _timer.start()
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import wraps
+from typing import Callable
+
+from flask import Response, current_app, request
+
+from services.post_ingest import dataset_version_name
+from services.shared_version import SharedVersion
+
+# Limites do cache de respostas por processo; respostas em streaming (dump
+# completo) so ganham ETag, o corpo nao fica em memoria.
+RELATORIO_CACHE_MAX_BYTES = int(float(os.getenv("RELATORIO_CACHE_MAX_MB", "128")) * 1024 * 1024)
+RELATORIO_CACHE_ITEM_MAX_BYTES = int(float(os.getenv("RELATORIO_CACHE_ITEM_MAX_MB", "8")) * 1024 * 1024)
+
+
+@dataclass(frozen=True)
+class _Entrada:
+    dataset: str
+    versao: tuple | None
+    corpo: bytes
+    mimetype: str
+
+
+_versoes: dict[str, SharedVersion] = {}
+_cache: OrderedDict[str, _Entrada] = OrderedDict()
+_bytes = 0
+_lock = threading.Lock()
+
+
+def _versao(dataset: str) -> tuple | None:
+    versao = _versoes.get(dataset)
+    if versao is None:
+        versao = _versoes.setdefault(dataset, SharedVersion(dataset_version_name(dataset)))
+    return versao.atual()
+
+
+def _etag(dataset: str, versao) -> str:
+    params = sorted(request.args.items(multi=True))
+    bruto = json.dumps([dataset, versao, request.path, params], ensure_ascii=True, default=str)
+    return hashlib.sha1(bruto.encode("utf-8")).hexdigest()
+
+
+def _com_etag(resp: Response, etag: str) -> Response:
+    resp.set_etag(etag)
+    # O navegador guarda, mas confere a versao (If-None-Match) a cada uso.
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def _guardar(etag: str, entrada: _Entrada) -> None:
+    global _bytes
+    with _lock:
+        for chave in [k for k, e in _cache.items() if e.dataset == entrada.dataset and e.versao != entrada.versao]:
+            _bytes -= len(_cache.pop(chave).corpo)
+        if etag in _cache:
+            _bytes -= len(_cache.pop(etag).corpo)
+        _cache[etag] = entrada
+        _bytes += len(entrada.corpo)
+        while _bytes > RELATORIO_CACHE_MAX_BYTES and _cache:
+            _, antiga = _cache.popitem(last=False)
+            _bytes -= len(antiga.corpo)
+
+
+def resposta_cacheada(dataset: str, gerar: Callable[[], object]) -> Response:
+    """
+    Resposta de relatorio cacheada pela versao dos dados do tipo (trocada
+    quando a ingestao termina) + rota + parametros. Com a versao igual, o
+    cliente recebe 304 pelo If-None-Match e os outros usuarios recebem o
+    corpo guardado, sem ir ao banco. Erros nao sao guardados.
+    """
+    versao = _versao(dataset)
+    etag = _etag(dataset, versao)
+    if request.if_none_match.contains(etag):
+        return _com_etag(Response(status=304), etag)
+    with _lock:
+        entrada = _cache.get(etag)
+        if entrada is not None:
+            _cache.move_to_end(etag)
+    if entrada is not None and entrada.versao == versao:
+        return _com_etag(Response(entrada.corpo, mimetype=entrada.mimetype), etag)
+
+    resp = current_app.make_response(gerar())
+    if resp.status_code != 200:
+        return resp
+    if not resp.is_streamed:
+        corpo = resp.get_data()
+        if len(corpo) <= RELATORIO_CACHE_ITEM_MAX_BYTES:
+            _guardar(etag, _Entrada(dataset, versao, corpo, resp.mimetype))
+    return _com_etag(resp, etag)
+
+
+def cache_relatorio(dataset: str):
+    """Decorator de resposta_cacheada; vai abaixo dos de login/permissao."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            return resposta_cacheada(dataset, lambda: view(*args, **kwargs))
+
+        return wrapped
+
+    return decorator
@@ -0,0 +1,635 @@
+from __future__ import annotations
+
+import base64
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Iterable, Iterator
+
+import sqlalchemy as sa
+from sqlalchemy import text
+
+from models import db
+from services.valor_sql import decimal_expr
+
+# Pagina padrao/maxima das consultas paginadas dos relatorios.
+RELATORIO_PAGINA = 200
+RELATORIO_PAGINA_MAX = int(os.getenv("RELATORIO_PAGINA_MAX", "5000"))
+# Maximo de grupos de uma agregacao e de valores distintos por coluna.
+AGREGADO_GRUPOS_MAX = int(os.getenv("AGREGADO_GRUPOS_MAX", "5000"))
+DISTINTOS_MAX = int(os.getenv("DISTINTOS_MAX", "2000"))
+# Linhas por lote no dump completo em streaming.
+RELATORIO_STREAM_LOTE = int(os.getenv("RELATORIO_STREAM_LOTE", "2000"))
+PREFIXO_SUFIXO = "_prefixo"
+# Parametros de controle; qualquer outro parametro com nome de coluna e filtro.
+_CONTROLE = {"colunas", "ordem", "limite", "cursor", "completo", "formato"}
+FORMATOS = ("linhas", "colunar")
+_CONTROLE_AGREGADO = {"agrupar", "medidas", "distintos", "limite"}
+
+
+def para_float(val) -> float:
+    """Numero do banco ou texto (1234.56 ou 1.234,56); vazio vira 0."""
+    try:
+        if val in (None, ""):
+            return 0.0
+        if isinstance(val, str) and "," in val:
+            return float(val.replace(".", "").replace(",", "."))
+        return float(val)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def data_br(val):
+    if not val:
+        return None
+    if hasattr(val, "strftime"):
+        return val.strftime("%d/%m/%Y")
+    return str(val)
+
+
+def data_hora_br(val):
+    if not val:
+        return None
+    if hasattr(val, "strftime"):
+        return val.strftime("%d/%m/%Y %H:%M:%S")
+    return str(val)
+
+
+def texto(val) -> str:
+    return str(val or "")
+
+
+@dataclass(frozen=True)
+class RelatorioSpec:
+    """
+    Tabela de um relatorio: colunas devolvidas (na ordem do JSON), formato de
+    cada coluna, as colunas ordenaveis, que tem indice (ativo, coluna), e as
+    dimensoes/medidas aceitas na agregacao.
+    """
+
+    tabela: str
+    # Tipo de upload (post_ingest) que altera a tabela.
+    dataset: str
+    colunas: tuple[str, ...]
+    ordenaveis: tuple[str, ...]
+    formatos: dict[str, Callable[[Any], Any]] = field(default_factory=dict)
+    dimensoes: tuple[str, ...] = ()
+    medidas: tuple[str, ...] = ()
+
+    def linha(self, row, colunas) -> dict:
+        formatos = self.formatos
+        return {c: formatos[c](row[c]) if c in formatos else row[c] for c in colunas}
+
+
+@dataclass
+class Consulta:
+    colunas: tuple[str, ...]
+    filtros: dict[str, list[str]]
+    prefixos: dict[str, str]
+    ordem: str
+    desc: bool
+    limite: int
+    cursor: tuple | None
+
+
+@dataclass
+class Agregacao:
+    agrupar: tuple[str, ...]
+    medidas: tuple[str, ...]
+    distintos: tuple[str, ...]
+    filtros: dict[str, list[str]]
+    prefixos: dict[str, str]
+    limite: int
+
+
+def _colunas(nomes: str) -> tuple[str, ...]:
+    return tuple(c.strip() for c in nomes.split() if c.strip())
+
+
+RELATORIO_PED = RelatorioSpec(
+    tabela="ped",
+    dataset="ped",
+    colunas=_colunas(
+        """
+        chave chave_planejamento regiao subfuncao_ug adj macropolitica pilar eixo politica_decreto
+        exercicio numero_ped numero_ped_estorno numero_emp numero_cad numero_noblist numero_os convenio
+        numero_processo_orcamentario_pagamento valor_ped valor_estorno indicativo_licitacao_exercicios_anteriores
+        data_licitacao liberado_fisco_estadual situacao uo nome_unidade_orcamentaria ug nome_unidade_gestora
+        data_solicitacao data_criacao tipo_empenho dotacao_orcamentaria funcao subfuncao programa_governo paoe
+        natureza_despesa cat_econ grupo modalidade elemento nome_elemento fonte iduso numero_emenda_ep
+        autor_emenda_ep numero_cac licitacao usuario_responsavel historico credor nome_credor data_autorizacao
+        data_hora_cadastro_autorizacao tipo_despesa numero_abj numero_processo_sequestro_judicial
+        indicativo_entrega_imediata indicativo_contrato codigo_uo_extinta devolucao_gcv
+        mes_competencia_folha_pagamento exercicio_competencia_folha obrigacao_patronal tipo_obrigacao_patronal
+        numero_nla
+        """
+    ),
+    ordenaveis=("exercicio", "numero_ped", "numero_emp", "uo", "situacao", "adj"),
+    formatos={"valor_ped": para_float, "valor_estorno": para_float},
+    dimensoes=_colunas(
+        """
+        exercicio chave_planejamento regiao subfuncao_ug adj macropolitica pilar eixo politica_decreto uo ug
+        funcao subfuncao programa_governo paoe natureza_despesa cat_econ grupo modalidade elemento fonte iduso
+        situacao tipo_empenho tipo_despesa
+        """
+    ),
+    medidas=("valor_ped", "valor_estorno"),
+)
+
+RELATORIO_EMP = RelatorioSpec(
+    tabela="emp",
+    dataset="emp",
+    colunas=_colunas(
+        """
+        chave chave_planejamento regiao subfuncao_ug adj macropolitica pilar eixo politica_decreto
+        exercicio numero_emp numero_ped valor_emp devolucao_gcv valor_emp_devolucao_gcv uo
+        nome_unidade_orcamentaria ug nome_unidade_gestora dotacao_orcamentaria funcao subfuncao
+        programa_governo paoe natureza_despesa cat_econ grupo modalidade elemento fonte iduso historico
+        tipo_despesa credor nome_credor cpf_cnpj_credor categoria_credor tipo_empenho situacao data_emissao
+        data_criacao numero_contrato numero_convenio
+        """
+    ),
+    ordenaveis=("exercicio", "numero_emp", "numero_ped", "uo", "situacao", "data_emissao"),
+    formatos={
+        "valor_emp": para_float,
+        "devolucao_gcv": para_float,
+        "valor_emp_devolucao_gcv": para_float,
+        "data_emissao": data_br,
+        "data_criacao": data_br,
+    },
+    dimensoes=_colunas(
+        """
+        exercicio chave_planejamento regiao subfuncao_ug adj macropolitica pilar eixo politica_decreto uo ug
+        funcao subfuncao programa_governo paoe natureza_despesa cat_econ grupo modalidade elemento fonte iduso
+        situacao tipo_empenho tipo_despesa categoria_credor
+        """
+    ),
+    medidas=("valor_emp", "devolucao_gcv", "valor_emp_devolucao_gcv"),
+)
+
+RELATORIO_EST_EMP = RelatorioSpec(
+    tabela="est_emp",
+    dataset="est_emp",
+    colunas=_colunas(
+        """
+        exercicio numero_est numero_emp empenho_atual empenho_rp numero_ped valor_emp valor_est_emp_sem_aqs
+        valor_est_emp_com_aqs valor_emp_liquido uo nome_unidade_orcamentaria ug nome_unidade_gestora
+        dotacao_orcamentaria historico credor nome_credor cpf_cnpj_credor data_criacao data_emissao situacao rp
+        """
+    ),
+    ordenaveis=("exercicio", "numero_est", "numero_emp", "uo", "data_emissao"),
+    formatos={
+        "valor_emp": para_float,
+        "valor_est_emp_sem_aqs": para_float,
+        "valor_est_emp_com_aqs": para_float,
+        "valor_emp_liquido": para_float,
+        "data_criacao": data_br,
+        "data_emissao": data_br,
+    },
+    dimensoes=("exercicio", "uo", "ug", "dotacao_orcamentaria", "situacao", "rp"),
+    medidas=("valor_emp", "valor_est_emp_sem_aqs", "valor_est_emp_com_aqs", "valor_emp_liquido"),
+)
+
+RELATORIO_NOB = RelatorioSpec(
+    tabela="nob",
+    dataset="nob",
+    colunas=_colunas(
+        """
+        exercicio numero_nob numero_nob_estorno numero_liq numero_emp empenho_atual empenho_rp numero_ped
+        valor_nob devolucao_gcv valor_nob_gcv uo ug dotacao_orcamentaria funcao subfuncao programa_governo paoe
+        natureza_despesa cat_econ grupo modalidade elemento nome_elemento_despesa fonte nome_fonte_recurso
+        iduso historico_liq nome_credor_principal cpf_cnpj_credor_principal credor nome_credor cpf_cnpj_credor
+        data_nob data_cadastro_nob data_hora_cadastro_liq
+        """
+    ),
+    ordenaveis=("exercicio", "numero_nob", "numero_emp", "uo", "data_nob"),
+    formatos={
+        "valor_nob": para_float,
+        "devolucao_gcv": para_float,
+        "valor_nob_gcv": para_float,
+        "data_nob": data_br,
+        "data_cadastro_nob": data_br,
+        "data_hora_cadastro_liq": data_hora_br,
+    },
+    dimensoes=_colunas(
+        """
+        exercicio uo ug funcao subfuncao programa_governo paoe natureza_despesa cat_econ grupo modalidade
+        elemento fonte iduso
+        """
+    ),
+    medidas=("valor_nob", "devolucao_gcv", "valor_nob_gcv"),
+)
+
+RELATORIO_PLAN20 = RelatorioSpec(
+    tabela="plan20_seduc",
+    dataset="plan20",
+    colunas=_colunas(
+        """
+        exercicio chave_planejamento regiao subfuncao_ug adj macropolitica pilar eixo politica_decreto
+        publico_transversal_chave programa funcao unidade_orcamentaria acao_paoe subfuncao objetivo_especifico
+        esfera responsavel_acao produto_acao unid_medida_produto regiao_produto meta_produto saldo_meta_produto
+        publico_transversal subacao_entrega responsavel prazo unid_gestora unidade_setorial_planejamento
+        produto_subacao unidade_medida regiao_subacao codigo municipios_entrega meta_subacao
+        detalhamento_produto etapa responsavel_etapa prazo_etapa regiao_etapa natureza cat_econ grupo
+        modalidade elemento subelemento fonte idu descricao_item_despesa unid_medida_item quantidade
+        valor_unitario valor_total
+        """
+    ),
+    ordenaveis=("exercicio", "unidade_orcamentaria", "chave_planejamento"),
+    formatos={"quantidade": para_float, "valor_unitario": para_float, "valor_total": para_float},
+    dimensoes=_colunas(
+        """
+        exercicio chave_planejamento regiao subfuncao_ug adj macropolitica pilar eixo politica_decreto programa
+        funcao unidade_orcamentaria acao_paoe subfuncao unid_gestora natureza cat_econ grupo modalidade elemento
+        subelemento fonte idu
+        """
+    ),
+    medidas=("quantidade", "valor_total"),
+)
+
+_FIP613_VALORES = _colunas(
+    """
+    dotacao_inicial cred_suplementar cred_especial cred_extraordinario reducao cred_autorizado
+    bloqueado_conting reserva_empenho saldo_destaque saldo_dotacao empenhado liquidado a_liquidar
+    valor_pago valor_a_pagar
+    """
+)
+RELATORIO_FIP613 = RelatorioSpec(
+    tabela="fip613",
+    dataset="fip613",
+    colunas=_colunas(
+        """
+        uo ug funcao subfuncao programa projeto_atividade regional natureza_despesa fonte_recurso iduso
+        tipo_recurso
+        """
+    )
+    + _FIP613_VALORES,
+    ordenaveis=("uo", "natureza_despesa", "fonte_recurso"),
+    formatos={"natureza_despesa": texto, "fonte_recurso": texto, **{c: para_float for c in _FIP613_VALORES}},
+    dimensoes=_colunas(
+        """
+        uo ug funcao subfuncao programa projeto_atividade regional natureza_despesa fonte_recurso iduso
+        tipo_recurso
+        """
+    ),
+    medidas=_FIP613_VALORES,
+)
+
+RELATORIOS = (RELATORIO_PED, RELATORIO_EMP, RELATORIO_EST_EMP, RELATORIO_NOB, RELATORIO_PLAN20, RELATORIO_FIP613)
+
+
+def _tabela(spec: RelatorioSpec) -> sa.TableClause:
+    return sa.table(spec.tabela, sa.column("id"), sa.column("ativo"), *map(sa.column, spec.colunas))
+
+
+def _codificar_cursor(valor, row_id) -> str:
+    if isinstance(valor, datetime):
+        bruto = ["dt", valor.isoformat(), row_id]
+    else:
+        bruto = ["v", valor if valor is None or isinstance(valor, (int, float, str)) else str(valor), row_id]
+    return base64.urlsafe_b64encode(json.dumps(bruto).encode()).decode().rstrip("=")
+
+
+def _decodificar_cursor(cursor: str) -> tuple:
+    try:
+        tipo, valor, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if tipo == "dt":
+            valor = datetime.fromisoformat(valor)
+        return valor, int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError("Cursor invalido.") from None
+
+
+def _filtros(spec: RelatorioSpec, args, controle: set[str]) -> tuple[dict[str, list[str]], dict[str, str]]:
+    """<coluna>=valor (repetivel, vira IN) e <coluna>_prefixo=texto; o resto fora de controle e erro."""
+    validas = set(spec.colunas)
+    filtros: dict[str, list[str]] = {}
+    prefixos: dict[str, str] = {}
+    for nome in args.keys():
+        if nome in controle:
+            continue
+        if nome.endswith(PREFIXO_SUFIXO) and nome[: -len(PREFIXO_SUFIXO)] in validas:
+            valor = (args.get(nome) or "").strip()
+            if valor:
+                prefixos[nome[: -len(PREFIXO_SUFIXO)]] = valor
+        elif nome in validas:
+            valores = [v.strip() for v in args.getlist(nome) if v.strip()]
+            if valores:
+                filtros[nome] = valores
+        else:
+            raise ValueError(f"Parametro desconhecido: {nome}.")
+    return filtros, prefixos
+
+
+def _lista(args, nome: str, validas: tuple[str, ...], padrao: tuple[str, ...] = ()) -> tuple[str, ...]:
+    nomes = [c.strip() for c in (args.get(nome) or "").split(",") if c.strip()]
+    invalidas = [c for c in nomes if c not in validas]
+    if invalidas:
+        raise ValueError(f"Valores invalidos em {nome}: {', '.join(invalidas)}.")
+    return tuple(dict.fromkeys(nomes)) or padrao
+
+
+def colunas_pedidas(spec: RelatorioSpec, args) -> tuple[str, ...]:
+    """Projecao pedida em colunas=a,b,c (padrao: todas)."""
+    return _lista(args, "colunas", spec.colunas, spec.colunas)
+
+
+def formato_pedido(args) -> str:
+    formato = (args.get("formato") or FORMATOS[0]).strip().lower()
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato invalido; use {' ou '.join(FORMATOS)}.")
+    return formato
+
+
+def parse_consulta(spec: RelatorioSpec, args) -> Consulta:
+    """
+    Le colunas (lista separada por virgula), ordem (coluna ou -coluna),
+    limite, cursor e os filtros: <coluna>=valor (repetivel, vira IN) e
+    <coluna>_prefixo=texto. Erros de parametro viram ValueError.
+    """
+    colunas = colunas_pedidas(spec, args)
+
+    ordem = (args.get("ordem") or "").strip()
+    desc = ordem.startswith("-")
+    ordem = ordem.lstrip("-") or "id"
+    if ordem != "id" and ordem not in spec.ordenaveis:
+        raise ValueError(f"Ordenacao permitida apenas por: {', '.join(('id',) + spec.ordenaveis)}.")
+
+    try:
+        limite = int(args.get("limite") or RELATORIO_PAGINA)
+    except ValueError:
+        raise ValueError("Limite invalido.") from None
+    limite = max(1, min(limite, RELATORIO_PAGINA_MAX))
+
+    filtros, prefixos = _filtros(spec, args, _CONTROLE)
+    cursor = _decodificar_cursor(args["cursor"]) if args.get("cursor") else None
+    return Consulta(colunas, filtros, prefixos, ordem, desc, limite, cursor)
+
+
+def _condicoes(tabela: sa.TableClause, filtros: dict[str, list[str]], prefixos: dict[str, str]) -> list:
+    c = tabela.c
+    condicoes = [c.ativo == 1]
+    for nome, valores in filtros.items():
+        condicoes.append(c[nome] == valores[0] if len(valores) == 1 else c[nome].in_(valores))
+    for nome, prefixo in prefixos.items():
+        escapado = prefixo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        condicoes.append(c[nome].like(f"{escapado}%", escape="\\"))
+    return condicoes
+
+
+_POR_ID = object()
+
+
+def _apos_cursor(col, id_col, desc: bool, valor, ultimo_id):
+    """
+    Linhas depois de (valor, id) na ordem (col, id). NULL vem primeiro no
+    ASC e por ultimo no DESC (MySQL e SQL Server), dai os casos separados.
+    """
+    if valor is _POR_ID:
+        return id_col < ultimo_id if desc else id_col > ultimo_id
+    if not desc:
+        if valor is None:
+            return sa.or_(col.isnot(None), sa.and_(col.is_(None), id_col > ultimo_id))
+        return sa.or_(col > valor, sa.and_(col == valor, id_col > ultimo_id))
+    if valor is None:
+        return sa.and_(col.is_(None), id_col < ultimo_id)
+    return sa.or_(col < valor, sa.and_(col == valor, id_col < ultimo_id), col.is_(None))
+
+
+def consultar(spec: RelatorioSpec, consulta: Consulta) -> dict:
+    """
+    Uma pagina do relatorio por keyset (ordem, id): a proxima pagina parte do
+    cursor devolvido, sem OFFSET. total conta todas as linhas dos filtros.
+    """
+    tabela = _tabela(spec)
+    c = tabela.c
+    por_id = consulta.ordem == "id"
+    col = c.id if por_id else c[consulta.ordem]
+    condicoes = _condicoes(tabela, consulta.filtros, consulta.prefixos)
+    total = db.session.execute(sa.select(sa.func.count()).select_from(tabela).where(*condicoes)).scalar()
+
+    if consulta.cursor is not None:
+        valor, ultimo_id = consulta.cursor
+        condicoes.append(_apos_cursor(col, c.id, consulta.desc, _POR_ID if por_id else valor, ultimo_id))
+    selecionadas = [c[n] for n in consulta.colunas]
+    if not por_id and consulta.ordem not in consulta.colunas:
+        selecionadas.append(col)
+    if por_id:
+        ordem = [c.id.desc() if consulta.desc else c.id.asc()]
+    else:
+        ordem = [col.desc(), c.id.desc()] if consulta.desc else [col.asc(), c.id.asc()]
+    rows = (
+        db.session.execute(
+            sa.select(c.id, *selecionadas).where(*condicoes).order_by(*ordem).limit(consulta.limite + 1)
+        )
+        .mappings()
+        .all()
+    )
+
+    proximo = None
+    if len(rows) > consulta.limite:
+        rows = rows[: consulta.limite]
+        ultimo = rows[-1]
+        proximo = _codificar_cursor(None if por_id else ultimo[consulta.ordem], ultimo["id"])
+    return {
+        "data": [spec.linha(r, consulta.colunas) for r in rows],
+        "total": int(total or 0),
+        "proximo_cursor": proximo,
+        "colunas": list(consulta.colunas),
+        "ordem": ("-" if consulta.desc else "") + consulta.ordem,
+        "ordenaveis": list(spec.ordenaveis),
+    }
+
+
+def parse_agregacao(spec: RelatorioSpec, args) -> Agregacao:
+    """
+    agrupar (lista de dimensoes separadas por virgula), medidas (padrao:
+    todas), distintos (qualquer coluna, sao as opcoes dos filtros das telas),
+    limite de grupos e os mesmos filtros da consulta.
+    """
+    agrupar = _lista(args, "agrupar", spec.dimensoes)
+    medidas = _lista(args, "medidas", spec.medidas, spec.medidas)
+    distintos = _lista(args, "distintos", spec.colunas)
+    try:
+        limite = int(args.get("limite") or AGREGADO_GRUPOS_MAX)
+    except ValueError:
+        raise ValueError("Limite invalido.") from None
+    limite = max(1, min(limite, AGREGADO_GRUPOS_MAX))
+    filtros, prefixos = _filtros(spec, args, _CONTROLE_AGREGADO)
+    return Agregacao(agrupar, medidas, distintos, filtros, prefixos, limite)
+
+
+def _somas(tabela: sa.TableClause, medidas: tuple[str, ...]) -> list:
+    # Conversao segura porque parte das medidas e gravada como texto (ex.: ped.valor_ped).
+    return [sa.func.coalesce(sa.func.sum(decimal_expr(tabela.c[m])), 0).label(m) for m in medidas]
+
+
+def _valores(row, medidas: tuple[str, ...]) -> dict:
+    return {"quantidade": int(row["quantidade"] or 0), **{m: float(row[m] or 0) for m in medidas}}
+
+
+def agregar(spec: RelatorioSpec, ag: Agregacao) -> dict:
+    """
+    Somas e contagens no banco: totais gerais, um grupo por combinacao das
+    dimensoes de agrupar (ate limite) e os valores distintos pedidos. Os
+    distintos de cada coluna ignoram o filtro da propria coluna, como os
+    filtros das telas.
+    """
+    tabela = _tabela(spec)
+    c = tabela.c
+    condicoes = _condicoes(tabela, ag.filtros, ag.prefixos)
+    quantidade = sa.func.count().label("quantidade")
+
+    totais = db.session.execute(sa.select(quantidade, *_somas(tabela, ag.medidas)).where(*condicoes)).mappings().one()
+    resultado: dict[str, Any] = {"totais": _valores(totais, ag.medidas), "grupos": [], "truncado": False}
+
+    if ag.agrupar:
+        dims = [c[d] for d in ag.agrupar]
+        rows = (
+            db.session.execute(
+                sa.select(*dims, quantidade, *_somas(tabela, ag.medidas))
+                .where(*condicoes)
+                .group_by(*dims)
+                .order_by(*dims)
+                .limit(ag.limite + 1)
+            )
+            .mappings()
+            .all()
+        )
+        resultado["truncado"] = len(rows) > ag.limite
+        resultado["grupos"] = [
+            {**{d: row[d] for d in ag.agrupar}, **_valores(row, ag.medidas)} for row in rows[: ag.limite]
+        ]
+
+    distintos = {}
+    for nome in ag.distintos:
+        outros = {k: v for k, v in ag.filtros.items() if k != nome}
+        outros_prefixos = {k: v for k, v in ag.prefixos.items() if k != nome}
+        col = c[nome]
+        valores = db.session.execute(
+            sa.select(col)
+            .where(*_condicoes(tabela, outros, outros_prefixos), col.isnot(None))
+            .distinct()
+            .order_by(col)
+            .limit(DISTINTOS_MAX)
+        ).scalars()
+        distintos[nome] = [v for v in (str(v).strip() for v in valores) if v]
+    resultado["distintos"] = distintos
+    return resultado
+
+
+def linhas_completo(spec: RelatorioSpec, colunas: tuple[str, ...] | None = None) -> Iterator[list[dict]]:
+    """
+    Todas as linhas ativas (?completo=1), nas colunas pedidas, em lotes de
+    RELATORIO_STREAM_LOTE lidos por cursor do lado do servidor (yield_per).
+    A consulta roda aqui, entao erro de banco aparece antes da resposta comecar.
+    """
+    colunas = colunas or spec.colunas
+    c = _tabela(spec).c
+    result = db.session.execute(
+        sa.select(*(c[n] for n in colunas))
+        .where(c.ativo == 1)
+        .execution_options(yield_per=RELATORIO_STREAM_LOTE)
+    ).mappings()
+
+    def _lotes():
+        try:
+            for lote in result.partitions():
+                yield [spec.linha(r, colunas) for r in lote]
+        finally:
+            result.close()
+
+    return _lotes()
+
+
+def json_stream(
+    lotes: Iterable[list],
+    cabecalho: dict,
+    dumps: Callable[[Any], str],
+    chave: str = "data",
+    rodape: Callable[[], dict] | None = None,
+) -> Iterator[str]:
+    """
+    Escreve {**cabecalho, chave: [...], **rodape()} lote a lote; so um lote
+    fica em memoria. rodape e chamado depois da ultima linha. dumps e o
+    encoder da app, para sair igual ao jsonify.
+    """
+    inicio = dumps(cabecalho).rstrip()[:-1].rstrip()
+    yield inicio + (", " if cabecalho else "") + json.dumps(chave) + ": ["
+    primeiro = True
+    for lote in lotes:
+        if not lote:
+            continue
+        parte = ",".join(dumps(linha) for linha in lote)
+        yield parte if primeiro else "," + parte
+        primeiro = False
+    fim = dumps(rodape()).strip()[1:-1].strip() if rodape else ""
+    yield "]" + (", " + fim if fim else "") + "}"
+
+
+class CodificadorColunar:
+    """
+    Formato colunar: os nomes das colunas vao uma vez e cada linha vira um
+    array de valores. As dimensoes do relatorio (uo, fonte, partes da
+    chave...) se repetem muito e vao como indice no dicionario da coluna,
+    montado durante a leitura e enviado no fim.
+    """
+
+    def __init__(self, spec: RelatorioSpec, colunas: Iterable[str]) -> None:
+        self.colunas = tuple(colunas)
+        self._dicionarios: dict[str, dict[Any, int]] = {c: {} for c in self.colunas if c in spec.dimensoes}
+        self._codificar = [self._dicionarios.get(c) for c in self.colunas]
+
+    def cabecalho(self) -> dict:
+        return {"formato": "colunar", "colunas": list(self.colunas), "codificadas": list(self._dicionarios)}
+
+    def linha(self, row: dict) -> list:
+        valores = []
+        for coluna, dicionario in zip(self.colunas, self._codificar):
+            valor = row[coluna]
+            if dicionario is not None and valor is not None:
+                valor = dicionario.setdefault(valor, len(dicionario))
+            valores.append(valor)
+        return valores
+
+    def dicionarios(self) -> dict[str, list]:
+        return {c: list(d) for c, d in self._dicionarios.items()}
+
+
+def para_colunar(spec: RelatorioSpec, resultado: dict) -> dict:
+    """Converte o resultado de consultar (lista de objetos em data) para o formato colunar."""
+    codificador = CodificadorColunar(spec, resultado["colunas"])
+    linhas = [codificador.linha(r) for r in resultado["data"]]
+    resto = {k: v for k, v in resultado.items() if k != "data"}
+    return {**resto, **codificador.cabecalho(), "linhas": linhas, "dicionarios": codificador.dicionarios()}
+
+
+def _indexavel(info: dict) -> bool:
+    # TEXT/VARCHAR(MAX) nao entram em indice; texto so ate 255.
+    tipo = info["type"]
+    if isinstance(tipo, sa.String):
+        return tipo.length is not None and tipo.length <= 255
+    return True
+
+
+def ensure_relatorio_indices() -> list[str]:
+    """
+    Cria os indices (ativo, coluna) das colunas ordenaveis dos relatorios que
+    ainda nao existem. Devolve os indices criados.
+    """
+    inspector = sa.inspect(db.engine)
+    criados = []
+    for spec in RELATORIOS:
+        if not inspector.has_table(spec.tabela):
+            continue
+        colunas = {c["name"]: c for c in inspector.get_columns(spec.tabela)}
+        indices = {i["name"] for i in inspector.get_indexes(spec.tabela)}
+        with db.engine.begin() as conn:
+            for col in spec.ordenaveis:
+                idx = f"idx_{spec.tabela}_ativo_{col}"
+                if idx in indices or col not in colunas or "ativo" not in colunas or not _indexavel(colunas[col]):
+                    continue
+                conn.execute(text(f"CREATE INDEX {idx} ON {spec.tabela} (ativo, {col})"))
+                criados.append(idx)
+    return criados
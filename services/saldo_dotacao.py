@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable
+
+import pytz
+from sqlalchemy import or_, text
+from sqlalchemy.exc import DBAPIError
+
+from models import db, SaldoDotacao, normalize_chave
+from services.plan21_index import assinatura_plan21
+from services.post_ingest import dataset_version_name
+from services.shared_version import SharedVersion
+
+SALDO_CAMPOS = (
+    "saldo",
+    "valor_atual",
+    "valor_dotacao",
+    "valor_ped",
+    "valor_emp_liquido",
+    "plan21_count",
+    "dotacao_count",
+    "ped_count",
+    "emp_count",
+)
+# Tipos de upload cujo conteudo entra no saldo sem passar pelas dotacoes.
+SALDO_BASES = ("ped", "emp")
+# Combinacoes recalculadas por lote (e por commit) no refresh da tabela.
+SALDO_DOTACAO_LOTE = 500
+# Linhas nao consultadas ha mais que isso saem no refresh completo.
+SALDO_DOTACAO_RETENCAO_DIAS = int(os.getenv("SALDO_DOTACAO_RETENCAO_DIAS", "30"))
+
+# (exercicio, chave_planejamento, filtros) como em _saldo_params.
+Combinacao = tuple[str, str, dict[str, str]]
+
+_versoes = {kind: SharedVersion(dataset_version_name(kind)) for kind in SALDO_BASES}
+
+
+def _now_local() -> datetime:
+    return datetime.now(pytz.timezone("America/Manaus")).replace(tzinfo=None)
+
+
+def saldo_zerado() -> dict:
+    return {campo: 0 if campo.endswith("_count") else Decimal("0") for campo in SALDO_CAMPOS}
+
+
+def assinatura_saldo(exercicio: str, chave_planejamento: str, filtros: dict[str, str]) -> str:
+    dados = [exercicio, chave_planejamento, sorted(filtros.items())]
+    return hashlib.sha1(json.dumps(dados, ensure_ascii=True).encode("utf-8")).hexdigest()
+
+
+def versao_base() -> str:
+    """Versao dos dados fora das dotacoes que entram no saldo (PED, EMP e plan21)."""
+    dados = [list(assinatura_plan21())] + [list(_versoes[kind].atual() or ()) for kind in SALDO_BASES]
+    return hashlib.sha1(json.dumps(dados, default=str).encode("utf-8")).hexdigest()
+
+
+def _valida(row, base: str) -> bool:
+    return row.geracao_saldo is not None and row.geracao_saldo == row.geracao and row.versao_base == base
+
+
+def _resultado(row) -> dict:
+    result = {campo: getattr(row, campo) for campo in SALDO_CAMPOS}
+    for campo in SALDO_CAMPOS:
+        if campo.endswith("_count"):
+            result[campo] = int(result[campo] or 0)
+        else:
+            result[campo] = Decimal(result[campo] or 0)
+    return result
+
+
+def _linhas(assinaturas) -> dict[str, SaldoDotacao]:
+    assinaturas = sorted(assinaturas)
+    linhas = {}
+    for i in range(0, len(assinaturas), SALDO_DOTACAO_LOTE):
+        for row in SaldoDotacao.query.filter(SaldoDotacao.assinatura.in_(assinaturas[i : i + SALDO_DOTACAO_LOTE])):
+            linhas[row.assinatura] = row
+    return linhas
+
+
+def _criar(novas: dict[str, Combinacao]) -> None:
+    """Linhas ainda sem saldo (geracao 0); outro processo pode ter criado a mesma antes."""
+    agora = _now_local()
+    for assinatura, (exercicio, chave_planejamento, filtros) in novas.items():
+        try:
+            with db.session.begin_nested():
+                db.session.add(
+                    SaldoDotacao(
+                        assinatura=assinatura,
+                        exercicio=exercicio,
+                        chave_planejamento=chave_planejamento,
+                        chave_planejamento_norm=normalize_chave(chave_planejamento),
+                        filtros=json.dumps(filtros, ensure_ascii=True, sort_keys=True),
+                        geracao=0,
+                        consultado_em=agora,
+                    )
+                )
+        except DBAPIError:
+            pass
+    db.session.commit()
+
+
+def _gravar(itens: list[tuple[int, int, dict]], base: str, agora) -> None:
+    """
+    Grava o saldo calculado so se a linha continua na geracao lida antes do
+    calculo: uma escrita de dotacao/estorno no meio descarta o resultado.
+    """
+    if not itens:
+        return
+    campos = ", ".join(f"{campo} = :{campo}" for campo in SALDO_CAMPOS)
+    db.session.execute(
+        text(
+            f"UPDATE saldo_dotacao SET {campos}, geracao_saldo = :geracao, versao_base = :base, "
+            "atualizado_em = :agora WHERE id = :id AND geracao = :geracao"
+        ),
+        [{**result, "id": row_id, "geracao": geracao, "base": base, "agora": agora} for row_id, geracao, result in itens],
+    )
+
+
+def saldos(
+    combinacoes: list[Combinacao],
+    calcular: Callable[[list[Combinacao]], list[dict]],
+    gravar: bool = True,
+) -> list[dict]:
+    """
+    Saldo de cada combinacao pela tabela saldo_dotacao. So as ausentes ou
+    invalidadas passam por calcular (uma chamada para todas); com gravar o
+    resultado fica na tabela. Validacoes de escrita usam gravar=False para
+    nao commitar a sessao da escrita.
+    """
+    assinaturas = [assinatura_saldo(*combinacao) for combinacao in combinacoes]
+    base = versao_base()
+    linhas = _linhas(assinaturas)
+    pendentes: dict[str, Combinacao] = {}
+    for assinatura, combinacao in zip(assinaturas, combinacoes):
+        exercicio, chave_planejamento, _ = combinacao
+        row = linhas.get(assinatura)
+        if exercicio and chave_planejamento and (row is None or not _valida(row, base)):
+            pendentes.setdefault(assinatura, combinacao)
+
+    calculados: dict[str, dict] = {}
+    if pendentes:
+        if gravar:
+            novas = {a: c for a, c in pendentes.items() if a not in linhas}
+            if novas:
+                _criar(novas)
+                # Geracao das linhas novas, lida antes do calculo.
+                linhas = _linhas(assinaturas)
+        calculados = dict(zip(pendentes, calcular(list(pendentes.values()))))
+        if gravar:
+            _gravar(
+                [(linhas[a].id, linhas[a].geracao, result) for a, result in calculados.items() if a in linhas],
+                base,
+                _now_local(),
+            )
+    if gravar:
+        agora = _now_local()
+        for row in linhas.values():
+            if row.consultado_em is None or agora - row.consultado_em > timedelta(days=1):
+                row.consultado_em = agora
+        db.session.commit()
+
+    resultados = []
+    for assinatura in assinaturas:
+        if assinatura in calculados:
+            resultados.append(calculados[assinatura])
+        elif assinatura in linhas and _valida(linhas[assinatura], base):
+            resultados.append(_resultado(linhas[assinatura]))
+        else:
+            resultados.append(saldo_zerado())
+    return resultados
+
+
+def atualizar_saldos(calcular: Callable[[list[Combinacao]], list[dict]], todas: bool = False) -> dict[str, Any]:
+    """
+    Recalcula as linhas invalidadas (ou todas) em lotes de SALDO_DOTACAO_LOTE,
+    um commit por lote. O refresh completo tambem remove as linhas que nao sao
+    consultadas ha SALDO_DOTACAO_RETENCAO_DIAS.
+    """
+    removidas = 0
+    if todas:
+        limite = _now_local() - timedelta(days=SALDO_DOTACAO_RETENCAO_DIAS)
+        removidas = SaldoDotacao.query.filter(SaldoDotacao.consultado_em < limite).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+    base = versao_base()
+    consulta = db.session.query(SaldoDotacao.id)
+    if not todas:
+        consulta = consulta.filter(
+            or_(
+                SaldoDotacao.geracao_saldo == None,  # noqa: E711
+                SaldoDotacao.geracao_saldo != SaldoDotacao.geracao,
+                SaldoDotacao.versao_base == None,  # noqa: E711
+                SaldoDotacao.versao_base != base,
+            )
+        )
+    ids = [row_id for (row_id,) in consulta.order_by(SaldoDotacao.id).all()]
+    atualizadas = 0
+    for i in range(0, len(ids), SALDO_DOTACAO_LOTE):
+        linhas = SaldoDotacao.query.filter(SaldoDotacao.id.in_(ids[i : i + SALDO_DOTACAO_LOTE])).all()
+        combinacoes = [(row.exercicio, row.chave_planejamento, json.loads(row.filtros)) for row in linhas]
+        resultados = calcular(combinacoes)
+        _gravar([(row.id, row.geracao, result) for row, result in zip(linhas, resultados)], base, _now_local())
+        db.session.commit()
+        atualizadas += len(linhas)
+    return {"atualizadas": atualizadas, "removidas": removidas}
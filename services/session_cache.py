@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from models import db, ActiveSession
+from services.diretorio import get_diretorio
+
+SESSION_TIMEOUT = timedelta(hours=2)
+# Validade (s) da sessao lida do banco antes de conferir de novo.
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "15"))
+# last_activity e gravado em lote, no maximo uma vez por janela (s) por usuario.
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "30"))
+ACTIVE_COUNT_TTL = float(os.getenv("ACTIVE_COUNT_TTL", "30"))
+
+
+@dataclass
+class _Sessao:
+    token: str
+    last_activity: datetime | None
+    lido_em: float
+
+
+_lock = threading.Lock()
+_sessoes: dict[str, _Sessao] = {}
+_pending: dict[str, tuple[str, datetime]] = {}
+_timer: threading.Timer | None = None
+_contagem: tuple[float, int] | None = None
+
+
+def _as_datetime(value) -> datetime | None:
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return value
+
+
+def _ler_sessao(email: str) -> _Sessao | None:
+    active = ActiveSession.query.filter_by(email=email).first()
+    if not active:
+        return None
+    sessao = _Sessao(active.session_token, _as_datetime(active.last_activity), time.monotonic())
+    pendente = _pending.get(email)
+    if pendente and pendente[0] == sessao.token and (sessao.last_activity is None or pendente[1] > sessao.last_activity):
+        sessao.last_activity = pendente[1]
+    return sessao
+
+
+def validar_sessao(email: str, token: str, now: datetime, app) -> bool:
+    """
+    Confere o token da sessao (lido do banco no maximo a cada
+    SESSION_CACHE_TTL) e registra a atividade, gravada depois em lote.
+    Sessao expirada e removida do banco na hora.
+    """
+    sessao = _sessoes.get(email)
+    if sessao is None or time.monotonic() - sessao.lido_em >= SESSION_CACHE_TTL:
+        sessao = _ler_sessao(email)
+        if sessao is None:
+            esquecer_sessao(email)
+            return False
+        _sessoes[email] = sessao
+    if sessao.token != token:
+        return False
+    if sessao.last_activity and sessao.last_activity < now - SESSION_TIMEOUT:
+        esquecer_sessao(email)
+        ActiveSession.query.filter_by(email=email, session_token=token).delete(synchronize_session=False)
+        db.session.commit()
+        return False
+    sessao.last_activity = now
+    _registrar_atividade(email, token, now, app)
+    return True
+
+
+def _registrar_atividade(email: str, token: str, now: datetime, app) -> None:
+    global _timer
+    with _lock:
+        _pending[email] = (token, now)
+        if _timer is None:
+            _timer = threading.Timer(ACTIVITY_FLUSH_INTERVAL, flush_atividade, args=(app,))
+            _timer.daemon = True
+            _timer.start()
+
+
+def flush_atividade(app) -> int:
+    """Grava o ultimo last_activity pendente de cada usuario (um UPDATE em lote)."""
+    global _pending, _timer
+    with _lock:
+        pendentes, _pending = _pending, {}
+        _timer = None
+    if not pendentes:
+        return 0
+    tabela = ActiveSession.__table__
+    params = [{"b_email": email, "b_token": token, "b_ts": ts} for email, (token, ts) in pendentes.items()]
+    with app.app_context():
+        try:
+            db.session.execute(
+                sa.update(tabela)
+                .where(tabela.c.email == sa.bindparam("b_email"), tabela.c.session_token == sa.bindparam("b_token"))
+                .values(last_activity=sa.bindparam("b_ts")),
+                params,
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.warning("Falha ao gravar last_activity das sessoes.", exc_info=True)
+        finally:
+            db.session.remove()
+    return len(params)
+
+
+def esquecer_sessao(email: str) -> None:
+    """Descarta a sessao em cache (login/logout trocam ou removem o token)."""
+    with _lock:
+        _sessoes.pop(email, None)
+        _pending.pop(email, None)
+
+
+def resolver_perfil(perfil_id, perfil_nome: str) -> tuple[int | None, int | None]:
+    """(perfil_id, nivel) do usuario, por id ou pelo nome, pelo diretorio em memoria."""
+    diretorio = get_diretorio()
+    perfil = (diretorio.perfil(perfil_id) if perfil_id else None) or diretorio.perfil_por_nome(perfil_nome)
+    return (perfil.id, perfil.nivel) if perfil else (None, None)
+
+
+def contar_sessoes_ativas() -> int:
+    """Sessoes com atividade nas ultimas SESSION_TIMEOUT; so o cabecalho usa, calculado sob demanda."""
+    global _contagem
+    if _contagem and time.monotonic() - _contagem[0] < ACTIVE_COUNT_TTL:
+        return _contagem[1]
+    cutoff = datetime.utcnow() - SESSION_TIMEOUT
+    total = ActiveSession.query.filter(ActiveSession.last_activity >= cutoff).count()
+    _contagem = (time.monotonic(), total)
+    return total
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from services.post_ingest import DERIVED_DIR, bump_version_file, read_derived
+
+
+class SharedVersion:
+    """
+    Contador de versao em outputs/derived/<nome>.json, visto por todos os
+    processos do servidor. Caches em memoria guardam a versao com que foram
+    montados e se descartam quando ela muda; o arquivo so e relido quando o
+    mtime muda, entao conferir custa um stat.
+    """
+
+    def __init__(self, nome: str) -> None:
+        self.nome = nome
+        self._path = DERIVED_DIR / f"{nome}.json"
+        self._mtime: int | None = None
+        self._versao: tuple | None = None
+
+    def atual(self) -> tuple | None:
+        try:
+            mtime = self._path.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            dados = read_derived(self.nome) or {}
+            self._versao = (dados.get("version"), dados.get("token"))
+            self._mtime = mtime
+        return self._versao
+
+    def bump(self) -> None:
+        """Chamar depois do commit da alteracao."""
+        bump_version_file(self.nome)
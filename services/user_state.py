@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+# Estado por usuario que nao cabe no cookie da sessao (ex.: listas de chaves
+# de um upload). O cookie continua so com o email, que e a chave aqui.
+STATE_DIR = Path("outputs/user_state")
+STATE_DB = STATE_DIR / "user_state.sqlite3"
+USER_STATE_TTL = float(os.getenv("USER_STATE_TTL", str(24 * 60 * 60)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_state (
+    email TEXT NOT NULL,
+    nome TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    saved_ts REAL NOT NULL,
+    expires_ts REAL NOT NULL,
+    PRIMARY KEY (email, nome)
+)
+"""
+_schema_ready = False
+
+
+def _email(email: str) -> str:
+    return (email or "").strip().lower()
+
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    """Conexao curta em modo WAL, como o store de status dos jobs."""
+    global _schema_ready
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(STATE_DB), timeout=10, isolation_level=None)
+    try:
+        if not _schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            _schema_ready = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        yield conn
+    finally:
+        conn.close()
+
+
+def put_user_state(email: str, nome: str, data: Any, ttl: float | None = None) -> None:
+    """Grava (substitui) o estado; entradas vencidas sao limpas na mesma escrita."""
+    agora = time.time()
+    with _connect() as conn:
+        conn.execute("DELETE FROM user_state WHERE expires_ts < ?", (agora,))
+        conn.execute(
+            """
+            INSERT INTO user_state (email, nome, payload, saved_ts, expires_ts)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (email, nome) DO UPDATE SET
+                payload = excluded.payload, saved_ts = excluded.saved_ts, expires_ts = excluded.expires_ts
+            """,
+            (
+                _email(email),
+                nome,
+                json.dumps(data, ensure_ascii=True, default=str),
+                agora,
+                agora + (USER_STATE_TTL if ttl is None else ttl),
+            ),
+        )
+
+
+def get_user_state(email: str, nome: str) -> tuple[Any, float] | None:
+    """(dados, gravado_em epoch) ou None se nao existe/venceu."""
+    try:
+        with _connect() as conn:
+            row = conn.execute(
+                "SELECT payload, saved_ts FROM user_state WHERE email = ? AND nome = ? AND expires_ts >= ?",
+                (_email(email), nome, time.time()),
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    if not row:
+        return None
+    try:
+        return json.loads(row[0]), float(row[1])
+    except ValueError:
+        return None
+
+
+def clear_user_state(email: str, nome: str) -> None:
+    with _connect() as conn:
+        conn.execute("DELETE FROM user_state WHERE email = ? AND nome = ?", (_email(email), nome))
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from models import db
+
+# Parte dos valores e gravada como texto (ex.: ped.valor_ped) e pode vir em
+# notacao cientifica ("1e-05", "1.23457e+006"). No SQL Server um CAST direto
+# para DECIMAL falha a consulta inteira por causa de uma linha; TRY_CAST
+# tenta DECIMAL e depois FLOAT, e o que nao converter vira NULL (soma ignora).
+
+
+def _mssql() -> bool:
+    return db.engine.dialect.name == "mssql"
+
+
+def decimal_sql(coluna: str) -> str:
+    """Trecho SQL textual da coluna como DECIMAL(18, 2), sem erro de conversao."""
+    if _mssql():
+        return (
+            f"COALESCE(TRY_CAST({coluna} AS DECIMAL(18, 2)), "
+            f"TRY_CAST(TRY_CAST({coluna} AS FLOAT) AS DECIMAL(18, 2)))"
+        )
+    return f"CAST({coluna} AS DECIMAL(18, 2))"
+
+
+def decimal_expr(coluna):
+    """Mesmo que decimal_sql, para expressoes do SQLAlchemy."""
+    tipo = sa.Numeric(18, 2)
+    if _mssql():
+        return sa.func.coalesce(sa.try_cast(coluna, tipo), sa.try_cast(sa.try_cast(coluna, sa.Float), tipo))
+    return sa.cast(coluna, tipo)
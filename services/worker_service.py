@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import os
+import queue
+import sys
+import threading
+import traceback
+from multiprocessing.connection import AuthenticationError, Client, Listener
+from typing import Callable
+
+# Worker persistente (python worker.py --serve): recebe (kind, upload_id) por
+# socket local e executa os jobs em fila, um por vez.
+WORKER_SERVICE_HOST = "127.0.0.1"
+WORKER_SERVICE_PORT = int(os.getenv("WORKER_SERVICE_PORT", "6011"))
+
+
+def _address() -> tuple[str, int]:
+    return (WORKER_SERVICE_HOST, WORKER_SERVICE_PORT)
+
+
+def _authkey() -> bytes | None:
+    """
+    Chave do socket (as mensagens sao pickle): so WORKER_SERVICE_KEY, sem
+    fallback. Sem ela o worker persistente nao sobe e o app usa o subprocess.
+    """
+    key = os.getenv("WORKER_SERVICE_KEY", "").strip()
+    return key.encode("utf-8") if key else None
+
+
+def submit_job(kind: str, upload_id: int) -> bool:
+    """Entrega o job ao worker persistente; False se ele nao estiver rodando."""
+    authkey = _authkey()
+    if authkey is None:
+        return False
+    try:
+        conn = Client(_address(), authkey=authkey)
+    except (OSError, EOFError, AuthenticationError):
+        return False
+    try:
+        conn.send({"kind": kind, "upload_id": int(upload_id)})
+        return bool(conn.recv())
+    except (OSError, EOFError):
+        return False
+    finally:
+        conn.close()
+
+
+def serve(handler: Callable[[str, int], None]) -> None:
+    authkey = _authkey()
+    if authkey is None:
+        raise RuntimeError("WORKER_SERVICE_KEY nao definida; o worker persistente nao sobe sem chave.")
+    jobs: queue.Queue = queue.Queue()
+    listener = Listener(_address(), authkey=authkey)
+
+    def _accept() -> None:
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                continue
+            try:
+                msg = conn.recv()
+                kind, upload_id = msg["kind"], int(msg["upload_id"])
+                jobs.put((kind, upload_id))
+                conn.send(True)
+            except Exception:
+                traceback.print_exc()
+                try:
+                    conn.send(False)
+                except OSError:
+                    pass
+            finally:
+                conn.close()
+
+    threading.Thread(target=_accept, name="worker-accept", daemon=True).start()
+    print(f"Worker persistente ouvindo em {WORKER_SERVICE_HOST}:{WORKER_SERVICE_PORT}.", file=sys.stderr)
+    try:
+        while True:
+            kind, upload_id = jobs.get()
+            try:
+                handler(kind, upload_id)
+            except Exception:
+                traceback.print_exc()
+    finally:
+        listener.close()
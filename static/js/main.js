@@ -871,30 +871,40 @@
     }
   }
 
-  async function loadPedStatus(target, submitBtn, viewLabel) {
+  async function loadPedStatus(target, submitBtn, viewLabel, evento) {
     if (!target) return;
-    target.textContent = "Carregando...";
+    let last = mergeStatusEvent("ped", evento);
+    if (!last) target.textContent = "Carregando...";
     try {
-      const res = await fetch("/api/ped/status");
-      const data = await res.json();
-      if (!res.ok) throw new Error(data.error || "Erro ao consultar status");
-      if (!data.last) {
-        target.textContent = "Nenhuma atualização encontrada.";
-        if (submitBtn) {
-          submitBtn.dataset.mode = "upload";
-          submitBtn.textContent = "Upload e processar";
-          submitBtn.dataset.output = "";
+      if (!last) {
+        const res = await fetch("/api/ped/status");
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error || "Erro ao consultar status");
+        if (!data.last) {
+          target.textContent = "Nenhuma atualização encontrada.";
+          if (submitBtn) {
+            submitBtn.dataset.mode = "upload";
+            submitBtn.textContent = "Upload e processar";
+            submitBtn.dataset.output = "";
+          }
+          return null;
         }
-        return;
+        last = data.last;
       }
-      const last = data.last;
+      lastStatus["ped"] = last;
+      toggleRetomar("ped-retomar", last);
       const uploaded = formatAmazonTime(last.uploaded_at);
       const dataArquivo = formatAmazonLocalTime(last.data_arquivo);
+      const statusProgress =
+        typeof last.status_progress === "number" ? `${last.status_progress}%` : "-";
       target.innerHTML = `
         <div><strong>Enviado por:</strong> ${last.user_email || "-"}</div>
         <div><strong>Upload em:</strong> ${uploaded}</div>
         <div><strong>Data do download:</strong> ${dataArquivo}</div>
         <div><strong>Arquivo original:</strong> ${last.original_filename || "-"}</div>
+        <div><strong>Status:</strong> ${last.status || "-"}</div>
+        <div><strong>Progresso:</strong> ${statusProgress}</div>
+        <div><strong>Mensagem:</strong> ${last.status_message || "-"}</div>
         <div><strong>Saída gerada:</strong> ${last.output_filename || "-"}</div>
       `;
       if (submitBtn && last.output_filename) {
@@ -902,35 +912,41 @@
         submitBtn.dataset.output = last.output_filename;
         submitBtn.textContent = viewLabel || "Ver relatório";
       }
+      return last.status || null;
     } catch (err) {
       target.textContent = "Falha ao carregar status.";
       console.error(err);
+      return null;
     }
   }
 
-  async function loadEmpStatus(target, submitBtn, viewLabel) {
+  async function loadEmpStatus(target, submitBtn, viewLabel, evento) {
     if (!target) return;
-    target.textContent = "Carregando...";
+    let last = mergeStatusEvent("emp", evento);
+    if (!last) target.textContent = "Carregando...";
     try {
-      const res = await fetch("/api/emp/status");
-      const raw = await res.text();
-      let data = {};
-      try {
-        data = JSON.parse(raw || "{}");
-      } catch {
-        throw new Error(raw || "Resposta invalida do servidor.");
-      }
-      if (!res.ok) throw new Error(data.error || "Erro ao consultar status");
-      if (!data.last) {
-        target.textContent = "Nenhuma atualização encontrada.";
-        if (submitBtn) {
-          submitBtn.dataset.mode = "upload";
-          submitBtn.textContent = "Upload e processar";
-          submitBtn.dataset.output = "";
+      if (!last) {
+        const res = await fetch("/api/emp/status");
+        const raw = await res.text();
+        let data = {};
+        try {
+          data = JSON.parse(raw || "{}");
+        } catch {
+          throw new Error(raw || "Resposta invalida do servidor.");
+        }
+        if (!res.ok) throw new Error(data.error || "Erro ao consultar status");
+        if (!data.last) {
+          target.textContent = "Nenhuma atualização encontrada.";
+          if (submitBtn) {
+            submitBtn.dataset.mode = "upload";
+            submitBtn.textContent = "Upload e processar";
+            submitBtn.dataset.output = "";
+          }
+          return null;
         }
-        return null;
+        last = data.last;
       }
-      const last = data.last;
+      lastStatus["emp"] = last;
       const uploaded = formatAmazonTime(last.uploaded_at);
       const dataArquivo = formatAmazonLocalTime(last.data_arquivo);
       const statusText = last.status || "-";
@@ -964,30 +980,40 @@
     }
   }
 
-  async function loadEstEmpStatus(target, submitBtn, viewLabel) {
+  async function loadEstEmpStatus(target, submitBtn, viewLabel, evento) {
     if (!target) return;
-    target.textContent = "Carregando...";
+    let last = mergeStatusEvent("est-emp", evento);
+    if (!last) target.textContent = "Carregando...";
     try {
-      const res = await fetch("/api/est-emp/status");
-      const data = await res.json();
-      if (!res.ok) throw new Error(data.error || "Erro ao consultar status");
-      if (!data.last) {
-        target.textContent = "Nenhuma atualização encontrada.";
-        if (submitBtn) {
-          submitBtn.dataset.mode = "upload";
-          submitBtn.textContent = "Upload e processar";
-          submitBtn.dataset.output = "";
+      if (!last) {
+        const res = await fetch("/api/est-emp/status");
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error || "Erro ao consultar status");
+        if (!data.last) {
+          target.textContent = "Nenhuma atualização encontrada.";
+          if (submitBtn) {
+            submitBtn.dataset.mode = "upload";
+            submitBtn.textContent = "Upload e processar";
+            submitBtn.dataset.output = "";
+          }
+          return null;
         }
-        return;
+        last = data.last;
       }
-      const last = data.last;
+      lastStatus["est-emp"] = last;
+      toggleRetomar("est-emp-retomar", last);
       const uploaded = formatAmazonTime(last.uploaded_at);
       const dataArquivo = formatAmazonLocalTime(last.data_arquivo);
+      const statusProgress =
+        typeof last.status_progress === "number" ? `${last.status_progress}%` : "-";
       target.innerHTML = `
         <div><strong>Enviado por:</strong> ${last.user_email || "-"}</div>
         <div><strong>Upload em:</strong> ${uploaded}</div>
         <div><strong>Data do download:</strong> ${dataArquivo}</div>
         <div><strong>Arquivo original:</strong> ${last.original_filename || "-"}</div>
+        <div><strong>Status:</strong> ${last.status || "-"}</div>
+        <div><strong>Progresso:</strong> ${statusProgress}</div>
+        <div><strong>Mensagem:</strong> ${last.status_message || "-"}</div>
         <div><strong>Saída gerada:</strong> ${last.output_filename || "-"}</div>
       `;
       if (submitBtn && last.output_filename) {
@@ -995,30 +1021,36 @@
         submitBtn.dataset.output = last.output_filename;
         submitBtn.textContent = viewLabel || "Ver relatório";
       }
+      return last.status || null;
     } catch (err) {
       target.textContent = "Falha ao carregar status.";
       console.error(err);
+      return null;
     }
   }
 
-  async function loadNobStatus(target, submitBtn, viewLabel) {
+  async function loadNobStatus(target, submitBtn, viewLabel, evento) {
     if (!target) return;
-    target.textContent = "Carregando...";
+    let last = mergeStatusEvent("nob", evento);
+    if (!last) target.textContent = "Carregando...";
     try {
-      const res = await fetch("/api/nob/status");
-      const raw = await res.text();
-      let data = {};
-      try {
-        data = JSON.parse(raw || "{}");
-      } catch {
-        throw new Error(raw || "Resposta invalida do servidor.");
-      }
-      if (!res.ok) throw new Error(data.error || "Erro ao consultar status");
-      if (!data.last) {
-        target.textContent = "Nenhuma atualização encontrada.";
-        return null;
+      if (!last) {
+        const res = await fetch("/api/nob/status");
+        const raw = await res.text();
+        let data = {};
+        try {
+          data = JSON.parse(raw || "{}");
+        } catch {
+          throw new Error(raw || "Resposta invalida do servidor.");
+        }
+        if (!res.ok) throw new Error(data.error || "Erro ao consultar status");
+        if (!data.last) {
+          target.textContent = "Nenhuma atualização encontrada.";
+          return null;
+        }
+        last = data.last;
       }
-      const last = data.last;
+      lastStatus["nob"] = last;
       const uploaded = formatAmazonTime(last.uploaded_at);
       const dataArquivo = formatAmazonLocalTime(last.data_arquivo);
       const statusText = last.status || "-";
@@ -1062,6 +1094,116 @@
     setTimeout(() => tick(attempts), intervalMs);
   }
 
+  const statusStreams = {};
+  // Ultimo data.last de cada tela de status; os eventos SSE so trazem o job.
+  const lastStatus = {};
+
+  // Aplica o payload do evento (status store) sobre o ultimo data.last do mesmo
+  // upload; null quando precisa buscar /status (sem cache ou upload novo).
+  function mergeStatusEvent(kind, evento) {
+    const last = lastStatus[kind];
+    if (!last || !evento || evento.upload_id == null || last.upload_id !== evento.upload_id) return null;
+    return {
+      ...last,
+      status: evento.state ?? last.status,
+      status_message: evento.message ?? last.status_message,
+      status_progress: evento.progress ?? last.status_progress,
+      status_updated_at: evento.updated_at ?? last.status_updated_at,
+      status_pid: evento.pid ?? last.status_pid,
+      output_filename: evento.output_filename || last.output_filename,
+      retomavel: Boolean(evento.retomavel),
+    };
+  }
+
+  // Botao Retomar: so aparece quando o job parou com lotes confirmados (checkpoint).
+  function toggleRetomar(id, last) {
+    const btn = document.getElementById(id);
+    if (btn) btn.style.display = last && last.retomavel ? "" : "none";
+  }
+
+  function bindRetomar(btn, kind, msg, loader) {
+    if (!btn) return;
+    btn.addEventListener("click", async () => {
+      if (msg) {
+        msg.textContent = "Retomando processamento...";
+        msg.classList.remove("text-error");
+      }
+      btn.disabled = true;
+      startStatusStream(kind, loader);
+      try {
+        const res = await fetch(`/api/${kind}/retomar`, {
+          method: "POST",
+          headers: { "Content-Type": "application/json", "X-Requested-With": "fetch" },
+          body: JSON.stringify({}),
+        });
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error || "Falha ao retomar.");
+        if (msg) msg.textContent = data.message || "Processamento concluído.";
+      } catch (err) {
+        if (msg) {
+          msg.textContent = err.message;
+          msg.classList.add("text-error");
+        }
+        console.error(err);
+      } finally {
+        btn.disabled = false;
+        await loader();
+      }
+    });
+  }
+
+  // Sem nenhum evento nesse intervalo (o servidor manda ping a cada 15s) o stream
+  // esta preso num buffer (IIS/wfastcgi, proxy): troca pelo polling.
+  const STATUS_STREAM_SILENCIO_MS = 40000;
+
+  // Recebe as mudancas de status por SSE; sem suporte, com o stream desligado no
+  // servidor (204) ou se nada chegar, volta ao polling. O servidor fecha a conexao
+  // periodicamente e o EventSource reconecta sozinho.
+  function startStatusStream(kind, loader) {
+    if (!window.EventSource) {
+      startStatusPolling(loader);
+      return;
+    }
+    if (statusStreams[kind]) statusStreams[kind].close();
+    const source = new EventSource(`/api/${kind}/status/stream`);
+    statusStreams[kind] = source;
+    let vigia = null;
+    const stop = () => {
+      clearTimeout(vigia);
+      source.close();
+      if (statusStreams[kind] === source) delete statusStreams[kind];
+    };
+    const armarVigia = () => {
+      clearTimeout(vigia);
+      vigia = setTimeout(() => {
+        stop();
+        startStatusPolling(loader);
+      }, STATUS_STREAM_SILENCIO_MS);
+    };
+    armarVigia();
+    source.addEventListener("ping", armarVigia);
+    source.onmessage = (ev) => {
+      armarVigia();
+      let evento = null;
+      try {
+        evento = JSON.parse(ev.data || "null");
+      } catch {
+        evento = null;
+      }
+      loader(evento);
+    };
+    source.addEventListener("done", () => {
+      stop();
+      loader();
+    });
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) {
+        stop();
+        startStatusPolling(loader);
+      }
+    };
+  }
+
   function setDefaultAmazonTime(input) {
     if (!input) return;
     const now = new Date();
@@ -1179,7 +1321,7 @@
     const fileInput = document.getElementById("ped-file");
     const loading = document.getElementById("ped-loading");
     const submitBtn = document.getElementById("ped-submit");
-    const reprocessBtn = document.getElementById("ped-reprocess");
+    const retomarBtn = document.getElementById("ped-retomar");
     const cancelBtn = document.getElementById("ped-cancel");
     const defaultLabel = "Upload e processar";
     const viewLabel = "Ver relatório";
@@ -1206,32 +1348,7 @@
       });
     }
 
-    if (reprocessBtn) {
-      reprocessBtn.addEventListener("click", async () => {
-        if (msg) {
-          msg.textContent = "Reprocessando...";
-          msg.classList.remove("text-error");
-        }
-        try {
-          const res = await fetch("/api/ped/reprocess", {
-            method: "POST",
-            headers: { "Content-Type": "application/json", "X-Requested-With": "fetch" },
-            body: JSON.stringify({}),
-          });
-          const data = await res.json();
-          if (!res.ok) throw new Error(data.error || "Falha ao reprocessar.");
-          if (msg) msg.textContent = data.message || "Reprocessamento iniciado.";
-          await loadPedStatus(statusBox, submitBtn, viewLabel);
-          startStatusPolling(() => loadPedStatus(statusBox, submitBtn, viewLabel));
-        } catch (err) {
-          if (msg) {
-            msg.textContent = err.message;
-            msg.classList.add("text-error");
-          }
-          console.error(err);
-        }
-      });
-    }
+    bindRetomar(retomarBtn, "ped", msg, (evento) => loadPedStatus(statusBox, submitBtn, viewLabel, evento));
 
     if (cancelBtn) {
       cancelBtn.addEventListener("click", async () => {
@@ -1279,6 +1396,7 @@
       if (loading) loading.style.display = "inline";
       if (submitBtn) submitBtn.disabled = true;
       const fd = new FormData(form);
+      startStatusStream("ped", (evento) => loadPedStatus(statusBox, submitBtn, viewLabel, evento));
       try {
         const res = await fetch("/api/ped/upload", {
           method: "POST",
@@ -1369,7 +1487,7 @@
           if (!res.ok) throw new Error(data.error || "Falha ao reprocessar.");
           if (msg) msg.textContent = data.message || "Reprocessamento iniciado.";
           await loadEmpStatus(statusBox, submitBtn, viewLabel);
-          startStatusPolling(() => loadEmpStatus(statusBox, submitBtn, viewLabel));
+          startStatusStream("emp", (evento) => loadEmpStatus(statusBox, submitBtn, viewLabel, evento));
         } catch (err) {
           if (msg) {
             msg.textContent = err.message;
@@ -1440,7 +1558,7 @@
         form.reset();
         if (inputData) inputData.value = "";
         await loadEmpStatus(statusBox, submitBtn, viewLabel);
-        startStatusPolling(() => loadEmpStatus(statusBox, submitBtn, viewLabel));
+        startStatusStream("emp", (evento) => loadEmpStatus(statusBox, submitBtn, viewLabel, evento));
         if (submitBtn && data.output) {
           submitBtn.textContent = viewLabel;
           submitBtn.dataset.mode = "view";
@@ -1474,6 +1592,8 @@
     const fileInput = document.getElementById("est-emp-file");
     const loading = document.getElementById("est-emp-loading");
     const submitBtn = document.getElementById("est-emp-submit");
+    const cancelBtn = document.getElementById("est-emp-cancel");
+    const retomarBtn = document.getElementById("est-emp-retomar");
     const defaultLabel = "Upload e processar";
     const viewLabel = "Ver relatório";
     const goToReport = () => {
@@ -1486,6 +1606,7 @@
     }
 
     loadEstEmpStatus(statusBox, submitBtn, viewLabel);
+    bindRetomar(retomarBtn, "est-emp", msg, (evento) => loadEstEmpStatus(statusBox, submitBtn, viewLabel, evento));
 
     if (submitBtn) {
       submitBtn.dataset.mode = "upload";
@@ -1499,6 +1620,32 @@
       });
     }
 
+    if (cancelBtn) {
+      cancelBtn.addEventListener("click", async () => {
+        if (msg) {
+          msg.textContent = "Solicitando cancelamento...";
+          msg.classList.remove("text-error");
+        }
+        try {
+          const res = await fetch("/api/est-emp/cancel", {
+            method: "POST",
+            headers: { "Content-Type": "application/json", "X-Requested-With": "fetch" },
+            body: JSON.stringify({}),
+          });
+          const data = await res.json();
+          if (!res.ok) throw new Error(data.error || "Falha ao cancelar.");
+          if (msg) msg.textContent = data.message || "Cancelamento solicitado.";
+          await loadEstEmpStatus(statusBox, submitBtn, viewLabel);
+        } catch (err) {
+          if (msg) {
+            msg.textContent = err.message;
+            msg.classList.add("text-error");
+          }
+          console.error(err);
+        }
+      });
+    }
+
     if (fileInput && submitBtn) {
       fileInput.addEventListener("change", () => {
         submitBtn.dataset.mode = "upload";
@@ -1519,6 +1666,7 @@
       if (loading) loading.style.display = "inline";
       if (submitBtn) submitBtn.disabled = true;
       const fd = new FormData(form);
+      startStatusStream("est-emp", (evento) => loadEstEmpStatus(statusBox, submitBtn, viewLabel, evento));
       try {
         const res = await fetch("/api/est-emp/upload", {
           method: "POST",
@@ -1609,7 +1757,7 @@
           if (!res.ok) throw new Error(data.error || "Falha ao reprocessar.");
           if (msg) msg.textContent = data.message || "Reprocessamento iniciado.";
           await loadNobStatus(statusBox, submitBtn, viewLabel);
-          startStatusPolling(() => loadNobStatus(statusBox, submitBtn, viewLabel));
+          startStatusStream("nob", (evento) => loadNobStatus(statusBox, submitBtn, viewLabel, evento));
         } catch (err) {
           if (msg) {
             msg.textContent = err.message;
@@ -1679,7 +1827,7 @@
         form.reset();
         if (inputData) inputData.value = "";
         await loadNobStatus(statusBox, submitBtn, viewLabel);
-        startStatusPolling(() => loadNobStatus(statusBox, submitBtn, viewLabel));
+        startStatusStream("nob", (evento) => loadNobStatus(statusBox, submitBtn, viewLabel, evento));
         if (submitBtn && data.output) {
           submitBtn.textContent = viewLabel;
           submitBtn.dataset.mode = "view";
@@ -3007,258 +3155,204 @@
     setResultsVisible(false);
   }
 
-  function initRelatorioFip() {
-    const table = document.getElementById("fip613-relatorio-tabela");
-    const tbody = table ? table.querySelector("tbody") : null;
-    const meta = document.getElementById("fip613-relatorio-meta");
-    const pager = document.getElementById("fip613-pagination");
-    const pageSizeSelect = document.getElementById("fip613-page-size");
-    const btnDownload = document.getElementById("fip613-download");
-    const btnReset = document.getElementById("fip613-reset");
-    if (!table || !tbody) return;
-    if (table.dataset.bound === "1") return;
-    table.dataset.bound = "1";
+  // Converte { colunas, linhas, dicionarios } de volta em objetos por linha.
+  function decodeColunar(data) {
+    const colunas = data.colunas || [];
+    const dicionarios = data.dicionarios || {};
+    const dicts = colunas.map((c) => dicionarios[c] || null);
+    return (data.linhas || []).map((linha) => {
+      const row = {};
+      for (let i = 0; i < colunas.length; i += 1) {
+        const v = linha[i];
+        row[colunas[i]] = dicts[i] && v !== null && v !== undefined ? dicts[i][v] : v;
+      }
+      return row;
+    });
+  }
 
+  // Tela de relatorio sobre a API paginada: a grade busca so a pagina exibida
+  // (limite + cursor), filtros e ordem viram parametros da consulta e os totais
+  // e as opcoes de cada filtro vem de /agregado, sem baixar a tabela inteira.
+  function initRelatorioRemoto({
+    table,
+    base,
+    colKeys,
+    meta,
+    pager,
+    pageSizeSelect,
+    btnReset,
+    btnDownload,
+    alias = {},
+    resumo = [],
+    mapearLinha = (r) => r,
+    renderLinha,
+    renderTotais,
+  }) {
+    const tbody = table.querySelector("tbody");
+    const colunas = colKeys.flatMap((k) => (k === "chave_display" ? ["chave", "chave_planejamento"] : [k]));
+    const filters = Object.fromEntries(colKeys.map((k) => [k, new Set()]));
+    const filterControls = {};
     let pageSize = parseInt(pageSizeSelect?.value || "20", 10) || 20;
-    let currentPage = 1;
-    let filteredRows = [];
-    const sumCols = [
-      "dotacao_inicial",
-      "cred_suplementar",
-      "cred_especial",
-      "cred_extraordinario",
-      "reducao",
-      "cred_autorizado",
-      "bloqueado_conting",
-      "reserva_empenho",
-      "saldo_destaque",
-      "saldo_dotacao",
-      "empenhado",
-      "liquidado",
-      "a_liquidar",
-      "valor_pago",
-      "valor_a_pagar",
-    ];
-
-    const numFmt = new Intl.NumberFormat("pt-BR", {
-      minimumFractionDigits: 2,
-      maximumFractionDigits: 2,
-    });
-    const fmt = (v) => {
-      const n = Number(v || 0);
-      if (Object.is(n, -0)) return "-";
-      return n === 0 ? "-" : numFmt.format(n);
-    };
-    const numCls = (v) => {
-      const n = Number(v || 0);
-      const classes = ["num"];
-      if (n > 0) classes.push("pos");
-      else if (n < 0) classes.push("neg");
-      return classes.join(" ");
+    // cursores[i] abre a pagina i; a pagina 0 nao tem cursor.
+    let cursores = [null];
+    let pagina = 0;
+    let total = 0;
+    let rows = [];
+    let agregado = null;
+    let ordem = "";
+    let seq = 0;
+
+    const colunaServidor = (key) => alias[key] || key;
+
+    const filtrosParams = () => {
+      const params = new URLSearchParams();
+      Object.entries(filters).forEach(([k, set]) => {
+        set.forEach((v) => params.append(colunaServidor(k), v));
+      });
+      return params;
     };
 
-    const computeTotals = (rows) => {
-      const totals = Object.fromEntries(sumCols.map((c) => [c, 0]));
-      const paoeSet = new Set();
-      const grupoSet = new Set();
-      rows.forEach((r) => {
-        const paoeParts = (r.projeto_atividade || "")
-          .split(/\s+/)
-          .filter((p) => /^\d+$/.test(p));
-        if (paoeParts.length) paoeSet.add(paoeParts.join("*"));
-        const natStr = String(r.natureza_despesa || "");
-        if (natStr.length >= 2) grupoSet.add(natStr[1]);
-        sumCols.forEach((c) => {
-          const v = Number(r[c] || 0);
-          if (!Number.isNaN(v)) totals[c] += v;
-        });
-      });
-      return { totals, paoeSet, grupoSet };
+    const buscar = async (url) => {
+      const res = await fetch(url);
+      const data = await res.json();
+      if (!res.ok) throw new Error(data.error || "Falha ao carregar.");
+      return data;
+    };
+
+    const buscarPagina = () => {
+      const params = filtrosParams();
+      params.set("formato", "colunar");
+      params.set("colunas", colunas.join(","));
+      params.set("limite", String(pageSize));
+      if (ordem) params.set("ordem", ordem);
+      if (cursores[pagina]) params.set("cursor", cursores[pagina]);
+      return buscar(`${base}?${params}`);
+    };
+
+    const buscarAgregado = (distintos) => {
+      const params = filtrosParams();
+      if (distintos.length) params.set("distintos", distintos.map(colunaServidor).join(","));
+      return buscar(`${base}/agregado?${params}`);
+    };
+
+    // Valores da coluna nas linhas filtradas (os distintos ignoram o filtro da propria coluna).
+    const valoresFiltrados = (key) => {
+      const valores = agregado?.distintos?.[colunaServidor(key)] || [];
+      const set = filters[key];
+      return set && set.size ? valores.filter((v) => set.has(v)) : valores;
+    };
+
+    const renderMeta = (data) => {
+      if (!meta) return;
+      const dt = formatAmazonLocalTime(data.data_arquivo);
+      const user = data.user_email || "-";
+      const uploaded = formatAmazonTime(data.uploaded_at);
+      meta.innerHTML = `
+        <div><strong>Última atualização</strong></div>
+        <div>Enviado por: ${user}</div>
+        <div>Upload em: ${uploaded}</div>
+        <div>Data do download: ${dt}</div>
+      `;
     };
 
-    const renderPagination = (totalPages) => {
+    const renderPagination = () => {
       if (!pager) return;
       pager.innerHTML = "";
+      const totalPages = Math.max(1, Math.ceil(total / pageSize));
       if (totalPages <= 1) return;
-      const addBtn = (label, page, disabled = false, active = false) => {
+      const addBtn = (label, destino, disabled) => {
         const b = document.createElement("button");
         b.textContent = label;
         if (disabled) b.disabled = true;
-        if (active) b.classList.add("active");
         b.addEventListener("click", () => {
-          if (disabled || page === currentPage) return;
-          currentPage = page;
-          renderFiltered(false);
+          if (disabled) return;
+          pagina = destino;
+          carregar(false);
         });
         pager.appendChild(b);
       };
-      addBtn("<<", 1, currentPage === 1);
-      addBtn("<", Math.max(1, currentPage - 1), currentPage === 1);
-
-      const maxButtons = 5;
-      const start = Math.max(1, Math.min(currentPage - 2, totalPages - maxButtons + 1));
-      const end = Math.min(totalPages, start + maxButtons - 1);
-      for (let p = start; p <= end; p++) {
-        addBtn(String(p), p, false, p === currentPage);
-      }
-      if (end < totalPages) {
-        const ellipsis = document.createElement("span");
-        ellipsis.textContent = "...";
-        pager.appendChild(ellipsis);
-        addBtn(String(totalPages), totalPages, false, currentPage === totalPages);
-      }
-
-      addBtn(">", Math.min(totalPages, currentPage + 1), currentPage === totalPages);
-      addBtn(">>", totalPages, currentPage === totalPages);
+      addBtn("<<", 0, pagina === 0);
+      addBtn("<", pagina - 1, pagina === 0);
+      const atual = document.createElement("span");
+      atual.textContent = `Página ${pagina + 1} de ${totalPages}`;
+      pager.appendChild(atual);
+      addBtn(">", pagina + 1, cursores.length <= pagina + 1);
+    };
+
+    // Cabecalhos das colunas que a API ordena (colunas indexadas); o clique
+    // alterna crescente, decrescente e sem ordem, sempre da primeira pagina.
+    const headers = Array.from(table.querySelectorAll("thead tr:first-child th"));
+    const sortIcons = {};
+
+    const updateSortIcons = () => {
+      Object.entries(sortIcons).forEach(([key, icon]) => {
+        if (ordem === key) icon.className = "bi bi-sort-up";
+        else if (ordem === `-${key}`) icon.className = "bi bi-sort-down";
+        else icon.className = "bi bi-arrow-down-up";
+      });
+    };
+
+    const bindSort = (ordenaveis) => {
+      headers.forEach((th, idx) => {
+        const key = colKeys[idx];
+        if (!key || sortIcons[key] || !ordenaveis.includes(key)) return;
+        const icon = document.createElement("i");
+        th.appendChild(document.createTextNode(" "));
+        th.appendChild(icon);
+        th.style.cursor = "pointer";
+        sortIcons[key] = icon;
+        th.addEventListener("click", () => {
+          if (ordem === key) ordem = `-${key}`;
+          else if (ordem === `-${key}`) ordem = "";
+          else ordem = key;
+          updateSortIcons();
+          pagina = 0;
+          cursores = [null];
+          carregar(false);
+        });
+      });
+      updateSortIcons();
     };
 
     const render = () => {
-      const rows = filteredRows;
-      const totalPages = Math.max(1, Math.ceil(rows.length / pageSize));
-      if (currentPage > totalPages) currentPage = totalPages;
-      const startIdx = (currentPage - 1) * pageSize;
-      const viewRows = rows.slice(startIdx, startIdx + pageSize);
-
       tbody.innerHTML = "";
-      const adjustedRows = rows.map((r) => {
-        const copy = { ...r };
-        negateCols.forEach((k) => {
-          copy[k] = adjustVal(k, copy[k]);
-        });
-        return copy;
-      });
-      const { totals, paoeSet, grupoSet } = computeTotals(adjustedRows);
-      const pageRows = adjustedRows.slice(startIdx, startIdx + pageSize);
-      pageRows.forEach((r) => {
+      rows.forEach((r) => {
         const tr = document.createElement("tr");
-        tr.innerHTML = `
-          <td>${r.uo || ""}</td>
-          <td>${r.ug || ""}</td>
-          <td>${r.funcao || ""}</td>
-          <td>${r.subfuncao || ""}</td>
-          <td>${r.programa || ""}</td>
-          <td>${r.projeto_atividade || ""}</td>
-          <td>${r.regional || ""}</td>
-          <td>${r.natureza_despesa || ""}</td>
-          <td>${r.fonte_recurso || ""}</td>
-          <td>${r.iduso ?? ""}</td>
-          <td>${r.tipo_recurso || ""}</td>
-          <td class="${numCls(r.dotacao_inicial)}">${fmt(r.dotacao_inicial)}</td>
-          <td class="${numCls(r.cred_suplementar)}">${fmt(r.cred_suplementar)}</td>
-          <td class="${numCls(r.cred_especial)}">${fmt(r.cred_especial)}</td>
-          <td class="${numCls(r.cred_extraordinario)}">${fmt(r.cred_extraordinario)}</td>
-          <td class="${numCls(r.reducao)}">${fmt(r.reducao)}</td>
-          <td class="${numCls(r.cred_autorizado)}">${fmt(r.cred_autorizado)}</td>
-          <td class="${numCls(r.bloqueado_conting)}">${fmt(r.bloqueado_conting)}</td>
-          <td class="${numCls(r.reserva_empenho)}">${fmt(r.reserva_empenho)}</td>
-          <td class="${numCls(r.saldo_destaque)}">${fmt(r.saldo_destaque)}</td>
-          <td class="${numCls(r.saldo_dotacao)}">${fmt(r.saldo_dotacao)}</td>
-          <td class="${numCls(r.empenhado)}">${fmt(r.empenhado)}</td>
-          <td class="${numCls(r.liquidado)}">${fmt(r.liquidado)}</td>
-          <td class="${numCls(r.a_liquidar)}">${fmt(r.a_liquidar)}</td>
-          <td class="${numCls(r.valor_pago)}">${fmt(r.valor_pago)}</td>
-          <td class="${numCls(r.valor_a_pagar)}">${fmt(r.valor_a_pagar)}</td>
-        `;
+        tr.innerHTML = renderLinha(r);
         tbody.appendChild(tr);
       });
-      // linha de totais
-      const totalTr = document.createElement("tr");
-      totalTr.innerHTML = `
-        <td colspan="11"><strong>Totais (linhas filtradas)</strong></td>
-        <td class="${numCls(totals.dotacao_inicial)}"><strong>${totals.dotacao_inicial.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.cred_suplementar)}"><strong>${totals.cred_suplementar.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.cred_especial)}"><strong>${totals.cred_especial.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.cred_extraordinario)}"><strong>${totals.cred_extraordinario.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.reducao)}"><strong>${totals.reducao.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.cred_autorizado)}"><strong>${totals.cred_autorizado.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.bloqueado_conting)}"><strong>${totals.bloqueado_conting.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.reserva_empenho)}"><strong>${totals.reserva_empenho.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.saldo_destaque)}"><strong>${totals.saldo_destaque.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.saldo_dotacao)}"><strong>${totals.saldo_dotacao.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.empenhado)}"><strong>${totals.empenhado.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.liquidado)}"><strong>${totals.liquidado.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.a_liquidar)}"><strong>${totals.a_liquidar.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.valor_pago)}"><strong>${totals.valor_pago.toLocaleString("pt-BR")}</strong></td>
-        <td class="${numCls(totals.valor_a_pagar)}"><strong>${totals.valor_a_pagar.toLocaleString("pt-BR")}</strong></td>
-      `;
-      tbody.appendChild(totalTr);
-
-      const paoeEl = document.getElementById("tot-paoe");
-      const grupoEl = document.getElementById("tot-grupo");
-      const credAutoEl = document.getElementById("tot-cred-autorizado");
-      const bloqueadoEl = document.getElementById("tot-bloqueado");
-      const tetoEl = document.getElementById("tot-teto");
-      const saldoDotEl = document.getElementById("tot-saldo-dotacao");
-      if (paoeEl) {
-        if (paoeSet.size === 0) {
-          paoeEl.textContent = "-";
-        } else if (paoeSet.size > 10) {
-          paoeEl.textContent = "Vários PAOEs";
-        } else {
-          paoeEl.textContent = Array.from(paoeSet).join(" * ");
-        }
-      }
-      if (grupoEl) grupoEl.textContent = grupoSet.size ? Array.from(grupoSet).join("*") : "-";
-      const formatVal = (el, val) => {
-        if (!el) return;
-        const n = Number(val || 0);
-        el.textContent = n === 0 ? "-" : n.toLocaleString("pt-BR");
-        el.classList.remove("pos", "neg");
-        if (n > 0) el.classList.add("pos");
-        if (n < 0) el.classList.add("neg");
-      };
-      formatVal(credAutoEl, totals.cred_autorizado);
-      const bloqueadoVal = totals.bloqueado_conting;
-      // bloquear cores no cred_autorizado e teto
-      if (bloqueadoEl) formatVal(bloqueadoEl, bloqueadoVal);
-      if (tetoEl) {
-        const teto = totals.cred_autorizado + bloqueadoVal;
-        tetoEl.textContent = Number(teto || 0).toLocaleString("pt-BR");
-        tetoEl.classList.remove("pos", "neg");
+      if (agregado) renderTotais(agregado.totais || {}, valoresFiltrados, tbody);
+      renderPagination();
+    };
+
+    // comTotais: os filtros mudaram, entao volta a primeira pagina e refaz os totais.
+    const carregar = async (comTotais = true) => {
+      const id = ++seq;
+      if (comTotais) {
+        pagina = 0;
+        cursores = [null];
       }
-      if (credAutoEl) {
-        credAutoEl.textContent = Number(totals.cred_autorizado || 0).toLocaleString("pt-BR");
-        credAutoEl.classList.remove("pos", "neg");
+      try {
+        const [data, novoAgregado] = await Promise.all([
+          buscarPagina(),
+          comTotais ? buscarAgregado(resumo) : Promise.resolve(null),
+        ]);
+        if (id !== seq) return;
+        cursores.length = pagina + 1;
+        if (data.proximo_cursor) cursores.push(data.proximo_cursor);
+        total = data.total || 0;
+        rows = decodeColunar(data).map(mapearLinha);
+        if (novoAgregado) agregado = novoAgregado;
+        bindSort(data.ordenaveis || []);
+        render();
+        renderMeta(data);
+      } catch (err) {
+        if (id !== seq) return;
+        if (meta) meta.textContent = err.message;
+        console.error(err);
       }
-      formatVal(saldoDotEl, totals.saldo_dotacao);
-      renderPagination(totalPages);
     };
 
-    const allData = { rows: [] };
-
-    const colKeys = [
-      "uo",
-      "ug",
-      "funcao",
-      "subfuncao",
-      "programa",
-      "projeto_atividade",
-      "regional",
-      "natureza_despesa",
-      "fonte_recurso",
-      "iduso",
-      "tipo_recurso",
-      "dotacao_inicial",
-      "cred_suplementar",
-      "cred_especial",
-      "cred_extraordinario",
-      "reducao",
-      "cred_autorizado",
-      "bloqueado_conting",
-      "reserva_empenho",
-      "saldo_destaque",
-      "saldo_dotacao",
-      "empenhado",
-      "liquidado",
-      "a_liquidar",
-      "valor_pago",
-      "valor_a_pagar",
-    ];
-
-    const filterContainers = table.querySelectorAll(".filter-row [data-col]");
-    const filters = Object.fromEntries(colKeys.map((k) => [k, new Set()]));
-    const filterControls = {};
-
     const closeAllPanels = () => {
       Object.values(filterControls).forEach((ctrl) => {
         if (ctrl?.panel) ctrl.panel.classList.remove("open");
@@ -3269,23 +3363,17 @@
       const set = filters[key] || new Set();
       const ctrl = filterControls[key];
       if (!ctrl) return;
-      const map = ctrl.labelMap || {};
-      if (ctrl.allCb) ctrl.allCb.checked = set.size === 0;
-      (ctrl.optionCbs || []).forEach((cb) => {
-        cb.checked = set.has(cb.dataset.val || "");
-      });
       if (set.size === 0) {
         ctrl.label.textContent = "(Todos)";
       } else if (set.size <= 2) {
-        ctrl.label.textContent = Array.from(set)
-          .map((v) => map[v] || v)
-          .join(", ");
+        ctrl.label.textContent = Array.from(set).join(", ");
       } else {
         ctrl.label.textContent = `${set.size} selecionados`;
       }
     };
 
-    const buildFilter = (container, options, key) => {
+    // As opcoes sao buscadas ao abrir o painel, ja com os filtros das outras colunas.
+    const buildFilter = (container, key) => {
       container.innerHTML = "";
       const wrap = document.createElement("div");
       wrap.className = "mf-wrapper";
@@ -3308,19 +3396,16 @@
       const list = document.createElement("div");
       list.className = "mf-options";
 
-      const tempSelected = new Set(filters[key] || []);
-      const allId = `${key}-all`;
+      const tempSelected = new Set();
       const allRow = document.createElement("label");
       allRow.className = "mf-option";
       const allCb = document.createElement("input");
       allCb.type = "checkbox";
-      allCb.id = allId;
       allCb.dataset.val = "";
       allRow.appendChild(allCb);
       const allSpan = document.createElement("span");
       allSpan.textContent = "(Todos)";
       allRow.appendChild(allSpan);
-      list.appendChild(allRow);
 
       const selectVisibleRow = document.createElement("label");
       selectVisibleRow.className = "mf-option mf-select-visible";
@@ -3330,25 +3415,11 @@
       const selectVisibleSpan = document.createElement("span");
       selectVisibleSpan.textContent = "Selecionar exibidos";
       selectVisibleRow.appendChild(selectVisibleSpan);
-      list.appendChild(selectVisibleRow);
 
-      const cbs = [];
-      const labelMap = {};
-      options.forEach((opt) => {
-        const row = document.createElement("label");
-        row.className = "mf-option";
-        const cb = document.createElement("input");
-        cb.type = "checkbox";
-        const norm = String(opt || "").toLowerCase();
-        cb.dataset.val = norm;
-        labelMap[norm] = opt;
-        row.appendChild(cb);
-        const txt = document.createElement("span");
-        txt.textContent = opt;
-        row.appendChild(txt);
-        list.appendChild(row);
-        cbs.push({ cb, txt, row, val: norm });
-      });
+      const status = document.createElement("div");
+      status.className = "mf-option muted";
+
+      let cbs = [];
 
       const syncUIFromTemp = () => {
         allCb.checked = tempSelected.size === 0;
@@ -3356,16 +3427,52 @@
           cb.checked = tempSelected.has(val);
         });
         const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        const allVisibleSelected = visible.length > 0 && visible.every(({ cb }) => cb.checked);
-        selectVisibleCb.checked = allVisibleSelected;
+        selectVisibleCb.checked = visible.length > 0 && visible.every(({ cb }) => cb.checked);
       };
 
-      const applyTempToFilters = () => {
-        const set = filters[key];
-        set.clear();
-        tempSelected.forEach((v) => set.add(v));
-        updateDisplay(key);
-        renderFiltered();
+      const fillOptions = (options) => {
+        list.innerHTML = "";
+        list.appendChild(allRow);
+        list.appendChild(selectVisibleRow);
+        // Selecionados que sairam das opcoes continuam na lista para poder desmarcar.
+        const valores = Array.from(new Set([...options, ...filters[key]]));
+        cbs = valores.map((opt) => {
+          const row = document.createElement("label");
+          row.className = "mf-option";
+          const cb = document.createElement("input");
+          cb.type = "checkbox";
+          cb.dataset.val = opt;
+          row.appendChild(cb);
+          const txt = document.createElement("span");
+          txt.textContent = opt;
+          row.appendChild(txt);
+          list.appendChild(row);
+          cb.addEventListener("change", () => {
+            if (cb.checked) {
+              tempSelected.add(opt);
+              allCb.checked = false;
+            } else {
+              tempSelected.delete(opt);
+            }
+            syncUIFromTemp();
+          });
+          return { cb, txt, row, val: opt };
+        });
+        syncUIFromTemp();
+      };
+
+      const loadOptions = async () => {
+        list.innerHTML = "";
+        status.textContent = "Carregando...";
+        list.appendChild(status);
+        const col = colunaServidor(key);
+        try {
+          const data = await buscarAgregado([key]);
+          if (panel.classList.contains("open")) fillOptions((data.distintos || {})[col] || []);
+        } catch (err) {
+          status.textContent = err.message;
+          console.error(err);
+        }
       };
 
       const closePanel = () => panel.classList.remove("open");
@@ -3384,31 +3491,15 @@
         } else {
           visible.forEach(({ val }) => tempSelected.delete(val));
         }
-        allCb.checked = tempSelected.size === 0;
         syncUIFromTemp();
       });
 
-      cbs.forEach(({ cb, val }) => {
-        cb.addEventListener("change", () => {
-          if (cb.checked) {
-            tempSelected.add(val);
-            allCb.checked = false;
-          } else {
-            tempSelected.delete(val);
-          }
-          syncUIFromTemp();
-        });
-      });
-
       search.addEventListener("input", () => {
         const term = search.value.toLowerCase();
         cbs.forEach(({ row, txt }) => {
-          const match = txt.textContent.toLowerCase().includes(term);
-          row.style.display = match ? "" : "none";
+          row.style.display = txt.textContent.toLowerCase().includes(term) ? "" : "none";
         });
-        const allMatch = "(todos)".includes(term) || term === "";
-        allRow.style.display = allMatch ? "" : "none";
-        selectVisibleRow.style.display = "";
+        allRow.style.display = "(todos)".includes(term) || term === "" ? "" : "none";
         syncUIFromTemp();
       });
 
@@ -3423,15 +3514,14 @@
       applyBtn.className = "mf-btn primary";
       applyBtn.textContent = "Aplicar";
 
-      cancelBtn.addEventListener("click", () => {
-        tempSelected.clear();
-        filters[key].forEach((v) => tempSelected.add(v));
-        syncUIFromTemp();
-        closePanel();
-      });
+      cancelBtn.addEventListener("click", closePanel);
       applyBtn.addEventListener("click", () => {
-        applyTempToFilters();
+        const set = filters[key];
+        set.clear();
+        tempSelected.forEach((v) => set.add(v));
+        updateDisplay(key);
         closePanel();
+        carregar();
       });
 
       display.addEventListener("click", () => {
@@ -3442,11 +3532,10 @@
           panel.style.height = "";
           tempSelected.clear();
           filters[key].forEach((v) => tempSelected.add(v));
-          cbs.forEach(({ row }) => (row.style.display = ""));
           allRow.style.display = "";
           search.value = "";
-          syncUIFromTemp();
           panel.classList.add("open");
+          loadOptions();
         }
       });
 
@@ -3459,272 +3548,231 @@
       wrap.appendChild(panel);
       container.appendChild(wrap);
 
-      filterControls[key] = {
-        panel,
-        label,
-        allCb,
-        optionCbs: cbs.map((c) => c.cb),
-        labelMap,
-      };
+      filterControls[key] = { panel, label };
       updateDisplay(key);
     };
 
-    const setOptions = (rows = allData.rows) => {
-      closeAllPanels();
-      const uniques = colKeys.map(() => new Set());
-      (rows || []).forEach((r) => {
-        colKeys.forEach((k, idx) => {
-          const v = r[k];
-          if (v !== undefined && v !== null && v !== "") uniques[idx].add(String(v));
-        });
-      });
-      filterContainers.forEach((container) => {
-        const key = container.getAttribute("data-col");
-        const idx = colKeys.indexOf(key);
-        if (idx === -1) return;
-        const opts = Array.from(uniques[idx]).sort((a, b) => a.localeCompare(b, "pt-BR"));
-        buildFilter(container, opts, key);
-      });
-    };
-
-    const renderFiltered = (resetPage = true) => {
-      const filtered = allData.rows.filter((r) =>
-        colKeys.every((k) => {
-          const set = filters[k];
-          if (!set || set.size === 0) return true;
-          const val = r[k];
-          const cmp = val === null || val === undefined ? "" : String(val).toLowerCase();
-          return set.has(cmp);
-        })
-      );
-      setOptions(filtered);
-      filteredRows = filtered;
-      if (resetPage) currentPage = 1;
-      render();
-    };
+    table.querySelectorAll(".filter-row [data-col]").forEach((container) => {
+      const key = container.getAttribute("data-col");
+      if (filters[key]) buildFilter(container, key);
+    });
 
-      if (!multiFilterClickBound) {
-        document.addEventListener("click", (ev) => {
-          if (!ev.target.closest(".mf-wrapper")) {
-            closeAllPanels();
-          }
+    if (!multiFilterClickBound) {
+      document.addEventListener("click", (ev) => {
+        if (!ev.target.closest(".mf-wrapper")) {
+          document.querySelectorAll(".mf-panel.open").forEach((p) => p.classList.remove("open"));
+        }
       });
       multiFilterClickBound = true;
     }
 
-    const load = async () => {
-      if (meta) meta.textContent = "Carregando...";
-      try {
-        const res = await fetch("/api/relatorios/fip613");
-        const data = await res.json();
-        if (!res.ok) throw new Error(data.error || "Falha ao carregar.");
-        allData.rows = data.data || [];
-        setOptions(allData.rows);
-        filteredRows = allData.rows;
-        render();
-        if (meta) {
-          const dt = formatAmazonLocalTime(data.data_arquivo);
-          const user = data.user_email || "-";
-          const uploaded = formatAmazonTime(data.uploaded_at);
-          meta.innerHTML = `
-            <div><strong>Última atualização</strong></div>
-            <div>Enviado por: ${user}</div>
-            <div>Upload em: ${uploaded}</div>
-            <div>Data do download: ${dt}</div>
-          `;
-        }
-      } catch (err) {
-        if (meta) meta.textContent = err.message;
-        console.error(err);
-      }
-    };
-
-    load();
-
     if (btnReset) {
       btnReset.addEventListener("click", () => {
-        Object.keys(filters).forEach((k) => filters[k].clear());
-        setOptions(allData.rows);
-        filteredRows = allData.rows;
-        currentPage = 1;
-        render();
+        closeAllPanels();
+        Object.keys(filters).forEach((k) => {
+          filters[k].clear();
+          updateDisplay(k);
+        });
+        carregar();
       });
     }
 
     if (pageSizeSelect) {
       pageSizeSelect.addEventListener("change", () => {
-        const val = parseInt(pageSizeSelect.value || "20", 10);
-        pageSize = Number.isNaN(val) ? 20 : val;
-        currentPage = 1;
-        render();
+        pageSize = parseInt(pageSizeSelect.value || "20", 10) || 20;
+        pagina = 0;
+        cursores = [null];
+        carregar(false);
       });
     }
 
     if (btnDownload) {
       btnDownload.addEventListener("click", () => {
-        window.open("/api/relatorios/fip613/download", "_blank");
+        window.open(`${base}/download`, "_blank");
       });
     }
+
+    if (meta) meta.textContent = "Carregando...";
+    carregar();
   }
 
-  function initRelatorioPlan20() {
-    const table = document.getElementById("plan20-relatorio-tabela");
-    const tbody = table ? table.querySelector("tbody") : null;
-    const meta = document.getElementById("plan20-relatorio-meta");
-    const pager = document.getElementById("plan20-pagination");
-    const pageSizeSelect = document.getElementById("plan20-page-size");
-    const btnDownload = document.getElementById("plan20-download");
-    const btnReset = document.getElementById("plan20-reset");
-    const totExercicio = document.getElementById("plan20-tot-exercicio");
-    const totValorTotal = document.getElementById("plan20-tot-valor-total");
-    if (!table || !tbody) return;
+  function initRelatorioFip() {
+    const table = document.getElementById("fip613-relatorio-tabela");
+    if (!table || !table.querySelector("tbody")) return;
     if (table.dataset.bound === "1") return;
     table.dataset.bound = "1";
 
-    let pageSize = parseInt(pageSizeSelect?.value || "20", 10) || 20;
-    let currentPage = 1;
-    let filteredRows = [];
-
     const numFmt = new Intl.NumberFormat("pt-BR", {
       minimumFractionDigits: 2,
       maximumFractionDigits: 2,
     });
-    const fmtNum = (v) => {
-      const n = Number(v);
-      if (Number.isNaN(n)) return v ?? "";
-      return numFmt.format(n);
-    };
-
-    const updateTotals = (rows) => {
-      const exSet = new Set();
-      let totalVal = 0;
-      rows.forEach((r) => {
-        if (r.exercicio !== undefined && r.exercicio !== null && r.exercicio !== "") {
-          exSet.add(String(r.exercicio));
-        }
-        const v = Number(r.valor_total || 0);
-        if (!Number.isNaN(v)) totalVal += v;
-      });
-      if (totExercicio) {
-        totExercicio.textContent = exSet.size ? Array.from(exSet).sort((a, b) => a.localeCompare(b, "pt-BR")).join(" * ") : "-";
-      }
-      if (totValorTotal) {
-        totValorTotal.textContent = numFmt.format(totalVal);
-        totValorTotal.classList.remove("pos", "neg");
-        if (totalVal > 0) totValorTotal.classList.add("pos");
-        else if (totalVal < 0) totValorTotal.classList.add("neg");
-      }
+    const fmt = (v) => {
+      const n = Number(v || 0);
+      if (Object.is(n, -0)) return "-";
+      return n === 0 ? "-" : numFmt.format(n);
     };
-
-    const renderPagination = (totalPages) => {
-      if (!pager) return;
-      pager.innerHTML = "";
-      if (totalPages <= 1) return;
-      const addBtn = (label, page, disabled = false, active = false) => {
-        const b = document.createElement("button");
-        b.textContent = label;
-        if (disabled) b.disabled = true;
-        if (active) b.classList.add("active");
-        b.addEventListener("click", () => {
-          if (disabled || page === currentPage) return;
-          currentPage = page;
-          renderFiltered(false);
-        });
-        pager.appendChild(b);
-      };
-      addBtn("<<", 1, currentPage === 1);
-      addBtn("<", Math.max(1, currentPage - 1), currentPage === 1);
-
-      const maxButtons = 5;
-      const start = Math.max(1, Math.min(currentPage - 2, totalPages - maxButtons + 1));
-      const end = Math.min(totalPages, start + maxButtons - 1);
-      for (let p = start; p <= end; p++) {
-        addBtn(String(p), p, false, p === currentPage);
-      }
-      if (end < totalPages) {
-        const ellipsis = document.createElement("span");
-        ellipsis.textContent = "...";
-        pager.appendChild(ellipsis);
-        addBtn(String(totalPages), totalPages, false, currentPage === totalPages);
-      }
-
-      addBtn(">", Math.min(totalPages, currentPage + 1), currentPage === totalPages);
-      addBtn(">>", totalPages, currentPage === totalPages);
+    const numCls = (v) => {
+      const n = Number(v || 0);
+      const classes = ["num"];
+      if (n > 0) classes.push("pos");
+      else if (n < 0) classes.push("neg");
+      return classes.join(" ");
     };
 
-    const render = () => {
-      const rows = filteredRows;
-      const totalPages = Math.max(1, Math.ceil(rows.length / pageSize));
-      if (currentPage > totalPages) currentPage = totalPages;
-      const startIdx = (currentPage - 1) * pageSize;
-      const pageRows = rows.slice(startIdx, startIdx + pageSize);
+    const colKeys = [
+      "uo",
+      "ug",
+      "funcao",
+      "subfuncao",
+      "programa",
+      "projeto_atividade",
+      "regional",
+      "natureza_despesa",
+      "fonte_recurso",
+      "iduso",
+      "tipo_recurso",
+      "dotacao_inicial",
+      "cred_suplementar",
+      "cred_especial",
+      "cred_extraordinario",
+      "reducao",
+      "cred_autorizado",
+      "bloqueado_conting",
+      "reserva_empenho",
+      "saldo_destaque",
+      "saldo_dotacao",
+      "empenhado",
+      "liquidado",
+      "a_liquidar",
+      "valor_pago",
+      "valor_a_pagar",
+    ];
+    const sumCols = colKeys.slice(11);
+
+    initRelatorioRemoto({
+      table,
+      base: "/api/relatorios/fip613",
+      colKeys,
+      meta: document.getElementById("fip613-relatorio-meta"),
+      pager: document.getElementById("fip613-pagination"),
+      pageSizeSelect: document.getElementById("fip613-page-size"),
+      btnReset: document.getElementById("fip613-reset"),
+      btnDownload: document.getElementById("fip613-download"),
+      resumo: ["projeto_atividade", "natureza_despesa"],
+      mapearLinha: (r) => {
+        const copy = { ...r };
+        negateCols.forEach((k) => {
+          copy[k] = adjustVal(k, copy[k]);
+        });
+        return copy;
+      },
+      renderLinha: (r) => `
+        <td>${r.uo || ""}</td>
+        <td>${r.ug || ""}</td>
+        <td>${r.funcao || ""}</td>
+        <td>${r.subfuncao || ""}</td>
+        <td>${r.programa || ""}</td>
+        <td>${r.projeto_atividade || ""}</td>
+        <td>${r.regional || ""}</td>
+        <td>${r.natureza_despesa || ""}</td>
+        <td>${r.fonte_recurso || ""}</td>
+        <td>${r.iduso ?? ""}</td>
+        <td>${r.tipo_recurso || ""}</td>
+        <td class="${numCls(r.dotacao_inicial)}">${fmt(r.dotacao_inicial)}</td>
+        <td class="${numCls(r.cred_suplementar)}">${fmt(r.cred_suplementar)}</td>
+        <td class="${numCls(r.cred_especial)}">${fmt(r.cred_especial)}</td>
+        <td class="${numCls(r.cred_extraordinario)}">${fmt(r.cred_extraordinario)}</td>
+        <td class="${numCls(r.reducao)}">${fmt(r.reducao)}</td>
+        <td class="${numCls(r.cred_autorizado)}">${fmt(r.cred_autorizado)}</td>
+        <td class="${numCls(r.bloqueado_conting)}">${fmt(r.bloqueado_conting)}</td>
+        <td class="${numCls(r.reserva_empenho)}">${fmt(r.reserva_empenho)}</td>
+        <td class="${numCls(r.saldo_destaque)}">${fmt(r.saldo_destaque)}</td>
+        <td class="${numCls(r.saldo_dotacao)}">${fmt(r.saldo_dotacao)}</td>
+        <td class="${numCls(r.empenhado)}">${fmt(r.empenhado)}</td>
+        <td class="${numCls(r.liquidado)}">${fmt(r.liquidado)}</td>
+        <td class="${numCls(r.a_liquidar)}">${fmt(r.a_liquidar)}</td>
+        <td class="${numCls(r.valor_pago)}">${fmt(r.valor_pago)}</td>
+        <td class="${numCls(r.valor_a_pagar)}">${fmt(r.valor_a_pagar)}</td>
+      `,
+      renderTotais: (somas, valoresFiltrados, tbody) => {
+        const totals = Object.fromEntries(sumCols.map((c) => [c, adjustVal(c, somas[c])]));
+        const paoeSet = new Set();
+        valoresFiltrados("projeto_atividade").forEach((v) => {
+          const paoeParts = v.split(/\s+/).filter((p) => /^\d+$/.test(p));
+          if (paoeParts.length) paoeSet.add(paoeParts.join("*"));
+        });
+        const grupoSet = new Set();
+        valoresFiltrados("natureza_despesa").forEach((v) => {
+          if (v.length >= 2) grupoSet.add(v[1]);
+        });
 
-      tbody.innerHTML = "";
-      pageRows.forEach((r) => {
-        const tr = document.createElement("tr");
-        tr.innerHTML = `
-          <td>${r.exercicio ?? ""}</td>
-          <td>${r.chave_planejamento ?? ""}</td>
-          <td>${r.regiao ?? ""}</td>
-          <td>${r.subfuncao_ug ?? ""}</td>
-          <td>${r.adj ?? ""}</td>
-          <td>${r.macropolitica ?? ""}</td>
-          <td>${r.pilar ?? ""}</td>
-          <td>${r.eixo ?? ""}</td>
-          <td>${r.politica_decreto ?? ""}</td>
-          <td>${r.publico_transversal_chave ?? ""}</td>
-          <td>${r.programa ?? ""}</td>
-          <td>${r.funcao ?? ""}</td>
-          <td>${r.unidade_orcamentaria ?? ""}</td>
-          <td>${r.acao_paoe ?? ""}</td>
-          <td>${r.subfuncao ?? ""}</td>
-          <td>${r.objetivo_especifico ?? ""}</td>
-          <td>${r.esfera ?? ""}</td>
-          <td>${r.responsavel_acao ?? ""}</td>
-          <td>${r.produto_acao ?? ""}</td>
-          <td>${r.unid_medida_produto ?? ""}</td>
-          <td>${r.regiao_produto ?? ""}</td>
-          <td>${r.meta_produto ?? ""}</td>
-          <td>${r.saldo_meta_produto ?? ""}</td>
-          <td>${r.publico_transversal ?? ""}</td>
-          <td>${r.subacao_entrega ?? ""}</td>
-          <td>${r.responsavel ?? ""}</td>
-          <td>${r.prazo ?? ""}</td>
-          <td>${r.unid_gestora ?? ""}</td>
-          <td>${r.unidade_setorial_planejamento ?? ""}</td>
-          <td>${r.produto_subacao ?? ""}</td>
-          <td>${r.unidade_medida ?? ""}</td>
-          <td>${r.regiao_subacao ?? ""}</td>
-          <td>${r.codigo ?? ""}</td>
-          <td>${r.municipios_entrega ?? ""}</td>
-          <td>${r.meta_subacao ?? ""}</td>
-          <td>${r.detalhamento_produto ?? ""}</td>
-          <td>${r.etapa ?? ""}</td>
-          <td>${r.responsavel_etapa ?? ""}</td>
-          <td>${r.prazo_etapa ?? ""}</td>
-          <td>${r.regiao_etapa ?? ""}</td>
-          <td>${r.natureza ?? ""}</td>
-          <td>${r.cat_econ ?? ""}</td>
-          <td>${r.grupo ?? ""}</td>
-          <td>${r.modalidade ?? ""}</td>
-          <td>${r.elemento ?? ""}</td>
-          <td>${r.subelemento ?? ""}</td>
-          <td>${r.fonte ?? ""}</td>
-          <td>${r.idu ?? ""}</td>
-          <td>${r.descricao_item_despesa ?? ""}</td>
-          <td>${r.unid_medida_item ?? ""}</td>
-          <td class="num">${fmtNum(r.quantidade)}</td>
-          <td class="num">${fmtNum(r.valor_unitario)}</td>
-          <td class="num">${fmtNum(r.valor_total)}</td>
+        // linha de totais
+        const totalTr = document.createElement("tr");
+        totalTr.innerHTML = `
+          <td colspan="11"><strong>Totais (linhas filtradas)</strong></td>
+          ${sumCols
+            .map((c) => `<td class="${numCls(totals[c])}"><strong>${totals[c].toLocaleString("pt-BR")}</strong></td>`)
+            .join("")}
         `;
-        tbody.appendChild(tr);
-      });
+        tbody.appendChild(totalTr);
+
+        const paoeEl = document.getElementById("tot-paoe");
+        const grupoEl = document.getElementById("tot-grupo");
+        const credAutoEl = document.getElementById("tot-cred-autorizado");
+        const bloqueadoEl = document.getElementById("tot-bloqueado");
+        const tetoEl = document.getElementById("tot-teto");
+        const saldoDotEl = document.getElementById("tot-saldo-dotacao");
+        if (paoeEl) {
+          if (paoeSet.size === 0) {
+            paoeEl.textContent = "-";
+          } else if (paoeSet.size > 10) {
+            paoeEl.textContent = "Vários PAOEs";
+          } else {
+            paoeEl.textContent = Array.from(paoeSet).join(" * ");
+          }
+        }
+        if (grupoEl) grupoEl.textContent = grupoSet.size ? Array.from(grupoSet).join("*") : "-";
+        const formatVal = (el, val) => {
+          if (!el) return;
+          const n = Number(val || 0);
+          el.textContent = n === 0 ? "-" : n.toLocaleString("pt-BR");
+          el.classList.remove("pos", "neg");
+          if (n > 0) el.classList.add("pos");
+          if (n < 0) el.classList.add("neg");
+        };
+        const bloqueadoVal = totals.bloqueado_conting;
+        if (bloqueadoEl) formatVal(bloqueadoEl, bloqueadoVal);
+        if (tetoEl) {
+          const teto = totals.cred_autorizado + bloqueadoVal;
+          tetoEl.textContent = Number(teto || 0).toLocaleString("pt-BR");
+          tetoEl.classList.remove("pos", "neg");
+        }
+        if (credAutoEl) {
+          credAutoEl.textContent = Number(totals.cred_autorizado || 0).toLocaleString("pt-BR");
+          credAutoEl.classList.remove("pos", "neg");
+        }
+        formatVal(saldoDotEl, totals.saldo_dotacao);
+      },
+    });
+  }
 
-      renderPagination(totalPages);
-      updateTotals(rows);
-    };
+  function initRelatorioPlan20() {
+    const table = document.getElementById("plan20-relatorio-tabela");
+    const totExercicio = document.getElementById("plan20-tot-exercicio");
+    const totValor = document.getElementById("plan20-tot-valor-total");
+    if (!table || !table.querySelector("tbody")) return;
+    if (table.dataset.bound === "1") return;
+    table.dataset.bound = "1";
 
-    const allData = { rows: [] };
+    const numFmt = new Intl.NumberFormat("pt-BR", {
+      minimumFractionDigits: 2,
+      maximumFractionDigits: 2,
+    });
+    const fmtNum = (v) => {
+      const n = Number(v);
+      if (Number.isNaN(n)) return v ?? "";
+      return numFmt.format(n);
+    };
 
     const colKeys = [
       "exercicio",
@@ -3782,337 +3830,335 @@
       "valor_total",
     ];
 
-    const filterContainers = table.querySelectorAll(".filter-row [data-col]");
-    const filters = Object.fromEntries(colKeys.map((k) => [k, new Set()]));
-    const filterControls = {};
+    initRelatorioRemoto({
+      table,
+      base: "/api/relatorios/plan20-seduc",
+      colKeys,
+      meta: document.getElementById("plan20-relatorio-meta"),
+      pager: document.getElementById("plan20-pagination"),
+      pageSizeSelect: document.getElementById("plan20-page-size"),
+      btnReset: document.getElementById("plan20-reset"),
+      btnDownload: document.getElementById("plan20-download"),
+      resumo: ["exercicio"],
+      renderLinha: (r) => `
+        <td>${r.exercicio ?? ""}</td>
+        <td>${r.chave_planejamento ?? ""}</td>
+        <td>${r.regiao ?? ""}</td>
+        <td>${r.subfuncao_ug ?? ""}</td>
+        <td>${r.adj ?? ""}</td>
+        <td>${r.macropolitica ?? ""}</td>
+        <td>${r.pilar ?? ""}</td>
+        <td>${r.eixo ?? ""}</td>
+        <td>${r.politica_decreto ?? ""}</td>
+        <td>${r.publico_transversal_chave ?? ""}</td>
+        <td>${r.programa ?? ""}</td>
+        <td>${r.funcao ?? ""}</td>
+        <td>${r.unidade_orcamentaria ?? ""}</td>
+        <td>${r.acao_paoe ?? ""}</td>
+        <td>${r.subfuncao ?? ""}</td>
+        <td>${r.objetivo_especifico ?? ""}</td>
+        <td>${r.esfera ?? ""}</td>
+        <td>${r.responsavel_acao ?? ""}</td>
+        <td>${r.produto_acao ?? ""}</td>
+        <td>${r.unid_medida_produto ?? ""}</td>
+        <td>${r.regiao_produto ?? ""}</td>
+        <td>${r.meta_produto ?? ""}</td>
+        <td>${r.saldo_meta_produto ?? ""}</td>
+        <td>${r.publico_transversal ?? ""}</td>
+        <td>${r.subacao_entrega ?? ""}</td>
+        <td>${r.responsavel ?? ""}</td>
+        <td>${r.prazo ?? ""}</td>
+        <td>${r.unid_gestora ?? ""}</td>
+        <td>${r.unidade_setorial_planejamento ?? ""}</td>
+        <td>${r.produto_subacao ?? ""}</td>
+        <td>${r.unidade_medida ?? ""}</td>
+        <td>${r.regiao_subacao ?? ""}</td>
+        <td>${r.codigo ?? ""}</td>
+        <td>${r.municipios_entrega ?? ""}</td>
+        <td>${r.meta_subacao ?? ""}</td>
+        <td>${r.detalhamento_produto ?? ""}</td>
+        <td>${r.etapa ?? ""}</td>
+        <td>${r.responsavel_etapa ?? ""}</td>
+        <td>${r.prazo_etapa ?? ""}</td>
+        <td>${r.regiao_etapa ?? ""}</td>
+        <td>${r.natureza ?? ""}</td>
+        <td>${r.cat_econ ?? ""}</td>
+        <td>${r.grupo ?? ""}</td>
+        <td>${r.modalidade ?? ""}</td>
+        <td>${r.elemento ?? ""}</td>
+        <td>${r.subelemento ?? ""}</td>
+        <td>${r.fonte ?? ""}</td>
+        <td>${r.idu ?? ""}</td>
+        <td>${r.descricao_item_despesa ?? ""}</td>
+        <td>${r.unid_medida_item ?? ""}</td>
+        <td class="num">${fmtNum(r.quantidade)}</td>
+        <td class="num">${fmtNum(r.valor_unitario)}</td>
+        <td class="num">${fmtNum(r.valor_total)}</td>
+      `,
+      renderTotais: (totais, valoresFiltrados) => {
+        const exercicios = valoresFiltrados("exercicio");
+        if (totExercicio) {
+          totExercicio.textContent = exercicios.length
+            ? exercicios.slice().sort((a, b) => a.localeCompare(b, "pt-BR")).join(" * ")
+            : "-";
+        }
+        if (totValor) {
+          const totalVal = Number(totais.valor_total || 0);
+          totValor.textContent = numFmt.format(totalVal);
+          totValor.classList.remove("pos", "neg");
+          if (totalVal > 0) totValor.classList.add("pos");
+          else if (totalVal < 0) totValor.classList.add("neg");
+        }
+      },
+    });
+  }
 
-    const closeAllPanels = () => {
-      Object.values(filterControls).forEach((ctrl) => {
-        if (ctrl?.panel) ctrl.panel.classList.remove("open");
-      });
-    };
+  function initRelatorioEmp() {
+    const table = document.getElementById("emp-relatorio-tabela");
+    const totExercicio = document.getElementById("emp-tot-exercicio");
+    const totValor = document.getElementById("emp-tot-valor-emp");
+    const chaveHeader = document.getElementById("emp-col-chave");
+    if (!table || !table.querySelector("tbody")) return;
+    if (table.dataset.bound === "1") return;
+    table.dataset.bound = "1";
 
-    const updateDisplay = (key) => {
-      const set = filters[key] || new Set();
-      const ctrl = filterControls[key];
-      if (!ctrl) return;
-      const map = ctrl.labelMap || {};
-      if (ctrl.allCb) ctrl.allCb.checked = set.size === 0;
-      (ctrl.optionCbs || []).forEach((cb) => {
-        cb.checked = set.has(cb.dataset.val || "");
-      });
-      if (set.size === 0) {
-        ctrl.label.textContent = "(Todos)";
-      } else if (set.size <= 2) {
-        ctrl.label.textContent = Array.from(set)
-          .map((v) => map[v] || v)
-          .join(", ");
-      } else {
-        ctrl.label.textContent = `${set.size} selecionados`;
-      }
+    const numFmt = new Intl.NumberFormat("pt-BR", {
+      minimumFractionDigits: 2,
+      maximumFractionDigits: 2,
+    });
+    const fmtNum = (v) => {
+      const n = Number(v);
+      if (Number.isNaN(n)) return v ?? "";
+      return numFmt.format(n);
     };
 
-    const buildFilter = (container, options, key) => {
-      container.innerHTML = "";
-      const wrap = document.createElement("div");
-      wrap.className = "mf-wrapper";
-      const display = document.createElement("button");
-      display.type = "button";
-      display.className = "mf-display";
-      const label = document.createElement("span");
-      label.textContent = "(Todos)";
-      display.appendChild(label);
-      const icon = document.createElement("i");
-      icon.className = "bi bi-chevron-down";
-      display.appendChild(icon);
-
-      const panel = document.createElement("div");
-      panel.className = "mf-panel";
-      const search = document.createElement("input");
-      search.type = "text";
-      search.className = "mf-search";
-      search.placeholder = "Buscar...";
-      const list = document.createElement("div");
-      list.className = "mf-options";
-
-      const tempSelected = new Set(filters[key] || []);
-      const allId = `${key}-all`;
-      const allRow = document.createElement("label");
-      allRow.className = "mf-option";
-      const allCb = document.createElement("input");
-      allCb.type = "checkbox";
-      allCb.id = allId;
-      allCb.dataset.val = "";
-      allRow.appendChild(allCb);
-      const allSpan = document.createElement("span");
-      allSpan.textContent = "(Todos)";
-      allRow.appendChild(allSpan);
-      list.appendChild(allRow);
+    const colKeys = [
+      "chave_display",
+      "regiao",
+      "subfuncao_ug",
+      "adj",
+      "macropolitica",
+      "pilar",
+      "eixo",
+      "politica_decreto",
+      "exercicio",
+      "numero_emp",
+      "numero_ped",
+      "valor_emp",
+      "devolucao_gcv",
+      "valor_emp_devolucao_gcv",
+      "uo",
+      "nome_unidade_orcamentaria",
+      "ug",
+      "nome_unidade_gestora",
+      "dotacao_orcamentaria",
+      "funcao",
+      "subfuncao",
+      "programa_governo",
+      "paoe",
+      "natureza_despesa",
+      "cat_econ",
+      "grupo",
+      "modalidade",
+      "elemento",
+      "fonte",
+      "iduso",
+      "historico",
+      "tipo_despesa",
+      "credor",
+      "nome_credor",
+      "cpf_cnpj_credor",
+      "categoria_credor",
+      "tipo_empenho",
+      "situacao",
+      "data_emissao",
+      "data_criacao",
+      "numero_contrato",
+      "numero_convenio",
+    ];
 
-      const selectVisibleRow = document.createElement("label");
-      selectVisibleRow.className = "mf-option mf-select-visible";
-      const selectVisibleCb = document.createElement("input");
-      selectVisibleCb.type = "checkbox";
-      selectVisibleRow.appendChild(selectVisibleCb);
-      const selectVisibleSpan = document.createElement("span");
-      selectVisibleSpan.textContent = "Selecionar exibidos";
-      selectVisibleRow.appendChild(selectVisibleSpan);
-      list.appendChild(selectVisibleRow);
+    if (chaveHeader) chaveHeader.textContent = "Chave de Planejamento/Chave";
+
+    initRelatorioRemoto({
+      table,
+      base: "/api/relatorios/emp",
+      colKeys,
+      meta: document.getElementById("emp-relatorio-meta"),
+      pager: document.getElementById("emp-pagination"),
+      pageSizeSelect: document.getElementById("emp-page-size"),
+      btnReset: document.getElementById("emp-reset"),
+      btnDownload: document.getElementById("emp-download"),
+      alias: { chave_display: "chave" },
+      mapearLinha: (r) => ({ ...r, chave_display: r.chave || r.chave_planejamento || "" }),
+      resumo: ["exercicio"],
+      renderLinha: (r) => `
+        <td>${r.chave_display ?? ""}</td>
+        <td>${r.regiao ?? ""}</td>
+        <td>${r.subfuncao_ug ?? ""}</td>
+        <td>${r.adj ?? ""}</td>
+        <td>${r.macropolitica ?? ""}</td>
+        <td>${r.pilar ?? ""}</td>
+        <td>${r.eixo ?? ""}</td>
+        <td>${r.politica_decreto ?? ""}</td>
+        <td>${r.exercicio ?? ""}</td>
+        <td>${r.numero_emp ?? ""}</td>
+        <td>${r.numero_ped ?? ""}</td>
+        <td class="num">${fmtNum(r.valor_emp)}</td>
+        <td class="num">${fmtNum(r.devolucao_gcv)}</td>
+        <td class="num">${fmtNum(r.valor_emp_devolucao_gcv)}</td>
+        <td>${r.uo ?? ""}</td>
+        <td>${r.nome_unidade_orcamentaria ?? ""}</td>
+        <td>${r.ug ?? ""}</td>
+        <td>${r.nome_unidade_gestora ?? ""}</td>
+        <td>${r.dotacao_orcamentaria ?? ""}</td>
+        <td>${r.funcao ?? ""}</td>
+        <td>${r.subfuncao ?? ""}</td>
+        <td>${r.programa_governo ?? ""}</td>
+        <td>${r.paoe ?? ""}</td>
+        <td>${r.natureza_despesa ?? ""}</td>
+        <td>${r.cat_econ ?? ""}</td>
+        <td>${r.grupo ?? ""}</td>
+        <td>${r.modalidade ?? ""}</td>
+        <td>${r.elemento ?? ""}</td>
+        <td>${r.fonte ?? ""}</td>
+        <td>${r.iduso ?? ""}</td>
+        <td>${r.historico ?? ""}</td>
+        <td>${r.tipo_despesa ?? ""}</td>
+        <td>${r.credor ?? ""}</td>
+        <td>${r.nome_credor ?? ""}</td>
+        <td>${r.cpf_cnpj_credor ?? ""}</td>
+        <td>${r.categoria_credor ?? ""}</td>
+        <td>${r.tipo_empenho ?? ""}</td>
+        <td>${r.situacao ?? ""}</td>
+        <td>${r.data_emissao ?? ""}</td>
+        <td>${r.data_criacao ?? ""}</td>
+        <td>${r.numero_contrato ?? ""}</td>
+        <td>${r.numero_convenio ?? ""}</td>
+      `,
+      renderTotais: (totais, valoresFiltrados) => {
+        const exercicios = valoresFiltrados("exercicio");
+        if (totExercicio) {
+          totExercicio.textContent = exercicios.length
+            ? exercicios.slice().sort((a, b) => a.localeCompare(b, "pt-BR")).join(" | ")
+            : "-";
+        }
+        if (totValor) {
+          const totalVal = Number(totais.valor_emp_devolucao_gcv || 0);
+          totValor.textContent = numFmt.format(totalVal);
+          totValor.classList.remove("pos", "neg");
+          if (totalVal > 0) totValor.classList.add("pos");
+          else if (totalVal < 0) totValor.classList.add("neg");
+        }
+      },
+    });
+  }
 
-      const cbs = [];
-      const labelMap = {};
-      options.forEach((opt) => {
-        const row = document.createElement("label");
-        row.className = "mf-option";
-        const cb = document.createElement("input");
-        cb.type = "checkbox";
-        const norm = String(opt || "").toLowerCase();
-        cb.dataset.val = norm;
-        labelMap[norm] = opt;
-        row.appendChild(cb);
-        const txt = document.createElement("span");
-        txt.textContent = opt;
-        row.appendChild(txt);
-        list.appendChild(row);
-        cbs.push({ cb, txt, row, val: norm });
-      });
+  function initRelatorioEstEmp() {
+    const table = document.getElementById("est-emp-relatorio-tabela");
+    const totExercicio = document.getElementById("est-emp-tot-exercicio");
+    const totValor = document.getElementById("est-emp-tot-valor-est-emp");
+    if (!table || !table.querySelector("tbody")) return;
+    if (table.dataset.bound === "1") return;
+    table.dataset.bound = "1";
 
-      const syncUIFromTemp = () => {
-        allCb.checked = tempSelected.size === 0;
-        cbs.forEach(({ cb, val }) => {
-          cb.checked = tempSelected.has(val);
-        });
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        const allVisibleSelected = visible.length > 0 && visible.every(({ cb }) => cb.checked);
-        selectVisibleCb.checked = allVisibleSelected;
-      };
+    const numFmt = new Intl.NumberFormat("pt-BR", {
+      minimumFractionDigits: 2,
+      maximumFractionDigits: 2,
+    });
+    const fmtNum = (v) => {
+      const n = Number(v);
+      if (Number.isNaN(n)) return v ?? "";
+      return numFmt.format(n);
+    };
 
-      const applyTempToFilters = () => {
-        const set = filters[key];
-        set.clear();
-        tempSelected.forEach((v) => set.add(v));
-        updateDisplay(key);
-        renderFiltered();
-      };
-
-      const closePanel = () => panel.classList.remove("open");
-
-      allCb.addEventListener("change", () => {
-        if (allCb.checked) {
-          tempSelected.clear();
-          syncUIFromTemp();
-        }
-      });
-
-      selectVisibleCb.addEventListener("change", () => {
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        if (selectVisibleCb.checked) {
-          visible.forEach(({ val }) => tempSelected.add(val));
-        } else {
-          visible.forEach(({ val }) => tempSelected.delete(val));
-        }
-        allCb.checked = tempSelected.size === 0;
-        syncUIFromTemp();
-      });
-
-      cbs.forEach(({ cb, val }) => {
-        cb.addEventListener("change", () => {
-          if (cb.checked) {
-            tempSelected.add(val);
-            allCb.checked = false;
-          } else {
-            tempSelected.delete(val);
-          }
-          syncUIFromTemp();
-        });
-      });
-
-      search.addEventListener("input", () => {
-        const term = search.value.toLowerCase();
-        cbs.forEach(({ row, txt }) => {
-          const match = txt.textContent.toLowerCase().includes(term);
-          row.style.display = match ? "" : "none";
-        });
-        const allMatch = "(todos)".includes(term) || term === "";
-        allRow.style.display = allMatch ? "" : "none";
-        selectVisibleRow.style.display = "";
-        syncUIFromTemp();
-      });
-
-      const actions = document.createElement("div");
-      actions.className = "mf-actions";
-      const cancelBtn = document.createElement("button");
-      cancelBtn.type = "button";
-      cancelBtn.className = "mf-btn ghost";
-      cancelBtn.textContent = "Cancelar";
-      const applyBtn = document.createElement("button");
-      applyBtn.type = "button";
-      applyBtn.className = "mf-btn primary";
-      applyBtn.textContent = "Aplicar";
-
-      cancelBtn.addEventListener("click", () => {
-        tempSelected.clear();
-        filters[key].forEach((v) => tempSelected.add(v));
-        syncUIFromTemp();
-        closePanel();
-      });
-      applyBtn.addEventListener("click", () => {
-        applyTempToFilters();
-        closePanel();
-      });
-
-      display.addEventListener("click", () => {
-        const isOpen = panel.classList.contains("open");
-        closeAllPanels();
-        if (!isOpen) {
-          panel.style.width = "";
-          panel.style.height = "";
-          tempSelected.clear();
-          filters[key].forEach((v) => tempSelected.add(v));
-          cbs.forEach(({ row }) => (row.style.display = ""));
-          allRow.style.display = "";
-          search.value = "";
-          syncUIFromTemp();
-          panel.classList.add("open");
-        }
-      });
-
-      wrap.appendChild(display);
-      panel.appendChild(search);
-      panel.appendChild(list);
-      actions.appendChild(cancelBtn);
-      actions.appendChild(applyBtn);
-      panel.appendChild(actions);
-      wrap.appendChild(panel);
-      container.appendChild(wrap);
-
-      filterControls[key] = {
-        panel,
-        label,
-        allCb,
-        optionCbs: cbs.map((c) => c.cb),
-        labelMap,
-      };
-      updateDisplay(key);
-    };
-
-    const setOptions = (rows = allData.rows) => {
-      closeAllPanels();
-      const uniques = colKeys.map(() => new Set());
-      (rows || []).forEach((r) => {
-        colKeys.forEach((k, idx) => {
-          const v = r[k];
-          if (v !== undefined && v !== null && v !== "") uniques[idx].add(String(v));
-        });
-      });
-      filterContainers.forEach((container) => {
-        const key = container.getAttribute("data-col");
-        const idx = colKeys.indexOf(key);
-        if (idx === -1) return;
-        const opts = Array.from(uniques[idx]).sort((a, b) => a.localeCompare(b, "pt-BR"));
-        buildFilter(container, opts, key);
-      });
-    };
-
-    const renderFiltered = (resetPage = true) => {
-      const filtered = allData.rows.filter((r) =>
-        colKeys.every((k) => {
-          const set = filters[k];
-          if (!set || set.size === 0) return true;
-          const val = r[k];
-          const cmp = val === null || val === undefined ? "" : String(val).toLowerCase();
-          return set.has(cmp);
-        })
-      );
-      setOptions(filtered);
-      filteredRows = filtered;
-      if (resetPage) currentPage = 1;
-      render();
-    };
-
-    if (!multiFilterClickBound) {
-      document.addEventListener("click", (ev) => {
-        if (!ev.target.closest(".mf-wrapper")) {
-          closeAllPanels();
-        }
-      });
-      multiFilterClickBound = true;
-    }
-
-    const load = async () => {
-      if (meta) meta.textContent = "Carregando...";
-      try {
-        const res = await fetch("/api/relatorios/plan20-seduc");
-        const data = await res.json();
-        if (!res.ok) throw new Error(data.error || "Falha ao carregar.");
-        allData.rows = data.data || [];
-        setOptions(allData.rows);
-        filteredRows = allData.rows;
-        render();
-        if (meta) {
-          const dt = formatAmazonLocalTime(data.data_arquivo);
-          const user = data.user_email || "-";
-          const uploaded = formatAmazonTime(data.uploaded_at);
-          meta.innerHTML = `
-            <div><strong>Última atualização</strong></div>
-            <div>Enviado por: ${user}</div>
-            <div>Upload em: ${uploaded}</div>
-            <div>Data do download: ${dt}</div>
-          `;
-        }
-      } catch (err) {
-        if (meta) meta.textContent = err.message;
-        console.error(err);
-      }
-    };
-
-    load();
-
-    if (btnReset) {
-      btnReset.addEventListener("click", () => {
-        Object.keys(filters).forEach((k) => filters[k].clear());
-        setOptions(allData.rows);
-        filteredRows = allData.rows;
-        currentPage = 1;
-        render();
-      });
-    }
-
-    if (pageSizeSelect) {
-      pageSizeSelect.addEventListener("change", () => {
-        const val = parseInt(pageSizeSelect.value || "20", 10);
-        pageSize = Number.isNaN(val) ? 20 : val;
-        currentPage = 1;
-        render();
-      });
-    }
+    const colKeys = [
+      "exercicio",
+      "numero_est",
+      "numero_emp",
+      "empenho_atual",
+      "empenho_rp",
+      "numero_ped",
+      "valor_emp",
+      "valor_est_emp_sem_aqs",
+      "valor_est_emp_com_aqs",
+      "valor_emp_liquido",
+      "uo",
+      "nome_unidade_orcamentaria",
+      "ug",
+      "nome_unidade_gestora",
+      "dotacao_orcamentaria",
+      "historico",
+      "credor",
+      "nome_credor",
+      "cpf_cnpj_credor",
+      "data_criacao",
+      "data_emissao",
+      "situacao",
+      "rp",
+    ];
 
-    if (btnDownload) {
-      btnDownload.addEventListener("click", () => {
-        window.open("/api/relatorios/plan20-seduc/download", "_blank");
-      });
-    }
+    initRelatorioRemoto({
+      table,
+      base: "/api/relatorios/est-emp",
+      colKeys,
+      meta: document.getElementById("est-emp-relatorio-meta"),
+      pager: document.getElementById("est-emp-pagination"),
+      pageSizeSelect: document.getElementById("est-emp-page-size"),
+      btnReset: document.getElementById("est-emp-reset"),
+      btnDownload: document.getElementById("est-emp-download"),
+      resumo: ["exercicio"],
+      renderLinha: (r) => `
+        <td>${r.exercicio ?? ""}</td>
+        <td>${r.numero_est ?? ""}</td>
+        <td>${r.numero_emp ?? ""}</td>
+        <td>${r.empenho_atual ?? ""}</td>
+        <td>${r.empenho_rp ?? ""}</td>
+        <td>${r.numero_ped ?? ""}</td>
+        <td class="num">${fmtNum(r.valor_emp)}</td>
+        <td class="num">${fmtNum(r.valor_est_emp_sem_aqs)}</td>
+        <td class="num">${fmtNum(r.valor_est_emp_com_aqs)}</td>
+        <td class="num">${fmtNum(r.valor_emp_liquido)}</td>
+        <td>${r.uo ?? ""}</td>
+        <td>${r.nome_unidade_orcamentaria ?? ""}</td>
+        <td>${r.ug ?? ""}</td>
+        <td>${r.nome_unidade_gestora ?? ""}</td>
+        <td>${r.dotacao_orcamentaria ?? ""}</td>
+        <td>${r.historico ?? ""}</td>
+        <td>${r.credor ?? ""}</td>
+        <td>${r.nome_credor ?? ""}</td>
+        <td>${r.cpf_cnpj_credor ?? ""}</td>
+        <td>${r.data_criacao ?? ""}</td>
+        <td>${r.data_emissao ?? ""}</td>
+        <td>${r.situacao ?? ""}</td>
+        <td>${r.rp ?? ""}</td>
+      `,
+      renderTotais: (totais, valoresFiltrados) => {
+        const exercicios = valoresFiltrados("exercicio");
+        if (totExercicio) {
+          totExercicio.textContent = exercicios.length
+            ? exercicios.slice().sort((a, b) => a.localeCompare(b, "pt-BR")).join(" | ")
+            : "-";
+        }
+        if (totValor) {
+          const totalVal = Number(totais.valor_emp_liquido || 0);
+          totValor.textContent = numFmt.format(totalVal);
+          totValor.classList.remove("pos", "neg");
+          if (totalVal > 0) totValor.classList.add("pos");
+          else if (totalVal < 0) totValor.classList.add("neg");
+        }
+      },
+    });
   }
 
-  function initRelatorioEmp() {
-    const table = document.getElementById("emp-relatorio-tabela");
-    const tbody = table ? table.querySelector("tbody") : null;
-    const meta = document.getElementById("emp-relatorio-meta");
-    const pager = document.getElementById("emp-pagination");
-    const pageSizeSelect = document.getElementById("emp-page-size");
-    const btnDownload = document.getElementById("emp-download");
-    const btnReset = document.getElementById("emp-reset");
-    const totExercicio = document.getElementById("emp-tot-exercicio");
-    const totValorEmp = document.getElementById("emp-tot-valor-emp");
-    const chaveHeader = document.getElementById("emp-col-chave");
-    if (!table || !tbody) return;
+  function initRelatorioPed() {
+    const table = document.getElementById("ped-relatorio-tabela");
+    const totExercicio = document.getElementById("ped-tot-exercicio");
+    const totValor = document.getElementById("ped-tot-valor-ped");
+    const chaveHeader = document.getElementById("ped-col-chave");
+    if (!table || !table.querySelector("tbody")) return;
     if (table.dataset.bound === "1") return;
     table.dataset.bound = "1";
 
-    let pageSize = parseInt(pageSizeSelect?.value || "20", 10) || 20;
-    let currentPage = 1;
-    let filteredRows = [];
-
     const numFmt = new Intl.NumberFormat("pt-BR", {
       minimumFractionDigits: 2,
       maximumFractionDigits: 2,
@@ -4133,15 +4179,27 @@
       "eixo",
       "politica_decreto",
       "exercicio",
-      "numero_emp",
       "numero_ped",
-      "valor_emp",
-      "devolucao_gcv",
-      "valor_emp_devolucao_gcv",
+      "numero_ped_estorno",
+      "numero_emp",
+      "numero_cad",
+      "numero_noblist",
+      "numero_os",
+      "convenio",
+      "numero_processo_orcamentario_pagamento",
+      "valor_ped",
+      "valor_estorno",
+      "indicativo_licitacao_exercicios_anteriores",
+      "data_licitacao",
+      "liberado_fisco_estadual",
+      "situacao",
       "uo",
       "nome_unidade_orcamentaria",
       "ug",
       "nome_unidade_gestora",
+      "data_solicitacao",
+      "data_criacao",
+      "tipo_empenho",
       "dotacao_orcamentaria",
       "funcao",
       "subfuncao",
@@ -4152,1990 +4210,254 @@
       "grupo",
       "modalidade",
       "elemento",
+      "nome_elemento",
       "fonte",
       "iduso",
+      "numero_emenda_ep",
+      "autor_emenda_ep",
+      "numero_cac",
+      "licitacao",
+      "usuario_responsavel",
       "historico",
-      "tipo_despesa",
       "credor",
       "nome_credor",
-      "cpf_cnpj_credor",
-      "categoria_credor",
-      "tipo_empenho",
-      "situacao",
-      "data_emissao",
-      "data_criacao",
-      "numero_contrato",
-      "numero_convenio",
-    ];
-
-    const filterContainers = table.querySelectorAll(".filter-row [data-col]");
-    const allData = { rows: [] };
-    const filters = Object.fromEntries(colKeys.map((k) => [k, new Set()]));
-    const filterControls = {};
-
-    const closeAllPanels = () => {
-      Object.values(filterControls).forEach((ctrl) => {
-        if (ctrl?.panel) ctrl.panel.classList.remove("open");
-      });
-    };
-
-    const updateDisplay = (key) => {
-      const set = filters[key] || new Set();
-      const ctrl = filterControls[key];
-      if (!ctrl) return;
-      const map = ctrl.labelMap || {};
-      if (ctrl.allCb) ctrl.allCb.checked = set.size === 0;
-      (ctrl.optionCbs || []).forEach((cb) => {
-        cb.checked = set.has(cb.dataset.val || "");
-      });
-      if (set.size === 0) {
-        ctrl.label.textContent = "(Todos)";
-      } else if (set.size <= 2) {
-        ctrl.label.textContent = Array.from(set)
-          .map((v) => map[v] || v)
-          .join(", ");
-      } else {
-        ctrl.label.textContent = `${set.size} selecionados`;
-      }
-    };
-
-    const buildFilter = (container, options, key) => {
-      container.innerHTML = "";
-      const wrap = document.createElement("div");
-      wrap.className = "mf-wrapper";
-      const display = document.createElement("button");
-      display.type = "button";
-      display.className = "mf-display";
-      const label = document.createElement("span");
-      label.textContent = "(Todos)";
-      display.appendChild(label);
-      const icon = document.createElement("i");
-      icon.className = "bi bi-chevron-down";
-      display.appendChild(icon);
-
-      const panel = document.createElement("div");
-      panel.className = "mf-panel";
-      const search = document.createElement("input");
-      search.type = "text";
-      search.className = "mf-search";
-      search.placeholder = "Buscar...";
-      const list = document.createElement("div");
-      list.className = "mf-options";
-
-      const tempSelected = new Set(filters[key] || []);
-      const allId = `${key}-all`;
-      const allRow = document.createElement("label");
-      allRow.className = "mf-option";
-      const allCb = document.createElement("input");
-      allCb.type = "checkbox";
-      allCb.id = allId;
-      allCb.dataset.val = "";
-      allRow.appendChild(allCb);
-      const allSpan = document.createElement("span");
-      allSpan.textContent = "(Todos)";
-      allRow.appendChild(allSpan);
-      list.appendChild(allRow);
-
-      const selectVisibleRow = document.createElement("label");
-      selectVisibleRow.className = "mf-option mf-select-visible";
-      const selectVisibleCb = document.createElement("input");
-      selectVisibleCb.type = "checkbox";
-      selectVisibleRow.appendChild(selectVisibleCb);
-      const selectVisibleSpan = document.createElement("span");
-      selectVisibleSpan.textContent = "Selecionar exibidos";
-      selectVisibleRow.appendChild(selectVisibleSpan);
-      list.appendChild(selectVisibleRow);
-
-      const cbs = [];
-      const labelMap = {};
-      options.forEach((opt) => {
-        const row = document.createElement("label");
-        row.className = "mf-option";
-        const cb = document.createElement("input");
-        cb.type = "checkbox";
-        const norm = String(opt || "").toLowerCase();
-        cb.dataset.val = norm;
-        labelMap[norm] = opt;
-        row.appendChild(cb);
-        const txt = document.createElement("span");
-        txt.textContent = opt;
-        row.appendChild(txt);
-        list.appendChild(row);
-        cbs.push({ cb, txt, row, val: norm });
-      });
-
-      const syncUIFromTemp = () => {
-        allCb.checked = tempSelected.size === 0;
-        cbs.forEach(({ cb, val }) => {
-          cb.checked = tempSelected.has(val);
-        });
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        const allVisibleSelected = visible.length > 0 && visible.every(({ cb }) => cb.checked);
-        selectVisibleCb.checked = allVisibleSelected;
-      };
-
-      const applyTempToFilters = () => {
-        const set = filters[key];
-        set.clear();
-        tempSelected.forEach((v) => set.add(v));
-        updateDisplay(key);
-        renderFiltered();
-      };
-
-      const closePanel = () => panel.classList.remove("open");
-
-      allCb.addEventListener("change", () => {
-        if (allCb.checked) {
-          tempSelected.clear();
-          syncUIFromTemp();
-        }
-      });
-
-      selectVisibleCb.addEventListener("change", () => {
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        if (selectVisibleCb.checked) {
-          visible.forEach(({ val }) => tempSelected.add(val));
-        } else {
-          visible.forEach(({ val }) => tempSelected.delete(val));
-        }
-        allCb.checked = tempSelected.size === 0;
-        syncUIFromTemp();
-      });
-
-      cbs.forEach(({ cb, val }) => {
-        cb.addEventListener("change", () => {
-          if (cb.checked) {
-            tempSelected.add(val);
-            allCb.checked = false;
-          } else {
-            tempSelected.delete(val);
-          }
-          syncUIFromTemp();
-        });
-      });
-
-      search.addEventListener("input", () => {
-        const term = search.value.toLowerCase();
-        cbs.forEach(({ row, txt }) => {
-          const match = txt.textContent.toLowerCase().includes(term);
-          row.style.display = match ? "" : "none";
-        });
-        const allMatch = "(todos)".includes(term) || term === "";
-        allRow.style.display = allMatch ? "" : "none";
-        selectVisibleRow.style.display = "";
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        const allVisibleSelected = visible.length > 0 && visible.every(({ cb }) => cb.checked);
-        selectVisibleCb.checked = allVisibleSelected;
-      });
-
-      const actions = document.createElement("div");
-      actions.className = "mf-actions";
-      const cancelBtn = document.createElement("button");
-      cancelBtn.type = "button";
-      cancelBtn.className = "mf-btn ghost";
-      cancelBtn.textContent = "Cancelar";
-      const applyBtn = document.createElement("button");
-      applyBtn.type = "button";
-      applyBtn.className = "mf-btn primary";
-      applyBtn.textContent = "Aplicar";
-
-      cancelBtn.addEventListener("click", () => {
-        tempSelected.clear();
-        filters[key].forEach((v) => tempSelected.add(v));
-        syncUIFromTemp();
-        closePanel();
-      });
-      applyBtn.addEventListener("click", () => {
-        applyTempToFilters();
-        closePanel();
-      });
-
-      display.addEventListener("click", () => {
-        const isOpen = panel.classList.contains("open");
-        closeAllPanels();
-        if (!isOpen) {
-          panel.style.width = "";
-          panel.style.height = "";
-          tempSelected.clear();
-          filters[key].forEach((v) => tempSelected.add(v));
-          cbs.forEach(({ row }) => (row.style.display = ""));
-          allRow.style.display = "";
-          search.value = "";
-          syncUIFromTemp();
-          panel.classList.add("open");
-        }
-      });
-
-      wrap.appendChild(display);
-      panel.appendChild(search);
-      panel.appendChild(list);
-      actions.appendChild(cancelBtn);
-      actions.appendChild(applyBtn);
-      panel.appendChild(actions);
-      wrap.appendChild(panel);
-      container.appendChild(wrap);
-
-      filterControls[key] = {
-        panel,
-        label,
-        allCb,
-        optionCbs: cbs.map((c) => c.cb),
-        labelMap,
-      };
-      updateDisplay(key);
-    };
-
-    const setOptions = (rows = allData.rows) => {
-      closeAllPanels();
-      const uniques = colKeys.map(() => new Set());
-      (rows || []).forEach((r) => {
-        colKeys.forEach((k, idx) => {
-          uniques[idx].add((r[k] ?? "").toString());
-        });
-      });
-      filterContainers.forEach((container) => {
-        const key = container.getAttribute("data-col");
-        const idx = colKeys.indexOf(key);
-        if (idx === -1) return;
-        const opts = Array.from(uniques[idx]).sort((a, b) => a.localeCompare(b, "pt-BR"));
-        buildFilter(container, opts, key);
-      });
-    };
-
-    const renderFiltered = (resetPage = true) => {
-      const filtered = allData.rows.filter((r) =>
-        colKeys.every((k) => {
-          const set = filters[k];
-          if (!set || set.size === 0) return true;
-          const val = r[k];
-          const cmp = val === null || val === undefined ? "" : String(val).toLowerCase();
-          return set.has(cmp);
-        })
-      );
-      setOptions(filtered);
-      filteredRows = filtered;
-      if (resetPage) currentPage = 1;
-      render();
-    };
-
-    const renderPagination = (totalPages) => {
-      if (!pager) return;
-      pager.innerHTML = "";
-      if (totalPages <= 1) return;
-      const addBtn = (label, page, disabled = false, active = false) => {
-        const b = document.createElement("button");
-        b.textContent = label;
-        if (disabled) b.disabled = true;
-        if (active) b.classList.add("active");
-        b.addEventListener("click", () => {
-          if (disabled || page === currentPage) return;
-          currentPage = page;
-          render();
-        });
-        pager.appendChild(b);
-      };
-      addBtn("<<", 1, currentPage === 1);
-      addBtn("<", Math.max(1, currentPage - 1), currentPage === 1);
-      const maxButtons = 5;
-      const start = Math.max(1, Math.min(currentPage - 2, totalPages - maxButtons + 1));
-      const end = Math.min(totalPages, start + maxButtons - 1);
-      for (let p = start; p <= end; p++) {
-        addBtn(String(p), p, false, p === currentPage);
-      }
-      if (end < totalPages) {
-        const ellipsis = document.createElement("span");
-        ellipsis.textContent = "...";
-        pager.appendChild(ellipsis);
-        addBtn(String(totalPages), totalPages, false, currentPage === totalPages);
-      }
-      addBtn(">", Math.min(totalPages, currentPage + 1), currentPage === totalPages);
-      addBtn(">>", totalPages, currentPage === totalPages);
-    };
-
-    const updateTotals = (rows) => {
-      const exSet = new Set();
-      let totalVal = 0;
-      rows.forEach((r) => {
-        if (r.exercicio !== undefined && r.exercicio !== null && r.exercicio !== "") {
-          exSet.add(String(r.exercicio));
-        }
-        const v = Number(r.valor_emp_devolucao_gcv || 0);
-        if (!Number.isNaN(v)) totalVal += v;
-      });
-      if (totExercicio) {
-        totExercicio.textContent = exSet.size
-          ? Array.from(exSet).sort((a, b) => a.localeCompare(b, "pt-BR")).join(" | ")
-          : "-";
-      }
-      if (totValorEmp) {
-        totValorEmp.textContent = numFmt.format(totalVal);
-        totValorEmp.classList.remove("pos", "neg");
-        if (totalVal > 0) totValorEmp.classList.add("pos");
-        else if (totalVal < 0) totValorEmp.classList.add("neg");
-      }
-    };
-
-    const render = () => {
-      const rows = filteredRows;
-      const totalPages = Math.max(1, Math.ceil(rows.length / pageSize));
-      if (currentPage > totalPages) currentPage = totalPages;
-      const startIdx = (currentPage - 1) * pageSize;
-      const pageRows = rows.slice(startIdx, startIdx + pageSize);
-
-      tbody.innerHTML = "";
-      pageRows.forEach((r) => {
-        const tr = document.createElement("tr");
-        tr.innerHTML = `
-          <td>${r.chave_display ?? ""}</td>
-          <td>${r.regiao ?? ""}</td>
-          <td>${r.subfuncao_ug ?? ""}</td>
-          <td>${r.adj ?? ""}</td>
-          <td>${r.macropolitica ?? ""}</td>
-          <td>${r.pilar ?? ""}</td>
-          <td>${r.eixo ?? ""}</td>
-          <td>${r.politica_decreto ?? ""}</td>
-          <td>${r.exercicio ?? ""}</td>
-          <td>${r.numero_emp ?? ""}</td>
-          <td>${r.numero_ped ?? ""}</td>
-          <td class="num">${fmtNum(r.valor_emp)}</td>
-          <td class="num">${fmtNum(r.devolucao_gcv)}</td>
-          <td class="num">${fmtNum(r.valor_emp_devolucao_gcv)}</td>
-          <td>${r.uo ?? ""}</td>
-          <td>${r.nome_unidade_orcamentaria ?? ""}</td>
-          <td>${r.ug ?? ""}</td>
-          <td>${r.nome_unidade_gestora ?? ""}</td>
-          <td>${r.dotacao_orcamentaria ?? ""}</td>
-          <td>${r.funcao ?? ""}</td>
-          <td>${r.subfuncao ?? ""}</td>
-          <td>${r.programa_governo ?? ""}</td>
-          <td>${r.paoe ?? ""}</td>
-          <td>${r.natureza_despesa ?? ""}</td>
-          <td>${r.cat_econ ?? ""}</td>
-          <td>${r.grupo ?? ""}</td>
-          <td>${r.modalidade ?? ""}</td>
-          <td>${r.elemento ?? ""}</td>
-          <td>${r.fonte ?? ""}</td>
-          <td>${r.iduso ?? ""}</td>
-          <td>${r.historico ?? ""}</td>
-          <td>${r.tipo_despesa ?? ""}</td>
-          <td>${r.credor ?? ""}</td>
-          <td>${r.nome_credor ?? ""}</td>
-          <td>${r.cpf_cnpj_credor ?? ""}</td>
-          <td>${r.categoria_credor ?? ""}</td>
-          <td>${r.tipo_empenho ?? ""}</td>
-          <td>${r.situacao ?? ""}</td>
-          <td>${r.data_emissao ?? ""}</td>
-          <td>${r.data_criacao ?? ""}</td>
-          <td>${r.numero_contrato ?? ""}</td>
-          <td>${r.numero_convenio ?? ""}</td>
-        `;
-        tbody.appendChild(tr);
-      });
-
-      renderPagination(totalPages);
-      updateTotals(rows);
-    };
-
-    const load = async () => {
-      if (meta) meta.textContent = "Carregando...";
-      try {
-        const res = await fetch("/api/relatorios/emp");
-        const data = await res.json();
-        if (!res.ok) throw new Error(data.error || "Falha ao carregar.");
-          allData.rows = (data.data || []).map((r) => {
-            const chaveDisplay = r.chave || r.chave_planejamento || "";
-            return { ...r, chave_display: chaveDisplay };
-          });
-        filteredRows = allData.rows;
-        setOptions(allData.rows);
-        render();
-        if (meta) {
-          const dt = formatAmazonLocalTime(data.data_arquivo);
-          const user = data.user_email || "-";
-          const uploaded = formatAmazonTime(data.uploaded_at);
-          meta.innerHTML = `
-            <div><strong>Última atualização</strong></div>
-            <div>Enviado por: ${user}</div>
-            <div>Upload em: ${uploaded}</div>
-            <div>Data do download: ${dt}</div>
-          `;
-        }
-        if (chaveHeader) {
-          chaveHeader.textContent = "Chave de Planejamento/Chave";
-        }
-      } catch (err) {
-        if (meta) meta.textContent = err.message;
-        console.error(err);
-      }
-    };
-
-    if (pageSizeSelect) {
-      pageSizeSelect.addEventListener("change", () => {
-        pageSize = parseInt(pageSizeSelect.value || "20", 10) || 20;
-        render();
-      });
-    }
-
-    if (btnDownload) {
-      btnDownload.addEventListener("click", () => {
-        window.open("/api/relatorios/emp/download", "_blank");
-      });
-    }
-
-    if (btnReset) {
-      btnReset.addEventListener("click", () => {
-        closeAllPanels();
-        Object.keys(filters).forEach((k) => filters[k].clear());
-        setOptions(allData.rows);
-        filteredRows = allData.rows;
-        currentPage = 1;
-        render();
-      });
-    }
-
-    if (!multiFilterClickBound) {
-      document.addEventListener("click", (ev) => {
-        if (!ev.target.closest(".mf-wrapper")) {
-          closeAllPanels();
-        }
-      });
-      multiFilterClickBound = true;
-    }
-
-    load();
-  }
-
-  function initRelatorioEstEmp() {
-    const table = document.getElementById("est-emp-relatorio-tabela");
-    const tbody = table ? table.querySelector("tbody") : null;
-    const meta = document.getElementById("est-emp-relatorio-meta");
-    const pager = document.getElementById("est-emp-pagination");
-    const pageSizeSelect = document.getElementById("est-emp-page-size");
-    const btnDownload = document.getElementById("est-emp-download");
-    const btnReset = document.getElementById("est-emp-reset");
-    const totExercicio = document.getElementById("est-emp-tot-exercicio");
-    const totValor = document.getElementById("est-emp-tot-valor-est-emp");
-    if (!table || !tbody) return;
-    if (table.dataset.bound === "1") return;
-    table.dataset.bound = "1";
-
-    let pageSize = parseInt(pageSizeSelect?.value || "20", 10) || 20;
-    let currentPage = 1;
-    let filteredRows = [];
-
-    const numFmt = new Intl.NumberFormat("pt-BR", {
-      minimumFractionDigits: 2,
-      maximumFractionDigits: 2,
-    });
-    const fmtNum = (v) => {
-      const n = Number(v);
-      if (Number.isNaN(n)) return v ?? "";
-      return numFmt.format(n);
-    };
-
-    const colKeys = [
-      "exercicio",
-      "numero_est",
-      "numero_emp",
-      "empenho_atual",
-      "empenho_rp",
-      "numero_ped",
-      "valor_emp",
-      "valor_est_emp_sem_aqs",
-      "valor_est_emp_com_aqs",
-      "valor_emp_liquido",
-      "uo",
-      "nome_unidade_orcamentaria",
-      "ug",
-      "nome_unidade_gestora",
-      "dotacao_orcamentaria",
-      "historico",
-      "credor",
-      "nome_credor",
-      "cpf_cnpj_credor",
-      "data_criacao",
-      "data_emissao",
-      "situacao",
-      "rp",
-    ];
-
-    const filterContainers = table.querySelectorAll(".filter-row [data-col]");
-    const allData = { rows: [] };
-    const filters = Object.fromEntries(colKeys.map((k) => [k, new Set()]));
-    const filterControls = {};
-
-    const closeAllPanels = () => {
-      Object.values(filterControls).forEach((ctrl) => {
-        if (ctrl?.panel) ctrl.panel.classList.remove("open");
-      });
-    };
-
-    const updateDisplay = (key) => {
-      const set = filters[key] || new Set();
-      const ctrl = filterControls[key];
-      if (!ctrl) return;
-      const map = ctrl.labelMap || {};
-      if (ctrl.allCb) ctrl.allCb.checked = set.size === 0;
-      (ctrl.optionCbs || []).forEach((cb) => {
-        cb.checked = set.has(cb.dataset.val || "");
-      });
-      if (set.size === 0) {
-        ctrl.label.textContent = "(Todos)";
-      } else if (set.size <= 2) {
-        ctrl.label.textContent = Array.from(set)
-          .map((v) => map[v] || v)
-          .join(", ");
-      } else {
-        ctrl.label.textContent = `${set.size} selecionados`;
-      }
-    };
-
-    const buildFilter = (container, options, key) => {
-      container.innerHTML = "";
-      const wrap = document.createElement("div");
-      wrap.className = "mf-wrapper";
-      const display = document.createElement("button");
-      display.type = "button";
-      display.className = "mf-display";
-      const label = document.createElement("span");
-      label.textContent = "(Todos)";
-      display.appendChild(label);
-      const icon = document.createElement("i");
-      icon.className = "bi bi-chevron-down";
-      display.appendChild(icon);
-
-      const panel = document.createElement("div");
-      panel.className = "mf-panel";
-      const search = document.createElement("input");
-      search.type = "text";
-      search.className = "mf-search";
-      search.placeholder = "Buscar...";
-      const list = document.createElement("div");
-      list.className = "mf-options";
-
-      const tempSelected = new Set(filters[key] || []);
-      const allId = `${key}-all`;
-      const allRow = document.createElement("label");
-      allRow.className = "mf-option";
-      const allCb = document.createElement("input");
-      allCb.type = "checkbox";
-      allCb.id = allId;
-      allCb.dataset.val = "";
-      allRow.appendChild(allCb);
-      const allSpan = document.createElement("span");
-      allSpan.textContent = "(Todos)";
-      allRow.appendChild(allSpan);
-      list.appendChild(allRow);
-
-      const selectVisibleRow = document.createElement("label");
-      selectVisibleRow.className = "mf-option mf-select-visible";
-      const selectVisibleCb = document.createElement("input");
-      selectVisibleCb.type = "checkbox";
-      selectVisibleRow.appendChild(selectVisibleCb);
-      const selectVisibleSpan = document.createElement("span");
-      selectVisibleSpan.textContent = "Selecionar exibidos";
-      selectVisibleRow.appendChild(selectVisibleSpan);
-      list.appendChild(selectVisibleRow);
-
-      const cbs = [];
-      const labelMap = {};
-      options.forEach((opt) => {
-        const row = document.createElement("label");
-        row.className = "mf-option";
-        const cb = document.createElement("input");
-        cb.type = "checkbox";
-        const norm = String(opt || "").toLowerCase();
-        cb.dataset.val = norm;
-        labelMap[norm] = opt;
-        row.appendChild(cb);
-        const txt = document.createElement("span");
-        txt.textContent = opt;
-        row.appendChild(txt);
-        list.appendChild(row);
-        cbs.push({ cb, txt, row, val: norm });
-      });
-
-      const syncUIFromTemp = () => {
-        allCb.checked = tempSelected.size === 0;
-        cbs.forEach(({ cb, val }) => {
-          cb.checked = tempSelected.has(val);
-        });
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        const allVisibleSelected = visible.length > 0 && visible.every(({ cb }) => cb.checked);
-        selectVisibleCb.checked = allVisibleSelected;
-      };
-
-      const applyTempToFilters = () => {
-        const set = filters[key];
-        set.clear();
-        tempSelected.forEach((v) => set.add(v));
-        updateDisplay(key);
-        renderFiltered();
-      };
-
-      const closePanel = () => panel.classList.remove("open");
-
-      allCb.addEventListener("change", () => {
-        if (allCb.checked) {
-          tempSelected.clear();
-          syncUIFromTemp();
-        }
-      });
-
-      selectVisibleCb.addEventListener("change", () => {
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        if (selectVisibleCb.checked) {
-          visible.forEach(({ val }) => tempSelected.add(val));
-        } else {
-          visible.forEach(({ val }) => tempSelected.delete(val));
-        }
-        allCb.checked = tempSelected.size === 0;
-        syncUIFromTemp();
-      });
-
-      cbs.forEach(({ cb, val }) => {
-        cb.addEventListener("change", () => {
-          if (cb.checked) {
-            tempSelected.add(val);
-            allCb.checked = false;
-          } else {
-            tempSelected.delete(val);
-          }
-          syncUIFromTemp();
-        });
-      });
-
-      search.addEventListener("input", () => {
-        const term = search.value.toLowerCase();
-        cbs.forEach(({ row, txt }) => {
-          const match = txt.textContent.toLowerCase().includes(term);
-          row.style.display = match ? "" : "none";
-        });
-        const allMatch = "(todos)".includes(term) || term === "";
-        allRow.style.display = allMatch ? "" : "none";
-        selectVisibleRow.style.display = "";
-        syncUIFromTemp();
-      });
-
-      const actions = document.createElement("div");
-      actions.className = "mf-actions";
-      const cancelBtn = document.createElement("button");
-      cancelBtn.type = "button";
-      cancelBtn.className = "mf-btn ghost";
-      cancelBtn.textContent = "Cancelar";
-      const applyBtn = document.createElement("button");
-      applyBtn.type = "button";
-      applyBtn.className = "mf-btn primary";
-      applyBtn.textContent = "Aplicar";
-
-      cancelBtn.addEventListener("click", () => {
-        tempSelected.clear();
-        filters[key].forEach((v) => tempSelected.add(v));
-        syncUIFromTemp();
-        closePanel();
-      });
-      applyBtn.addEventListener("click", () => {
-        applyTempToFilters();
-        closePanel();
-      });
-
-      display.addEventListener("click", () => {
-        const isOpen = panel.classList.contains("open");
-        closeAllPanels();
-        if (!isOpen) {
-          panel.style.width = "";
-          panel.style.height = "";
-          tempSelected.clear();
-          filters[key].forEach((v) => tempSelected.add(v));
-          cbs.forEach(({ row }) => (row.style.display = ""));
-          allRow.style.display = "";
-          search.value = "";
-          syncUIFromTemp();
-          panel.classList.add("open");
-        }
-      });
-
-      wrap.appendChild(display);
-      panel.appendChild(search);
-      panel.appendChild(list);
-      actions.appendChild(cancelBtn);
-      actions.appendChild(applyBtn);
-      panel.appendChild(actions);
-      wrap.appendChild(panel);
-      container.appendChild(wrap);
-
-      filterControls[key] = {
-        panel,
-        label,
-        allCb,
-        optionCbs: cbs.map((c) => c.cb),
-        labelMap,
-      };
-      updateDisplay(key);
-    };
-
-    const setOptions = (rows = allData.rows) => {
-      closeAllPanels();
-      const uniques = colKeys.map(() => new Set());
-      (rows || []).forEach((r) => {
-        colKeys.forEach((k, idx) => {
-          const v = r[k];
-          if (v !== undefined && v !== null && v !== "") uniques[idx].add(String(v));
-        });
-      });
-      filterContainers.forEach((container) => {
-        const key = container.getAttribute("data-col");
-        const idx = colKeys.indexOf(key);
-        if (idx === -1) return;
-        const opts = Array.from(uniques[idx]).sort((a, b) => a.localeCompare(b, "pt-BR"));
-        buildFilter(container, opts, key);
-      });
-    };
-
-    const updateTotals = (rows) => {
-      const exSet = new Set();
-      let totalVal = 0;
-      rows.forEach((r) => {
-        if (r.exercicio !== undefined && r.exercicio !== null && r.exercicio !== "") {
-          exSet.add(String(r.exercicio));
-        }
-        const v = Number(r.valor_emp_liquido || 0);
-        if (!Number.isNaN(v)) totalVal += v;
-      });
-      if (totExercicio) {
-        totExercicio.textContent = exSet.size
-          ? Array.from(exSet).sort((a, b) => a.localeCompare(b, "pt-BR")).join(" | ")
-          : "-";
-      }
-      if (totValor) {
-        totValor.textContent = numFmt.format(totalVal);
-        totValor.classList.remove("pos", "neg");
-        if (totalVal > 0) totValor.classList.add("pos");
-        else if (totalVal < 0) totValor.classList.add("neg");
-      }
-    };
-
-    const renderPagination = (totalPages) => {
-      if (!pager) return;
-      pager.innerHTML = "";
-
-      const addBtn = (label, page, disabled, active = false) => {
-        const btn = document.createElement("button");
-        btn.type = "button";
-        btn.className = "page-btn";
-        if (active) btn.classList.add("active");
-        btn.disabled = disabled;
-        btn.textContent = label;
-        btn.addEventListener("click", () => {
-          currentPage = page;
-          render();
-        });
-        pager.appendChild(btn);
-      };
-
-      addBtn("<<", 1, currentPage === 1);
-      addBtn("<", Math.max(1, currentPage - 1), currentPage === 1);
-
-      const maxBtns = 5;
-      let startPage = Math.max(1, currentPage - Math.floor(maxBtns / 2));
-      let endPage = Math.min(totalPages, startPage + maxBtns - 1);
-      if (endPage - startPage + 1 < maxBtns) {
-        startPage = Math.max(1, endPage - maxBtns + 1);
-      }
-
-      if (startPage > 1) {
-        addBtn("1", 1, false, currentPage === 1);
-        if (startPage > 2) {
-          const ellipsis = document.createElement("span");
-          ellipsis.textContent = "...";
-          pager.appendChild(ellipsis);
-        }
-      }
-
-      for (let p = startPage; p <= endPage; p += 1) {
-        addBtn(String(p), p, false, currentPage === p);
-      }
-
-      if (endPage < totalPages) {
-        if (endPage < totalPages - 1) {
-          const ellipsis = document.createElement("span");
-          ellipsis.textContent = "...";
-          pager.appendChild(ellipsis);
-        }
-        addBtn(String(totalPages), totalPages, false, currentPage === totalPages);
-      }
-
-      addBtn(">", Math.min(totalPages, currentPage + 1), currentPage === totalPages);
-      addBtn(">>", totalPages, currentPage === totalPages);
-    };
-
-    const render = () => {
-      const rows = filteredRows;
-      const totalPages = Math.max(1, Math.ceil(rows.length / pageSize));
-      if (currentPage > totalPages) currentPage = totalPages;
-      const startIdx = (currentPage - 1) * pageSize;
-      const pageRows = rows.slice(startIdx, startIdx + pageSize);
-
-      tbody.innerHTML = "";
-      pageRows.forEach((r) => {
-        const tr = document.createElement("tr");
-        tr.innerHTML = `
-          <td>${r.exercicio ?? ""}</td>
-          <td>${r.numero_est ?? ""}</td>
-          <td>${r.numero_emp ?? ""}</td>
-          <td>${r.empenho_atual ?? ""}</td>
-          <td>${r.empenho_rp ?? ""}</td>
-          <td>${r.numero_ped ?? ""}</td>
-          <td class="num">${fmtNum(r.valor_emp)}</td>
-          <td class="num">${fmtNum(r.valor_est_emp_sem_aqs)}</td>
-          <td class="num">${fmtNum(r.valor_est_emp_com_aqs)}</td>
-          <td class="num">${fmtNum(r.valor_emp_liquido)}</td>
-          <td>${r.uo ?? ""}</td>
-          <td>${r.nome_unidade_orcamentaria ?? ""}</td>
-          <td>${r.ug ?? ""}</td>
-          <td>${r.nome_unidade_gestora ?? ""}</td>
-          <td>${r.dotacao_orcamentaria ?? ""}</td>
-          <td>${r.historico ?? ""}</td>
-          <td>${r.credor ?? ""}</td>
-          <td>${r.nome_credor ?? ""}</td>
-          <td>${r.cpf_cnpj_credor ?? ""}</td>
-          <td>${r.data_criacao ?? ""}</td>
-          <td>${r.data_emissao ?? ""}</td>
-          <td>${r.situacao ?? ""}</td>
-          <td>${r.rp ?? ""}</td>
-        `;
-        tbody.appendChild(tr);
-      });
-
-      renderPagination(totalPages);
-      updateTotals(rows);
-    };
-
-    const renderFiltered = (resetPage = true) => {
-      const filtered = allData.rows.filter((r) =>
-        colKeys.every((k) => {
-          const set = filters[k];
-          if (!set || set.size === 0) return true;
-          const val = r[k];
-          const cmp = val === null || val === undefined ? "" : String(val).toLowerCase();
-          return set.has(cmp);
-        })
-      );
-      setOptions(filtered);
-      filteredRows = filtered;
-      if (resetPage) currentPage = 1;
-      render();
-    };
-
-    if (!multiFilterClickBound) {
-      document.addEventListener("click", (ev) => {
-        if (!ev.target.closest(".mf-wrapper")) {
-          closeAllPanels();
-        }
-      });
-      multiFilterClickBound = true;
-    }
-
-    const load = async () => {
-      if (meta) meta.textContent = "Carregando...";
-      try {
-        const res = await fetch("/api/relatorios/est-emp");
-        const data = await res.json();
-        if (!res.ok) throw new Error(data.error || "Falha ao carregar.");
-        allData.rows = data.data || [];
-        setOptions(allData.rows);
-        filteredRows = allData.rows;
-        render();
-        if (meta) {
-          const dt = formatAmazonLocalTime(data.data_arquivo);
-          const user = data.user_email || "-";
-          const uploaded = formatAmazonTime(data.uploaded_at);
-          meta.innerHTML = `
-            <div><strong>Última atualização</strong></div>
-            <div>Enviado por: ${user}</div>
-            <div>Upload em: ${uploaded}</div>
-            <div>Data do download: ${dt}</div>
-          `;
-        }
-      } catch (err) {
-        if (meta) meta.textContent = err.message;
-        console.error(err);
-      }
-    };
-
-    load();
-
-    if (btnReset) {
-      btnReset.addEventListener("click", () => {
-        Object.keys(filters).forEach((k) => filters[k].clear());
-        setOptions(allData.rows);
-        filteredRows = allData.rows;
-        currentPage = 1;
-        render();
-      });
-    }
-
-    if (pageSizeSelect) {
-      pageSizeSelect.addEventListener("change", () => {
-        const val = parseInt(pageSizeSelect.value || "20", 10);
-        pageSize = Number.isNaN(val) ? 20 : val;
-        currentPage = 1;
-        render();
-      });
-    }
-
-    if (btnDownload) {
-      btnDownload.addEventListener("click", () => {
-        window.open("/api/relatorios/est-emp/download", "_blank");
-      });
-    }
-  }
-
-  function initRelatorioPed() {
-    const table = document.getElementById("ped-relatorio-tabela");
-    const tbody = table ? table.querySelector("tbody") : null;
-    const meta = document.getElementById("ped-relatorio-meta");
-    const pager = document.getElementById("ped-pagination");
-    const pageSizeSelect = document.getElementById("ped-page-size");
-    const btnDownload = document.getElementById("ped-download");
-    const btnReset = document.getElementById("ped-reset");
-    const totExercicio = document.getElementById("ped-tot-exercicio");
-    const totValorPed = document.getElementById("ped-tot-valor-ped");
-    const chaveHeader = document.getElementById("ped-col-chave");
-    if (!table || !tbody) return;
-    if (table.dataset.bound === "1") return;
-    table.dataset.bound = "1";
-
-    let pageSize = parseInt(pageSizeSelect?.value || "20", 10) || 20;
-    let currentPage = 1;
-    let filteredRows = [];
-
-    const numFmt = new Intl.NumberFormat("pt-BR", {
-      minimumFractionDigits: 2,
-      maximumFractionDigits: 2,
-    });
-    const fmtNum = (v) => {
-      const n = Number(v);
-      if (Number.isNaN(n)) return v ?? "";
-      return numFmt.format(n);
-    };
-
-    const colKeys = [
-      "chave_display",
-      "regiao",
-      "subfuncao_ug",
-      "adj",
-      "macropolitica",
-      "pilar",
-      "eixo",
-      "politica_decreto",
-      "exercicio",
-      "numero_ped",
-      "numero_ped_estorno",
-      "numero_emp",
-      "numero_cad",
-      "numero_noblist",
-      "numero_os",
-      "convenio",
-      "numero_processo_orcamentario_pagamento",
-      "valor_ped",
-      "valor_estorno",
-      "indicativo_licitacao_exercicios_anteriores",
-      "data_licitacao",
-      "liberado_fisco_estadual",
-      "situacao",
-      "uo",
-      "nome_unidade_orcamentaria",
-      "ug",
-      "nome_unidade_gestora",
-      "data_solicitacao",
-      "data_criacao",
-      "tipo_empenho",
-      "dotacao_orcamentaria",
-      "funcao",
-      "subfuncao",
-      "programa_governo",
-      "paoe",
-      "natureza_despesa",
-      "cat_econ",
-      "grupo",
-      "modalidade",
-      "elemento",
-      "nome_elemento",
-      "fonte",
-      "iduso",
-      "numero_emenda_ep",
-      "autor_emenda_ep",
-      "numero_cac",
-      "licitacao",
-      "usuario_responsavel",
-      "historico",
-      "credor",
-      "nome_credor",
-      "data_autorizacao",
-      "data_hora_cadastro_autorizacao",
-      "tipo_despesa",
-      "numero_abj",
-      "numero_processo_sequestro_judicial",
-      "indicativo_entrega_imediata",
-      "indicativo_contrato",
-      "codigo_uo_extinta",
-      "devolucao_gcv",
-      "mes_competencia_folha_pagamento",
-      "exercicio_competencia_folha",
-      "obrigacao_patronal",
-      "tipo_obrigacao_patronal",
-      "numero_nla",
-    ];
-
-    const filterContainers = table.querySelectorAll(".filter-row [data-col]");
-    const allData = { rows: [] };
-    const filters = Object.fromEntries(colKeys.map((k) => [k, new Set()]));
-    const filterControls = {};
-
-    const closeAllPanels = () => {
-      Object.values(filterControls).forEach((ctrl) => {
-        if (ctrl?.panel) ctrl.panel.classList.remove("open");
-      });
-    };
-
-    const updateDisplay = (key) => {
-      const set = filters[key] || new Set();
-      const ctrl = filterControls[key];
-      if (!ctrl) return;
-      const map = ctrl.labelMap || {};
-      if (ctrl.allCb) ctrl.allCb.checked = set.size === 0;
-      (ctrl.optionCbs || []).forEach((cb) => {
-        cb.checked = set.has(cb.dataset.val || "");
-      });
-      if (set.size === 0) {
-        ctrl.label.textContent = "(Todos)";
-      } else if (set.size <= 2) {
-        ctrl.label.textContent = Array.from(set)
-          .map((v) => map[v] || v)
-          .join(", ");
-      } else {
-        ctrl.label.textContent = `${set.size} selecionados`;
-      }
-    };
-
-    const buildFilter = (container, options, key) => {
-      container.innerHTML = "";
-      const wrap = document.createElement("div");
-      wrap.className = "mf-wrapper";
-      const display = document.createElement("button");
-      display.type = "button";
-      display.className = "mf-display";
-      const label = document.createElement("span");
-      label.textContent = "(Todos)";
-      display.appendChild(label);
-      const icon = document.createElement("i");
-      icon.className = "bi bi-chevron-down";
-      display.appendChild(icon);
-
-      const panel = document.createElement("div");
-      panel.className = "mf-panel";
-      const search = document.createElement("input");
-      search.type = "text";
-      search.className = "mf-search";
-      search.placeholder = "Buscar...";
-      const list = document.createElement("div");
-      list.className = "mf-options";
-
-      const tempSelected = new Set(filters[key] || []);
-      const allId = `${key}-all`;
-      const allRow = document.createElement("label");
-      allRow.className = "mf-option";
-      const allCb = document.createElement("input");
-      allCb.type = "checkbox";
-      allCb.id = allId;
-      allCb.dataset.val = "";
-      allRow.appendChild(allCb);
-      const allSpan = document.createElement("span");
-      allSpan.textContent = "(Todos)";
-      allRow.appendChild(allSpan);
-      list.appendChild(allRow);
-
-      const selectVisibleRow = document.createElement("label");
-      selectVisibleRow.className = "mf-option mf-select-visible";
-      const selectVisibleCb = document.createElement("input");
-      selectVisibleCb.type = "checkbox";
-      selectVisibleRow.appendChild(selectVisibleCb);
-      const selectVisibleSpan = document.createElement("span");
-      selectVisibleSpan.textContent = "Selecionar exibidos";
-      selectVisibleRow.appendChild(selectVisibleSpan);
-      list.appendChild(selectVisibleRow);
-
-      const cbs = [];
-      const labelMap = {};
-      options.forEach((opt) => {
-        const row = document.createElement("label");
-        row.className = "mf-option";
-        const cb = document.createElement("input");
-        cb.type = "checkbox";
-        const norm = String(opt || "").toLowerCase();
-        cb.dataset.val = norm;
-        labelMap[norm] = opt;
-        row.appendChild(cb);
-        const txt = document.createElement("span");
-        txt.textContent = opt;
-        row.appendChild(txt);
-        list.appendChild(row);
-        cbs.push({ cb, txt, row, val: norm });
-      });
-
-      const syncUIFromTemp = () => {
-        allCb.checked = tempSelected.size === 0;
-        cbs.forEach(({ cb, val }) => {
-          cb.checked = tempSelected.has(val);
-        });
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        const allVisibleSelected = visible.length > 0 && visible.every(({ cb }) => cb.checked);
-        selectVisibleCb.checked = allVisibleSelected;
-      };
-
-      const applyTempToFilters = () => {
-        const set = filters[key];
-        set.clear();
-        tempSelected.forEach((v) => set.add(v));
-        updateDisplay(key);
-        renderFiltered();
-      };
-
-      const closePanel = () => panel.classList.remove("open");
-
-      allCb.addEventListener("change", () => {
-        if (allCb.checked) {
-          tempSelected.clear();
-          syncUIFromTemp();
-        }
-      });
-
-      selectVisibleCb.addEventListener("change", () => {
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        if (selectVisibleCb.checked) {
-          visible.forEach(({ val }) => tempSelected.add(val));
-        } else {
-          visible.forEach(({ val }) => tempSelected.delete(val));
-        }
-        allCb.checked = tempSelected.size === 0;
-        syncUIFromTemp();
-      });
-
-      cbs.forEach(({ cb, val }) => {
-        cb.addEventListener("change", () => {
-          if (cb.checked) {
-            tempSelected.add(val);
-            allCb.checked = false;
-          } else {
-            tempSelected.delete(val);
-          }
-          syncUIFromTemp();
-        });
-      });
-
-      search.addEventListener("input", () => {
-        const term = search.value.toLowerCase();
-        cbs.forEach(({ row, txt }) => {
-          const match = txt.textContent.toLowerCase().includes(term);
-          row.style.display = match ? "" : "none";
-        });
-        const allMatch = "(todos)".includes(term) || term === "";
-        allRow.style.display = allMatch ? "" : "none";
-        selectVisibleRow.style.display = "";
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        const allVisibleSelected = visible.length > 0 && visible.every(({ cb }) => cb.checked);
-        selectVisibleCb.checked = allVisibleSelected;
-      });
-
-      const actions = document.createElement("div");
-      actions.className = "mf-actions";
-      const cancelBtn = document.createElement("button");
-      cancelBtn.type = "button";
-      cancelBtn.className = "mf-btn ghost";
-      cancelBtn.textContent = "Cancelar";
-      const applyBtn = document.createElement("button");
-      applyBtn.type = "button";
-      applyBtn.className = "mf-btn primary";
-      applyBtn.textContent = "Aplicar";
-
-      cancelBtn.addEventListener("click", () => {
-        tempSelected.clear();
-        filters[key].forEach((v) => tempSelected.add(v));
-        syncUIFromTemp();
-        closePanel();
-      });
-      applyBtn.addEventListener("click", () => {
-        applyTempToFilters();
-        closePanel();
-      });
-
-      display.addEventListener("click", () => {
-        const isOpen = panel.classList.contains("open");
-        closeAllPanels();
-        if (!isOpen) {
-          panel.style.width = "";
-          panel.style.height = "";
-          tempSelected.clear();
-          filters[key].forEach((v) => tempSelected.add(v));
-          cbs.forEach(({ row }) => (row.style.display = ""));
-          allRow.style.display = "";
-          search.value = "";
-          syncUIFromTemp();
-          panel.classList.add("open");
-        }
-      });
-
-      wrap.appendChild(display);
-      panel.appendChild(search);
-      panel.appendChild(list);
-      actions.appendChild(cancelBtn);
-      actions.appendChild(applyBtn);
-      panel.appendChild(actions);
-      wrap.appendChild(panel);
-      container.appendChild(wrap);
-
-      filterControls[key] = {
-        panel,
-        label,
-        allCb,
-        optionCbs: cbs.map((c) => c.cb),
-        labelMap,
-      };
-      updateDisplay(key);
-    };
-
-    const setOptions = (rows = allData.rows) => {
-      closeAllPanels();
-      const uniques = colKeys.map(() => new Set());
-      (rows || []).forEach((r) => {
-        colKeys.forEach((k, idx) => {
-          uniques[idx].add((r[k] ?? "").toString());
-        });
-      });
-      filterContainers.forEach((container) => {
-        const key = container.getAttribute("data-col");
-        const idx = colKeys.indexOf(key);
-        if (idx === -1) return;
-        const opts = Array.from(uniques[idx]).sort((a, b) => a.localeCompare(b, "pt-BR"));
-        buildFilter(container, opts, key);
-      });
-    };
-
-    const renderFiltered = (resetPage = true) => {
-      const filtered = allData.rows.filter((r) =>
-        colKeys.every((k) => {
-          const set = filters[k];
-          if (!set || set.size === 0) return true;
-          const val = r[k];
-          const cmp = val === null || val === undefined ? "" : String(val).toLowerCase();
-          return set.has(cmp);
-        })
-      );
-      setOptions(filtered);
-      filteredRows = filtered;
-      if (resetPage) currentPage = 1;
-      render();
-    };
-
-    const renderPagination = (totalPages) => {
-      if (!pager) return;
-      pager.innerHTML = "";
-      if (totalPages <= 1) return;
-      const addBtn = (label, page, disabled = false, active = false) => {
-        const b = document.createElement("button");
-        b.textContent = label;
-        if (disabled) b.disabled = true;
-        if (active) b.classList.add("active");
-        b.addEventListener("click", () => {
-          if (disabled || page === currentPage) return;
-          currentPage = page;
-          render();
-        });
-        pager.appendChild(b);
-      };
-      addBtn("<<", 1, currentPage === 1);
-      addBtn("<", Math.max(1, currentPage - 1), currentPage === 1);
-      const maxButtons = 5;
-      const start = Math.max(1, Math.min(currentPage - 2, totalPages - maxButtons + 1));
-      const end = Math.min(totalPages, start + maxButtons - 1);
-      for (let p = start; p <= end; p++) {
-        addBtn(String(p), p, false, p === currentPage);
-      }
-      if (end < totalPages) {
-        const ellipsis = document.createElement("span");
-        ellipsis.textContent = "...";
-        pager.appendChild(ellipsis);
-        addBtn(String(totalPages), totalPages, false, currentPage === totalPages);
-      }
-      addBtn(">", Math.min(totalPages, currentPage + 1), currentPage === totalPages);
-      addBtn(">>", totalPages, currentPage === totalPages);
-    };
-
-    const updateTotals = (rows) => {
-      const exSet = new Set();
-      let totalVal = 0;
-      rows.forEach((r) => {
-        if (r.exercicio !== undefined && r.exercicio !== null && r.exercicio !== "") {
-          exSet.add(String(r.exercicio));
-        }
-        const v = Number(r.valor_ped || 0);
-        if (!Number.isNaN(v)) totalVal += v;
-      });
-      if (totExercicio) {
-        totExercicio.textContent = exSet.size
-          ? Array.from(exSet).sort((a, b) => a.localeCompare(b, "pt-BR")).join(" | ")
-          : "-";
-      }
-      if (totValorPed) {
-        totValorPed.textContent = numFmt.format(totalVal);
-        totValorPed.classList.remove("pos", "neg");
-        if (totalVal > 0) totValorPed.classList.add("pos");
-        else if (totalVal < 0) totValorPed.classList.add("neg");
-      }
-    };
-
-    const render = () => {
-      const rows = filteredRows;
-      const totalPages = Math.max(1, Math.ceil(rows.length / pageSize));
-      if (currentPage > totalPages) currentPage = totalPages;
-      const startIdx = (currentPage - 1) * pageSize;
-      const pageRows = rows.slice(startIdx, startIdx + pageSize);
-
-      tbody.innerHTML = "";
-      pageRows.forEach((r) => {
-        const tr = document.createElement("tr");
-        tr.innerHTML = `
-          <td>${r.chave_display ?? ""}</td>
-          <td>${r.regiao ?? ""}</td>
-          <td>${r.subfuncao_ug ?? ""}</td>
-          <td>${r.adj ?? ""}</td>
-          <td>${r.macropolitica ?? ""}</td>
-          <td>${r.pilar ?? ""}</td>
-          <td>${r.eixo ?? ""}</td>
-          <td>${r.politica_decreto ?? ""}</td>
-          <td>${r.exercicio ?? ""}</td>
-          <td>${r.numero_ped ?? ""}</td>
-          <td>${r.numero_ped_estorno ?? ""}</td>
-          <td>${r.numero_emp ?? ""}</td>
-          <td>${r.numero_cad ?? ""}</td>
-          <td>${r.numero_noblist ?? ""}</td>
-          <td>${r.numero_os ?? ""}</td>
-          <td>${r.convenio ?? ""}</td>
-          <td>${r.numero_processo_orcamentario_pagamento ?? ""}</td>
-          <td class="num">${fmtNum(r.valor_ped)}</td>
-          <td class="num">${fmtNum(r.valor_estorno)}</td>
-          <td>${r.indicativo_licitacao_exercicios_anteriores ?? ""}</td>
-          <td>${r.data_licitacao ?? ""}</td>
-          <td>${r.liberado_fisco_estadual ?? ""}</td>
-          <td>${r.situacao ?? ""}</td>
-          <td>${r.uo ?? ""}</td>
-          <td>${r.nome_unidade_orcamentaria ?? ""}</td>
-          <td>${r.ug ?? ""}</td>
-          <td>${r.nome_unidade_gestora ?? ""}</td>
-          <td>${r.data_solicitacao ?? ""}</td>
-          <td>${r.data_criacao ?? ""}</td>
-          <td>${r.tipo_empenho ?? ""}</td>
-          <td>${r.dotacao_orcamentaria ?? ""}</td>
-          <td>${r.funcao ?? ""}</td>
-          <td>${r.subfuncao ?? ""}</td>
-          <td>${r.programa_governo ?? ""}</td>
-          <td>${r.paoe ?? ""}</td>
-          <td>${r.natureza_despesa ?? ""}</td>
-          <td>${r.cat_econ ?? ""}</td>
-          <td>${r.grupo ?? ""}</td>
-          <td>${r.modalidade ?? ""}</td>
-          <td>${r.elemento ?? ""}</td>
-          <td>${r.nome_elemento ?? ""}</td>
-          <td>${r.fonte ?? ""}</td>
-          <td>${r.iduso ?? ""}</td>
-          <td>${r.numero_emenda_ep ?? ""}</td>
-          <td>${r.autor_emenda_ep ?? ""}</td>
-          <td>${r.numero_cac ?? ""}</td>
-          <td>${r.licitacao ?? ""}</td>
-          <td>${r.usuario_responsavel ?? ""}</td>
-          <td>${r.historico ?? ""}</td>
-          <td>${r.credor ?? ""}</td>
-          <td>${r.nome_credor ?? ""}</td>
-          <td>${r.data_autorizacao ?? ""}</td>
-          <td>${r.data_hora_cadastro_autorizacao ?? ""}</td>
-          <td>${r.tipo_despesa ?? ""}</td>
-          <td>${r.numero_abj ?? ""}</td>
-          <td>${r.numero_processo_sequestro_judicial ?? ""}</td>
-          <td>${r.indicativo_entrega_imediata ?? ""}</td>
-          <td>${r.indicativo_contrato ?? ""}</td>
-          <td>${r.codigo_uo_extinta ?? ""}</td>
-          <td>${r.devolucao_gcv ?? ""}</td>
-          <td>${r.mes_competencia_folha_pagamento ?? ""}</td>
-          <td>${r.exercicio_competencia_folha ?? ""}</td>
-          <td>${r.obrigacao_patronal ?? ""}</td>
-          <td>${r.tipo_obrigacao_patronal ?? ""}</td>
-          <td>${r.numero_nla ?? ""}</td>
-        `;
-        tbody.appendChild(tr);
-      });
-      renderPagination(totalPages);
-      updateTotals(rows);
-    };
-
-    const load = async () => {
-      if (meta) meta.textContent = "Carregando...";
-      try {
-        const res = await fetch("/api/relatorios/ped");
-        const data = await res.json();
-        if (!res.ok) throw new Error(data.error || "Falha ao carregar.");
-        allData.rows = (data.data || []).map((r) => {
-          const chaveDisplay = r.chave || r.chave_planejamento || "";
-          return { ...r, chave_display: chaveDisplay };
-        });
-        filteredRows = allData.rows;
-        setOptions(allData.rows);
-        render();
-        if (meta) {
-          const dt = formatAmazonLocalTime(data.data_arquivo);
-          const user = data.user_email || "-";
-          const uploaded = formatAmazonTime(data.uploaded_at);
-          meta.innerHTML = `
-            <div><strong>Última atualização</strong></div>
-            <div>Enviado por: ${user}</div>
-            <div>Upload em: ${uploaded}</div>
-            <div>Data do download: ${dt}</div>
-          `;
-        }
-        if (chaveHeader) {
-          chaveHeader.textContent = "Chave de Planejamento/Chave";
-        }
-      } catch (err) {
-        if (meta) meta.textContent = err.message;
-        console.error(err);
-      }
-    };
-
-    if (pageSizeSelect) {
-      pageSizeSelect.addEventListener("change", () => {
-        pageSize = parseInt(pageSizeSelect.value || "20", 10) || 20;
-        render();
-      });
-    }
-
-    if (btnDownload) {
-      btnDownload.addEventListener("click", () => {
-        window.open("/api/relatorios/ped/download", "_blank");
-      });
-    }
-
-    if (btnReset) {
-      btnReset.addEventListener("click", () => {
-        closeAllPanels();
-        Object.keys(filters).forEach((k) => filters[k].clear());
-        setOptions(allData.rows);
-        filteredRows = allData.rows;
-        currentPage = 1;
-        render();
-      });
-    }
-
-    if (!multiFilterClickBound) {
-      document.addEventListener("click", (ev) => {
-        if (!ev.target.closest(".mf-wrapper")) {
-          closeAllPanels();
-        }
-      });
-      multiFilterClickBound = true;
-    }
-
-    load();
-  }
-
-
-  function initRelatorioNob() {
-    const table = document.getElementById("nob-relatorio-tabela");
-    const tbody = table ? table.querySelector("tbody") : null;
-    const meta = document.getElementById("nob-relatorio-meta");
-    const pager = document.getElementById("nob-pagination");
-    const pageSizeSelect = document.getElementById("nob-page-size");
-    const btnDownload = document.getElementById("nob-download");
-    const btnReset = document.getElementById("nob-reset");
-    const totExercicio = document.getElementById("nob-tot-exercicio");
-    const totValorNob = document.getElementById("nob-tot-valor-nob");
-    if (!table || !tbody) return;
-    if (table.dataset.bound === "1") return;
-    table.dataset.bound = "1";
-
-    let pageSize = parseInt(pageSizeSelect?.value || "20", 10) || 20;
-    let currentPage = 1;
-    let filteredRows = [];
-
-    const numFmt = new Intl.NumberFormat("pt-BR", {
-      minimumFractionDigits: 2,
-      maximumFractionDigits: 2,
-    });
-    const fmtNum = (v) => {
-      const n = Number(v);
-      if (Number.isNaN(n)) return v ?? "";
-      return numFmt.format(n);
-    };
-
-    const colKeys = [
-      "exercicio",
-      "numero_nob",
-      "numero_nob_estorno",
-      "numero_liq",
-      "numero_emp",
-      "empenho_atual",
-      "empenho_rp",
-      "numero_ped",
-      "valor_nob",
-      "devolucao_gcv",
-      "valor_nob_gcv",
-      "uo",
-      "ug",
-      "dotacao_orcamentaria",
-      "funcao",
-      "subfuncao",
-      "programa_governo",
-      "paoe",
-      "natureza_despesa",
-      "cat_econ",
-      "grupo",
-      "modalidade",
-      "elemento",
-      "nome_elemento_despesa",
-      "fonte",
-      "nome_fonte_recurso",
-      "iduso",
-      "historico_liq",
-      "nome_credor_principal",
-      "cpf_cnpj_credor_principal",
-      "credor",
-      "nome_credor",
-      "cpf_cnpj_credor",
-      "data_nob",
-      "data_cadastro_nob",
-      "data_hora_cadastro_liq",
-    ];
-
-    const filterContainers = table.querySelectorAll(".filter-row [data-col]");
-    const allData = { rows: [] };
-    const filters = Object.fromEntries(colKeys.map((k) => [k, new Set()]));
-    const filterControls = {};
-
-    const closeAllPanels = () => {
-      Object.values(filterControls).forEach((ctrl) => {
-        if (ctrl?.panel) ctrl.panel.classList.remove("open");
-      });
-    };
-
-    const updateDisplay = (key) => {
-      const set = filters[key] || new Set();
-      const ctrl = filterControls[key];
-      if (!ctrl) return;
-      const map = ctrl.labelMap || {};
-      if (ctrl.allCb) ctrl.allCb.checked = set.size === 0;
-      (ctrl.optionCbs || []).forEach((cb) => {
-        cb.checked = set.has(cb.dataset.val || "");
-      });
-      if (set.size === 0) {
-        ctrl.label.textContent = "(Todos)";
-      } else if (set.size <= 2) {
-        ctrl.label.textContent = Array.from(set)
-          .map((v) => map[v] || v)
-          .join(", ");
-      } else {
-        ctrl.label.textContent = `${set.size} selecionados`;
-      }
-    };
-
-    const buildFilter = (container, options, key) => {
-      container.innerHTML = "";
-      const wrap = document.createElement("div");
-      wrap.className = "mf-wrapper";
-      const display = document.createElement("button");
-      display.type = "button";
-      display.className = "mf-display";
-      const label = document.createElement("span");
-      label.textContent = "(Todos)";
-      display.appendChild(label);
-      const icon = document.createElement("i");
-      icon.className = "bi bi-chevron-down";
-      display.appendChild(icon);
-
-      const panel = document.createElement("div");
-      panel.className = "mf-panel";
-      const search = document.createElement("input");
-      search.type = "text";
-      search.className = "mf-search";
-      search.placeholder = "Buscar...";
-      const list = document.createElement("div");
-      list.className = "mf-options";
-
-      const tempSelected = new Set(filters[key] || []);
-      const allId = `${key}-all`;
-      const allRow = document.createElement("label");
-      allRow.className = "mf-option";
-      const allCb = document.createElement("input");
-      allCb.type = "checkbox";
-      allCb.id = allId;
-      allCb.dataset.val = "";
-      allRow.appendChild(allCb);
-      const allSpan = document.createElement("span");
-      allSpan.textContent = "(Todos)";
-      allRow.appendChild(allSpan);
-      list.appendChild(allRow);
-
-      const selectVisibleRow = document.createElement("label");
-      selectVisibleRow.className = "mf-option mf-select-visible";
-      const selectVisibleCb = document.createElement("input");
-      selectVisibleCb.type = "checkbox";
-      selectVisibleRow.appendChild(selectVisibleCb);
-      const selectVisibleSpan = document.createElement("span");
-      selectVisibleSpan.textContent = "Selecionar exibidos";
-      selectVisibleRow.appendChild(selectVisibleSpan);
-      list.appendChild(selectVisibleRow);
-
-      const cbs = [];
-      const labelMap = {};
-      options.forEach((opt) => {
-        const row = document.createElement("label");
-        row.className = "mf-option";
-        const cb = document.createElement("input");
-        cb.type = "checkbox";
-        const norm = String(opt || "").toLowerCase();
-        cb.dataset.val = norm;
-        labelMap[norm] = opt;
-        row.appendChild(cb);
-        const txt = document.createElement("span");
-        txt.textContent = opt;
-        row.appendChild(txt);
-        list.appendChild(row);
-        cbs.push({ cb, txt, row, val: norm });
-      });
-
-      const syncUIFromTemp = () => {
-        allCb.checked = tempSelected.size === 0;
-        cbs.forEach(({ cb, val }) => {
-          cb.checked = tempSelected.has(val);
-        });
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        const allVisibleSelected = visible.length > 0 && visible.every(({ cb }) => cb.checked);
-        selectVisibleCb.checked = allVisibleSelected;
-      };
-
-      const applyTempToFilters = () => {
-        const set = filters[key];
-        set.clear();
-        tempSelected.forEach((v) => set.add(v));
-        updateDisplay(key);
-        renderFiltered();
-      };
-
-      const closePanel = () => panel.classList.remove("open");
-
-      allCb.addEventListener("change", () => {
-        if (allCb.checked) {
-          tempSelected.clear();
-          syncUIFromTemp();
-        }
-      });
-
-      selectVisibleCb.addEventListener("change", () => {
-        const visible = cbs.filter(({ row }) => row.style.display !== "none");
-        if (selectVisibleCb.checked) {
-          visible.forEach(({ val }) => tempSelected.add(val));
-        } else {
-          visible.forEach(({ val }) => tempSelected.delete(val));
-        }
-        allCb.checked = tempSelected.size === 0;
-        syncUIFromTemp();
-      });
-
-      cbs.forEach(({ cb, val }) => {
-        cb.addEventListener("change", () => {
-          if (cb.checked) {
-            tempSelected.add(val);
-            allCb.checked = false;
-          } else {
-            tempSelected.delete(val);
-          }
-          syncUIFromTemp();
-        });
-      });
-
-      search.addEventListener("input", () => {
-        const term = search.value.toLowerCase();
-        cbs.forEach(({ row, txt }) => {
-          const match = txt.textContent.toLowerCase().includes(term);
-          row.style.display = match ? "" : "none";
-        });
-        const allMatch = "(todos)".includes(term) || term === "";
-        allRow.style.display = allMatch ? "" : "none";
-        selectVisibleRow.style.display = "";
-        syncUIFromTemp();
-      });
-
-      const actions = document.createElement("div");
-      actions.className = "mf-actions";
-      const cancelBtn = document.createElement("button");
-      cancelBtn.type = "button";
-      cancelBtn.className = "mf-btn ghost";
-      cancelBtn.textContent = "Cancelar";
-      const applyBtn = document.createElement("button");
-      applyBtn.type = "button";
-      applyBtn.className = "mf-btn primary";
-      applyBtn.textContent = "Aplicar";
-
-      cancelBtn.addEventListener("click", () => {
-        tempSelected.clear();
-        filters[key].forEach((v) => tempSelected.add(v));
-        syncUIFromTemp();
-        closePanel();
-      });
-      applyBtn.addEventListener("click", () => {
-        applyTempToFilters();
-        closePanel();
-      });
-
-      display.addEventListener("click", () => {
-        const isOpen = panel.classList.contains("open");
-        closeAllPanels();
-        if (!isOpen) {
-          panel.style.width = "";
-          panel.style.height = "";
-          tempSelected.clear();
-          filters[key].forEach((v) => tempSelected.add(v));
-          cbs.forEach(({ row }) => (row.style.display = ""));
-          allRow.style.display = "";
-          search.value = "";
-          syncUIFromTemp();
-          panel.classList.add("open");
-        }
-      });
-
-      wrap.appendChild(display);
-      panel.appendChild(search);
-      panel.appendChild(list);
-      actions.appendChild(cancelBtn);
-      actions.appendChild(applyBtn);
-      panel.appendChild(actions);
-      wrap.appendChild(panel);
-      container.appendChild(wrap);
-
-      filterControls[key] = {
-        panel,
-        label,
-        allCb,
-        optionCbs: cbs.map((c) => c.cb),
-        labelMap,
-      };
-      updateDisplay(key);
-    };
-
-    const setOptions = (rows = allData.rows) => {
-      closeAllPanels();
-      const uniques = colKeys.map(() => new Set());
-      (rows || []).forEach((r) => {
-        colKeys.forEach((k, idx) => {
-          uniques[idx].add((r[k] ?? "").toString());
-        });
-      });
-      filterContainers.forEach((container) => {
-        const key = container.getAttribute("data-col");
-        const idx = colKeys.indexOf(key);
-        if (idx === -1) return;
-        const opts = Array.from(uniques[idx]).sort((a, b) => a.localeCompare(b, "pt-BR"));
-        buildFilter(container, opts, key);
-      });
-    };
-
-    const renderFiltered = (resetPage = true) => {
-      const filtered = allData.rows.filter((r) =>
-        colKeys.every((k) => {
-          const set = filters[k];
-          if (!set || set.size === 0) return true;
-          const val = r[k];
-          const cmp = val === null || val === undefined ? "" : String(val).toLowerCase();
-          return set.has(cmp);
-        })
-      );
-      setOptions(filtered);
-      filteredRows = filtered;
-      if (resetPage) currentPage = 1;
-      render();
-    };
-
-    const renderPagination = (totalPages) => {
-      if (!pager) return;
-      pager.innerHTML = "";
-      if (totalPages <= 1) return;
-      const addBtn = (label, page, disabled = false, active = false) => {
-        const b = document.createElement("button");
-        b.textContent = label;
-        if (disabled) b.disabled = true;
-        if (active) b.classList.add("active");
-        b.addEventListener("click", () => {
-          if (disabled || page === currentPage) return;
-          currentPage = page;
-          render();
-        });
-        pager.appendChild(b);
-      };
-      addBtn("<<", 1, currentPage === 1);
-      addBtn("<", Math.max(1, currentPage - 1), currentPage === 1);
-      const maxButtons = 5;
-      const start = Math.max(1, Math.min(currentPage - 2, totalPages - maxButtons + 1));
-      const end = Math.min(totalPages, start + maxButtons - 1);
-      for (let p = start; p <= end; p++) {
-        addBtn(String(p), p, false, p === currentPage);
-      }
-      if (end < totalPages) {
-        const ellipsis = document.createElement("span");
-        ellipsis.textContent = "...";
-        pager.appendChild(ellipsis);
-        addBtn(String(totalPages), totalPages, false, currentPage === totalPages);
-      }
-      addBtn(">", Math.min(totalPages, currentPage + 1), currentPage === totalPages);
-      addBtn(">>", totalPages, currentPage === totalPages);
-    };
-
-    const updateTotals = (rows) => {
-      const exSet = new Set();
-      let totalVal = 0;
-      rows.forEach((r) => {
-        if (r.exercicio !== undefined && r.exercicio !== null && r.exercicio !== "") {
-          exSet.add(String(r.exercicio));
-        }
-        const v = Number(r.valor_nob_gcv || 0);
-        if (!Number.isNaN(v)) totalVal += v;
-      });
-      if (totExercicio) {
-        totExercicio.textContent = exSet.size
-          ? Array.from(exSet).sort((a, b) => a.localeCompare(b, "pt-BR")).join(" | ")
-          : "-";
-      }
-      if (totValorNob) {
-        totValorNob.textContent = numFmt.format(totalVal);
-        totValorNob.classList.remove("pos", "neg");
-        if (totalVal > 0) totValorNob.classList.add("pos");
-        else if (totalVal < 0) totValorNob.classList.add("neg");
-      }
-    };
+      "data_autorizacao",
+      "data_hora_cadastro_autorizacao",
+      "tipo_despesa",
+      "numero_abj",
+      "numero_processo_sequestro_judicial",
+      "indicativo_entrega_imediata",
+      "indicativo_contrato",
+      "codigo_uo_extinta",
+      "devolucao_gcv",
+      "mes_competencia_folha_pagamento",
+      "exercicio_competencia_folha",
+      "obrigacao_patronal",
+      "tipo_obrigacao_patronal",
+      "numero_nla",
+    ];
 
-    const render = () => {
-      const rows = filteredRows;
-      const totalPages = Math.max(1, Math.ceil(rows.length / pageSize));
-      if (currentPage > totalPages) currentPage = totalPages;
-      const startIdx = (currentPage - 1) * pageSize;
-      const pageRows = rows.slice(startIdx, startIdx + pageSize);
+    if (chaveHeader) chaveHeader.textContent = "Chave de Planejamento/Chave";
+
+    initRelatorioRemoto({
+      table,
+      base: "/api/relatorios/ped",
+      colKeys,
+      meta: document.getElementById("ped-relatorio-meta"),
+      pager: document.getElementById("ped-pagination"),
+      pageSizeSelect: document.getElementById("ped-page-size"),
+      btnReset: document.getElementById("ped-reset"),
+      btnDownload: document.getElementById("ped-download"),
+      alias: { chave_display: "chave" },
+      mapearLinha: (r) => ({ ...r, chave_display: r.chave || r.chave_planejamento || "" }),
+      resumo: ["exercicio"],
+      renderLinha: (r) => `
+        <td>${r.chave_display ?? ""}</td>
+        <td>${r.regiao ?? ""}</td>
+        <td>${r.subfuncao_ug ?? ""}</td>
+        <td>${r.adj ?? ""}</td>
+        <td>${r.macropolitica ?? ""}</td>
+        <td>${r.pilar ?? ""}</td>
+        <td>${r.eixo ?? ""}</td>
+        <td>${r.politica_decreto ?? ""}</td>
+        <td>${r.exercicio ?? ""}</td>
+        <td>${r.numero_ped ?? ""}</td>
+        <td>${r.numero_ped_estorno ?? ""}</td>
+        <td>${r.numero_emp ?? ""}</td>
+        <td>${r.numero_cad ?? ""}</td>
+        <td>${r.numero_noblist ?? ""}</td>
+        <td>${r.numero_os ?? ""}</td>
+        <td>${r.convenio ?? ""}</td>
+        <td>${r.numero_processo_orcamentario_pagamento ?? ""}</td>
+        <td class="num">${fmtNum(r.valor_ped)}</td>
+        <td class="num">${fmtNum(r.valor_estorno)}</td>
+        <td>${r.indicativo_licitacao_exercicios_anteriores ?? ""}</td>
+        <td>${r.data_licitacao ?? ""}</td>
+        <td>${r.liberado_fisco_estadual ?? ""}</td>
+        <td>${r.situacao ?? ""}</td>
+        <td>${r.uo ?? ""}</td>
+        <td>${r.nome_unidade_orcamentaria ?? ""}</td>
+        <td>${r.ug ?? ""}</td>
+        <td>${r.nome_unidade_gestora ?? ""}</td>
+        <td>${r.data_solicitacao ?? ""}</td>
+        <td>${r.data_criacao ?? ""}</td>
+        <td>${r.tipo_empenho ?? ""}</td>
+        <td>${r.dotacao_orcamentaria ?? ""}</td>
+        <td>${r.funcao ?? ""}</td>
+        <td>${r.subfuncao ?? ""}</td>
+        <td>${r.programa_governo ?? ""}</td>
+        <td>${r.paoe ?? ""}</td>
+        <td>${r.natureza_despesa ?? ""}</td>
+        <td>${r.cat_econ ?? ""}</td>
+        <td>${r.grupo ?? ""}</td>
+        <td>${r.modalidade ?? ""}</td>
+        <td>${r.elemento ?? ""}</td>
+        <td>${r.nome_elemento ?? ""}</td>
+        <td>${r.fonte ?? ""}</td>
+        <td>${r.iduso ?? ""}</td>
+        <td>${r.numero_emenda_ep ?? ""}</td>
+        <td>${r.autor_emenda_ep ?? ""}</td>
+        <td>${r.numero_cac ?? ""}</td>
+        <td>${r.licitacao ?? ""}</td>
+        <td>${r.usuario_responsavel ?? ""}</td>
+        <td>${r.historico ?? ""}</td>
+        <td>${r.credor ?? ""}</td>
+        <td>${r.nome_credor ?? ""}</td>
+        <td>${r.data_autorizacao ?? ""}</td>
+        <td>${r.data_hora_cadastro_autorizacao ?? ""}</td>
+        <td>${r.tipo_despesa ?? ""}</td>
+        <td>${r.numero_abj ?? ""}</td>
+        <td>${r.numero_processo_sequestro_judicial ?? ""}</td>
+        <td>${r.indicativo_entrega_imediata ?? ""}</td>
+        <td>${r.indicativo_contrato ?? ""}</td>
+        <td>${r.codigo_uo_extinta ?? ""}</td>
+        <td>${r.devolucao_gcv ?? ""}</td>
+        <td>${r.mes_competencia_folha_pagamento ?? ""}</td>
+        <td>${r.exercicio_competencia_folha ?? ""}</td>
+        <td>${r.obrigacao_patronal ?? ""}</td>
+        <td>${r.tipo_obrigacao_patronal ?? ""}</td>
+        <td>${r.numero_nla ?? ""}</td>
+      `,
+      renderTotais: (totais, valoresFiltrados) => {
+        const exercicios = valoresFiltrados("exercicio");
+        if (totExercicio) {
+          totExercicio.textContent = exercicios.length
+            ? exercicios.slice().sort((a, b) => a.localeCompare(b, "pt-BR")).join(" | ")
+            : "-";
+        }
+        if (totValor) {
+          const totalVal = Number(totais.valor_ped || 0);
+          totValor.textContent = numFmt.format(totalVal);
+          totValor.classList.remove("pos", "neg");
+          if (totalVal > 0) totValor.classList.add("pos");
+          else if (totalVal < 0) totValor.classList.add("neg");
+        }
+      },
+    });
+  }
 
-      tbody.innerHTML = "";
-      pageRows.forEach((r) => {
-        const tr = document.createElement("tr");
-        tr.innerHTML = `
-          <td>${r.exercicio ?? ""}</td>
-          <td>${r.numero_nob ?? ""}</td>
-          <td>${r.numero_nob_estorno ?? ""}</td>
-          <td>${r.numero_liq ?? ""}</td>
-          <td>${r.numero_emp ?? ""}</td>
-          <td>${r.empenho_atual ?? ""}</td>
-          <td>${r.empenho_rp ?? ""}</td>
-          <td>${r.numero_ped ?? ""}</td>
-          <td class="num">${fmtNum(r.valor_nob)}</td>
-          <td class="num">${fmtNum(r.devolucao_gcv)}</td>
-          <td class="num">${fmtNum(r.valor_nob_gcv)}</td>
-          <td>${r.uo ?? ""}</td>
-          <td>${r.ug ?? ""}</td>
-          <td>${r.dotacao_orcamentaria ?? ""}</td>
-          <td>${r.funcao ?? ""}</td>
-          <td>${r.subfuncao ?? ""}</td>
-          <td>${r.programa_governo ?? ""}</td>
-          <td>${r.paoe ?? ""}</td>
-          <td>${r.natureza_despesa ?? ""}</td>
-          <td>${r.cat_econ ?? ""}</td>
-          <td>${r.grupo ?? ""}</td>
-          <td>${r.modalidade ?? ""}</td>
-          <td>${r.elemento ?? ""}</td>
-          <td>${r.nome_elemento_despesa ?? ""}</td>
-          <td>${r.fonte ?? ""}</td>
-          <td>${r.nome_fonte_recurso ?? ""}</td>
-          <td>${r.iduso ?? ""}</td>
-          <td>${r.historico_liq ?? ""}</td>
-          <td>${r.nome_credor_principal ?? ""}</td>
-          <td>${r.cpf_cnpj_credor_principal ?? ""}</td>
-          <td>${r.credor ?? ""}</td>
-          <td>${r.nome_credor ?? ""}</td>
-          <td>${r.cpf_cnpj_credor ?? ""}</td>
-          <td>${r.data_nob ?? ""}</td>
-          <td>${r.data_cadastro_nob ?? ""}</td>
-          <td>${r.data_hora_cadastro_liq ?? ""}</td>
-        `;
-        tbody.appendChild(tr);
-      });
 
-      renderPagination(totalPages);
-      updateTotals(rows);
-    };
+  function initRelatorioNob() {
+    const table = document.getElementById("nob-relatorio-tabela");
+    const totExercicio = document.getElementById("nob-tot-exercicio");
+    const totValor = document.getElementById("nob-tot-valor-nob");
+    if (!table || !table.querySelector("tbody")) return;
+    if (table.dataset.bound === "1") return;
+    table.dataset.bound = "1";
 
-    const load = async () => {
-      if (meta) meta.textContent = "Carregando...";
-      try {
-        const res = await fetch("/api/relatorios/nob");
-        const data = await res.json();
-        if (!res.ok) throw new Error(data.error || "Falha ao carregar.");
-        allData.rows = data.data || [];
-        filteredRows = allData.rows;
-        setOptions(allData.rows);
-        render();
-        if (meta) {
-          const dt = formatAmazonLocalTime(data.data_arquivo);
-          const user = data.user_email || "-";
-          const uploaded = formatAmazonTime(data.uploaded_at);
-          meta.innerHTML = `
-            <div><strong>Última atualização</strong></div>
-            <div>Enviado por: ${user}</div>
-            <div>Upload em: ${uploaded}</div>
-            <div>Data do download: ${dt}</div>
-          `;
-        }
-      } catch (err) {
-        if (meta) meta.textContent = err.message;
-        console.error(err);
-      }
+    const numFmt = new Intl.NumberFormat("pt-BR", {
+      minimumFractionDigits: 2,
+      maximumFractionDigits: 2,
+    });
+    const fmtNum = (v) => {
+      const n = Number(v);
+      if (Number.isNaN(n)) return v ?? "";
+      return numFmt.format(n);
     };
 
-    if (pageSizeSelect) {
-      pageSizeSelect.addEventListener("change", () => {
-        pageSize = parseInt(pageSizeSelect.value || "20", 10) || 20;
-        render();
-      });
-    }
-
-    if (btnDownload) {
-      btnDownload.addEventListener("click", () => {
-        window.open("/api/relatorios/nob/download", "_blank");
-      });
-    }
-
-    if (btnReset) {
-      btnReset.addEventListener("click", () => {
-        closeAllPanels();
-        Object.keys(filters).forEach((k) => filters[k].clear());
-        setOptions(allData.rows);
-        filteredRows = allData.rows;
-        currentPage = 1;
-        render();
-      });
-    }
-
-    if (!multiFilterClickBound) {
-      document.addEventListener("click", (ev) => {
-        if (!ev.target.closest(".mf-wrapper")) {
-          closeAllPanels();
-        }
-      });
-      multiFilterClickBound = true;
-    }
+    const colKeys = [
+      "exercicio",
+      "numero_nob",
+      "numero_nob_estorno",
+      "numero_liq",
+      "numero_emp",
+      "empenho_atual",
+      "empenho_rp",
+      "numero_ped",
+      "valor_nob",
+      "devolucao_gcv",
+      "valor_nob_gcv",
+      "uo",
+      "ug",
+      "dotacao_orcamentaria",
+      "funcao",
+      "subfuncao",
+      "programa_governo",
+      "paoe",
+      "natureza_despesa",
+      "cat_econ",
+      "grupo",
+      "modalidade",
+      "elemento",
+      "nome_elemento_despesa",
+      "fonte",
+      "nome_fonte_recurso",
+      "iduso",
+      "historico_liq",
+      "nome_credor_principal",
+      "cpf_cnpj_credor_principal",
+      "credor",
+      "nome_credor",
+      "cpf_cnpj_credor",
+      "data_nob",
+      "data_cadastro_nob",
+      "data_hora_cadastro_liq",
+    ];
 
-    load();
+    initRelatorioRemoto({
+      table,
+      base: "/api/relatorios/nob",
+      colKeys,
+      meta: document.getElementById("nob-relatorio-meta"),
+      pager: document.getElementById("nob-pagination"),
+      pageSizeSelect: document.getElementById("nob-page-size"),
+      btnReset: document.getElementById("nob-reset"),
+      btnDownload: document.getElementById("nob-download"),
+      resumo: ["exercicio"],
+      renderLinha: (r) => `
+        <td>${r.exercicio ?? ""}</td>
+        <td>${r.numero_nob ?? ""}</td>
+        <td>${r.numero_nob_estorno ?? ""}</td>
+        <td>${r.numero_liq ?? ""}</td>
+        <td>${r.numero_emp ?? ""}</td>
+        <td>${r.empenho_atual ?? ""}</td>
+        <td>${r.empenho_rp ?? ""}</td>
+        <td>${r.numero_ped ?? ""}</td>
+        <td class="num">${fmtNum(r.valor_nob)}</td>
+        <td class="num">${fmtNum(r.devolucao_gcv)}</td>
+        <td class="num">${fmtNum(r.valor_nob_gcv)}</td>
+        <td>${r.uo ?? ""}</td>
+        <td>${r.ug ?? ""}</td>
+        <td>${r.dotacao_orcamentaria ?? ""}</td>
+        <td>${r.funcao ?? ""}</td>
+        <td>${r.subfuncao ?? ""}</td>
+        <td>${r.programa_governo ?? ""}</td>
+        <td>${r.paoe ?? ""}</td>
+        <td>${r.natureza_despesa ?? ""}</td>
+        <td>${r.cat_econ ?? ""}</td>
+        <td>${r.grupo ?? ""}</td>
+        <td>${r.modalidade ?? ""}</td>
+        <td>${r.elemento ?? ""}</td>
+        <td>${r.nome_elemento_despesa ?? ""}</td>
+        <td>${r.fonte ?? ""}</td>
+        <td>${r.nome_fonte_recurso ?? ""}</td>
+        <td>${r.iduso ?? ""}</td>
+        <td>${r.historico_liq ?? ""}</td>
+        <td>${r.nome_credor_principal ?? ""}</td>
+        <td>${r.cpf_cnpj_credor_principal ?? ""}</td>
+        <td>${r.credor ?? ""}</td>
+        <td>${r.nome_credor ?? ""}</td>
+        <td>${r.cpf_cnpj_credor ?? ""}</td>
+        <td>${r.data_nob ?? ""}</td>
+        <td>${r.data_cadastro_nob ?? ""}</td>
+        <td>${r.data_hora_cadastro_liq ?? ""}</td>
+      `,
+      renderTotais: (totais, valoresFiltrados) => {
+        const exercicios = valoresFiltrados("exercicio");
+        if (totExercicio) {
+          totExercicio.textContent = exercicios.length
+            ? exercicios.slice().sort((a, b) => a.localeCompare(b, "pt-BR")).join(" | ")
+            : "-";
+        }
+        if (totValor) {
+          const totalVal = Number(totais.valor_nob_gcv || 0);
+          totValor.textContent = numFmt.format(totalVal);
+          totValor.classList.remove("pos", "neg");
+          if (totalVal > 0) totValor.classList.add("pos");
+          else if (totalVal < 0) totValor.classList.add("neg");
+        }
+      },
+    });
   }
 
   function initRoute(route) {
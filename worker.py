@@ -1,9 +1,7 @@
 from __future__ import annotations
 
 import argparse
-import json
 import os
-import subprocess
 import sys
 import traceback
 from datetime import datetime
@@ -11,13 +9,14 @@ from pathlib import Path
 
 from app import create_app
 from models import db, EmpUpload, NobUpload
-from sqlalchemy.exc import SQLAlchemyError
+from services.ingest_checkpoint import with_db_retry
 from services.job_status import clear_cancel_flag, update_status_fields, write_status
+from services.node_runner import NodeRunnerSupervisor, run_node
+from services.post_ingest import DATASET_STEPS, bump_dataset_version, run_refresh_now, schedule_refresh
+from services.worker_service import serve
 
 EMP_INPUT_DIR = Path("upload/emp")
 NOB_INPUT_DIR = Path("upload/nob")
-NODE_RUNNER = Path(__file__).resolve().parent / "node_runners" / "run.js"
-NODE_EXE = os.getenv("NODE_EXE", "node")
 
 
 def _find_upload_path(base_dir: Path, stored_filename: str) -> Path | None:
@@ -34,40 +33,6 @@ def _find_upload_path(base_dir: Path, stored_filename: str) -> Path | None:
     return matches[0] if matches else None
 
 
-def _run_node(kind: str, file_path: Path, user_email: str, data_arquivo, upload_id: int) -> dict:
-    args = [
-        NODE_EXE,
-        str(NODE_RUNNER),
-        "--kind",
-        kind,
-        "--file",
-        str(file_path),
-        "--upload-id",
-        str(upload_id),
-        "--user-email",
-        user_email or "desconhecido",
-    ]
-    if data_arquivo:
-        try:
-            args.extend(["--data-arquivo", data_arquivo.isoformat()])
-        except Exception:
-            args.extend(["--data-arquivo", str(data_arquivo)])
-    proc = subprocess.run(args, capture_output=True, text=True, cwd=str(NODE_RUNNER.parent))
-    if proc.stderr:
-        print(proc.stderr, file=sys.stderr)
-    if proc.returncode != 0:
-        err = (proc.stderr or proc.stdout or "").strip()
-        raise RuntimeError(f"Node runner falhou: {err or 'erro desconhecido'}")
-    raw = (proc.stdout or "").strip()
-    try:
-        payload = json.loads(raw) if raw else {}
-    except json.JSONDecodeError as exc:
-        raise RuntimeError(f"Resposta invalida do Node: {exc}") from exc
-    if not payload.get("ok"):
-        raise RuntimeError(f"Node runner falhou: {payload.get('error')}")
-    return payload
-
-
 def _commit_upload_filename(model_cls, upload_id: int, output_filename: str | None) -> None:
     def _do_commit() -> None:
         upload = db.session.get(model_cls, upload_id)
@@ -76,37 +41,37 @@ def _commit_upload_filename(model_cls, upload_id: int, output_filename: str | No
         upload.output_filename = str(output_filename or "")
         db.session.commit()
 
-    try:
-        _do_commit()
-    except SQLAlchemyError as exc:
-        msg = str(exc)
-        if "MySQL server has gone away" in msg or "Packet sequence number wrong" in msg:
-            db.session.rollback()
-            db.session.remove()
-            try:
-                db.engine.dispose()
-            except Exception:
-                pass
-            _do_commit()
-        else:
-            raise
+    with_db_retry(_do_commit)
 
 
 def _parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Background worker for heavy uploads.")
-    parser.add_argument("--kind", choices=["emp", "nob"], required=True)
-    parser.add_argument("--upload-id", type=int, required=True)
-    return parser.parse_args()
+    parser.add_argument("--kind", choices=["emp", "nob"])
+    parser.add_argument("--upload-id", type=int)
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Fica rodando e recebe jobs por socket local, com runner Node persistente.",
+    )
+    parser.add_argument(
+        "--refresh",
+        choices=sorted(DATASET_STEPS),
+        help="Invalida os caches do tipo e roda o pos-ingestao (ex.: depois da carga do plan21_nger).",
+    )
+    args = parser.parse_args()
+    if not args.serve and not args.refresh and (not args.kind or args.upload_id is None):
+        parser.error("--kind e --upload-id sao obrigatorios (ou use --serve/--refresh).")
+    return args
 
 
-def _run_emp(upload_id: int) -> None:
+def _run_emp(upload_id: int, runner=run_node) -> None:
     upload = db.session.get(EmpUpload, upload_id)
     if not upload:
         raise RuntimeError(f"Upload EMP nao encontrado: {upload_id}")
     file_path = _find_upload_path(Path(EMP_INPUT_DIR), upload.stored_filename)
     if not file_path:
         raise RuntimeError(f"Arquivo EMP nao encontrado: {Path(EMP_INPUT_DIR) / upload.stored_filename}")
-    payload = _run_node("emp", file_path, upload.user_email, upload.data_arquivo, upload.id)
+    payload = runner("emp", file_path, upload.user_email, upload.data_arquivo, upload.id)
     _commit_upload_filename(EmpUpload, upload_id, payload.get("output_filename"))
     update_status_fields(
         "emp",
@@ -117,14 +82,14 @@ def _run_emp(upload_id: int) -> None:
     )
 
 
-def _run_nob(upload_id: int) -> None:
+def _run_nob(upload_id: int, runner=run_node) -> None:
     upload = db.session.get(NobUpload, upload_id)
     if not upload:
         raise RuntimeError(f"Upload NOB nao encontrado: {upload_id}")
     file_path = _find_upload_path(Path(NOB_INPUT_DIR), upload.stored_filename)
     if not file_path:
         raise RuntimeError(f"Arquivo NOB nao encontrado: {Path(NOB_INPUT_DIR) / upload.stored_filename}")
-    payload = _run_node("nob", file_path, upload.user_email, upload.data_arquivo, upload.id)
+    payload = runner("nob", file_path, upload.user_email, upload.data_arquivo, upload.id)
     _commit_upload_filename(NobUpload, upload_id, payload.get("output_filename"))
     write_status(
         "nob",
@@ -135,33 +100,64 @@ def _run_nob(upload_id: int) -> None:
     )
 
 
+def _run_job(kind: str, upload_id: int, runner=run_node, refresh=run_refresh_now) -> int:
+    try:
+        clear_cancel_flag(kind, upload_id)
+        write_status(
+            kind,
+            upload_id,
+            "em processamento",
+            "Processamento iniciado.",
+            progress=0,
+            pid=os.getpid(),
+        )
+        bump_dataset_version(kind)
+        if kind == "emp":
+            _run_emp(upload_id, runner)
+        else:
+            _run_nob(upload_id, runner)
+    except Exception as exc:
+        msg = f"{type(exc).__name__}: {exc}"
+        if "PROCESSAMENTO_CANCELADO" in msg:
+            write_status(kind, upload_id, "processamento cancelado", "Cancelado pelo usuario.")
+        else:
+            write_status(kind, upload_id, "falha no processamento", msg)
+        # O runner Node desfaz o job, mas o cache pode ter visto o meio dele.
+        bump_dataset_version(kind)
+        traceback.print_exc()
+        return 1
+    else:
+        refresh(kind)
+    finally:
+        db.session.remove()
+    return 0
+
+
+def _serve(app) -> int:
+    supervisor = NodeRunnerSupervisor()
+
+    def _handle(kind: str, upload_id: int) -> None:
+        with app.app_context():
+            _run_job(kind, upload_id, supervisor.run, lambda k: schedule_refresh(k, app))
+
+    try:
+        serve(_handle)
+    finally:
+        supervisor.stop()
+    return 0
+
+
 def main() -> int:
     args = _parse_args()
     app = create_app()
+    if args.serve:
+        return _serve(app)
+    if args.refresh:
+        with app.app_context():
+            resultados = run_refresh_now(args.refresh)
+        return 0 if all(r["ok"] for r in resultados) else 1
     with app.app_context():
-        try:
-            clear_cancel_flag(args.kind, args.upload_id)
-            write_status(
-                args.kind,
-                args.upload_id,
-                "em processamento",
-                "Processamento iniciado.",
-                progress=0,
-                pid=os.getpid(),
-            )
-            if args.kind == "emp":
-                _run_emp(args.upload_id)
-            else:
-                _run_nob(args.upload_id)
-        except Exception as exc:
-            msg = f"{type(exc).__name__}: {exc}"
-            if "PROCESSAMENTO_CANCELADO" in msg:
-                write_status(args.kind, args.upload_id, "processamento cancelado", "Cancelado pelo usuario.")
-            else:
-                write_status(args.kind, args.upload_id, "falha no processamento", msg)
-            traceback.print_exc()
-            return 1
-    return 0
+        return _run_job(args.kind, args.upload_id)
 
 
 if __name__ == "__main__":